@@ -0,0 +1,97 @@
+"""
+Benchmark storage size and range scans for live vs archived health data
+
+Generates --days of samples at --rate Hz for one patient (see
+bench_backfill.simulate), then reports:
+  - bytes per sample in the HealthData table (with its indexes) and in the
+    archive files written by archive_health_data
+  - samples/sec when reading one day through api.archive.history(), and
+    the raw read speed of each tier (values_list() rows vs NumPy columns)
+
+Usage: python benchmarks/bench_archive.py [--days N] [--rate HZ]
+"""
+import argparse
+import datetime
+import os
+import tempfile
+import time
+
+import common
+from django.conf import settings
+from django.db import connection
+from django.utils import timezone
+
+from api import archive
+from api.models import HealthData, Patient
+from bench_backfill import FIELDS, simulate
+
+
+def table_bytes():
+    """Bytes used by the health data table and its indexes"""
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            cursor.execute("SELECT pg_total_relation_size('api_healthdata')")
+            return cursor.fetchone()[0]
+        cursor.execute("PRAGMA page_count")
+        pages = cursor.fetchone()[0]
+        cursor.execute("PRAGMA page_size")
+        return pages * cursor.fetchone()[0]
+
+
+def archive_bytes(directory):
+    return sum(
+        os.path.getsize(os.path.join(root, name))
+        for root, _, names in os.walk(directory) for name in names
+    )
+
+
+def timed(function):
+    start = time.perf_counter()
+    count = function()
+    return count / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--days', type=int, default=3)
+    parser.add_argument('--rate', type=float, default=1.0)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory, common.benchmark_database():
+        settings.HEALTH_DATA_ARCHIVE_DIR = directory
+        patient = Patient.objects.create(name="Archive", age=80, gender='OTHER', user_id='bench-archive')
+        rows = simulate(args.days * 24, args.rate)
+        offset = time.time() - 40 * 86400 - rows[-1][1]
+        empty = table_bytes()
+        HealthData.objects.bulk_create(
+            (HealthData(patient=patient, **dict(
+                zip(FIELDS, row),
+                timestamp=datetime.datetime.fromtimestamp(row[1] + offset, tz=datetime.timezone.utc),
+            )) for row in rows),
+            batch_size=5000,
+        )
+        samples = len(rows)
+        live_bytes = table_bytes() - empty
+
+        # Middle day of the range
+        start = datetime.datetime.fromtimestamp(rows[samples // 2][1] + offset, tz=datetime.timezone.utc)
+        start = start.replace(hour=0, minute=0, second=0, microsecond=0)
+        end = start + datetime.timedelta(days=1)
+        day_rows = HealthData.objects.filter(patient=patient, timestamp__gte=start, timestamp__lt=end)
+
+        live_history = timed(lambda: sum(1 for _ in archive.history(patient.id, start, end)))
+        live_raw = timed(lambda: len(list(day_rows.values_list(*archive.COLUMNS))))
+
+        moved, files = archive.archive_health_data(timezone.now() - datetime.timedelta(days=7))
+        stored_bytes = archive_bytes(directory)
+        archived_history = timed(lambda: sum(1 for _ in archive.history(patient.id, start, end)))
+        archived_raw = timed(lambda: len(archive.read_day(patient.id, start.date())['id']))
+
+        print(f"{samples:,} samples over {args.days} days, {moved:,} archived in {files} files")
+        print(f"{'tier':<10}{'bytes/sample':>14}{'history/sec':>14}{'raw read/sec':>15}")
+        print(f"{'database':<10}{live_bytes / samples:>14,.1f}{live_history:>14,.0f}{live_raw:>15,.0f}")
+        print(f"{'archive':<10}{stored_bytes / moved:>14,.1f}{archived_history:>14,.0f}{archived_raw:>15,.0f}")
+
+
+if __name__ == '__main__':
+    main()
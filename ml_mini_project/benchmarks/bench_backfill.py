@@ -0,0 +1,142 @@
+"""
+Simulate a watch catching up after an outage and measure backfill throughput
+
+Generates the samples a device would buffer over --hours at --rate Hz (heart
+rate and SpO2 random walks, with a short desaturation episode), uploads them
+as gzip-compressed chunks to the backfill endpoint and reports catch-up time,
+samples/sec and bytes sent. By default the server code runs in-process on a
+throwaway database; with --url the chunks are posted to a running server
+instead (the patient with --user-id must exist there).
+
+For comparison, --live N replays the first N samples one by one through the
+real-time ingestion endpoint.
+
+Usage: python benchmarks/bench_backfill.py [--hours H] [--rate HZ] [--chunk N] [--url URL]
+"""
+import argparse
+import gzip
+import json
+import time
+
+import numpy as np
+
+import common
+from rest_framework.test import APIRequestFactory
+
+from api import cache, views
+from api.models import Alert, Patient
+
+FIELDS = ['seq', 'timestamp', 'heart_rate', 'spo2', 'accelerometer_x', 'accelerometer_y',
+          'accelerometer_z', 'gyroscope_x', 'gyroscope_y', 'gyroscope_z']
+
+
+def simulate(hours, rate, seed=0):
+    """Rows buffered by a device over the outage, oldest first"""
+    rng = np.random.default_rng(seed)
+    count = int(hours * 3600 * rate)
+    start = time.time() - hours * 3600
+    heart_rate = np.clip(72 + np.cumsum(rng.normal(0, 0.3, count)) * 0.1, 45, 130)
+    spo2 = np.clip(97.5 + rng.normal(0, 0.4, count), 90, 100)
+    # A two-minute desaturation somewhere in the middle of the outage
+    episode = slice(count // 2, count // 2 + int(120 * rate))
+    spo2[episode] = 86
+    columns = [
+        np.arange(count), start + np.arange(count) / rate,
+        np.round(heart_rate, 1), np.round(spo2, 1),
+        np.round(rng.normal(0.1, 0.05, count), 3), np.round(rng.normal(0.2, 0.05, count), 3),
+        np.round(rng.normal(9.8, 0.05, count), 3),
+        np.round(rng.normal(0, 0.5, count), 3), np.round(rng.normal(0, 0.5, count), 3),
+        np.round(rng.normal(0, 0.5, count), 3),
+    ]
+    rows = np.column_stack(columns).tolist()
+    for row in rows:
+        row[0] = int(row[0])
+    return rows
+
+
+def chunks(rows, size, user_id):
+    for start in range(0, len(rows), size):
+        body = json.dumps({'user_id': user_id, 'fields': FIELDS, 'rows': rows[start:start + size]})
+        yield gzip.compress(body.encode()), len(body)
+
+
+def post_in_process(body):
+    factory = APIRequestFactory()
+    request = factory.post('/api/health-data/backfill/', body, content_type='application/json',
+                           HTTP_CONTENT_ENCODING='gzip')
+    return views.backfill_health_data(request).data
+
+
+def post_remote(url):
+    import requests
+
+    def post(body):
+        response = requests.post(f"{url.rstrip('/')}/api/health-data/backfill/", data=body,
+                                 headers={'Content-Type': 'application/json', 'Content-Encoding': 'gzip'})
+        response.raise_for_status()
+        return response.json()
+    return post
+
+
+def catch_up(rows, chunk_size, user_id, post):
+    sent = raw = inserted = alerts = 0
+    latencies = []
+    start = time.perf_counter()
+    for body, size in chunks(rows, chunk_size, user_id):
+        chunk_start = time.perf_counter()
+        result = post(body)
+        latencies.append(time.perf_counter() - chunk_start)
+        sent += len(body)
+        raw += size
+        inserted += result['inserted']
+        alerts += len(result['alerts_created'])
+    elapsed = time.perf_counter() - start
+    print(f"samples:          {len(rows):,} in {len(latencies)} chunks of {chunk_size}")
+    print(f"inserted:         {inserted:,}, alerts created: {alerts}")
+    print(f"catch-up time:    {elapsed:,.1f} s ({len(rows) / elapsed:,.0f} samples/sec)")
+    print(f"chunk latency:    median {np.median(latencies) * 1000:,.0f} ms, max {max(latencies) * 1000:,.0f} ms")
+    print(f"bytes sent:       {sent:,} gzip ({raw / sent:.1f}x smaller than {raw:,} raw)")
+
+
+def replay_live(rows, user_id):
+    factory = APIRequestFactory()
+    start = time.perf_counter()
+    for row in rows:
+        data = dict(zip(FIELDS, row))
+        data['user_id'] = user_id
+        data.pop('timestamp')
+        views.process_health_data(factory.post('/api/health-data/', data, format='json'))
+    elapsed = time.perf_counter() - start
+    print(f"live replay:      {len(rows) / elapsed:,.0f} samples/sec over {len(rows):,} samples")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--hours', type=float, default=24)
+    parser.add_argument('--rate', type=float, default=1.0, help="Samples per second on the device")
+    parser.add_argument('--chunk', type=int, default=5000, help="Samples per uploaded chunk")
+    parser.add_argument('--url', help="Post to a running server instead of in-process")
+    parser.add_argument('--user-id', default='bench-backfill')
+    parser.add_argument('--live', type=int, default=0, help="Also replay N samples through live ingestion")
+    args = parser.parse_args()
+
+    rows = simulate(args.hours, args.rate)
+    if args.url:
+        catch_up(rows, args.chunk, args.user_id, post_remote(args.url))
+        return
+
+    common.use_null_firestore()
+    with common.benchmark_database():
+        Patient.objects.create(name="Bench Patient", age=70, gender='OTHER', user_id=args.user_id)
+        cache.clear_all()
+        catch_up(rows, args.chunk, args.user_id, post_in_process)
+        print(f"alerts in db:     {Alert.objects.count()}")
+    if args.live:
+        with common.benchmark_database():
+            Patient.objects.create(name="Bench Patient", age=70, gender='OTHER', user_id=args.user_id)
+            cache.clear_all()
+            replay_live(rows[:args.live], args.user_id)
+
+
+if __name__ == '__main__':
+    main()
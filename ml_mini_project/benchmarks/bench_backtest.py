@@ -0,0 +1,111 @@
+"""
+Benchmark threshold backtesting throughput
+
+Synthesizes --rows samples for --patients patients and reports samples/sec for:
+  - per-row:   HealthPredictor.predict_fall() and predict_vitals_risk() per
+               sample, as ingestion calls them (on the first --per-row samples)
+  - vectorized: api.backtest.Backtest scoring blocks against a 19-threshold grid
+  - archive:   the same, reading the samples back from archive files
+               (api.backtest.database_blocks) instead of from memory
+
+Usage: python benchmarks/bench_backtest.py [--rows N] [--patients N]
+"""
+import argparse
+import datetime
+import tempfile
+import time
+
+import numpy as np
+
+import common
+from django.conf import settings
+
+from api import archive, backtest
+from api.features import CHANNELS
+from api.ml_predictor import HealthPredictor
+
+GRID = np.round(np.arange(0.05, 0.951, 0.05), 2)
+
+
+def synthesize(rows, patients, seed=0):
+    """One block per patient-day of 1 Hz samples"""
+    rng = np.random.default_rng(seed)
+    per_patient = rows // patients
+    start = time.time() - 60 * 86400
+    blocks = []
+    for patient_id in range(1, patients + 1):
+        for offset in range(0, per_patient, 86400):
+            count = min(86400, per_patient - offset)
+            samples = np.column_stack([
+                start + offset + np.arange(count),
+                rng.normal(75, 15, count), rng.normal(96, 2.5, count),
+                rng.normal(0.1, 1.5, count), rng.normal(0.2, 1.5, count), rng.normal(9.8, 1.5, count),
+                rng.normal(0, 10, count), rng.normal(0, 10, count), rng.normal(0, 10, count),
+                np.full((count, len(CHANNELS) - 9), np.nan),
+            ])
+            ids = np.arange(count, dtype=np.int64) + patient_id * 10 ** 9 + offset
+            blocks.append(backtest.Block(patient_id, ids, samples))
+    return blocks
+
+
+def per_row(predictor, block, count):
+    index = {name: i for i, name in enumerate(CHANNELS)}
+    start = time.perf_counter()
+    for row in block.samples[:count]:
+        predictor.predict_fall(
+            [row[index['accelerometer_x']]], [row[index['accelerometer_y']]], [row[index['accelerometer_z']]],
+            [row[index['gyroscope_x']]], [row[index['gyroscope_y']]], [row[index['gyroscope_z']]]
+        )
+        predictor.predict_vitals_risk(row[index['heart_rate']], row[index['spo2']])
+    return count / (time.perf_counter() - start)
+
+
+def vectorized(predictor, blocks):
+    replay = backtest.Backtest(predictor, GRID, GRID)
+    start = time.perf_counter()
+    for block in blocks:
+        replay.add(block)
+    return replay.samples / (time.perf_counter() - start)
+
+
+def write_archive(blocks):
+    for block in blocks:
+        micros = (block.samples[:, 0] * 1e6).astype(np.int64)
+        day = datetime.datetime.fromtimestamp(block.samples[0, 0], tz=datetime.timezone.utc).date()
+        rows = [
+            (int(id_), None, 0, datetime.datetime.fromtimestamp(us / 1e6, tz=datetime.timezone.utc))
+            + tuple(None if value != value else float(value) for value in sample[1:])
+            for id_, us, sample in zip(block.ids, micros, block.samples)
+        ]
+        archive.write_day(block.patient_id, day, rows)
+
+
+def from_archive(predictor):
+    replay = backtest.Backtest(predictor, GRID, GRID)
+    start = time.perf_counter()
+    for block in backtest.database_blocks():
+        replay.add(block)
+    return replay.samples / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--rows', type=int, default=2_000_000)
+    parser.add_argument('--patients', type=int, default=20)
+    parser.add_argument('--per-row', type=int, default=20000)
+    args = parser.parse_args()
+
+    predictor = HealthPredictor()
+    blocks = synthesize(args.rows, args.patients)
+    print(f"{'mode':<12}{'samples/sec':>14}")
+    print(f"{'per-row':<12}{per_row(predictor, blocks[0], args.per_row):>14,.0f}")
+    print(f"{'vectorized':<12}{vectorized(predictor, blocks):>14,.0f}")
+
+    with tempfile.TemporaryDirectory() as directory, common.benchmark_database():
+        settings.HEALTH_DATA_ARCHIVE_DIR = directory
+        write_archive(blocks)
+        print(f"{'archive':<12}{from_archive(predictor):>14,.0f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,124 @@
+"""
+Benchmark the patient dashboard against per-patient calls at --patients scale
+
+Seeds a throwaway database with --patients patients, --samples samples each,
+open alerts for one patient in ten and the PatientStatus rows ingestion would
+have left, then reports:
+  - GET /api/dashboard/: latency (median of --calls), queries and response size
+  - the same overview built from each patient's health-data and alerts
+    endpoints, timed on --sample patients and extrapolated to all of them
+  - the upkeep ingestion pays: PatientStatus.objects.record_sample() per sample
+
+Usage: python benchmarks/bench_dashboard.py [--patients N] [--samples N] [--calls N] [--sample N]
+"""
+import argparse
+import datetime
+import statistics
+import time
+
+import numpy as np
+
+import common
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APIRequestFactory
+
+from api import views
+from api.models import RISK_LEVELS, Alert, HealthData, Patient, PatientStatus
+
+
+def seed(patients, samples, seed=0):
+    rng = np.random.default_rng(seed)
+    now = timezone.now()
+    Patient.objects.bulk_create(
+        (Patient(name=f"Patient {i}", age=60 + i % 40, gender='OTHER', user_id=f'dashboard-{i}')
+         for i in range(patients)),
+        batch_size=5000,
+    )
+    ids = list(Patient.objects.values_list('id', flat=True))
+    heart_rate = np.round(rng.normal(75, 12, (len(ids), samples)), 1)
+    spo2 = np.round(np.clip(rng.normal(96.5, 1.5, (len(ids), samples)), 80, 100), 1)
+    HealthData.objects.bulk_create(
+        (HealthData(patient_id=patient_id, timestamp=now - datetime.timedelta(seconds=samples - j),
+                    heart_rate=heart_rate[i, j], spo2=spo2[i, j], accelerometer_x=0.0, accelerometer_y=0.0,
+                    accelerometer_z=9.8, gyroscope_x=0.0, gyroscope_y=0.0, gyroscope_z=0.0)
+         for i, patient_id in enumerate(ids) for j in range(samples)),
+        batch_size=5000,
+    )
+    alerted = ids[::10]
+    Alert.objects.bulk_create(
+        (Alert(patient_id=patient_id, type='VITALS', message="Abnormal vitals", status='NEW')
+         for patient_id in alerted for _ in range(2)),
+        batch_size=5000,
+    )
+    risk = rng.choice(len(RISK_LEVELS), len(ids), p=[0.85, 0.1, 0.04, 0.01])
+    PatientStatus.objects.bulk_create(
+        (PatientStatus(patient_id=patient_id, last_seen=now, heart_rate=heart_rate[i, -1], spo2=spo2[i, -1],
+                       risk_level=RISK_LEVELS[risk[i]], risk_rank=int(risk[i]),
+                       risk_probability=float(rng.random()), fall_probability=float(rng.random() * 0.1))
+         for i, patient_id in enumerate(ids)),
+        batch_size=5000,
+    )
+    PatientStatus.objects.refresh_alerts(alerted)
+    return ids
+
+
+def timed(view, calls, **kwargs):
+    factory = APIRequestFactory()
+    timings = []
+    for _ in range(calls):
+        started = time.perf_counter()
+        response = view(factory.get('/'), **kwargs)
+        response.render()
+        timings.append(time.perf_counter() - started)
+    return statistics.median(timings), response
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--patients', type=int, default=50000)
+    parser.add_argument('--samples', type=int, default=3)
+    parser.add_argument('--calls', type=int, default=5)
+    parser.add_argument('--sample', type=int, default=200,
+                        help="Patients timed through the per-patient endpoints")
+    args = parser.parse_args()
+
+    with common.benchmark_database():
+        started = time.perf_counter()
+        ids = seed(args.patients, args.samples)
+        print(f"Seeded {len(ids):,} patients in {time.perf_counter() - started:.1f}s")
+
+        with CaptureQueriesContext(connection) as queries:
+            seconds, response = timed(views.dashboard, args.calls)
+        print(f"GET /api/dashboard/: {seconds * 1e3:,.0f} ms for {len(response.data):,} patients, "
+              f"{len(queries) // args.calls} query, {len(response.content) / 1e6:.1f} MB")
+
+        health_data = views.PatientViewSet.as_view({'get': 'health_data'})
+        alerts = views.PatientViewSet.as_view({'get': 'alerts'})
+        chosen = ids[::max(1, len(ids) // args.sample)][:args.sample]
+        started = time.perf_counter()
+        with CaptureQueriesContext(connection) as queries:
+            for patient_id in chosen:
+                timed(health_data, 1, pk=patient_id)
+                timed(alerts, 1, pk=patient_id)
+        per_patient = (time.perf_counter() - started) / len(chosen)
+        print(f"Per-patient health-data + alerts calls: {per_patient * 1e3:.1f} ms and "
+              f"{len(queries) / len(chosen):.0f} queries per patient, "
+              f"{per_patient * len(ids):,.0f} s for all {len(ids):,}")
+
+        now = timezone.now()
+        sample = {'timestamp': now, 'heart_rate': 72.0, 'spo2': 97.0}
+        vitals = {'risk_level': 'NORMAL', 'risk_probability': 0.1}
+        fall = {'fall_probability': 0.01}
+        rng = np.random.default_rng(1)
+        updates = [int(i) for i in rng.choice(ids, 2000)]
+        started = time.perf_counter()
+        for patient_id in updates:
+            PatientStatus.objects.record_sample(patient_id, sample, vitals, fall)
+        print(f"Ingest upkeep: {(time.perf_counter() - started) / len(updates) * 1e6:.0f} us per "
+              f"record_sample()")
+
+
+if __name__ == '__main__':
+    main()
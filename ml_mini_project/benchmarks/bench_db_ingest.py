@@ -0,0 +1,100 @@
+"""
+Benchmark concurrent health data ingestion throughput per database backend
+
+Worker threads post samples to the ingestion view, each for its own patient
+and on its own database connection, as a threaded WSGI server would.
+Firestore writes are discarded.
+
+With the default SQLite backend two configurations are compared:
+  - sqlite-default: rollback journal with synchronous=FULL
+  - sqlite-wal:     SQLITE_PRAGMAS from settings (WAL, synchronous=NORMAL, ...)
+Run with DB_ENGINE=postgres and the DB_* variables to measure PostgreSQL;
+a throwaway test database is created on the configured server.
+
+Usage: python benchmarks/bench_db_ingest.py [--samples N] [--threads N ...]
+"""
+import argparse
+import threading
+import time
+
+import common
+from django.conf import settings
+from django.db import connection, connections
+from rest_framework.test import APIRequestFactory
+
+from api import cache, views
+from api.models import Patient
+
+SQLITE_DEFAULT_PRAGMAS = {'journal_mode': 'DELETE', 'synchronous': 'FULL'}
+
+
+def payload(user_id, i):
+    return {
+        'user_id': user_id,
+        'heart_rate': 60 + i % 40,
+        'spo2': 96 + i % 4,
+        'accelerometer_x': 0.1,
+        'accelerometer_y': 0.2,
+        'accelerometer_z': 9.8,
+        'gyroscope_x': 0.5,
+        'gyroscope_y': -0.2,
+        'gyroscope_z': 0.1,
+    }
+
+
+def run(threads, samples):
+    factory = APIRequestFactory()
+    per_thread = samples // threads
+    errors = []
+
+    def worker(user_id):
+        try:
+            for i in range(per_thread):
+                request = factory.post('/api/health-data/', payload(user_id, i), format='json')
+                response = views.process_health_data(request)
+                if response.status_code != 200:
+                    errors.append(response.status_code)
+        finally:
+            connections.close_all()
+
+    workers = [threading.Thread(target=worker, args=(f'bench-{n}',)) for n in range(threads)]
+    start = time.perf_counter()
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    return per_thread * threads / elapsed, len(errors)
+
+
+def benchmark(label, thread_counts, samples):
+    with common.benchmark_database():
+        for n in range(max(thread_counts)):
+            Patient.objects.create(name=f"Bench {n}", age=70, gender='OTHER', user_id=f'bench-{n}')
+        connection.close()
+        cache.clear_all()
+        for threads in thread_counts:
+            rate, errors = run(threads, samples)
+            print(f"{label:<16}{threads:>8}{rate:>14,.0f}{errors:>8}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--samples', type=int, default=4000)
+    parser.add_argument('--threads', type=int, nargs='+', default=[1, 4, 8])
+    args = parser.parse_args()
+
+    common.use_null_firestore()
+    print(f"{'backend':<16}{'threads':>8}{'samples/sec':>14}{'errors':>8}")
+    if connection.vendor == 'sqlite':
+        configured = settings.SQLITE_PRAGMAS
+        settings.SQLITE_PRAGMAS = SQLITE_DEFAULT_PRAGMAS
+        benchmark('sqlite-default', args.threads, args.samples)
+        settings.SQLITE_PRAGMAS = configured
+        benchmark('sqlite-wal', args.threads, args.samples)
+    else:
+        benchmark(connection.vendor, args.threads, args.samples)
+
+
+if __name__ == '__main__':
+    main()
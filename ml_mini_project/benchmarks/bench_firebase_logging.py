@@ -0,0 +1,107 @@
+"""
+Benchmark the Firebase save path with print-per-save vs structured logging
+
+Saves HealthData documents to an in-process Firestore stand-in from several
+threads and reports throughput for:
+  - print:      the old behaviour, one line written to the console per save
+  - sync-log:   one logging line per save through a synchronous StreamHandler
+  - structured: counters for successes, queue-backed handler (current code)
+
+Console output goes to a line-buffered temporary file so every line costs a
+write() as it would on a terminal or log pipe.
+
+Usage: python benchmarks/bench_firebase_logging.py [--saves N] [--threads N ...]
+"""
+import argparse
+import logging
+import tempfile
+import threading
+import time
+
+from common import NullFirestore
+from api.firebase_service import FirebaseService
+from api.logging_utils import NonBlockingHandler, RateLimitFilter, StructuredFormatter
+from api.models import HealthData
+
+
+def make_health_data(count):
+    return [
+        HealthData(id=i, patient_id=1, heart_rate=72.0, spo2=98.0,
+                   accelerometer_x=0.1, accelerometer_y=0.2, accelerometer_z=9.8,
+                   gyroscope_x=0.5, gyroscope_y=-0.2, gyroscope_z=0.1)
+        for i in range(count)
+    ]
+
+
+def configure_logger(mode, stream):
+    """Point the api logger at the handler used by the given mode"""
+    api_logger = logging.getLogger('api')
+    for handler in list(api_logger.handlers):
+        api_logger.removeHandler(handler)
+    if mode == 'sync-log':
+        handler = logging.StreamHandler(stream)
+        handler.setFormatter(StructuredFormatter())
+        api_logger.setLevel(logging.DEBUG)
+    else:
+        handler = NonBlockingHandler(stream=stream)
+        handler.setFormatter(StructuredFormatter())
+        handler.addFilter(RateLimitFilter())
+        api_logger.setLevel(logging.INFO)
+    api_logger.addHandler(handler)
+    return handler
+
+
+def run(service, mode, saves, threads):
+    records = make_health_data(saves)
+    per_thread = saves // threads
+    sync_logger = logging.getLogger('api.firebase_service')
+
+    with tempfile.TemporaryFile('w', buffering=1) as stream:
+        handler = configure_logger(mode, stream)
+
+        def worker(chunk):
+            for health_data in chunk:
+                service.add_health_data_to_firebase(1, health_data)
+                if mode == 'print':
+                    print(f"Health data {health_data.id} saved to Firebase", file=stream)
+                elif mode == 'sync-log':
+                    sync_logger.debug("Health data %s saved to Firebase", health_data.id,
+                                      extra={'event': 'firebase.saved'})
+
+        workers = [
+            threading.Thread(target=worker, args=(records[i * per_thread:(i + 1) * per_thread],))
+            for i in range(threads)
+        ]
+        start = time.perf_counter()
+        for thread in workers:
+            thread.start()
+        for thread in workers:
+            thread.join()
+        elapsed = time.perf_counter() - start
+        handler.flush()
+        logging.getLogger('api').removeHandler(handler)
+        if isinstance(handler, NonBlockingHandler):
+            handler.stop()
+
+    return per_thread * threads / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--saves', type=int, default=50000)
+    parser.add_argument('--threads', type=int, nargs='+', default=[1, 4, 8])
+    args = parser.parse_args()
+
+    service = FirebaseService()
+    service.initialized = True
+    service.db = NullFirestore()
+
+    print(f"{'mode':<12}{'threads':>8}{'saves/sec':>14}")
+    for threads in args.threads:
+        for mode in ('print', 'sync-log', 'structured'):
+            rate = run(service, mode, args.saves, threads)
+            print(f"{mode:<12}{threads:>8}{rate:>14,.0f}")
+
+
+if __name__ == '__main__':
+    main()
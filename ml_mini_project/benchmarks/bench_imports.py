@@ -0,0 +1,101 @@
+"""
+Benchmark process startup: import time and memory of manage.py commands and workers
+
+Runs each case in a fresh Python process with ``-X importtime`` and reports
+the median over --runs of:
+  - wall time of the whole process
+  - import time (the sum of the top-level imports -X importtime lists)
+  - peak RSS of the process
+  - which of the heavy dependencies (NumPy, firebase_admin and its Firestore
+    gRPC stack, requests, joblib, scikit-learn) were imported at all
+
+Cases:
+  - manage.py check, which loads the URLconf and so api.views
+  - manage.py showmigrations, against an empty SQLite file
+  - a worker that loads health_monitor.wsgi without warming up
+  - a worker that loads health_monitor.wsgi and warms up (api.warmup)
+
+Workers use a Firestore that discards writes (benchmarks/common.py), so no
+request leaves the machine.
+
+Usage: python benchmarks/bench_imports.py [--runs N]
+"""
+import argparse
+import os
+import re
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+SERVER = os.path.join(HERE, '..', 'health_monitor_server')
+
+HEAVY = ('numpy', 'firebase_admin', 'google.cloud.firestore', 'requests', 'joblib', 'sklearn')
+
+IMPORT_LINE = re.compile(r'^import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)$')
+
+# Loads health_monitor.wsgi as a server worker would, with Firestore swapped out first
+WORKER = """
+import sys
+sys.path.insert(0, {benchmarks!r})
+import common
+common.use_null_firestore()
+import health_monitor.wsgi
+"""
+
+
+def run(command, env, cwd):
+    """Run a command with -X importtime; returns (seconds, import seconds, peak RSS in MB, modules)"""
+    with tempfile.TemporaryFile() as stderr:
+        started = time.perf_counter()
+        process = subprocess.Popen([sys.executable, '-X', 'importtime', *command], env=env, cwd=cwd,
+                                   stdout=subprocess.DEVNULL, stderr=stderr)
+        _, status, usage = os.wait4(process.pid, 0)
+        elapsed = time.perf_counter() - started
+        process.returncode = os.waitstatus_to_exitcode(status)
+        stderr.seek(0)
+        output = stderr.read().decode(errors='replace')
+    if process.returncode:
+        raise RuntimeError(f"{' '.join(command)} failed:\n{output[-2000:]}")
+
+    imported, total = set(), 0
+    for line in output.splitlines():
+        match = IMPORT_LINE.match(line)
+        if match:
+            imported.add(match.group(4))
+            if len(match.group(3)) == 1:
+                total += int(match.group(2))  # a top-level import
+    # ru_maxrss is in KB on Linux
+    return elapsed, total / 1e6, usage.ru_maxrss / 1024, imported
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--runs', type=int, default=5)
+    args = parser.parse_args()
+
+    worker = ['-c', WORKER.format(benchmarks=HERE)]
+    with tempfile.TemporaryDirectory() as directory:
+        env = dict(os.environ, DJANGO_SETTINGS_MODULE='health_monitor.settings', LOG_LEVEL='ERROR',
+                   SQLITE_PATH=os.path.join(directory, 'bench.sqlite3'), PYTHONPATH=SERVER)
+        cases = (
+            ('manage.py check', ['manage.py', 'check'], env),
+            ('manage.py showmigrations', ['manage.py', 'showmigrations'], env),
+            ('worker, no warm-up', worker, dict(env, WARMUP_ON_STARTUP='false')),
+            ('worker, warm-up', worker, dict(env, WARMUP_ON_STARTUP='true')),
+        )
+        print(f"{'case':<26}{'wall':>9}{'imports':>10}{'peak RSS':>11}  heavy modules imported")
+        for name, command, case_env in cases:
+            results = [run(command, case_env, SERVER) for _ in range(args.runs)]
+            wall = statistics.median(result[0] for result in results)
+            imports = statistics.median(result[1] for result in results)
+            rss = statistics.median(result[2] for result in results)
+            heavy = [module for module in HEAVY if module in results[0][3]]
+            print(f"{name:<26}{wall * 1e3:>6.0f} ms{imports * 1e3:>7.0f} ms{rss:>8.1f} MB  "
+                  f"{', '.join(heavy) or '-'}")
+
+
+if __name__ == '__main__':
+    main()
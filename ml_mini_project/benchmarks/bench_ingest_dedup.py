@@ -0,0 +1,84 @@
+"""
+Benchmark the per-request cost of duplicate detection on ingestion
+
+Posts samples for one device to the ingestion view and reports the mean time
+per request for:
+  - no-seq:   samples without a sequence number (no duplicate checks)
+  - seq:      every sample carries a new seq (in-memory check, insert in a savepoint)
+  - retries:  every sample is sent twice; the second copy is dropped
+Also times the in-memory window check on its own. Firestore writes are discarded.
+
+Usage: python benchmarks/bench_ingest_dedup.py [--samples N]
+"""
+import argparse
+import time
+
+import common
+from rest_framework.test import APIRequestFactory
+
+from api import cache, views
+from api.dedup import SeqWindow, seq_window
+from api.features import feature_store
+from api.models import Patient
+from bench_db_ingest import payload
+
+
+def post_samples(samples, seq_of, copies=1):
+    factory = APIRequestFactory()
+    requests = 0
+    start = time.perf_counter()
+    for i in range(samples):
+        data = payload('bench-dedup', i)
+        seq = seq_of(i)
+        if seq is not None:
+            data['seq'] = seq
+        for _ in range(copies):
+            response = views.process_health_data(factory.post('/api/health-data/', data, format='json'))
+            assert response.status_code == 200, response.data
+            requests += 1
+    return (time.perf_counter() - start) / requests
+
+
+def window_cost(operations):
+    window = SeqWindow(size=256, loader=None)
+    start = time.perf_counter()
+    for seq in range(operations):
+        window.check(1, seq)
+        window.add(1, seq)
+    return (time.perf_counter() - start) / operations
+
+
+def run(mode, samples):
+    _, seq_of, copies = mode
+    with common.benchmark_database():
+        Patient.objects.create(name="Bench Patient", age=70, gender='OTHER', user_id='bench-dedup')
+        cache.clear_all()
+        feature_store.reset()
+        seq_window.reset()
+        return post_samples(samples, seq_of, copies)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--samples', type=int, default=2000)
+    args = parser.parse_args()
+
+    common.use_null_firestore()
+    modes = (
+        ('no-seq', lambda i: None, 1),
+        ('seq', lambda i: i, 1),
+        ('retries', lambda i: i, 2),
+    )
+    print(f"{'mode':<10}{'us/request':>12}{'overhead':>10}")
+    run(modes[0], args.samples // 4)  # warm up imports, models and caches
+    baseline = None
+    for mode in modes:
+        per_request = run(mode, args.samples) * 1e6
+        baseline = baseline or per_request
+        print(f"{mode[0]:<10}{per_request:>12,.1f}{per_request - baseline:>+10,.1f}")
+
+    print(f"window check+add: {window_cost(200000) * 1e9:,.0f} ns")
+
+
+if __name__ == '__main__':
+    main()
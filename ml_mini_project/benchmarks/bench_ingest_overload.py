@@ -0,0 +1,111 @@
+"""
+Benchmark ingestion under overload with and without rate limiting
+
+One device floods the ingestion view from several threads, as a device stuck
+in a retry loop would, while quiet devices each post one sample every
+--interval seconds. Reports, per device class, the samples accepted, the
+429s and the latency of accepted quiet samples for:
+  - unlimited: no rate limits
+  - limited:   per-device and global token buckets with load shedding
+Firestore writes are discarded.
+
+Usage: python benchmarks/bench_ingest_overload.py [--seconds N] [--quiet N] [--flood-threads N]
+"""
+import argparse
+import threading
+import time
+
+import common
+from django.conf import settings
+from django.db import connection, connections
+from rest_framework.test import APIRequestFactory
+
+from api import cache, throttling, views
+from api.models import Patient
+from bench_db_ingest import payload
+
+
+def run(seconds, quiet, flood_threads, interval):
+    factory = APIRequestFactory()
+    stop = time.perf_counter() + seconds
+    results = {'flood': [0, 0], 'quiet': [0, 0]}
+    latencies = []
+    lock = threading.Lock()
+
+    def post(user_id, i):
+        request = factory.post('/api/health-data/', payload(user_id, i), format='json')
+        start = time.perf_counter()
+        response = views.process_health_data(request)
+        return response.status_code, time.perf_counter() - start
+
+    def record(kind, code, elapsed=None):
+        with lock:
+            results[kind][0 if code == 200 else 1] += 1
+            if code == 200 and elapsed is not None:
+                latencies.append(elapsed)
+
+    def flood():
+        try:
+            i = 0
+            while time.perf_counter() < stop:
+                record('flood', post('bench-flood', i)[0])
+                i += 1
+        finally:
+            connections.close_all()
+
+    def device(user_id):
+        try:
+            i = 0
+            while time.perf_counter() < stop:
+                code, elapsed = post(user_id, i)
+                record('quiet', code, elapsed)
+                i += 1
+                time.sleep(max(0.0, interval - elapsed))
+        finally:
+            connections.close_all()
+
+    workers = [threading.Thread(target=flood) for _ in range(flood_threads)]
+    workers += [threading.Thread(target=device, args=(f'bench-{n}',)) for n in range(quiet)]
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+
+    latencies.sort()
+    percentile = lambda p: latencies[min(len(latencies) - 1, int(p * len(latencies)))] * 1000 if latencies else 0.0
+    return results, percentile(0.5), percentile(0.99)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--seconds', type=float, default=10)
+    parser.add_argument('--quiet', type=int, default=8)
+    parser.add_argument('--flood-threads', type=int, default=4)
+    parser.add_argument('--interval', type=float, default=0.2)
+    parser.add_argument('--device-rate', type=float, default=5)
+    parser.add_argument('--global-rate', type=float, default=100)
+    args = parser.parse_args()
+
+    common.use_null_firestore()
+    print(f"{'mode':<11}{'flood ok':>10}{'flood 429':>11}{'quiet ok':>10}{'quiet 429':>11}"
+          f"{'quiet p50 ms':>14}{'quiet p99 ms':>14}")
+    with common.benchmark_database():
+        Patient.objects.create(name="Flood", age=70, gender='OTHER', user_id='bench-flood')
+        for n in range(args.quiet):
+            Patient.objects.create(name=f"Bench {n}", age=70, gender='OTHER', user_id=f'bench-{n}')
+        connection.close()
+        for mode, device_rate, global_rate in (('unlimited', 0, 0),
+                                               ('limited', args.device_rate, args.global_rate)):
+            settings.INGEST_DEVICE_RATE = device_rate
+            settings.INGEST_DEVICE_BURST = device_rate * 2
+            settings.INGEST_GLOBAL_RATE = global_rate
+            settings.INGEST_GLOBAL_BURST = global_rate
+            throttling.reset()
+            cache.clear_all()
+            results, p50, p99 = run(args.seconds, args.quiet, args.flood_threads, args.interval)
+            print(f"{mode:<11}{results['flood'][0]:>10}{results['flood'][1]:>11}"
+                  f"{results['quiet'][0]:>10}{results['quiet'][1]:>11}{p50:>14.1f}{p99:>14.1f}")
+
+
+if __name__ == '__main__':
+    main()
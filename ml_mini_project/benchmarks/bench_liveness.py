@@ -0,0 +1,90 @@
+"""
+Benchmark device liveness tracking (api.liveness) at --devices scale
+
+Reports, for --devices devices reporting every --interval seconds:
+  - heartbeat cost: re-arming a device's deadline in the timer wheel, timed
+    at 1k devices and at --devices to show it does not grow with the count
+  - advancing the wheel one tick, as the background thread does every second
+  - advancing ticks while timers move down the wheel's levels
+  - expiring the --offline devices that stopped reporting, in one tick
+  - for comparison, one periodic scan of every device's last-seen time, the
+    work a timer-less check would repeat every tick
+
+Only the in-memory tracker is measured; confirming and alerting go to the
+database and are excluded.
+
+Usage: python benchmarks/bench_liveness.py [--devices N] [--interval S] [--offline N]
+"""
+import argparse
+import time
+
+import common
+
+from api.liveness import LivenessTracker
+
+
+def heartbeats(tracker, devices, now, timeout, rounds=3):
+    """Seconds per heartbeat over every device, best of rounds"""
+    best = float('inf')
+    for round_ in range(rounds):
+        started = time.perf_counter()
+        for device in range(devices):
+            tracker.heartbeat(device, device, timeout, now=now + round_ + device * 1e-6, start=False)
+        best = min(best, (time.perf_counter() - started) / devices)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--devices', type=int, default=100000)
+    parser.add_argument('--interval', type=float, default=60.0)
+    parser.add_argument('--missed', type=int, default=5)
+    parser.add_argument('--offline', type=int, default=1000)
+    args = parser.parse_args()
+    timeout = args.interval * args.missed
+    now = 1_700_000_000.0
+
+    small = LivenessTracker(timeout, clock=lambda: now)
+    print(f"Heartbeat, 1,000 devices: {heartbeats(small, 1000, now, timeout) * 1e6:.2f} us")
+
+    tracker = LivenessTracker(timeout, clock=lambda: now)
+    per_heartbeat = heartbeats(tracker, args.devices, now, timeout)
+    print(f"Heartbeat, {args.devices:,} devices: {per_heartbeat * 1e6:.2f} us "
+          f"({1 / per_heartbeat:,.0f} heartbeats/s)")
+
+    # Devices keep reporting for one interval, spread over it, except the silent ones
+    last = now + 2
+    reporting = args.devices - args.offline
+    started = time.perf_counter()
+    ticks = int(args.interval)
+    for tick in range(1, ticks + 1):
+        for device in range((tick - 1) * reporting // ticks, tick * reporting // ticks):
+            tracker.heartbeat(device, device, timeout, now=last + tick + 1, start=False)
+        tracker.check(last + tick + 1)
+    loaded = (time.perf_counter() - started) / ticks
+    print(f"One tick with {args.devices / args.interval:,.0f} heartbeats/s: {loaded * 1e3:.2f} ms "
+          f"(heartbeats and advancing the wheel)")
+
+    started = time.perf_counter()
+    tracker.check(last + ticks + 2)
+    print(f"Advancing one tick with nothing due: {(time.perf_counter() - started) * 1e6:.1f} us")
+
+    # The silent devices were last seen at `last`; move the wheel to the tick before they are due
+    started = time.perf_counter()
+    for tick in range(ticks + 3, int(timeout) + 1):
+        tracker.check(last + tick)
+    idle = (time.perf_counter() - started) / (int(timeout) - ticks - 2)
+    print(f"Advancing one tick without heartbeats, timers cascading: {idle * 1e6:.1f} us on average")
+    started = time.perf_counter()
+    offline = tracker.check(last + timeout + 1)
+    print(f"Expiring {len(offline):,} silent devices: {(time.perf_counter() - started) * 1e3:.2f} ms")
+
+    seen = {device: tracker.last_seen(device) for device in range(args.devices)}
+    started = time.perf_counter()
+    due = [device for device, at in seen.items() if at + timeout < last + timeout + 1]
+    print(f"Full scan of {len(seen):,} last-seen times ({len(due):,} due): "
+          f"{(time.perf_counter() - started) * 1e3:.2f} ms every tick")
+
+
+if __name__ == '__main__':
+    main()
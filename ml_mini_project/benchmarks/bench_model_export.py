@@ -0,0 +1,69 @@
+"""
+Benchmark scikit-learn estimators against their NumPy-only exports
+
+Trains the train_models candidates (api.training.CANDIDATES) on --rows
+synthetic feature vectors, exports them with api.model_export and reports:
+  - single-row latency (median of --calls predict_proba calls on one row,
+    the way ingestion scores each sample)
+  - batch throughput (rows/sec scoring all rows in one call)
+  - the largest probability difference between the two
+
+Usage: python benchmarks/bench_model_export.py [--rows N] [--calls N]
+"""
+import argparse
+import time
+import warnings
+
+import numpy as np
+
+import common  # noqa: F401  (configures Django)
+from api import model_export, training
+from api.features import FEATURE_NAMES
+
+
+def synthesize(rows, seed=0):
+    rng = np.random.default_rng(seed)
+    X = rng.normal(size=(rows, len(FEATURE_NAMES)))
+    X[rng.random(X.shape) < 0.05] = np.nan
+    signal = np.nan_to_num(X[:, 0]) + 0.5 * np.nan_to_num(X[:, 9]) - 0.3 * np.nan_to_num(X[:, 5])
+    y = (signal + rng.normal(scale=0.5, size=rows) > 2).astype(int)
+    return X, y
+
+
+def single_row(model, X, calls):
+    timings = []
+    for row in X[:calls]:
+        row = row.reshape(1, -1)
+        started = time.perf_counter()
+        model.predict_proba(row)
+        timings.append(time.perf_counter() - started)
+    return float(np.median(timings))
+
+
+def batch(model, X):
+    started = time.perf_counter()
+    model.predict_proba(X)
+    return len(X) / (time.perf_counter() - started)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--rows', type=int, default=100000)
+    parser.add_argument('--calls', type=int, default=1000)
+    args = parser.parse_args()
+
+    X, y = synthesize(args.rows)
+    print(f"{'model':<10}{'runtime':<10}{'single row':>13}{'batch rows/sec':>16}{'max diff':>11}")
+    for name, candidate in training.CANDIDATES.items():
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', UserWarning)
+            estimator = candidate().fit(X, y)
+        exported = model_export.export(estimator, X.shape[1])
+        difference = np.abs(exported.predict_proba(X) - estimator.predict_proba(X)).max()
+        for runtime, model in (('sklearn', estimator), ('numpy', exported)):
+            print(f"{name:<10}{runtime:<10}{single_row(model, X, args.calls) * 1e6:>10.0f} us"
+                  f"{batch(model, X):>16,.0f}{difference if runtime == 'numpy' else 0:>11.1e}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,110 @@
+"""
+Benchmark push latency for anomalous samples under background load
+
+Background threads post normal readings for their own devices as fast as
+they can, while one device posts an anomalous reading every --interval
+seconds. Reports the time from posting an anomalous sample to its push
+notification being sent (p50/p99/max) and the background throughput.
+Firestore writes and pushes are discarded after --firestore-ms each, to
+stand in for the round trips to Firebase.
+
+Usage: python benchmarks/bench_priority_lanes.py [--seconds N] [--threads N] [--firestore-ms MS]
+"""
+import argparse
+import threading
+import time
+
+import common
+from django.db import connection, connections
+from rest_framework.test import APIRequestFactory
+
+from api import cache, views
+from api.models import Patient
+from bench_db_ingest import payload
+
+
+def run(seconds, threads, interval):
+    factory = APIRequestFactory()
+    stop = time.perf_counter() + seconds
+    sent = threading.local()
+    latencies = []
+    background = [0]
+    lock = threading.Lock()
+
+    send = views.firebase_service.send_alert_to_guardians
+    def record_push(*args):
+        if not hasattr(sent, 'at'):
+            sent.at = time.perf_counter()
+        return send(*args)
+    views.firebase_service.send_alert_to_guardians = record_push
+
+    def normal(user_id):
+        try:
+            i = 0
+            while time.perf_counter() < stop:
+                views.process_health_data(factory.post('/api/health-data/', payload(user_id, i), format='json'))
+                i += 1
+            with lock:
+                background[0] += i
+        finally:
+            connections.close_all()
+
+    def critical():
+        try:
+            i = 0
+            while time.perf_counter() < stop:
+                data = dict(payload('bench-critical', i), heart_rate=150, spo2=85)
+                request = factory.post('/api/health-data/', data, format='json')
+                if hasattr(sent, 'at'):
+                    del sent.at
+                start = time.perf_counter()
+                views.process_health_data(request)
+                latencies.append(sent.at - start)
+                i += 1
+                time.sleep(interval)
+        finally:
+            connections.close_all()
+
+    workers = [threading.Thread(target=normal, args=(f'bench-{n}',)) for n in range(threads)]
+    workers.append(threading.Thread(target=critical))
+    try:
+        for thread in workers:
+            thread.start()
+        for thread in workers:
+            thread.join()
+    finally:
+        views.firebase_service.send_alert_to_guardians = send
+    views.firebase_repository.health_data_buffer.flush()
+
+    latencies.sort()
+    percentile = lambda p: latencies[min(len(latencies) - 1, int(p * len(latencies)))] * 1000
+    return percentile(0.5), percentile(0.99), latencies[-1] * 1000, background[0] / seconds
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--seconds', type=float, default=10)
+    parser.add_argument('--threads', type=int, nargs='+', default=[0, 4, 8])
+    parser.add_argument('--interval', type=float, default=0.05)
+    parser.add_argument('--firestore-ms', type=float, default=20)
+    args = parser.parse_args()
+
+    latency = args.firestore_ms / 1000
+    common.use_null_firestore(latency)
+    # Stand-in for the FCM round trip; no guardian tokens are needed
+    views.firebase_service.send_alert_to_guardians = lambda *args: time.sleep(latency)
+
+    print(f"{'threads':>8}{'push p50 ms':>13}{'push p99 ms':>13}{'push max ms':>13}{'normal/sec':>12}")
+    with common.benchmark_database():
+        Patient.objects.create(name="Critical", age=80, gender='OTHER', user_id='bench-critical')
+        for n in range(max(args.threads)):
+            Patient.objects.create(name=f"Bench {n}", age=70, gender='OTHER', user_id=f'bench-{n}')
+        connection.close()
+        cache.clear_all()
+        for threads in args.threads:
+            p50, p99, worst, rate = run(args.seconds, threads, args.interval)
+            print(f"{threads:>8}{p50:>13.1f}{p99:>13.1f}{worst:>13.1f}{rate:>12,.0f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,87 @@
+"""
+Benchmark rendering health data listings: DRF serializer vs values() rows
+
+For each size the same queryset is turned into JSON bytes by:
+  - serializer:  HealthDataSerializer(many=True) + stock JSONRenderer (old path)
+  - rows-json:   RowSerializer rows + FastJSONRenderer with orjson disabled
+  - rows-orjson: RowSerializer rows + FastJSONRenderer (current path)
+Timings include the database query, as they do for a request.
+
+Usage: python benchmarks/bench_serialization.py [--sizes N ...] [--repeat N]
+"""
+import argparse
+import time
+from unittest import mock
+
+import common
+from django.utils import timezone
+from rest_framework.renderers import JSONRenderer
+
+from api import renderers
+from api.models import HealthData, Patient
+from api.renderers import FastJSONRenderer
+from api.serializers import HealthDataSerializer, health_data_rows
+
+
+def create_rows(count):
+    patient = Patient.objects.create(name="Bench Patient", age=70, gender='OTHER', user_id='bench-render')
+    now = timezone.now()
+    HealthData.objects.bulk_create(
+        (HealthData(patient=patient, timestamp=now, heart_rate=60 + i % 40, spo2=96 + i % 4,
+                    accelerometer_x=0.1, accelerometer_y=0.2, accelerometer_z=9.8,
+                    gyroscope_x=0.5, gyroscope_y=-0.2, gyroscope_z=0.1,
+                    temperature=36.6 if i % 2 else None)
+         for i in range(count)),
+        batch_size=5000,
+    )
+
+
+def render_serializer(queryset):
+    return JSONRenderer().render(HealthDataSerializer(queryset, many=True).data)
+
+
+def render_rows(queryset):
+    return FastJSONRenderer().render(health_data_rows.rows(queryset))
+
+
+def render_rows_json(queryset):
+    with mock.patch.object(renderers, 'orjson', None):
+        return render_rows(queryset)
+
+
+MODES = (
+    ('serializer', render_serializer),
+    ('rows-json', render_rows_json),
+    ('rows-orjson', render_rows),
+)
+
+
+def _timed(render, queryset):
+    start = time.perf_counter()
+    render(queryset.all())
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[100, 10000, 100000])
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    if renderers.orjson is None:
+        print("orjson is not installed; rows-orjson falls back to json")
+    print(f"{'rows':>8}  {'mode':<12}{'rows/sec':>14}{'speedup':>9}")
+    for size in args.sizes:
+        with common.benchmark_database():
+            create_rows(size)
+            queryset = HealthData.objects.all()
+            baseline = None
+            for mode, render in MODES:
+                best = min(_timed(render, queryset) for _ in range(args.repeat))
+                rate = size / best
+                baseline = baseline or rate
+                print(f"{size:>8}  {mode:<12}{rate:>14,.0f}{rate / baseline:>8.1f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,160 @@
+"""
+Benchmark sharded ingestion (api.sharding): throughput against shard count
+
+Seeds a throwaway database with --patients patients, then for each shard
+count in --shards starts that many shard processes (as
+``manage.py run_ingest_shards`` does) and drives them through ShardRouters
+from --clients client processes per shard, each posting samples for its own
+devices for --seconds. Reports samples/s, the speedup over one shard and the
+round trip through the router. Ideal scaling is linear up to the number of
+CPU cores; the database is shared by every shard, so on SQLite its single
+writer caps the total.
+
+Then, with the largest shard count, one shard is killed mid-run to show the
+supervisor taking it off the ring and putting its restart back, and how many
+devices moved.
+
+Usage: python benchmarks/bench_sharding.py [--shards 1,2,4] [--seconds S] [--patients N]
+"""
+import argparse
+import multiprocessing
+import os
+import signal
+import statistics
+import tempfile
+import time
+
+os.environ.setdefault('LOG_LEVEL', 'WARNING')
+
+import common
+
+common.use_null_firestore()
+
+from django.db import connections
+
+from api import sharding
+from api.models import Patient
+
+
+def sample(user_id, seq):
+    return {
+        'user_id': user_id, 'seq': seq, 'heart_rate': 70 + seq % 10, 'spo2': 97,
+        'accelerometer_x': 0.0, 'accelerometer_y': 0.0, 'accelerometer_z': 9.8,
+        'gyroscope_x': 0.0, 'gyroscope_y': 0.0, 'gyroscope_z': 0.0,
+    }
+
+
+def client(directory, user_ids, seconds, start_seq, results):
+    """Post samples round-robin over user_ids until time is up; reports (count, errors, latencies)"""
+    router = sharding.ShardRouter(directory, refresh=0.1)
+    count = errors = 0
+    latencies = []
+    deadline = time.monotonic() + seconds
+    seq = start_seq
+    while time.monotonic() < deadline:
+        user_id = user_ids[seq % len(user_ids)]
+        started = time.perf_counter()
+        try:
+            status, _, _ = router.forward('ingest', sample(user_id, seq))
+        except sharding.ShardUnavailable:
+            status = 503
+        latencies.append(time.perf_counter() - started)
+        if status == 200:
+            count += 1
+        else:
+            errors += 1
+        seq += 1
+    results.put((count, errors, latencies))
+
+
+def drive(directory, user_ids, clients, seconds, start_seq):
+    connections.close_all()
+    context = multiprocessing.get_context('fork')
+    results = context.Queue()
+    processes = [
+        context.Process(target=client, args=(directory, user_ids[index::clients], seconds,
+                                             start_seq + index * 10 ** 9, results))
+        for index in range(clients)
+    ]
+    for process in processes:
+        process.start()
+    outcomes = [results.get() for _ in processes]
+    for process in processes:
+        process.join()
+    count = sum(outcome[0] for outcome in outcomes)
+    errors = sum(outcome[1] for outcome in outcomes)
+    latencies = [latency for outcome in outcomes for latency in outcome[2]]
+    return count, errors, latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--shards', default=','.join(str(n) for n in (1, 2, 4, 8) if n <= max(os.cpu_count(), 2)))
+    parser.add_argument('--clients', type=int, default=2, help="Client processes per shard")
+    parser.add_argument('--seconds', type=float, default=10.0)
+    parser.add_argument('--patients', type=int, default=1000)
+    args = parser.parse_args()
+    shard_counts = [int(n) for n in args.shards.split(',')]
+
+    print(f"{os.cpu_count()} CPU cores")
+    with common.benchmark_database(), tempfile.TemporaryDirectory() as tmpdir:
+        Patient.objects.bulk_create(
+            Patient(name=f"Patient {i}", age=70, gender='OTHER', user_id=f'shard-bench-{i}')
+            for i in range(args.patients)
+        )
+        user_ids = [f'shard-bench-{i}' for i in range(args.patients)]
+
+        baseline = None
+        start_seq = 0
+        for shards in shard_counts:
+            directory = os.path.join(tmpdir, f'{shards}-shards')
+            supervisor = sharding.Supervisor(directory, shards)
+            supervisor.start()
+            try:
+                count, errors, latencies = drive(directory, user_ids, shards * args.clients, args.seconds, start_seq)
+            finally:
+                supervisor.stop()
+            start_seq += 10 ** 12
+            rate = count / args.seconds
+            baseline = baseline or rate
+            print(f"{shards} shard(s), {shards * args.clients} clients: {rate:,.0f} samples/s "
+                  f"({rate / baseline:.2f}x), median round trip {statistics.median(latencies) * 1e3:.1f} ms, "
+                  f"{errors} errors")
+
+        shards = shard_counts[-1]
+        directory = os.path.join(tmpdir, 'restart')
+        supervisor = sharding.Supervisor(directory, shards)
+        supervisor.start()
+        before = sharding.HashRing(supervisor.members)
+        try:
+            context = multiprocessing.get_context('fork')
+            connections.close_all()
+            results = context.Queue()
+            load = context.Process(target=client, args=(directory, user_ids, args.seconds, start_seq, results))
+            load.start()
+            time.sleep(args.seconds / 4)
+            victim = sorted(supervisor.members)[0]
+            os.kill(supervisor.processes[victim][0].pid, signal.SIGKILL)
+            killed = time.monotonic()
+            left = back = None
+            while time.monotonic() - killed < args.seconds and back is None:
+                supervisor.poll()
+                if left is None and victim not in supervisor.members:
+                    left = time.monotonic() - killed
+                    during = sharding.HashRing(supervisor.members)
+                if left is not None and victim in supervisor.members:
+                    back = time.monotonic() - killed
+                time.sleep(0.01)
+            count, errors, _ = results.get()
+            load.join()
+        finally:
+            supervisor.stop()
+        moved = sum(before.node_for(user_id) != during.node_for(user_id) for user_id in user_ids)
+        owned = sum(before.node_for(user_id) == victim for user_id in user_ids)
+        print(f"Killed {victim}: off the ring after {left * 1e3:.0f} ms, back after {back:.1f} s; "
+              f"{moved} of {len(user_ids)} devices moved ({owned} were on {victim}); "
+              f"{count:,} samples stored, {errors} failed during the run")
+
+
+if __name__ == '__main__':
+    main()
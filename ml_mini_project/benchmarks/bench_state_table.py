@@ -0,0 +1,144 @@
+"""
+Benchmark the shared latest-state table (api.state_table) across processes
+
+Maps a --patients row table in /dev/shm (or the temp directory), fills it,
+then runs one writer process rewriting random rows flat out and --readers
+reader processes reading random rows for --seconds. Every write stores one
+counter in all of a row's vitals, probabilities and last-seen time, so a read
+that mixes two writes shows up as a row whose values differ. Reports reads/s
+in total and per reader, writes/s, torn reads (should be 0) and reads that
+gave up on a busy row.
+
+For comparison it then times GET /api/patients/{id}/latest/ in one process
+served from the table and from the database (the PatientStatus row), and the
+bare PatientStatus query.
+
+Usage: python benchmarks/bench_state_table.py [--readers N] [--seconds S] [--patients N]
+"""
+import argparse
+import multiprocessing
+import os
+import random
+import statistics
+import tempfile
+import time
+
+import common
+
+common.use_null_firestore()
+
+from django.db import connection
+from django.test import override_settings
+from rest_framework.test import APIRequestFactory
+
+from api import state_table, views
+from api.models import Patient, PatientStatus
+from api.state_table import FIELDS, LatestStateTable
+
+COUNTED = [name for name, _ in FIELDS[1:-1]]   # last_seen, the vitals and the probabilities
+
+
+def writer(path, patients, stop, results):
+    table = LatestStateTable(path, patients + 1)
+    rng = random.Random(1)
+    count = 0
+    while not stop.is_set():
+        for _ in range(1000):
+            count += 1
+            value = float(count % (1 << 24))   # exact in float32
+            # last_seen only grows, so every write is newer than the row's
+            table.write(rng.randint(1, patients), float(count), dict.fromkeys(COUNTED[1:], value))
+    results.put(('writer', count))
+
+
+def reader(path, patients, seconds, seed, results):
+    table = LatestStateTable(path, patients + 1)
+    rng = random.Random(seed)
+    reads = torn = busy = 0
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        for _ in range(1000):
+            record = table.read_record(rng.randint(1, patients))
+            if record is None:
+                busy += 1
+                continue
+            value = float(record['last_seen']) % (1 << 24)
+            if any(float(record[name]) != value for name in COUNTED[1:]):
+                torn += 1
+        reads += 1000
+    results.put(('reader', reads, torn, busy))
+
+
+def per_call(function, calls):
+    timings = []
+    for _ in range(calls):
+        started = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - started)
+    return statistics.median(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--readers', type=int, default=8)
+    parser.add_argument('--seconds', type=float, default=5.0)
+    parser.add_argument('--patients', type=int, default=100000)
+    parser.add_argument('--calls', type=int, default=2000)
+    args = parser.parse_args()
+
+    print(f"{os.cpu_count()} CPU cores")
+    directory = '/dev/shm' if os.path.isdir('/dev/shm') else None
+    with tempfile.TemporaryDirectory(dir=directory) as tmpdir:
+        path = os.path.join(tmpdir, 'latest')
+        table = LatestStateTable(path, args.patients + 1)
+        for patient_id in range(1, args.patients + 1):
+            table.write(patient_id, 0.0, dict.fromkeys(COUNTED[1:], 0.0))
+
+        context = multiprocessing.get_context('fork')
+        results = context.Queue()
+        stop = context.Event()
+        processes = [context.Process(target=writer, args=(path, args.patients, stop, results))]
+        processes += [
+            context.Process(target=reader, args=(path, args.patients, args.seconds, index, results))
+            for index in range(args.readers)
+        ]
+        for process in processes:
+            process.start()
+        readers = [results.get() for _ in range(args.readers)]
+        stop.set()
+        writes = results.get()[1]
+        for process in processes:
+            process.join()
+        reads = sum(result[1] for result in readers)
+        torn = sum(result[2] for result in readers)
+        busy = sum(result[3] for result in readers)
+        print(f"{args.readers} readers, 1 writer, {args.patients:,} rows: {reads / args.seconds:,.0f} reads/s "
+              f"({reads / args.seconds / args.readers:,.0f} per reader), {writes / args.seconds:,.0f} writes/s; "
+              f"{torn} torn reads, {busy} gave up on a busy row")
+
+        with common.benchmark_database():
+            patient = Patient.objects.create(name="Patient", age=70, gender='OTHER', user_id='state-bench')
+            PatientStatus.objects.filter(patient=patient).update(heart_rate=72, spo2=97, risk_level='NORMAL')
+            table.write(patient.id, time.time(), {'heart_rate': 72, 'spo2': 97, 'risk_level': 'NORMAL'})
+            view = views.PatientViewSet.as_view({'get': 'latest'})
+            factory = APIRequestFactory()
+
+            def get():
+                return view(factory.get(f'/api/patients/{patient.id}/latest/'), pk=str(patient.id))
+
+            with override_settings(LATEST_STATE_PATH=path, LATEST_STATE_CAPACITY=args.patients + 1):
+                state_table.reset()
+                from_table = per_call(get, args.calls)
+            state_table.reset()
+            from_database = per_call(get, args.calls)
+            query = per_call(lambda: PatientStatus.objects.filter(patient_id=patient.id).values().first(),
+                             args.calls)
+            print(f"GET /api/patients/{{id}}/latest/: {from_table * 1e6:.0f} us from the table, "
+                  f"{from_database * 1e6:.0f} us from {connection.vendor} "
+                  f"(the PatientStatus query alone {query * 1e6:.0f} us); "
+                  f"table read alone {per_call(lambda: table.read(patient.id), args.calls) * 1e6:.1f} us")
+        table.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,111 @@
+"""
+Benchmark cold start vs warm-up for a fresh server process
+
+Starts a new Python process per run, loads the WSGI application the way a
+server does (health_monitor.wsgi) with WARMUP_ON_STARTUP off and on, and
+reports:
+  - startup: from process start to the application being loaded
+  - first request: latency of the first POST /api/health-data/
+  - steady: median latency of the --requests that follow
+
+Requests go straight to the WSGI callable. The database is a SQLite file
+prepared beforehand and Firestore is replaced by one that discards writes.
+
+Usage: python benchmarks/bench_warmup.py [--runs N] [--requests N]
+"""
+import argparse
+import io
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+def prepare():
+    """Create the database and the benchmark patient"""
+    import common  # noqa: F401
+    from django.core.management import call_command
+
+    from api.models import Patient
+
+    call_command('migrate', verbosity=0)
+    Patient.objects.create(name="Warm-up", age=80, gender='OTHER', user_id='bench-warmup')
+
+
+def post(application, i):
+    from wsgiref.util import setup_testing_defaults
+
+    body = json.dumps({
+        'user_id': 'bench-warmup', 'heart_rate': 60 + i % 40, 'spo2': 96 + i % 4,
+        'accelerometer_x': 0.1, 'accelerometer_y': 0.2, 'accelerometer_z': 9.8,
+        'gyroscope_x': 0.5, 'gyroscope_y': -0.2, 'gyroscope_z': 0.1,
+    }).encode()
+    environ = {
+        'REQUEST_METHOD': 'POST', 'PATH_INFO': '/api/health-data/', 'CONTENT_TYPE': 'application/json',
+        'CONTENT_LENGTH': str(len(body)), 'wsgi.input': io.BytesIO(body),
+    }
+    setup_testing_defaults(environ)
+    statuses = []
+    started = time.perf_counter()
+    response = application(environ, lambda status, headers: statuses.append(status))
+    b''.join(response)
+    response.close()
+    elapsed = time.perf_counter() - started
+    assert statuses[0].startswith('200'), statuses
+    return elapsed
+
+
+def measure(process_started, requests):
+    """Load the application as a server would and time the requests"""
+    import common
+
+    # Django's setup has already imported the API; swap its Firestore before warm-up
+    common.use_null_firestore()
+    from health_monitor import wsgi
+    startup = time.time() - process_started
+
+    first = post(wsgi.application, 0)
+    steady = statistics.median(post(wsgi.application, i) for i in range(1, requests + 1))
+    print(json.dumps({'startup': startup, 'first': first, 'steady': steady}))
+
+
+def child(database, mode, *args):
+    env = dict(os.environ, SQLITE_PATH=database, WARMUP_ON_STARTUP='true' if mode == 'warm' else 'false',
+               LOG_LEVEL='ERROR')
+    command = [sys.executable, __file__, '--child', 'prepare' if mode == 'prepare' else 'measure', *args]
+    output = subprocess.run(command, env=env, cwd=HERE, check=True, capture_output=True, text=True).stdout
+    return json.loads(output.strip().splitlines()[-1]) if mode != 'prepare' else None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--requests', type=int, default=50)
+    parser.add_argument('--child', nargs='+', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        if args.child[0] == 'prepare':
+            prepare()
+        else:
+            measure(float(args.child[1]), args.requests)
+        return
+
+    with tempfile.TemporaryDirectory() as directory:
+        database = os.path.join(directory, 'bench.sqlite3')
+        child(database, 'prepare')
+        print(f"{'mode':<6}{'startup':>10}{'first request':>16}{'steady':>10}")
+        for mode in ('cold', 'warm'):
+            results = [child(database, mode, str(time.time())) for _ in range(args.runs)]
+            median = {key: statistics.median(result[key] for result in results) for key in results[0]}
+            print(f"{mode:<6}{median['startup'] * 1e3:>8.0f} ms{median['first'] * 1e3:>13.1f} ms"
+                  f"{median['steady'] * 1e3:>7.1f} ms")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,113 @@
+"""
+Shared setup for the benchmark scripts
+"""
+import contextlib
+import os
+import sys
+import tempfile
+import time
+
+import django
+
+# Set up Django environment
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'health_monitor_server'))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'health_monitor.settings')
+django.setup()
+
+from django.conf import settings
+
+# Benchmarks post flat out from a few devices; bench_ingest_overload.py sets its own limits
+settings.INGEST_DEVICE_RATE = 0
+settings.INGEST_GLOBAL_RATE = 0
+
+
+class NullDocument:
+    def __init__(self, doc_id, latency=0.0):
+        self.id = doc_id
+        self.latency = latency
+
+    def set(self, data, merge=False):
+        time.sleep(self.latency)
+
+    def update(self, data):
+        time.sleep(self.latency)
+
+    def get(self, field_paths=None, timeout=None):
+        time.sleep(self.latency)
+        return NullSnapshot(self.id)
+
+
+class NullSnapshot:
+    exists = False
+
+    def __init__(self, doc_id):
+        self.id = doc_id
+
+    def to_dict(self):
+        return None
+
+
+class NullCollection:
+    def __init__(self, latency=0.0):
+        self.latency = latency
+
+    def document(self, doc_id):
+        return NullDocument(doc_id, self.latency)
+
+
+class NullBatch:
+    def __init__(self, latency=0.0):
+        self.latency = latency
+
+    def set(self, reference, data, merge=False):
+        pass
+
+    def commit(self):
+        time.sleep(self.latency)
+
+
+class NullFirestore:
+    """
+    Firestore stand-in that accepts writes without doing any I/O
+
+    Each write or batch commit can be made to take ``latency`` seconds, to
+    stand in for the round trip to Firestore.
+    """
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+
+    def collection(self, name):
+        return NullCollection(self.latency)
+
+    def batch(self):
+        return NullBatch(self.latency)
+
+
+def use_null_firestore(latency=0.0):
+    """Point the API's Firebase services at a Firestore that discards writes"""
+    from api import views
+
+    for service in (views.firebase_service, views.firebase_repository.firebase_service):
+        service.initialized = True
+        service.db = NullFirestore(latency)
+
+
+@contextlib.contextmanager
+def benchmark_database():
+    """
+    Create a throwaway database for the configured backend and remove it afterwards.
+
+    SQLite uses a temporary file rather than the in-memory test database so
+    journal settings and cross-connection locking behave as in production.
+    """
+    from django.db import connection
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        if connection.vendor == 'sqlite':
+            connection.settings_dict['TEST']['NAME'] = os.path.join(tmpdir, 'bench.sqlite3')
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            yield connection
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
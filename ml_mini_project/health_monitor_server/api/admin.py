@@ -1,5 +1,6 @@
 from django.contrib import admin
 from .models import Patient, Guardian, HealthData, Alert
+from .views import set_alerts_status
 
 class GuardianInline(admin.TabularInline):
     model = Guardian
@@ -66,10 +67,11 @@ class AlertAdmin(admin.ModelAdmin):
     get_patient_name.admin_order_field = 'patient__name'
     
     def mark_as_acknowledged(self, request, queryset):
-        queryset.update(status='ACKNOWLEDGED')
+        updated = set_alerts_status(queryset, 'ACKNOWLEDGED')
+        self.message_user(request, f"{updated} alert(s) marked as acknowledged")
     mark_as_acknowledged.short_description = "Mark selected alerts as acknowledged"
     
     def mark_as_resolved(self, request, queryset):
-        from django.utils import timezone
-        queryset.update(status='RESOLVED', resolved_at=timezone.now())
-    mark_as_resolved.short_description = "Mark selected alerts as resolved"
\ No newline at end of file
+        updated = set_alerts_status(queryset, 'RESOLVED')
+        self.message_user(request, f"{updated} alert(s) marked as resolved")
+    mark_as_resolved.short_description = "Mark selected alerts as resolved"
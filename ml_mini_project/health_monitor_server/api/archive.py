@@ -0,0 +1,271 @@
+"""
+Columnar cold storage for old health data.
+
+Rows older than HEALTH_DATA_ARCHIVE_AFTER_DAYS are moved out of the HealthData
+table (``manage.py archive_health_data``) into one compressed NumPy archive per
+patient and day under HEALTH_DATA_ARCHIVE_DIR::
+
+    <HEALTH_DATA_ARCHIVE_DIR>/<patient_id>/<YYYY-MM-DD>.npz
+
+Each file holds one array per column: ids, sequence numbers, boots and
+timestamps (microseconds since the epoch) as int64, readings as float64 with
+NaN for missing values. Samples referenced by an alert stay in the database.
+Files written before boots were archived read as boot 0.
+
+``history()`` reads a patient's samples from both tiers, merged in time order,
+so callers do not need to know where a sample is kept.
+"""
+import datetime
+import heapq
+import itertools
+import os
+import tempfile
+
+import numpy as np
+from django.conf import settings
+from django.db import transaction
+
+from .models import HealthData
+
+# Columns kept per sample, in file order
+INT_COLUMNS = ('id', 'seq', 'boot', 'timestamp')
+FLOAT_COLUMNS = (
+    'heart_rate', 'spo2',
+    'accelerometer_x', 'accelerometer_y', 'accelerometer_z',
+    'gyroscope_x', 'gyroscope_y', 'gyroscope_z',
+    'temperature', 'systolic_bp', 'diastolic_bp', 'respiratory_rate',
+)
+COLUMNS = INT_COLUMNS + FLOAT_COLUMNS
+
+# Readings stored as integers in the database
+_INTEGER_READINGS = frozenset(
+    field.name for field in HealthData._meta.concrete_fields
+    if field.name in FLOAT_COLUMNS and field.get_internal_type() == 'IntegerField'
+)
+
+# Stands in for a missing sequence number
+_NO_SEQ = np.iinfo(np.int64).min
+
+_EPOCH = datetime.datetime(1970, 1, 1, tzinfo=datetime.timezone.utc)
+
+# Rows deleted per statement once archived, below SQLite's limit on query parameters
+DELETE_CHUNK_SIZE = 5000
+
+
+def archive_dir():
+    return os.fspath(settings.HEALTH_DATA_ARCHIVE_DIR)
+
+
+def _patient_dir(patient_id):
+    return os.path.join(archive_dir(), str(patient_id))
+
+
+def _to_micros(value):
+    return (value - _EPOCH) // datetime.timedelta(microseconds=1)
+
+
+def patients():
+    """Ids of patients with archived samples"""
+    try:
+        names = os.listdir(archive_dir())
+    except FileNotFoundError:
+        return []
+    return sorted(int(name) for name in names if name.isdigit())
+
+
+def days(patient_id):
+    """Days with archived samples for a patient, oldest first"""
+    try:
+        names = os.listdir(_patient_dir(patient_id))
+    except FileNotFoundError:
+        return []
+    return sorted(datetime.date.fromisoformat(name[:-4]) for name in names if name.endswith('.npz'))
+
+
+def state(patient_id):
+    """Name, size and modification time of each of a patient's day files, for validators"""
+    try:
+        entries = list(os.scandir(_patient_dir(patient_id)))
+    except FileNotFoundError:
+        return []
+    files = []
+    for entry in entries:
+        if entry.name.endswith('.npz'):
+            stat = entry.stat()
+            files.append((entry.name, stat.st_size, stat.st_mtime_ns))
+    return sorted(files)
+
+
+def read_day(patient_id, day):
+    """Columns archived for a patient and day, sorted by timestamp"""
+    path = os.path.join(_patient_dir(patient_id), f'{day.isoformat()}.npz')
+    with np.load(path) as archive:
+        columns = {column: archive[column] for column in COLUMNS if column in archive.files}
+    columns.setdefault('boot', np.zeros(len(columns['id']), dtype=np.int64))
+    return columns
+
+
+def archived_seqs(patient_id, dates):
+    """(boot, seq) pairs archived for a patient on any of some days"""
+    pairs = set()
+    for day in sorted(set(dates) & set(days(patient_id))):
+        columns = read_day(patient_id, day)
+        numbered = columns['seq'] != _NO_SEQ
+        pairs.update(zip(columns['boot'][numbered].tolist(), columns['seq'][numbered].tolist()))
+    return pairs
+
+
+def _columns(rows):
+    """Turn values_list(*COLUMNS) rows into column arrays"""
+    ints = np.array(
+        [(row[0], _NO_SEQ if row[1] is None else row[1], row[2], _to_micros(row[3])) for row in rows],
+        dtype=np.int64,
+    ).reshape(-1, len(INT_COLUMNS))
+    floats = np.array(
+        [row[len(INT_COLUMNS):] for row in rows], dtype=np.float64
+    ).reshape(-1, len(FLOAT_COLUMNS))
+    columns = {name: ints[:, index] for index, name in enumerate(INT_COLUMNS)}
+    columns.update({name: floats[:, index] for index, name in enumerate(FLOAT_COLUMNS)})
+    return columns
+
+
+def write_day(patient_id, day, rows):
+    """
+    Add samples to a patient's archive for one day
+
+    Args:
+        rows: values_list(*COLUMNS) tuples; samples already in the file
+            (same id) are replaced
+
+    Returns:
+        Number of samples in the file
+    """
+    columns = _columns(rows)
+    directory = _patient_dir(patient_id)
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f'{day.isoformat()}.npz')
+    if os.path.exists(path):
+        existing = read_day(patient_id, day)
+        keep = ~np.isin(existing['id'], columns['id'])
+        columns = {name: np.concatenate((existing[name][keep], columns[name])) for name in COLUMNS}
+
+    order = np.lexsort((columns['id'], columns['timestamp']))
+    columns = {name: values[order] for name, values in columns.items()}
+
+    # Write a temporary file and move it into place, so readers never see a partial archive
+    handle, temporary = tempfile.mkstemp(dir=directory, suffix='.npz.tmp')
+    try:
+        with os.fdopen(handle, 'wb') as stream:
+            np.savez_compressed(stream, **columns)
+        os.replace(temporary, path)
+    except BaseException:
+        os.unlink(temporary)
+        raise
+    return len(order)
+
+
+def archive_health_data(cutoff, patient_ids=None, dry_run=False):
+    """
+    Move samples older than cutoff to the archive
+
+    Each patient and day is written to its file before its rows are deleted;
+    if the process stops in between, the next run rewrites the same ids. The
+    days are listed first and each day is read in full before its rows are
+    deleted, so no cursor is left open on the table while rows go (SQLite
+    does not define what such a cursor returns).
+
+    Returns:
+        Tuple of (samples archived, day files written)
+    """
+    rows = HealthData.objects.filter(timestamp__lt=cutoff, alerts__isnull=True)
+    if patient_ids is not None:
+        rows = rows.filter(patient_id__in=patient_ids)
+    archived = files = 0
+    for patient_id in list(rows.values_list('patient_id', flat=True).distinct().order_by('patient_id')):
+        patient_rows = rows.filter(patient_id=patient_id)
+        for start in list(patient_rows.datetimes('timestamp', 'day', tzinfo=datetime.timezone.utc)):
+            day_rows = list(
+                patient_rows.filter(timestamp__gte=start, timestamp__lt=start + datetime.timedelta(days=1))
+                .order_by('timestamp', 'id')
+                .values_list(*COLUMNS)
+            )
+            if not dry_run:
+                write_day(patient_id, start.date(), day_rows)
+                ids = [row[0] for row in day_rows]
+                with transaction.atomic():
+                    for offset in range(0, len(ids), DELETE_CHUNK_SIZE):
+                        HealthData.objects.filter(id__in=ids[offset:offset + DELETE_CHUNK_SIZE]).delete()
+            archived += len(day_rows)
+            files += 1
+    return archived, files
+
+
+def _records(columns, descending=False):
+    """Yield one dict per archived sample, with database values"""
+    step = -1 if descending else 1
+    values = []
+    for name in COLUMNS:
+        column = columns[name][::step].tolist()
+        if name == 'timestamp':
+            column = [_EPOCH + datetime.timedelta(microseconds=value) for value in column]
+        elif name == 'seq':
+            column = [None if value == _NO_SEQ else value for value in column]
+        elif name in _INTEGER_READINGS:
+            column = [None if value != value else int(value) for value in column]
+        elif name in FLOAT_COLUMNS:
+            column = [None if value != value else value for value in column]
+        values.append(column)
+    for row in zip(*values):
+        yield dict(zip(COLUMNS, row))
+
+
+def _archived(patient_id, start, end, descending):
+    selected = [
+        day for day in days(patient_id)
+        if (start is None or day >= start.astimezone(datetime.timezone.utc).date())
+        and (end is None or day <= end.astimezone(datetime.timezone.utc).date())
+    ]
+    for day in reversed(selected) if descending else selected:
+        columns = read_day(patient_id, day)
+        keep = np.ones(len(columns['id']), dtype=bool)
+        if start is not None:
+            keep &= columns['timestamp'] >= _to_micros(start)
+        if end is not None:
+            keep &= columns['timestamp'] < _to_micros(end)
+        yield from _records({name: values[keep] for name, values in columns.items()}, descending)
+
+
+def _live(patient_id, start, end, descending, limit):
+    rows = HealthData.objects.filter(patient_id=patient_id)
+    if start is not None:
+        rows = rows.filter(timestamp__gte=start)
+    if end is not None:
+        rows = rows.filter(timestamp__lt=end)
+    order = ('-timestamp', '-id') if descending else ('timestamp', 'id')
+    rows = rows.order_by(*order).values_list(*COLUMNS)
+    if limit is not None:
+        rows = rows[:limit]
+    for row in rows.iterator(chunk_size=2000):
+        yield dict(zip(COLUMNS, row))
+
+
+def history(patient_id, start=None, end=None, descending=False, limit=None):
+    """
+    A patient's samples from the database and the archive, in time order
+
+    Args:
+        start: Earliest timestamp to include
+        end: Timestamp to stop before
+        descending: Newest first
+        limit: Most samples to return
+
+    Yields:
+        Dicts of COLUMNS, lazily; day files are only read when reached
+    """
+    merged = heapq.merge(
+        _live(patient_id, start, end, descending, limit),
+        _archived(patient_id, start, end, descending),
+        key=lambda record: (record['timestamp'], record['id']),
+        reverse=descending,
+    )
+    return itertools.islice(merged, limit)
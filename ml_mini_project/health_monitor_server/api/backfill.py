@@ -0,0 +1,161 @@
+"""
+Backfill of samples buffered on a device while it was offline.
+
+Buffered samples arrive in chunks with their original timestamps. They are
+stored with bulk inserts (samples already stored are skipped by sequence
+number) and are not pushed or alerted one by one: by the time they arrive
+they are history, not live readings. Instead the windowed features and models
+are rerun over the backfilled range, and each run of consecutive anomalous
+samples becomes one alert dated when it started.
+"""
+import datetime
+
+import numpy as np
+from django.conf import settings
+
+from . import archive, state_table
+from .features import CHANNELS, compute_features, sample_row, sliding_windows
+from .models import RISK_LEVELS, HealthData, Alert, PatientStatus
+
+# Windows scored per compute_features() call, bounding memory on long backfills
+SCORE_CHUNK_SIZE = 10000
+
+# Columns of CHANNELS the models score when they do not use feature vectors
+_IMU = [CHANNELS.index(name) for name in ('accelerometer_x', 'accelerometer_y', 'accelerometer_z',
+                                          'gyroscope_x', 'gyroscope_y', 'gyroscope_z')]
+_VITALS = [CHANNELS.index('heart_rate'), CHANNELS.index('spo2')]
+
+
+def store_samples(patient, samples, batch_size=1000):
+    """
+    Bulk insert samples, skipping sequence numbers the patient already has
+    
+    Stored samples may have been archived since (see api.archive), so the
+    archive files of the days the samples fall on are checked too.
+    
+    Args:
+        patient: Patient the samples belong to
+        samples: Sample dicts with HealthData field values, each with a seq and boot
+        
+    Returns:
+        Set of the (boot, seq) pairs inserted
+    """
+    if not samples:
+        return set()
+    # Buffered sequence numbers are mostly contiguous, so one range query per
+    # boot finds the stored ones without a parameter per sample
+    stored = set()
+    for boot in {sample['boot'] for sample in samples}:
+        seqs = [sample['seq'] for sample in samples if sample['boot'] == boot]
+        stored.update(
+            HealthData.objects.filter(patient=patient, boot=boot, seq__gte=min(seqs), seq__lte=max(seqs))
+            .values_list('boot', 'seq')
+        )
+    dates = {sample['timestamp'].astimezone(datetime.timezone.utc).date() for sample in samples}
+    stored.update(archive.archived_seqs(patient.id, dates))
+    
+    new = {}
+    for sample in samples:
+        key = (sample['boot'], sample['seq'])
+        if key not in stored:
+            new.setdefault(key, sample)
+    HealthData.objects.bulk_create(
+        (HealthData(patient=patient, **sample) for sample in new.values()),
+        batch_size=batch_size,
+        ignore_conflicts=True,
+    )
+    return set(new)
+
+
+def _episodes(flags):
+    """(start, end) index pairs of each run of True values, end exclusive"""
+    edges = np.diff(np.concatenate(([0], flags.astype(np.int8), [0])))
+    return zip(np.flatnonzero(edges == 1), np.flatnonzero(edges == -1))
+
+
+def rescore(patient, start, end, predictor, seqs, window_size=None):
+    """
+    Rerun windowed analytics over a backfilled time range
+    
+    Windows ending at every sample in [start, end] are built from the stored
+    samples, including the ones just before the range for context. Only
+    samples whose (boot, seq) is in ``seqs`` (those just inserted) can raise alerts.
+    The newest sample of the range updates the patient's PatientStatus if it
+    is the latest the patient has.
+    
+    Returns:
+        List of Alert instances created, one per anomalous episode
+    """
+    window_size = window_size or getattr(settings, 'FEATURE_WINDOW_SIZE', 30)
+    patient_data = HealthData.objects.filter(patient=patient)
+    context = list(
+        patient_data.filter(timestamp__lt=start).order_by('-timestamp').values(*CHANNELS)[:window_size - 1]
+    )
+    context.reverse()
+    rows = list(
+        patient_data.filter(timestamp__gte=start, timestamp__lte=end)
+        .order_by('timestamp', 'id').values('id', 'boot', 'seq', *CHANNELS)
+    )
+    if not rows:
+        return []
+    
+    matrix = np.array([sample_row(row) for row in context + rows])
+    windows = sliding_windows(matrix, window_size)[len(context):]
+    samples = matrix[len(context):]
+    
+    # Each chunk is scored in one call per model, with the thresholds ingestion uses
+    falls = np.empty(len(rows))
+    risks = np.empty(len(rows))
+    for offset in range(0, len(rows), SCORE_CHUNK_SIZE):
+        chunk = slice(offset, offset + SCORE_CHUNK_SIZE)
+        features = compute_features(windows[chunk])
+        falls[chunk] = predictor.fall_probabilities(samples[chunk][:, _IMU], features)
+        risks[chunk] = predictor.vitals_probabilities(samples[chunk][:, _VITALS], features)
+    levels = predictor.risk_levels(risks)
+    
+    backfilled = np.array([(row['boot'], row['seq']) in seqs for row in rows])
+    alerts = []
+    
+    fall_flags = (falls >= predictor.fall_threshold) & backfilled
+    for first, last in _episodes(fall_flags):
+        worst = first + int(np.argmax(falls[first:last]))
+        alerts.append(Alert(
+            patient=patient,
+            timestamp=rows[first]['timestamp'],
+            type='FALL',
+            message=f"Fall detected with {falls[worst]:.2%} confidence "
+                    f"while the device was offline{_span(rows, first, last)}",
+            health_data_id=rows[worst]['id'],
+            status='NEW',
+        ))
+    
+    vitals_flags = (levels > 0) & backfilled
+    for first, last in _episodes(vitals_flags):
+        worst = first + int(np.argmax(risks[first:last]))
+        alerts.append(Alert(
+            patient=patient,
+            timestamp=rows[first]['timestamp'],
+            type='VITALS',
+            message=f"Abnormal vitals detected while the device was offline: {RISK_LEVELS[levels[worst]]}. "
+                    f"HR: {rows[worst]['heart_rate']}, SpO2: {rows[worst]['spo2']}{_span(rows, first, last)}",
+            health_data_id=rows[worst]['id'],
+            status='NEW',
+        ))
+    
+    alerts.sort(key=lambda alert: alert.timestamp)
+    for alert in alerts:
+        alert.save()
+    
+    # The newest sample of the range may be the patient's latest
+    vitals = {'risk_level': RISK_LEVELS[levels[-1]], 'risk_probability': risks[-1]}
+    fall = {'fall_probability': falls[-1]}
+    PatientStatus.objects.record_sample(patient.id, rows[-1], vitals, fall)
+    state_table.record_sample(patient.id, rows[-1], vitals, fall)
+    return alerts
+
+
+def _span(rows, first, last):
+    if last - first == 1:
+        return ""
+    return (f" ({last - first} samples from {rows[first]['timestamp']:%Y-%m-%d %H:%M:%S} "
+            f"to {rows[last - 1]['timestamp']:%Y-%m-%d %H:%M:%S} UTC)")
@@ -0,0 +1,290 @@
+"""
+Offline replay of the alert models over stored health data.
+
+Samples are loaded in column blocks (NumPy arrays, one patient per block, in
+time order) from the database and the archive, or from CSV files written by
+the export endpoint. Both models are scored on whole blocks at once and the
+results are reduced against a grid of thresholds without a per-row loop:
+each probability is bucketed once with ``searchsorted`` and the alert counts
+for every threshold follow from a cumulative sum of the bucket counts.
+
+Alerts that guardians triaged give the labels: a RESOLVED alert marks its
+sample as a real event, a FALSE_ALARM as a false one. Precision and recall
+are computed over those labeled samples only.
+"""
+import csv
+import datetime
+import itertools
+
+import numpy as np
+
+from . import archive
+from .features import CHANNELS, compute_features, sliding_windows
+from .models import Alert, HealthData
+
+IMU_CHANNELS = ('accelerometer_x', 'accelerometer_y', 'accelerometer_z',
+                'gyroscope_x', 'gyroscope_y', 'gyroscope_z')
+_COL = {name: index for index, name in enumerate(CHANNELS)}
+_IMU = [_COL[name] for name in IMU_CHANNELS]
+_VITALS = [_COL['heart_rate'], _COL['spo2']]
+
+# Triaged alert statuses and whether they confirm the event
+OUTCOMES = {'RESOLVED': True, 'FALSE_ALARM': False}
+
+# Windows scored per compute_features() call, bounding memory for feature models
+FEATURE_CHUNK_SIZE = 10000
+
+
+class Block:
+    """Samples of one patient, in time order, as arrays"""
+    __slots__ = ('patient_id', 'ids', 'samples')
+
+    def __init__(self, patient_id, ids, samples):
+        self.patient_id = patient_id
+        self.ids = ids          # int64 HealthData ids (-1 if unknown)
+        self.samples = samples  # float64 (n, len(CHANNELS)), timestamps in epoch seconds
+
+    def __len__(self):
+        return len(self.ids)
+
+
+def _archived_block(patient_id, columns, start, end):
+    timestamps = columns['timestamp'] / 1e6
+    keep = np.ones(len(timestamps), dtype=bool)
+    if start is not None:
+        keep &= timestamps >= start.timestamp()
+    if end is not None:
+        keep &= timestamps < end.timestamp()
+    samples = np.column_stack([
+        timestamps if name == 'timestamp' else columns[name] for name in CHANNELS
+    ])
+    return Block(patient_id, columns['id'][keep], samples[keep])
+
+
+def _rows_block(patient_id, rows):
+    ids = np.fromiter((row[0] for row in rows), dtype=np.int64, count=len(rows))
+    samples = np.array([(row[1].timestamp(),) + row[2:] for row in rows], dtype=np.float64)
+    return Block(patient_id, ids, samples.reshape(-1, len(CHANNELS)))
+
+
+def _day_start(day):
+    return datetime.datetime.combine(day, datetime.time(), tzinfo=datetime.timezone.utc)
+
+
+def database_blocks(patient_ids=None, start=None, end=None, chunk_size=100000, include_archive=True):
+    """
+    Blocks of stored samples, patient by patient in time order
+
+    Each archived day is one block, merged with any samples of that day still
+    in the database (such as those referenced by alerts); the remaining
+    database rows follow in chunks.
+    """
+    rows = HealthData.objects.all()
+    if start is not None:
+        rows = rows.filter(timestamp__gte=start)
+    if end is not None:
+        rows = rows.filter(timestamp__lt=end)
+    patients = set(rows.values_list('patient_id', flat=True).distinct())
+    if include_archive:
+        patients.update(archive.patients())
+    if patient_ids is not None:
+        patients &= set(patient_ids)
+
+    for patient_id in sorted(patients):
+        patient_rows = rows.filter(patient_id=patient_id).order_by('timestamp', 'id').values_list('id', *CHANNELS)
+        archived_days = []
+        if include_archive:
+            archived_days = [
+                day for day in archive.days(patient_id)
+                if (start is None or day >= start.astimezone(datetime.timezone.utc).date())
+                and (end is None or day <= end.astimezone(datetime.timezone.utc).date())
+            ]
+        for day in archived_days:
+            block = _archived_block(patient_id, archive.read_day(patient_id, day), start, end)
+            live = list(patient_rows.filter(
+                timestamp__gte=_day_start(day), timestamp__lt=_day_start(day + datetime.timedelta(days=1))
+            ))
+            if live:
+                live = _rows_block(patient_id, live)
+                ids = np.concatenate((block.ids, live.ids))
+                samples = np.concatenate((block.samples, live.samples))
+                order = np.lexsort((ids, samples[:, 0]))
+                block = Block(patient_id, ids[order], samples[order])
+            if len(block):
+                yield block
+
+        # Database rows on archived days were merged above
+        skip = np.array([_day_start(day).timestamp() for day in archived_days])
+        iterator = patient_rows.iterator(chunk_size=min(chunk_size, 10000))
+        while True:
+            chunk = list(itertools.islice(iterator, chunk_size))
+            if not chunk:
+                break
+            block = _rows_block(patient_id, chunk)
+            if len(skip):
+                day_starts = np.floor(block.samples[:, 0] / 86400) * 86400
+                keep = ~np.isin(day_starts, skip)
+                block = Block(patient_id, block.ids[keep], block.samples[keep])
+            if len(block):
+                yield block
+
+
+def csv_blocks(paths, chunk_size=100000):
+    """Blocks from CSV files written by the export endpoint, one patient per file"""
+    for patient_id, path in enumerate(paths):
+        with open(path, newline='') as stream:
+            reader = csv.DictReader(stream)
+            while True:
+                chunk = list(itertools.islice(reader, chunk_size))
+                if not chunk:
+                    break
+                ids = np.array([int(row['id']) if row.get('id') else -1 for row in chunk], dtype=np.int64)
+                samples = np.array([
+                    [datetime.datetime.fromisoformat(row['timestamp']).timestamp()] +
+                    [float(row[name]) if row.get(name) else np.nan for name in CHANNELS[1:]]
+                    for row in chunk
+                ], dtype=np.float64)
+                yield Block(patient_id, ids, samples)
+
+
+def load_labels():
+    """Triaged alerts by type: (sorted HealthData ids, whether each was a real event)"""
+    labels = {}
+    rows = (
+        Alert.objects.filter(status__in=OUTCOMES, health_data__isnull=False)
+        .values_list('type', 'health_data_id', 'status')
+    )
+    for alert_type, group in itertools.groupby(sorted(rows), key=lambda row: row[0]):
+        group = list(group)
+        ids = np.array([row[1] for row in group], dtype=np.int64)
+        outcomes = np.array([OUTCOMES[row[2]] for row in group])
+        order = np.argsort(ids, kind='stable')
+        labels[alert_type] = (ids[order], outcomes[order])
+    return labels
+
+
+def _above(probabilities, thresholds):
+    """For each threshold, how many probabilities are at or above it"""
+    buckets = np.searchsorted(thresholds, probabilities, side='right')
+    counts = np.bincount(buckets, minlength=len(thresholds) + 1)
+    return np.cumsum(counts[::-1])[::-1][1:]
+
+
+class BlockFeatures:
+    """
+    Feature matrices for consecutive blocks
+
+    Windows of ``window_size`` samples are continued across consecutive
+    blocks of the same patient.
+    """
+
+    def __init__(self, window_size=30):
+        self.window_size = window_size
+        self._context = (None, None)
+
+    def __call__(self, block):
+        """Array of shape (len(block), len(FEATURE_NAMES))"""
+        patient_id, context = self._context
+        if patient_id != block.patient_id:
+            context = block.samples[:0]
+        matrix = np.concatenate((context, block.samples))
+        self._context = (block.patient_id, matrix[-(self.window_size - 1):] if self.window_size > 1 else matrix[:0])
+        windows = sliding_windows(matrix, self.window_size)[len(context):]
+        return np.concatenate([
+            compute_features(windows[offset:offset + FEATURE_CHUNK_SIZE])
+            for offset in range(0, len(windows), FEATURE_CHUNK_SIZE)
+        ])
+
+
+class ThresholdTally:
+    """Alert counts and labeled outcomes over a grid of thresholds for one model"""
+
+    def __init__(self, thresholds, labels=None):
+        self.thresholds = np.asarray(sorted(thresholds), dtype=float)
+        self.labels = labels
+        self.alerts = np.zeros(len(self.thresholds), dtype=np.int64)
+        self.patient_alerts = {}
+        self.true_positives = np.zeros(len(self.thresholds), dtype=np.int64)
+        self.false_positives = np.zeros(len(self.thresholds), dtype=np.int64)
+        self.positives = 0
+        self.negatives = 0
+
+    def add(self, patient_id, ids, probabilities):
+        above = _above(probabilities, self.thresholds)
+        self.alerts += above
+        if patient_id in self.patient_alerts:
+            self.patient_alerts[patient_id] += above
+        else:
+            self.patient_alerts[patient_id] = above.copy()
+
+        if self.labels is None or not len(self.labels[0]):
+            return
+        label_ids, outcomes = self.labels
+        index = np.minimum(np.searchsorted(label_ids, ids), len(label_ids) - 1)
+        labeled = label_ids[index] == ids
+        positive = outcomes[index] & labeled
+        negative = ~outcomes[index] & labeled
+        self.positives += int(positive.sum())
+        self.negatives += int(negative.sum())
+        self.true_positives += _above(probabilities[positive], self.thresholds)
+        self.false_positives += _above(probabilities[negative], self.thresholds)
+
+    def rows(self, patient_days):
+        """One dict per threshold: alerts, alerts per patient-day and precision/recall"""
+        per_patient = np.array([
+            self.patient_alerts[patient_id] / patient_days[patient_id] for patient_id in sorted(self.patient_alerts)
+        ]).reshape(-1, len(self.thresholds))
+        results = []
+        for index, threshold in enumerate(self.thresholds):
+            flagged = self.true_positives[index] + self.false_positives[index]
+            results.append({
+                'threshold': float(threshold),
+                'alerts': int(self.alerts[index]),
+                'rate_median': float(np.median(per_patient[:, index])) if len(per_patient) else 0.0,
+                'rate_max': float(per_patient[:, index].max()) if len(per_patient) else 0.0,
+                'precision': self.true_positives[index] / flagged if flagged else None,
+                'recall': self.true_positives[index] / self.positives if self.positives else None,
+            })
+        return results
+
+
+class Backtest:
+    """
+    Replay the fall and vitals models of a HealthPredictor over sample blocks
+
+    Models that use windowed features get windows of ``window_size`` samples
+    (see BlockFeatures).
+    """
+
+    def __init__(self, predictor, fall_thresholds, vitals_thresholds, labels=None, window_size=30):
+        labels = labels or {}
+        self.predictor = predictor
+        self.fall = ThresholdTally(fall_thresholds, labels.get('FALL'))
+        self.vitals = ThresholdTally(vitals_thresholds, labels.get('VITALS'))
+        self.risk_levels = np.zeros(len(predictor.risk_bands) + 1, dtype=np.int64)
+        self.samples = 0
+        self._spans = {}
+        self._features = BlockFeatures(window_size)
+
+    def add(self, block):
+        """Score a block and add it to the tallies"""
+        samples = block.samples
+        features = self._features(block) if self.predictor.uses_features() else None
+        fall = self.predictor.fall_probabilities(samples[:, _IMU], features)
+        vitals = self.predictor.vitals_probabilities(samples[:, _VITALS], features)
+
+        self.fall.add(block.patient_id, block.ids, fall)
+        self.vitals.add(block.patient_id, block.ids, vitals)
+        self.risk_levels += np.bincount(self.predictor.risk_levels(vitals), minlength=len(self.risk_levels))
+        self.samples += len(block)
+
+        first, last = samples[0, 0], samples[-1, 0]
+        span = self._spans.get(block.patient_id)
+        self._spans[block.patient_id] = (first, last) if span is None else (min(span[0], first), max(span[1], last))
+
+    def patient_days(self):
+        """Days covered per patient, at least an hour, for alert rates"""
+        return {
+            patient_id: max(last - first, 3600.0) / 86400.0
+            for patient_id, (first, last) in self._spans.items()
+        }
@@ -0,0 +1,139 @@
+"""
+Read-through caches for rows that are read on every sample but rarely change.
+
+Ingestion, chat and alert notification all look up the patient for a device
+and the guardians to notify. These helpers serve those lookups from an
+in-process TTL cache; ``api.signals`` drops entries when a Patient or
+Guardian is saved or deleted, and the TTL bounds staleness for changes made
+by other worker processes.
+"""
+import threading
+import time
+
+from django.conf import settings
+
+from . import metrics
+from .models import Patient, Guardian
+
+CACHE_REQUESTS = metrics.Counter(
+    'cache_requests_total',
+    'Lookups served by the in-process caches, by cache and result',
+    ['cache', 'result'],
+)
+
+_MISSING = object()
+
+
+class TTLCache:
+    """Thread-safe in-process cache whose entries expire after ``ttl`` seconds"""
+
+    def __init__(self, name, ttl, maxsize=10000):
+        self.name = name
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self._entries = {}
+        self._lock = threading.Lock()
+        self._hits = CACHE_REQUESTS.labels(name, 'hit')
+        self._misses = CACHE_REQUESTS.labels(name, 'miss')
+
+    def get(self, key, loader):
+        """Return the cached value for key, calling loader() on a miss"""
+        entry = self._entries.get(key)
+        if entry is not None and entry[1] > time.monotonic():
+            self._hits.inc()
+            return entry[0]
+
+        self._misses.inc()
+        value = loader()
+        self.set(key, value)
+        return value
+
+    def peek(self, key, default=None):
+        """Return the cached value without loading or counting a lookup"""
+        entry = self._entries.get(key)
+        if entry is not None and entry[1] > time.monotonic():
+            return entry[0]
+        return default
+
+    def set(self, key, value):
+        """Store a value"""
+        with self._lock:
+            if len(self._entries) >= self.maxsize and key not in self._entries:
+                self._evict()
+            self._entries[key] = (value, time.monotonic() + self.ttl)
+
+    def _evict(self):
+        # Drop expired entries first, then the oldest insertions
+        now = time.monotonic()
+        for key in [key for key, (_, expires) in self._entries.items() if expires <= now]:
+            del self._entries[key]
+        while len(self._entries) >= self.maxsize:
+            del self._entries[next(iter(self._entries))]
+
+    def invalidate(self, key):
+        """Drop the entry for key"""
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def invalidate_where(self, predicate):
+        """Drop every entry whose (key, value) matches the predicate"""
+        with self._lock:
+            for key in [key for key, (value, _) in self._entries.items() if predicate(key, value)]:
+                del self._entries[key]
+
+    def clear(self):
+        """Drop all entries"""
+        with self._lock:
+            self._entries = {}
+
+    def __len__(self):
+        return len(self._entries)
+
+
+def _ttl():
+    return getattr(settings, 'PATIENT_CACHE_TTL', 300)
+
+
+patients_by_user_id = TTLCache('patient_by_user_id', _ttl())
+patients_by_id = TTLCache('patient_by_id', _ttl())
+notifiable_guardians = TTLCache('notifiable_guardians', _ttl())
+
+
+def get_patient_by_user_id(user_id):
+    """Get the patient for a device user_id; raises Patient.DoesNotExist"""
+    return patients_by_user_id.get(user_id, lambda: Patient.objects.get(user_id=user_id))
+
+
+def get_patient(patient_id):
+    """Get a patient by primary key; raises Patient.DoesNotExist"""
+    return patients_by_id.get(str(patient_id), lambda: Patient.objects.get(id=patient_id))
+
+
+def get_notifiable_guardians(patient):
+    """Get the guardians of a patient that have notifications enabled"""
+    return notifiable_guardians.get(
+        patient.id,
+        lambda: list(Guardian.objects.filter(patient=patient, notification_enabled=True))
+    )
+
+
+def invalidate_patient(patient):
+    """Drop cached entries for a patient, including under a previous user_id"""
+    patients_by_user_id.invalidate_where(lambda key, value: value.pk == patient.pk)
+    patients_by_user_id.invalidate(patient.user_id)
+    patients_by_id.invalidate(str(patient.pk))
+    notifiable_guardians.invalidate(patient.pk)
+
+
+def invalidate_guardian(guardian):
+    """Drop cached guardian lists containing a guardian or for its patient"""
+    notifiable_guardians.invalidate(guardian.patient_id)
+    notifiable_guardians.invalidate_where(
+        lambda key, value: any(cached.pk == guardian.pk for cached in value)
+    )
+
+
+def clear_all():
+    """Drop every cached entry"""
+    for cache in (patients_by_user_id, patients_by_id, notifiable_guardians):
+        cache.clear()
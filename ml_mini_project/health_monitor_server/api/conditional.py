@@ -0,0 +1,88 @@
+"""
+Conditional GET (ETag / Last-Modified) for polled API endpoints.
+
+Validators are computed from a single aggregate query over the rows a
+response would contain: their count, lowest and highest id and latest
+``updated_at``. Inserts raise the highest id, deletes change the count or id
+range and edits move ``updated_at``, so any change that would alter the body
+changes the ETag. When the client's If-None-Match / If-Modified-Since still
+matches, a 304 is returned before any rows are loaded or serialized.
+
+Last-Modified is only sent where the date covers every change: for single
+instances (a deleted one is a 404), not for lists, whose deletes leave no
+date behind. It has whole-second resolution, so it is also left out while
+the resource changed within the current second, when a later write in the
+same second would go unnoticed.
+"""
+import hashlib
+
+from django.db.models import Count, Max, Min
+from django.utils import timezone
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
+
+
+def _etag(*parts):
+    return quote_etag(hashlib.md5(repr(parts).encode()).hexdigest())
+
+
+def _latest(*values):
+    values = [value for value in values if value is not None]
+    return max(values) if values else None
+
+
+def instance_validators(instance, *related):
+    """ETag and Last-Modified for a single instance and related instances it renders"""
+    objects = (instance,) + related
+    last_modified = _latest(*(obj.updated_at for obj in objects))
+    return _etag(*((type(obj).__name__, obj.pk, obj.updated_at) for obj in objects)), last_modified
+
+
+def queryset_validators(queryset, related=(), lookups=(), extra=()):
+    """
+    ETag for the rows of a queryset, from one aggregate query, and no Last-Modified
+    
+    Args:
+        queryset: Rows the response renders (may be sliced)
+        related: Already loaded instances whose fields show in every row,
+            e.g. the patient behind ``patient_name``
+        lookups: ``updated_at`` lookups on related rows that show in the
+            rendered rows, e.g. ``'patient__updated_at'``
+        extra: Other state the response renders, e.g. archived files
+    """
+    if not queryset.query.is_sliced:
+        queryset = queryset.order_by()
+    aggregates = {
+        'count': Count('id'),
+        'first_id': Min('id'),
+        'last_id': Max('id'),
+        'updated_at': Max('updated_at'),
+    }
+    for index, lookup in enumerate(lookups):
+        aggregates[f'lookup_{index}'] = Max(lookup)
+    stats = queryset.aggregate(**aggregates)
+    
+    parts = [queryset.model.__name__] + sorted(stats.items())
+    parts.extend((type(obj).__name__, obj.pk, obj.updated_at) for obj in related)
+    parts.extend(extra)
+    return _etag(*parts), None
+
+
+def conditional_response(request, validators, render):
+    """
+    Return 304 Not Modified if the request's validators match, else render()
+    
+    Both responses carry the ETag and, when it is safe to use (see above), Last-Modified headers.
+    """
+    etag, last_modified = validators
+    timestamp = None
+    if last_modified is not None and int(last_modified.timestamp()) < int(timezone.now().timestamp()):
+        timestamp = int(last_modified.timestamp())
+    response = get_conditional_response(request, etag=etag, last_modified=timestamp)
+    if response is None:
+        response = render()
+    if 200 <= response.status_code < 300 or response.status_code == 304:
+        response.headers['ETag'] = etag
+        if timestamp is not None:
+            response.headers['Last-Modified'] = http_date(timestamp)
+    return response
@@ -0,0 +1,137 @@
+"""
+Duplicate detection for retried health data uploads.
+
+Devices number their samples (``seq``). For each patient a sliding window of the last ``size``
+sequence numbers is kept as a bitmask below the highest one seen, as in
+IPsec/DTLS anti-replay windows: checking a retry costs a few integer
+operations and no database round trip, and samples that arrive out of order
+within the window are still accepted once.
+
+A device's counter starts again from 0 when it reboots, so devices that
+send ``seq`` also send ``boot``, a number that grows with every boot (e.g. a
+reboot counter). The window follows the device's latest boot: a sample of a
+newer boot starts it over, and samples of older boots (late retries from
+before the reboot) are answered from the database.
+
+Samples sent without ``seq`` are numbered by their sample time in
+milliseconds. Those numbers are sparse, so the window only spans the last
+``size`` milliseconds of sample time and retries of such samples are nearly
+always answered from the database.
+
+Sequence numbers older than the window, and patients not yet in memory
+(first sample after a restart, or evicted), are answered from the database.
+The unique constraint on (patient, boot, seq) remains the final guard against
+concurrent retries and other worker processes.
+"""
+import threading
+from collections import OrderedDict
+
+from django.conf import settings
+
+from .models import HealthData
+
+NEW = 'new'
+DUPLICATE = 'duplicate'
+UNKNOWN = 'unknown'
+
+
+def load_recent_seqs(patient_id, limit):
+    """Load the latest boot a patient's numbered samples came from and its highest stored sequence numbers"""
+    samples = HealthData.objects.filter(patient_id=patient_id, seq__isnull=False)
+    boot = samples.order_by('-boot').values_list('boot', flat=True).first()
+    if boot is None:
+        return 0, []
+    return boot, list(samples.filter(boot=boot).order_by('-seq').values_list('seq', flat=True)[:limit])
+
+
+class _Window:
+    """Boot, highest sequence number seen in it and a bitmask of those seen below it"""
+    __slots__ = ('boot', 'high', 'mask')
+    
+    def __init__(self, boot=0):
+        self.boot = boot
+        self.high = -1
+        self.mask = 0
+
+
+class SeqWindow:
+    """
+    Per-patient windows of recently stored sequence numbers.
+    
+    ``check()`` answers NEW, DUPLICATE, or UNKNOWN when the number is older
+    than the window or from another boot; ``add()`` records a number once its
+    sample is stored, so a failed insert can be retried. ``loader(patient_id,
+    limit)`` returns the boot and the sequence numbers to start a window with.
+    """
+    
+    def __init__(self, size=256, max_patients=10000, loader=load_recent_seqs):
+        self.size = size
+        self.max_patients = max_patients
+        self.loader = loader
+        self._windows = OrderedDict()
+        self._lock = threading.Lock()
+    
+    def _window(self, patient_id):
+        with self._lock:
+            window = self._windows.get(patient_id)
+            if window is not None:
+                self._windows.move_to_end(patient_id)
+                return window
+        
+        # Load outside the lock, so a patient's query does not hold up the others
+        window = _Window()
+        if self.loader is not None:
+            window.boot, seqs = self.loader(patient_id, self.size)
+            for seq in seqs:
+                self._add(window, seq)
+        with self._lock:
+            # Another thread may have loaded it meanwhile
+            window = self._windows.setdefault(patient_id, window)
+            if len(self._windows) > self.max_patients:
+                self._windows.popitem(last=False)
+        return window
+    
+    def _add(self, window, seq):
+        if seq > window.high:
+            shift = seq - window.high
+            window.mask = ((window.mask << shift) | 1) & ((1 << self.size) - 1) if shift < self.size else 1
+            window.high = seq
+        elif window.high - seq < self.size:
+            window.mask |= 1 << (window.high - seq)
+    
+    def check(self, patient_id, seq, boot=0):
+        """Whether a sequence number is NEW, a DUPLICATE, or UNKNOWN (older than the window, or another boot)"""
+        window = self._window(patient_id)
+        with self._lock:
+            if boot != window.boot:
+                return UNKNOWN
+            if seq > window.high:
+                return NEW
+            offset = window.high - seq
+            if offset >= self.size:
+                return UNKNOWN
+            return DUPLICATE if window.mask >> offset & 1 else NEW
+    
+    def add(self, patient_id, seq, boot=0):
+        """Record a stored sequence number; one from a newer boot starts the window over, older boots are ignored"""
+        window = self._window(patient_id)
+        with self._lock:
+            if boot < window.boot:
+                return
+            if boot > window.boot:
+                window.boot, window.high, window.mask = boot, -1, 0
+            self._add(window, seq)
+    
+    def reset(self, patient_id=None):
+        """Forget one patient's window, or all of them"""
+        with self._lock:
+            if patient_id is None:
+                self._windows.clear()
+            else:
+                self._windows.pop(patient_id, None)
+
+
+seq_window = SeqWindow(
+    size=getattr(settings, 'INGEST_DEDUP_WINDOW', 256),
+    max_patients=getattr(settings, 'INGEST_DEDUP_MAX_DEVICES', 10000),
+)
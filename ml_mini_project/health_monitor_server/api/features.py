@@ -0,0 +1,239 @@
+"""
+Derived features over a sliding window of recent samples per patient.
+
+Each patient has a fixed-size ring buffer of raw samples (vitals, IMU and the
+optional temperature / blood pressure / respiratory readings). Features are
+computed with NumPy over a batch of windows at once, so a single request is
+just a batch of one and backfills can score thousands of windows per call.
+Missing readings are NaN and ignored by every feature.
+"""
+import threading
+from collections import OrderedDict
+
+import numpy as np
+from django.conf import settings
+
+from .models import HealthData
+
+GRAVITY = 9.8
+
+# Raw channels kept per sample, in ring buffer column order
+CHANNELS = (
+    'timestamp', 'heart_rate', 'spo2',
+    'accelerometer_x', 'accelerometer_y', 'accelerometer_z',
+    'gyroscope_x', 'gyroscope_y', 'gyroscope_z',
+    'temperature', 'systolic_bp', 'diastolic_bp', 'respiratory_rate',
+)
+_COL = {name: index for index, name in enumerate(CHANNELS)}
+
+# Feature vector layout handed to the models
+FEATURE_NAMES = (
+    'heart_rate',        # latest heart rate, bpm
+    'spo2',              # latest SpO2, %
+    'hr_mean',           # mean heart rate over the window
+    'hr_std',            # heart rate standard deviation over the window
+    'hrv_rmssd',         # RMSSD of beat intervals derived from heart rate, ms
+    'spo2_slope',        # SpO2 trend, % per minute (least squares)
+    'pulse_pressure',    # mean systolic - diastolic over the window, mmHg
+    'temperature',       # mean body temperature over the window, Celsius
+    'respiratory_rate',  # mean respiratory rate over the window
+    'activity_level',    # RMS of dynamic acceleration (|acc| - g) over the window
+    'acc_magnitude',     # latest acceleration magnitude
+    'gyro_magnitude',    # latest rotation rate magnitude
+)
+
+
+def _nanmean(values, axis=1):
+    """Mean ignoring NaN; NaN where a row has no values (without warnings)"""
+    valid = ~np.isnan(values)
+    count = valid.sum(axis=axis)
+    total = np.where(valid, values, 0.0).sum(axis=axis)
+    return np.divide(total, count, out=np.full(count.shape, np.nan), where=count > 0)
+
+
+def compute_features(windows):
+    """
+    Compute the feature matrix for a batch of windows.
+
+    Args:
+        windows: array of shape (batch, window, len(CHANNELS)), oldest sample
+            first, NaN where a slot or reading is empty
+
+    Returns:
+        Array of shape (batch, len(FEATURE_NAMES))
+    """
+    windows = np.asarray(windows, dtype=np.float64)
+    column = lambda name: windows[:, :, _COL[name]]
+
+    hr = column('heart_rate')
+    spo2 = column('spo2')
+    t = column('timestamp')
+
+    hr_mean = _nanmean(hr)
+    hr_std = np.sqrt(_nanmean((hr - hr_mean[:, None]) ** 2))
+
+    # Beat-to-beat intervals approximated from successive heart rate readings
+    with np.errstate(divide='ignore', invalid='ignore'):
+        rr = np.where(hr > 0, 60000.0 / hr, np.nan)
+    hrv_rmssd = np.sqrt(_nanmean(np.diff(rr, axis=1) ** 2))
+
+    # Least squares slope of SpO2 against time, per minute
+    valid = ~(np.isnan(spo2) | np.isnan(t))
+    t_mean = _nanmean(np.where(valid, t, np.nan))
+    s_mean = _nanmean(np.where(valid, spo2, np.nan))
+    dt = np.where(valid, t - t_mean[:, None], 0.0)
+    ds = np.where(valid, spo2 - s_mean[:, None], 0.0)
+    denom = (dt * dt).sum(axis=1)
+    spo2_slope = np.divide((dt * ds).sum(axis=1) * 60.0, denom,
+                           out=np.full(denom.shape, np.nan), where=denom > 0)
+
+    pulse_pressure = _nanmean(column('systolic_bp') - column('diastolic_bp'))
+
+    acc = np.sqrt(column('accelerometer_x') ** 2 + column('accelerometer_y') ** 2 + column('accelerometer_z') ** 2)
+    gyro = np.sqrt(column('gyroscope_x') ** 2 + column('gyroscope_y') ** 2 + column('gyroscope_z') ** 2)
+    activity_level = np.sqrt(_nanmean((acc - GRAVITY) ** 2))
+
+    return np.column_stack([
+        hr[:, -1],
+        spo2[:, -1],
+        hr_mean,
+        hr_std,
+        hrv_rmssd,
+        spo2_slope,
+        pulse_pressure,
+        _nanmean(column('temperature')),
+        _nanmean(column('respiratory_rate')),
+        activity_level,
+        acc[:, -1],
+        gyro[:, -1],
+    ])
+
+
+def sample_row(sample):
+    """Convert a sample dict (or HealthData) to a ring buffer row"""
+    get = sample.get if isinstance(sample, dict) else lambda name, default=None: getattr(sample, name, default)
+    row = np.full(len(CHANNELS), np.nan)
+    for index, name in enumerate(CHANNELS):
+        value = get(name, None)
+        if value is None:
+            continue
+        if name == 'timestamp' and not isinstance(value, (int, float)):
+            value = value.timestamp()
+        row[index] = float(value)
+    return row
+
+
+def load_recent_samples(patient_id, limit):
+    """Load a patient's latest samples from the database, oldest first"""
+    rows = list(
+        HealthData.objects.filter(patient_id=patient_id)
+        .order_by('-timestamp')
+        .values(*CHANNELS)[:limit]
+    )
+    rows.reverse()
+    return [sample_row(row) for row in rows]
+
+
+class _Window:
+    """Ring buffer of the latest samples for one patient"""
+    __slots__ = ('buffer', 'next')
+
+    def __init__(self, size):
+        self.buffer = np.full((size, len(CHANNELS)), np.nan)
+        self.next = 0
+
+    def append(self, row):
+        self.buffer[self.next] = row
+        self.next = (self.next + 1) % len(self.buffer)
+
+    def ordered(self):
+        return np.concatenate((self.buffer[self.next:], self.buffer[:self.next]))
+
+
+class FeatureStore:
+    """
+    Per-patient sample windows kept in process memory.
+
+    A window missing from memory (first sample after a restart, or evicted)
+    is seeded from the database by ``loader`` so features do not start cold;
+    it is loaded outside the store's lock, so one patient's query does not
+    hold up the others.
+    """
+
+    def __init__(self, window_size=30, max_patients=10000, loader=load_recent_samples):
+        self.window_size = window_size
+        self.max_patients = max_patients
+        self.loader = loader
+        self._windows = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _load(self, patient_id):
+        window = _Window(self.window_size)
+        for row in self.loader(patient_id, self.window_size):
+            window.append(row)
+        return window
+
+    def _window(self, patient_id, loaded):
+        window = self._windows.get(patient_id)
+        if window is None:
+            # Another thread may have loaded it meanwhile; if not, use ours
+            window = loaded.pop(patient_id, None) or _Window(self.window_size)
+            self._windows[patient_id] = window
+            if len(self._windows) > self.max_patients:
+                self._windows.popitem(last=False)
+        else:
+            self._windows.move_to_end(patient_id)
+        return window
+
+    def update(self, patient_id, sample):
+        """Add a sample to a patient's window and return its feature vector"""
+        return self.update_many([patient_id], [sample])[0]
+
+    def update_many(self, patient_ids, samples):
+        """Add one sample per patient id and return the feature matrix"""
+        loaded = {}
+        while True:
+            with self._lock:
+                missing = [pid for pid in patient_ids if pid not in self._windows and pid not in loaded]
+                if not missing or self.loader is None:
+                    windows = []
+                    for patient_id, sample in zip(patient_ids, samples):
+                        window = self._window(patient_id, loaded)
+                        window.append(sample_row(sample))
+                        windows.append(window.ordered())
+                    break
+            # Windows evicted while their patients were loaded are loaded again
+            for patient_id in dict.fromkeys(missing):
+                loaded[patient_id] = self._load(patient_id)
+        return compute_features(np.stack(windows))
+
+    def reset(self, patient_id=None):
+        """Forget one patient's window, or all of them"""
+        with self._lock:
+            if patient_id is None:
+                self._windows.clear()
+            else:
+                self._windows.pop(patient_id, None)
+
+
+def sliding_windows(rows, window_size):
+    """
+    Windows ending at each row of a chronological sample matrix.
+
+    Args:
+        rows: array of shape (n, len(CHANNELS)), oldest first
+        window_size: samples per window
+
+    Returns:
+        Array of shape (n, window_size, len(CHANNELS)), NaN-padded at the start
+    """
+    rows = np.asarray(rows, dtype=np.float64)
+    padded = np.concatenate((np.full((window_size - 1, len(CHANNELS)), np.nan), rows))
+    view = np.lib.stride_tricks.sliding_window_view(padded, window_size, axis=0)
+    return view.transpose(0, 2, 1)
+
+
+feature_store = FeatureStore(
+    window_size=getattr(settings, 'FEATURE_WINDOW_SIZE', 30),
+    max_patients=getattr(settings, 'FEATURE_STORE_MAX_PATIENTS', 10000),
+)
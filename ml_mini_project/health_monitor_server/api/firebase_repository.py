@@ -1,81 +1,234 @@
 """
 Firebase Repository - Handles all database operations with Firebase
 """
-from .firebase_service import FirebaseService
+import itertools
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+
+from .cache import TTLCache
+from .firebase_service import FirebaseService, to_document
 from .models import Patient, Guardian, HealthData, Alert
+from .write_buffer import WriteBuffer
 
 class FirebaseRepository:
     """Repository pattern implementation for Firebase database operations"""
-    
+
     def __init__(self):
         self.firebase_service = FirebaseService()
-    
+
+        # Reads are cached for FIRESTORE_CACHE_TTL seconds. Cache keys carry a
+        # generation per scope (a document, or a patient's documents in a
+        # collection); writes through this repository and snapshot listeners
+        # bump the generation, so stale entries are never served again.
+        self.cache = TTLCache('firestore_reads', getattr(settings, 'FIRESTORE_CACHE_TTL', 30))
+        self._generations = OrderedDict()  # scope -> (generation, invalidated at), oldest first
+        self._generation_counter = itertools.count(1)
+        self._listeners = OrderedDict()
+        self._lock = threading.Lock()
+
+        # Health data that raised no alert is mirrored in batches
+        self.health_data_buffer = WriteBuffer(
+            'health_data', self._write_health_data,
+            max_batch=getattr(settings, 'FIRESTORE_WRITE_BATCH_SIZE', 100),
+            max_delay=getattr(settings, 'FIRESTORE_WRITE_DELAY', 1.0),
+        )
+
+    # Read cache
+
+    def _generation(self, scope):
+        entry = self._generations.get(scope)
+        return entry[0] if entry is not None else 0
+
+    def invalidate(self, *scope):
+        """Invalidate cached reads for a scope, e.g. ('alerts', patient_id)"""
+        scope = tuple(str(part) for part in scope)
+        now = time.monotonic()
+        with self._lock:
+            # Generations are never reused, so a scope can be forgotten once
+            # everything cached under its old generations has expired
+            self._generations[scope] = (next(self._generation_counter), now)
+            self._generations.move_to_end(scope)
+            while self._generations:
+                _, invalidated_at = next(iter(self._generations.values()))
+                if now - invalidated_at <= self.cache.ttl:
+                    break
+                self._generations.popitem(last=False)
+
+    def _cached(self, scope, params, loader):
+        scope = tuple(str(part) for part in scope)
+        key = scope + (self._generation(scope),) + params
+        return self.cache.get(key, loader)
+
+    def _watch(self, collection, patient_id):
+        """Invalidate a patient's cached reads when the collection changes in Firestore"""
+        if not getattr(settings, 'FIRESTORE_CACHE_LISTENERS', False):
+            return
+        scope = (collection, str(patient_id))
+        with self._lock:
+            if scope in self._listeners:
+                self._listeners.move_to_end(scope)
+                return
+            self._listeners[scope] = None
+
+        watch = self.firebase_service.watch_query(
+            collection, [('patient_id', '==', str(patient_id))],
+            lambda: self.invalidate(*scope)
+        )
+
+        with self._lock:
+            self._listeners[scope] = watch
+            # Each listener holds a stream open; keep only the most recently used
+            while len(self._listeners) > getattr(settings, 'FIRESTORE_MAX_LISTENERS', 100):
+                _, oldest = self._listeners.popitem(last=False)
+                if oldest is not None:
+                    oldest.unsubscribe()
+
+    def close(self):
+        """Stop all snapshot listeners"""
+        with self._lock:
+            listeners, self._listeners = self._listeners, OrderedDict()
+        for watch in listeners.values():
+            if watch is not None:
+                watch.unsubscribe()
+
+    def _get_document(self, collection, document_id, fields=None):
+        fields = tuple(sorted(fields)) if fields else None
+        return self._cached(
+            (collection, 'doc', document_id), (fields,),
+            lambda: self.firebase_service.get_document(collection, document_id, fields)
+        )
+
+    def _query_patient(self, collection, patient_id, limit, cursor, fields):
+        fields = tuple(sorted(fields)) if fields else None
+        self._watch(collection, patient_id)
+        return self._cached(
+            (collection, patient_id), (limit, cursor, fields),
+            lambda: self.firebase_service.query_documents(
+                collection, [('patient_id', '==', str(patient_id))],
+                limit=limit, cursor=cursor, fields=fields
+            )
+        )
+
     # Patient operations
-    
+
     def save_patient(self, patient):
         """Save a patient to Firebase"""
+        self.invalidate('patients', 'doc', patient.id)
         return self.firebase_service.save_patient(patient)
-    
-    def get_patient(self, patient_id):
+
+    def get_patient(self, patient_id, fields=None):
         """Get a patient by ID"""
-        return self.firebase_service.get_patient(patient_id)
-    
+        return self._get_document('patients', patient_id, fields)
+
     def get_all_patients(self):
         """Get all patients"""
         return self.firebase_service.get_all_patients()
-    
+
     def delete_patient(self, patient_id):
         """Delete a patient"""
-        # Implement this method in firebase_service.py
-        pass
-    
+        self.invalidate('patients', 'doc', patient_id)
+        return self.firebase_service.delete_document('patients', patient_id)
+
     # Guardian operations
-    
+
     def save_guardian(self, guardian):
         """Save a guardian to Firebase"""
+        self.invalidate('guardians', 'doc', guardian.id)
+        self.invalidate('guardians', guardian.patient_id)
         return self.firebase_service.save_guardian(guardian)
-    
-    def get_guardian(self, guardian_id):
+
+    def get_guardian(self, guardian_id, fields=None):
         """Get a guardian by ID"""
-        # Implement this method in firebase_service.py
-        pass
-    
-    def get_patient_guardians(self, patient_id):
+        return self._get_document('guardians', guardian_id, fields)
+
+    def get_patient_guardians(self, patient_id, limit=100, fields=None):
         """Get all guardians for a patient"""
-        # Implement this method in firebase_service.py
-        pass
-    
+        guardians, _ = self._query_patient('guardians', patient_id, limit, None, fields)
+        return guardians
+
     # Health data operations
-    
+
     def save_health_data(self, health_data):
         """Save health data to Firebase"""
+        self.invalidate('health_data', health_data.patient_id)
         return self.firebase_service.add_health_data_to_firebase(
-            patient_id=health_data.patient.id if health_data.patient else None,
+            patient_id=health_data.patient_id,
             health_data=health_data
         )
-    
-    def get_patient_health_data(self, patient_id, limit=20):
-        """Get health data for a patient"""
-        # Implement this method in firebase_service.py
-        pass
-    
+
+    def buffer_health_data(self, health_data):
+        """Queue health data for a batched write to Firebase"""
+        self.health_data_buffer.add(health_data.id, to_document(health_data))
+
+    def _write_health_data(self, documents):
+        written = self.firebase_service.batch_write('health_data', documents, merge=False)
+        for patient_id in {data['patient_id'] for _, data in documents}:
+            self.invalidate('health_data', patient_id)
+        return written
+
+    def get_patient_health_data(self, patient_id, limit=20, cursor=None, fields=None):
+        """
+        Get health data for a patient, newest first
+
+        Returns a tuple of (documents, next_cursor); pass next_cursor back to
+        get the following page.
+        """
+        return self._query_patient('health_data', patient_id, limit, cursor, fields)
+
     # Alert operations
-    
+
     def save_alert(self, alert):
         """Save an alert to Firebase"""
+        self.invalidate('alerts', 'doc', alert.id)
+        self.invalidate('alerts', alert.patient_id)
         return self.firebase_service.save_alert(alert)
-    
-    def get_alert(self, alert_id):
+
+    def get_alert(self, alert_id, fields=None):
         """Get an alert by ID"""
-        # Implement this method in firebase_service.py
-        pass
-    
-    def get_patient_alerts(self, patient_id, limit=20):
-        """Get alerts for a patient"""
-        # Implement this method in firebase_service.py
-        pass
-    
-    def update_alert_status(self, alert_id, status):
+        return self._get_document('alerts', alert_id, fields)
+
+    def get_patient_alerts(self, patient_id, limit=20, cursor=None, fields=None):
+        """
+        Get alerts for a patient, newest first
+
+        Returns a tuple of (documents, next_cursor); pass next_cursor back to
+        get the following page.
+        """
+        return self._query_patient('alerts', patient_id, limit, cursor, fields)
+
+    def update_alert_status(self, alert_id, status, patient_id=None, resolved_at=None):
         """Update the status of an alert"""
-        # Implement this method in firebase_service.py
-        pass
\ No newline at end of file
+        fields = {'status': status}
+        if resolved_at is not None:
+            fields['resolved_at'] = resolved_at.isoformat()
+        self.invalidate('alerts', 'doc', alert_id)
+        if patient_id is not None:
+            self.invalidate('alerts', patient_id)
+        return self.firebase_service.update_document('alerts', alert_id, fields)
+
+    def update_alerts_status(self, rows, status, resolved_at=None):
+        """
+        Mirror a bulk status change to Firestore in batched writes
+
+        Args:
+            rows: (alert_id, patient_id) pairs, as returned by
+                Alert.objects.set_status()
+            status: New status
+            resolved_at: Resolution time, when resolving
+
+        Returns:
+            Number of alert documents written
+        """
+        fields = {'status': status}
+        if resolved_at is not None:
+            fields['resolved_at'] = resolved_at.isoformat()
+        for alert_id, patient_id in rows:
+            self.invalidate('alerts', 'doc', alert_id)
+        for patient_id in {patient_id for _, patient_id in rows}:
+            self.invalidate('alerts', patient_id)
+        return self.firebase_service.batch_write(
+            'alerts', ((alert_id, fields) for alert_id, _ in rows)
+        )
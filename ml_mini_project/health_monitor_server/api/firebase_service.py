@@ -1,30 +1,106 @@
-import firebase_admin
-from firebase_admin import credentials, messaging, firestore
 import os
 import datetime
 import json
+import logging
+import threading
 from pathlib import Path
-from django.forms.models import model_to_dict
+from . import metrics
 
 BASE_DIR = Path(__file__).resolve().parent.parent.parent
 
+logger = logging.getLogger(__name__)
+
+# Serializes the first use of Firebase across threads
+_initialize_lock = threading.Lock()
+
+
+def to_document(instance, fields=None):
+    """
+    Convert a model instance to Firestore document data
+    
+    Related objects are stored as string ids under their attname (e.g.
+    ``patient_id``) and datetimes as ISO 8601 strings. Fields that are not
+    editable (``created_at``, ``updated_at``) are not mirrored.
+    
+    Args:
+        instance: Model instance
+        fields: Optional attnames to include; defaults to all mirrored fields
+    """
+    data = {}
+    for field in instance._meta.concrete_fields:
+        if not field.editable or (fields is not None and field.attname not in fields):
+            continue
+        value = field.value_from_object(instance)
+        if field.is_relation:
+            data[field.attname] = str(value) if value is not None else None
+        elif isinstance(value, datetime.datetime):
+            data[field.name] = value.isoformat()
+        else:
+            data[field.name] = value
+    return data
+
+# Successful saves and sends are counted rather than logged one line per event
+FIREBASE_OPERATIONS = metrics.Counter(
+    'firebase_operations_total',
+    'Firebase operations by type and outcome',
+    ['operation', 'outcome'],
+)
+FIREBASE_FIELDS_WRITTEN = metrics.Counter(
+    'firebase_fields_written_total',
+    'Document fields sent to Firestore, by operation',
+    ['operation'],
+)
+
 class FirebaseService:
-    """Service for Firebase integration and notifications"""
+    """
+    Service for Firebase integration and notifications
+    
+    The Firebase Admin SDK and its Firestore gRPC stack take a third of a
+    second to import, so they are imported and initialized on first use of
+    ``initialized`` or ``db`` rather than when the service is created.
+    """
     
     def __init__(self):
-        self.initialized = False
-        self.db = None
-        self.initialize_firebase()
+        self._initialized = None  # not attempted yet
+        self._db = None
+    
+    def _ensure_initialized(self):
+        if self._initialized is None:
+            with _initialize_lock:
+                if self._initialized is None:
+                    self.initialize_firebase()
+    
+    @property
+    def initialized(self):
+        self._ensure_initialized()
+        return self._initialized
+    
+    @initialized.setter
+    def initialized(self, value):
+        self._initialized = value
+    
+    @property
+    def db(self):
+        self._ensure_initialized()
+        return self._db
+    
+    @db.setter
+    def db(self, value):
+        self._db = value
     
     def initialize_firebase(self):
         """Initialize Firebase Admin SDK"""
         try:
+            import firebase_admin
+            from firebase_admin import credentials, firestore
+            
             # The path where you would store your Firebase service account key
             service_account_path = os.path.join(BASE_DIR, 'health_monitor_server', 'firebase-key.json')
             
             # Check if credentials file exists
             if not os.path.exists(service_account_path):
-                print(f"Firebase credentials file not found at {service_account_path}")
+                logger.warning("Firebase credentials file not found at %s", service_account_path,
+                               extra={'event': 'firebase.init.missing_credentials'})
                 self.initialized = False
                 return
             
@@ -32,24 +108,42 @@ class FirebaseService:
             if not firebase_admin._apps:
                 cred = credentials.Certificate(service_account_path)
                 firebase_admin.initialize_app(cred)
-                self.initialized = True
                 self.db = firestore.client()
-                print("Firebase Admin SDK initialized successfully")
-            else:
                 self.initialized = True
+                logger.info("Firebase Admin SDK initialized", extra={'event': 'firebase.init.ok'})
+            else:
                 self.db = firestore.client()
-                print("Firebase Admin SDK already initialized")
-        except Exception as e:
-            print(f"Error initializing Firebase: {e}")
+                self.initialized = True
+                logger.debug("Firebase Admin SDK already initialized", extra={'event': 'firebase.init.reused'})
+        except Exception:
+            logger.exception("Error initializing Firebase", extra={'event': 'firebase.init.failed'})
             self.initialized = False
     
+    def _not_initialized(self, operation):
+        """Record an operation skipped because Firebase is not available"""
+        FIREBASE_OPERATIONS.labels(operation, 'skipped').inc()
+        logger.warning("Firebase not initialized, skipping %s", operation,
+                       extra={'event': 'firebase.not_initialized', 'operation': operation})
+    
+    def _succeeded(self, operation):
+        """Record a successful operation"""
+        FIREBASE_OPERATIONS.labels(operation, 'ok').inc()
+    
+    def _failed(self, operation, **context):
+        """Record and log a failed operation; call from an except block"""
+        FIREBASE_OPERATIONS.labels(operation, 'error').inc()
+        logger.warning("Firebase %s failed", operation, exc_info=True,
+                       extra={'event': 'firebase.failed', 'operation': operation, **context})
+    
     def send_alert_notification(self, token, title, body, data=None):
         """Send notification to a specific device token"""
         if not self.initialized:
-            print("Firebase not initialized, cannot send notification")
+            self._not_initialized('send_notification')
             return False
         
         try:
+            from firebase_admin import messaging
+            
             # Create message
             message = messaging.Message(
                 notification=messaging.Notification(
@@ -62,16 +156,17 @@ class FirebaseService:
             
             # Send message
             response = messaging.send(message)
-            print(f"Successfully sent notification: {response}")
+            self._succeeded('send_notification')
+            logger.debug("Sent notification %s", response, extra={'event': 'firebase.notification.sent'})
             return True
-        except Exception as e:
-            print(f"Error sending notification: {e}")
+        except Exception:
+            self._failed('send_notification')
             return False
     
     def send_alert_to_guardians(self, guardians, patient_name, alert_type, alert_message):
         """Send notifications to all guardians of a patient"""
         if not self.initialized:
-            print("Firebase not initialized, cannot send notifications to guardians")
+            self._not_initialized('send_alert_to_guardians')
             return False
         
         success = False
@@ -88,7 +183,7 @@ class FirebaseService:
                 body = f"{alert_type}: {alert_message}"
                 data = {
                     "alert_type": alert_type,
-                    "patient_id": str(guardian.patient.id),
+                    "patient_id": str(guardian.patient_id),
                     "guardian_id": str(guardian.id)
                 }
                 
@@ -111,160 +206,283 @@ class FirebaseService:
                 guardian_data = guardian_doc.to_dict()
                 return guardian_data.get('fcm_token', '')
             return ''
-        except Exception as e:
-            print(f"Error getting guardian token: {e}")
+        except Exception:
+            self._failed('get_guardian_token', guardian_id=guardian.id)
             return ''
 
     # Firebase Database Operations
     
-    def save_patient(self, patient):
-        """Save patient data to Firestore"""
+    def save_document(self, collection, instance, operation):
+        """
+        Mirror a model instance to a Firestore document
+        
+        Instances that track changes (see models.ChangeTrackingMixin) send only
+        the fields changed since they were loaded or last mirrored, and skip the
+        write entirely when nothing changed. New instances, and documents that
+        turn out to be missing, are written in full.
+        """
         if not self.initialized or not self.db:
-            print("Firebase not initialized, cannot save patient")
+            self._not_initialized(operation)
             return False
         
         try:
-            # Convert Django model to dict
-            patient_data = model_to_dict(patient)
+            from google.api_core.exceptions import NotFound
+            
+            doc_ref = self.db.collection(collection).document(str(instance.id))
+            changed = instance.get_changed_fields() if hasattr(instance, 'get_changed_fields') else None
             
-            # Convert datetime objects to ISO format strings
-            for key, value in patient_data.items():
-                if isinstance(value, datetime.datetime):
-                    patient_data[key] = value.isoformat()
+            if changed is None:
+                data = to_document(instance)
+                doc_ref.set(data)
+            else:
+                data = to_document(instance, changed)
+                if not data:
+                    FIREBASE_OPERATIONS.labels(operation, 'unchanged').inc()
+                    return True
+                try:
+                    doc_ref.update(data)
+                except NotFound:
+                    data = to_document(instance)
+                    doc_ref.set(data)
+            FIREBASE_FIELDS_WRITTEN.labels(operation).inc(len(data))
             
-            # Save to Firestore
-            self.db.collection('patients').document(str(patient.id)).set(patient_data)
-            print(f"Patient {patient.id} saved to Firebase")
+            if hasattr(instance, 'mark_synced'):
+                instance.mark_synced()
+            self._succeeded(operation)
             return True
-        except Exception as e:
-            print(f"Error saving patient to Firebase: {e}")
+        except Exception:
+            self._failed(operation, document_id=instance.id)
             return False
     
+    def save_patient(self, patient):
+        """Save patient data to Firestore"""
+        return self.save_document('patients', patient, 'save_patient')
+    
     def save_guardian(self, guardian):
         """Save guardian data to Firestore"""
+        return self.save_document('guardians', guardian, 'save_guardian')
+    
+    def add_health_data_to_firebase(self, patient_id, health_data):
+        """Add health data to Firestore"""
+        return self.save_document('health_data', health_data, 'save_health_data')
+    
+    def save_alert(self, alert):
+        """Save alert data to Firestore"""
+        return self.save_document('alerts', alert, 'save_alert')
+
+    # Methods to retrieve data from Firebase
+    
+    def get_all_patients(self, page_size=500):
+        """Get all patients from Firestore, reading the collection page by page"""
+        patients = []
+        cursor = None
+        while True:
+            page, cursor = self.query_documents('patients', limit=page_size, cursor=cursor, descending=False)
+            patients.extend(page)
+            if cursor is None:
+                return patients
+
+    def get_patient(self, patient_id):
+        """Get patient by ID from Firestore"""
+        return self.get_document('patients', patient_id)
+    
+    def get_document(self, collection, document_id, fields=None):
+        """Get a single document by ID, optionally projected to the given fields"""
         if not self.initialized or not self.db:
-            print("Firebase not initialized, cannot save guardian")
-            return False
+            self._not_initialized('get_document')
+            return None
         
         try:
-            # Convert Django model to dict
-            guardian_data = model_to_dict(guardian)
-            
-            # Convert datetime objects to ISO format strings
-            for key, value in guardian_data.items():
-                if isinstance(value, datetime.datetime):
-                    guardian_data[key] = value.isoformat()
-            
-            # Replace patient with patient_id
-            if 'patient' in guardian_data and guardian_data['patient']:
-                guardian_data['patient_id'] = str(guardian_data['patient'].id)
-                del guardian_data['patient']
+            doc_ref = self.db.collection(collection).document(str(document_id))
+            doc = doc_ref.get(field_paths=list(fields) if fields else None)
             
-            # Save to Firestore
-            self.db.collection('guardians').document(str(guardian.id)).set(guardian_data)
-            print(f"Guardian {guardian.id} saved to Firebase")
-            return True
-        except Exception as e:
-            print(f"Error saving guardian to Firebase: {e}")
-            return False
+            if doc.exists:
+                data = doc.to_dict()
+                data['id'] = doc.id
+                return data
+            return None
+        except Exception:
+            self._failed('get_document', collection=collection, document_id=document_id)
+            return None
     
-    def add_health_data_to_firebase(self, patient_id, health_data):
-        """Add health data to Firestore"""
+    def query_documents(self, collection, filters=(), order_by='id', descending=True,
+                        limit=20, cursor=None, fields=None):
+        """
+        Run an indexed query and return one page of documents
+        
+        Args:
+            collection: Firestore collection name
+            filters: (field, op, value) tuples, e.g. ('patient_id', '==', '1')
+            order_by: Unique field to order and page by (documents store the Django id)
+            descending: Newest first when ordering by id
+            limit: Page size
+            cursor: Value of order_by on the last document of the previous page
+            fields: Optional field projection; order_by is always included
+            
+        Returns:
+            Tuple of (documents, next_cursor); next_cursor is None on the last page
+        """
         if not self.initialized or not self.db:
-            print("Firebase not initialized, cannot save health data")
-            return False
+            self._not_initialized('query_documents')
+            return [], None
         
         try:
-            # Convert Django model to dict
-            data_dict = model_to_dict(health_data)
+            from firebase_admin import firestore
+            from google.cloud.firestore_v1.base_query import FieldFilter
             
-            # Convert datetime objects to ISO format strings
-            for key, value in data_dict.items():
-                if isinstance(value, datetime.datetime):
-                    data_dict[key] = value.isoformat()
+            query = self.db.collection(collection)
+            for field, op, value in filters:
+                query = query.where(filter=FieldFilter(field, op, value))
+            direction = firestore.Query.DESCENDING if descending else firestore.Query.ASCENDING
+            query = query.order_by(order_by, direction=direction)
+            if cursor is not None:
+                query = query.start_after({order_by: cursor})
+            if fields:
+                query = query.select(sorted(set(fields) | {order_by}))
+            query = query.limit(limit)
             
-            # Replace patient with patient_id
-            if 'patient' in data_dict and data_dict['patient']:
-                data_dict['patient_id'] = str(data_dict['patient'].id)
-                del data_dict['patient']
+            documents = []
+            next_cursor = None
+            for doc in query.stream():
+                data = doc.to_dict()
+                next_cursor = data.get(order_by)
+                data['id'] = doc.id
+                documents.append(data)
             
-            # Save to Firestore
-            self.db.collection('health_data').document(str(health_data.id)).set(data_dict)
-            print(f"Health data {health_data.id} saved to Firebase")
-            return True
-        except Exception as e:
-            print(f"Error saving health data to Firebase: {e}")
-            return False
+            if len(documents) < limit:
+                next_cursor = None
+            return documents, next_cursor
+        except Exception:
+            self._failed('query_documents', collection=collection)
+            return [], None
     
-    def save_alert(self, alert):
-        """Save alert data to Firestore"""
+    def update_document(self, collection, document_id, fields):
+        """Update only the given fields of a document"""
         if not self.initialized or not self.db:
-            print("Firebase not initialized, cannot save alert")
+            self._not_initialized('update_document')
             return False
         
         try:
-            # Convert Django model to dict
-            alert_data = model_to_dict(alert)
-            
-            # Convert datetime objects to ISO format strings
-            for key, value in alert_data.items():
-                if isinstance(value, datetime.datetime):
-                    alert_data[key] = value.isoformat()
-            
-            # Replace related objects with their IDs
-            if 'patient' in alert_data and alert_data['patient']:
-                alert_data['patient_id'] = str(alert_data['patient'].id)
-                del alert_data['patient']
-            
-            if 'health_data' in alert_data and alert_data['health_data']:
-                alert_data['health_data_id'] = str(alert_data['health_data'].id)
-                del alert_data['health_data']
-            
-            # Save to Firestore
-            self.db.collection('alerts').document(str(alert.id)).set(alert_data)
-            print(f"Alert {alert.id} saved to Firebase")
+            self.db.collection(collection).document(str(document_id)).update(fields)
+            self._succeeded('update_document')
             return True
-        except Exception as e:
-            print(f"Error saving alert to Firebase: {e}")
+        except Exception:
+            self._failed('update_document', collection=collection, document_id=document_id)
             return False
-
-    # Methods to retrieve data from Firebase
     
-    def get_all_patients(self):
-        """Get all patients from Firestore"""
+    def get_documents(self, collection, document_ids):
+        """
+        Get many documents in one batched read
+        
+        Returns:
+            Dict of document id to data for the documents that exist, or None
+            if the read failed
+        """
         if not self.initialized or not self.db:
-            print("Firebase not initialized, cannot get patients")
-            return []
+            self._not_initialized('get_documents')
+            return None
         
         try:
-            patients = []
-            patient_docs = self.db.collection('patients').stream()
-            
-            for doc in patient_docs:
-                patient_data = doc.to_dict()
-                patient_data['id'] = doc.id
-                patients.append(patient_data)
+            collection_ref = self.db.collection(collection)
+            references = [collection_ref.document(str(document_id)) for document_id in document_ids]
+            documents = {doc.id: doc.to_dict() for doc in self.db.get_all(references) if doc.exists}
+            self._succeeded('get_documents')
+            return documents
+        except Exception:
+            self._failed('get_documents', collection=collection, count=len(document_ids))
+            return None
+    
+    def batch_write(self, collection, documents, merge=True, batch_size=500):
+        """
+        Write many documents using batched writes
+        
+        Each batch commits up to batch_size writes (Firestore allows 500) in a
+        single round trip. With merge the given fields are merged into the
+        document, so a document that was never mirrored is created with just
+        these fields rather than failing the whole batch; without it each
+        document is replaced.
+        
+        Args:
+            collection: Firestore collection name
+            documents: Iterable of (document_id, data) pairs
+            merge: Merge into existing documents instead of replacing them
+            batch_size: Writes per committed batch
             
-            return patients
-        except Exception as e:
-            print(f"Error getting patients from Firebase: {e}")
-            return []
-
-    def get_patient(self, patient_id):
-        """Get patient by ID from Firestore"""
+        Returns:
+            Number of documents written
+        """
+        operation = 'batch_update' if merge else 'batch_set'
+        if not self.initialized or not self.db:
+            self._not_initialized(operation)
+            return 0
+        
+        written = 0
+        batch = None
+        pending = fields = 0
+        try:
+            collection_ref = self.db.collection(collection)
+            for document_id, data in documents:
+                if batch is None:
+                    batch = self.db.batch()
+                batch.set(collection_ref.document(str(document_id)), data, merge=merge)
+                pending += 1
+                fields += len(data)
+                if pending == batch_size:
+                    batch.commit()
+                    written += pending
+                    FIREBASE_FIELDS_WRITTEN.labels(operation).inc(fields)
+                    batch, pending, fields = None, 0, 0
+            if pending:
+                batch.commit()
+                written += pending
+                FIREBASE_FIELDS_WRITTEN.labels(operation).inc(fields)
+            self._succeeded(operation)
+            return written
+        except Exception:
+            self._failed(operation, collection=collection, written=written)
+            return written
+    
+    def delete_document(self, collection, document_id):
+        """Delete a document"""
+        if not self.initialized or not self.db:
+            self._not_initialized('delete_document')
+            return False
+        
+        try:
+            self.db.collection(collection).document(str(document_id)).delete()
+            self._succeeded('delete_document')
+            return True
+        except Exception:
+            self._failed('delete_document', collection=collection, document_id=document_id)
+            return False
+    
+    def watch_query(self, collection, filters, callback):
+        """
+        Listen for changes to the documents matched by a query
+        
+        The callback is called with no arguments on every change after the
+        initial snapshot. Returns the watch handle (call unsubscribe() to stop),
+        or None if Firebase is not available.
+        """
         if not self.initialized or not self.db:
-            print("Firebase not initialized, cannot get patient")
             return None
         
         try:
-            doc_ref = self.db.collection('patients').document(str(patient_id))
-            doc = doc_ref.get()
+            from google.cloud.firestore_v1.base_query import FieldFilter
             
-            if doc.exists:
-                patient_data = doc.to_dict()
-                patient_data['id'] = doc.id
-                return patient_data
+            query = self.db.collection(collection)
+            for field, op, value in filters:
+                query = query.where(filter=FieldFilter(field, op, value))
+            
+            initial = [True]
+            
+            def on_snapshot(docs, changes, read_time):
+                if initial[0]:
+                    initial[0] = False
+                    return
+                callback()
+            
+            return query.on_snapshot(on_snapshot)
+        except Exception:
+            self._failed('watch_query', collection=collection)
             return None
-        except Exception as e:
-            print(f"Error getting patient from Firebase: {e}")
-            return None
\ No newline at end of file
@@ -0,0 +1,394 @@
+"""
+Detection of devices that stop reporting.
+
+A watch that goes silent (flat battery, taken off, out of WiFi range) is an
+alert condition in itself. Every ingested sample is a heartbeat for its
+device: ``heartbeat()`` records when the device was last seen and re-arms its
+deadline, ``report_interval`` x ``DEVICE_OFFLINE_MISSED`` seconds later, in a
+hierarchical timer wheel. Re-arming and expiring a deadline are O(1), so the
+cost of a heartbeat does not grow with the number of devices and nothing ever
+scans them all.
+
+A background thread, started by the first heartbeat, advances the wheel once a
+tick. Devices whose deadline passes are checked against
+``PatientStatus.last_received`` (another worker process may have heard from
+them; it is the server's receive time, since device clocks can be off)
+and the rest raise one DEVICE_OFFLINE alert each, pushed to guardians and
+mirrored like the others. It is resolved when the device reports again, to
+whichever worker: a process also resolves open alerts from the database on
+the first report it gets from a device, and after any gap longer than the
+device's timeout, since another worker may have raised one meanwhile.
+
+Deadlines live in process memory; ``seed()``, run as a warm-up step, re-arms
+them from the dashboard status rows after a restart and marks the devices
+with open DEVICE_OFFLINE alerts offline again.
+"""
+import datetime
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.utils import timezone
+
+from . import metrics
+from .models import OPEN_ALERT_STATUSES, Alert, PatientStatus
+
+logger = logging.getLogger(__name__)
+
+DEVICES = metrics.Gauge(
+    'liveness_devices',
+    'Devices tracked for liveness by this process, by state',
+    ['state'],
+)
+DEVICE_OFFLINE_ALERTS = metrics.Counter(
+    'device_offline_alerts_total',
+    'DEVICE_OFFLINE alerts raised for devices that stopped reporting',
+)
+
+ALERT_TYPE = 'DEVICE_OFFLINE'
+
+# Devices silent for longer than this (seconds) when the process starts are not
+# tracked until they report again, so a restart does not alert for long-dead devices
+SEED_LOOKBACK = 3600
+
+
+class TimerWheel:
+    """
+    Hierarchical timing wheel of keyed deadlines, in whole ticks.
+
+    Each level has 2 ** ``slot_bits`` slots: level 0 one per tick, level 1 one
+    per turn of level 0, and so on. A timer goes into the lowest level
+    whose span covers its deadline and moves down a level each time the wheel
+    below wraps around to it, reaching level 0 in time to fire. Deadlines
+    beyond the top level are parked there and placed again when they come up.
+    """
+
+    def __init__(self, tick=1.0, slot_bits=6, levels=4, start=0.0):
+        self.tick = tick
+        self.bits = slot_bits
+        self.mask = (1 << slot_bits) - 1
+        self.levels = levels
+        self.origin = start
+        self.current = 0  # next tick to fire
+        self._wheels = [[{} for _ in range(1 << slot_bits)] for _ in range(levels)]
+        self._slots = {}  # key -> the slot holding its timer
+
+    def __len__(self):
+        return len(self._slots)
+
+    def __contains__(self, key):
+        return key in self._slots
+
+    def _tick(self, when):
+        return max(int(-(-(when - self.origin) // self.tick)), self.current)
+
+    def _place(self, key, when):
+        current, bits = self.current, self.bits
+        # Deadlines past the top level wait at the end of its current turn
+        at = min(when, ((current >> bits * self.levels) + 1 << bits * self.levels) - 1)
+        # Lowest level whose slot for the deadline comes up before that level wraps around
+        level = 0
+        while at >> bits * (level + 1) != current >> bits * (level + 1):
+            level += 1
+        slot = self._wheels[level][at >> bits * level & self.mask]
+        slot[key] = when
+        self._slots[key] = slot
+
+    def schedule(self, key, deadline):
+        """Fire key at deadline (a time on the clock the wheel was started with), replacing its timer"""
+        self.cancel(key)
+        self._place(key, self._tick(deadline))
+
+    def cancel(self, key):
+        """Remove key's timer; returns whether it had one"""
+        slot = self._slots.pop(key, None)
+        if slot is None:
+            return False
+        del slot[key]
+        return True
+
+    def advance(self, now):
+        """Move the wheel up to now; returns the keys whose deadline has passed"""
+        target = int((now - self.origin) // self.tick)
+        expired = []
+        while self.current <= target:
+            if not self._slots:
+                self.current = target + 1
+                break
+            current = self.current
+            # Bring timers down from the levels that wrap around at this tick
+            for level in range(self.levels - 1, 0, -1):
+                if current & ((1 << self.bits * level) - 1) == 0:
+                    self._cascade(self._wheels[level][current >> self.bits * level & self.mask])
+            slot = self._wheels[0][current & self.mask]
+            timers = list(slot.items())
+            slot.clear()
+            self.current += 1
+            for key, when in timers:
+                del self._slots[key]
+                if when > current:
+                    self._place(key, when)  # parked beyond the top level
+                else:
+                    expired.append(key)
+        return expired
+
+    def _cascade(self, slot):
+        timers = list(slot.items())
+        slot.clear()
+        for key, when in timers:
+            self._place(key, when)
+
+
+class LivenessTracker:
+    """
+    Last report and deadline of every device heard from.
+
+    ``confirm(devices)`` is called with the (user_id, patient_id, last_seen,
+    timeout) of devices whose deadline passed and returns a dict of newer
+    report times seen elsewhere, which re-arm those devices; the others are
+    offline and passed to ``on_offline`` one by one. ``on_online`` is called
+    when a device that may have been offline reports: one found offline, one
+    not heard from within its timeout, or one this tracker did not know.
+    """
+
+    def __init__(self, timeout=300.0, tick=1.0, confirm=None, on_offline=None, on_online=None,
+                 clock=time.time):
+        self.timeout = timeout
+        self.tick = tick
+        self.confirm = confirm
+        self.on_offline = on_offline
+        self.on_online = on_online
+        self.clock = clock
+        self.wheel = TimerWheel(tick, start=clock())
+        self._devices = {}  # user_id -> (patient_id, last seen, timeout)
+        self._offline = set()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def __len__(self):
+        return len(self._devices)
+
+    def last_seen(self, user_id):
+        """Time of the device's last report, or None"""
+        device = self._devices.get(user_id)
+        return device[1] if device else None
+
+    def is_offline(self, user_id):
+        return user_id in self._offline
+
+    def heartbeat(self, user_id, patient_id, timeout=None, now=None, start=True, notify=True):
+        """
+        Record a report from a device
+
+        Args:
+            notify: Whether to call on_online if the device may have been offline
+
+        Returns:
+            Whether the device may have been offline
+        """
+        now = self.clock() if now is None else now
+        timeout = timeout or self.timeout
+        with self._lock:
+            device = self._devices.get(user_id)
+            if device is not None and device[1] >= now:
+                # Nothing newer than the report already recorded (a device clock
+                # running ahead, or seeding again); keep that deadline
+                return False
+            self._devices[user_id] = (patient_id, now, timeout)
+            self.wheel.schedule(user_id, now + timeout)
+            came_back = device is None or now - device[1] > device[2] or user_id in self._offline
+            self._offline.discard(user_id)
+            if start:
+                self._start()
+        if came_back and notify and self.on_online is not None:
+            self.on_online(user_id, patient_id)
+        return came_back
+
+    def check(self, now=None):
+        """Expire the deadlines that have passed; returns the devices found offline"""
+        now = self.clock() if now is None else now
+        with self._lock:
+            expired = [(user_id, *self._devices[user_id]) for user_id in self.wheel.advance(now)]
+        newer = self.confirm(expired) if expired and self.confirm is not None else {}
+
+        offline = []
+        with self._lock:
+            for user_id, patient_id, last_seen, timeout in expired:
+                if self._devices.get(user_id) != (patient_id, last_seen, timeout):
+                    continue  # reported again in the meantime
+                seen = newer.get(user_id)
+                if seen is not None and seen > last_seen:
+                    self._devices[user_id] = (patient_id, seen, timeout)
+                    self.wheel.schedule(user_id, seen + timeout)
+                else:
+                    self._offline.add(user_id)
+                    offline.append((user_id, patient_id, last_seen, timeout))
+            DEVICES.labels('online').set(len(self._devices) - len(self._offline))
+            DEVICES.labels('offline').set(len(self._offline))
+        if self.on_offline is not None:
+            for device in offline:
+                try:
+                    self.on_offline(*device)
+                except Exception:
+                    logger.exception("Could not report device %s offline", device[0],
+                                     extra={'event': 'liveness.alert_failed'})
+        return [device[0] for device in offline]
+
+    def mark_offline(self, user_ids):
+        """Mark tracked devices offline, e.g. those with alerts raised before a restart"""
+        with self._lock:
+            self._offline.update(user_id for user_id in user_ids if user_id in self._devices)
+
+    def devices(self):
+        """User ids of every tracked device"""
+        with self._lock:
+            return list(self._devices)
+
+    def forget(self, user_id):
+        """Stop tracking a device"""
+        with self._lock:
+            self._devices.pop(user_id, None)
+            self._offline.discard(user_id)
+            self.wheel.cancel(user_id)
+
+    def reset(self):
+        """Forget every device"""
+        with self._lock:
+            self._devices.clear()
+            self._offline.clear()
+            self.wheel = TimerWheel(self.tick, start=self.clock())
+
+    def start(self):
+        """Start the background thread that expires deadlines, unless it is running"""
+        with self._lock:
+            self._start()
+
+    def _start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='liveness', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.tick)
+            try:
+                self.check()
+            except Exception:
+                logger.exception("Liveness check failed", extra={'event': 'liveness.check_failed'})
+
+
+def _confirm(devices):
+    """Report times newer than the tracked ones, from samples other workers stored"""
+    close_old_connections()
+    seen = PatientStatus.objects.filter(
+        patient_id__in={patient_id for _, patient_id, _, _ in devices}, last_received__isnull=False,
+    ).values_list('patient_id', 'last_received')
+    seen = {patient_id: received.timestamp() for patient_id, received in seen}
+    return {user_id: seen[patient_id] for user_id, patient_id, _, _ in devices if patient_id in seen}
+
+
+def _raise_alert(user_id, patient_id, last_seen, timeout):
+    """Raise, push and mirror a DEVICE_OFFLINE alert unless one is already open"""
+    from . import cache, views
+
+    close_old_connections()
+    since = datetime.datetime.fromtimestamp(last_seen, tz=datetime.timezone.utc)
+    message = f"No data from device {user_id} since {since:%Y-%m-%d %H:%M:%S} UTC ({timeout:.0f}s without a report)"
+    with transaction.atomic():
+        # Workers that find the device silent at the same time queue on the
+        # patient's status row, so only the first one raises the alert
+        PatientStatus.objects.select_for_update().get_or_create(patient_id=patient_id)
+        open_alerts = Alert.objects.filter(patient_id=patient_id, type=ALERT_TYPE, status__in=OPEN_ALERT_STATUSES)
+        if open_alerts.exists():
+            return None
+        alert = Alert.objects.create(patient_id=patient_id, type=ALERT_TYPE, message=message, status='NEW')
+    DEVICE_OFFLINE_ALERTS.inc()
+    logger.warning("Device %s stopped reporting", user_id,
+                   extra={'event': 'liveness.offline', 'patient_id': patient_id, 'alert_id': alert.id})
+
+    patient = cache.get_patient(patient_id)
+    views.firebase_service.send_alert_to_guardians(
+        cache.get_notifiable_guardians(patient), patient.name, "Device Offline", message
+    )
+    views.firebase_repository.save_alert(alert)
+    return alert
+
+
+def _resolve_alerts(user_id, patient_id):
+    """Resolve a device's open DEVICE_OFFLINE alerts once it reports again"""
+    from .views import set_alerts_status
+
+    open_alerts = Alert.objects.filter(patient_id=patient_id, type=ALERT_TYPE, status__in=OPEN_ALERT_STATUSES)
+    if set_alerts_status(open_alerts, 'RESOLVED'):
+        logger.info("Device %s is reporting again", user_id,
+                    extra={'event': 'liveness.online', 'patient_id': patient_id})
+
+
+def offline_timeout(report_interval=None):
+    """Seconds without a report after which a device is offline, or 0 if liveness is disabled"""
+    interval = report_interval or getattr(settings, 'DEVICE_REPORT_INTERVAL', 60.0)
+    return getattr(settings, 'DEVICE_OFFLINE_MISSED', 5) * interval
+
+
+tracker = LivenessTracker(
+    timeout=offline_timeout(),
+    tick=getattr(settings, 'DEVICE_LIVENESS_TICK', 1.0),
+    confirm=_confirm,
+    on_offline=_raise_alert,
+    on_online=_resolve_alerts,
+)
+
+
+def heartbeat(user_id, patient_id, report_interval=None, received=None):
+    """
+    Record a report from a device; returns whether it may have been offline
+
+    Args:
+        received: Optional server time of the report, as also stored in
+            PatientStatus.last_received (default now)
+    """
+    timeout = offline_timeout(report_interval)
+    if not timeout:
+        return False
+    now = received.timestamp() if received is not None else None
+    return tracker.heartbeat(user_id, patient_id, timeout, now=now)
+
+
+def seed(owns=None):
+    """
+    Track every device that reported recently, from the dashboard status rows
+
+    Args:
+        owns: Optional predicate on user_id; other devices are left out
+
+    Returns:
+        Number of devices tracked
+    """
+    if not offline_timeout():
+        return 0
+    now = time.time()
+    since = timezone.now() - datetime.timedelta(seconds=tracker.timeout + SEED_LOOKBACK)
+    rows = PatientStatus.objects.filter(last_received__gte=since).values_list(
+        'patient__user_id', 'patient_id', 'last_received'
+    )
+    count = 0
+    for user_id, patient_id, received in rows.iterator(chunk_size=5000):
+        if owns is not None and not owns(user_id):
+            continue
+        # Another server's clock can run ahead; never arm a deadline further out than a fresh report would
+        tracker.heartbeat(user_id, patient_id, now=min(received.timestamp(), now), start=False, notify=False)
+        count += 1
+    # Alerts raised before the restart are resolved by the device's next report
+    tracker.mark_offline(Alert.objects.filter(type=ALERT_TYPE, status__in=OPEN_ALERT_STATUSES).values_list(
+        'patient__user_id', flat=True
+    ))
+    if count:
+        tracker.start()
+    return count
+
+
+def reset():
+    """Forget every tracked device"""
+    tracker.reset()
@@ -0,0 +1,159 @@
+"""
+Logging helpers for the health monitoring API.
+
+``NonBlockingHandler`` hands records to a background thread through a bounded
+queue so request threads never block on stdout. ``RateLimitFilter`` caps how
+often each message type is emitted and ``StructuredFormatter`` renders records
+as one JSON object per line. They are wired together in ``settings.LOGGING``.
+"""
+import atexit
+import datetime
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+import threading
+import time
+
+from . import metrics
+
+LOG_RECORDS_DROPPED = metrics.Counter(
+    'log_records_dropped_total',
+    'Log records that were not written, by reason',
+    ['reason'],
+)
+
+# Attributes every LogRecord has; anything else was passed through ``extra``
+_STANDARD_ATTRS = frozenset(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+
+
+class StructuredFormatter(logging.Formatter):
+    """Format records as single-line JSON objects"""
+
+    def format(self, record):
+        entry = {
+            'ts': datetime.datetime.fromtimestamp(record.created, tz=datetime.timezone.utc).isoformat(),
+            'level': record.levelname,
+            'logger': record.name,
+            'msg': record.getMessage(),
+        }
+        for key, value in record.__dict__.items():
+            if key not in _STANDARD_ATTRS and not key.startswith('_'):
+                entry[key] = value
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry['exc'] = record.exc_text
+        return json.dumps(entry, default=str)
+
+
+class RateLimitFilter(logging.Filter):
+    """
+    Token-bucket rate limit per message type.
+
+    The message type is the ``event`` passed through ``extra``, falling back
+    to the logger name and unformatted message. Each type may emit ``rate``
+    records per ``per`` seconds; ``limits`` overrides that for specific events
+    and ``sample_every`` keeps only every Nth record of an event. The next
+    record let through carries a ``suppressed`` count of what was dropped.
+    """
+
+    def __init__(self, rate=10, per=60.0, limits=None, sample_every=None):
+        super().__init__()
+        self.rate = rate
+        self.per = per
+        self.limits = limits or {}
+        self.sample_every = sample_every or {}
+        self._buckets = {}
+        self._suppressed = {}
+        self._seen = {}
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        event = getattr(record, 'event', None)
+        key = event or (record.name, record.msg)
+        with self._lock:
+            every = self.sample_every.get(event)
+            if every:
+                seen = self._seen.get(key, 0)
+                self._seen[key] = seen + 1
+                if seen % every:
+                    LOG_RECORDS_DROPPED.labels('sampled').inc()
+                    return False
+
+            rate, per = self.limits.get(event, (self.rate, self.per))
+            now = time.monotonic()
+            tokens, last = self._buckets.get(key, (rate, now))
+            tokens = min(rate, tokens + (now - last) * rate / per)
+            if tokens < 1:
+                self._buckets[key] = (tokens, now)
+                self._suppressed[key] = self._suppressed.get(key, 0) + 1
+                LOG_RECORDS_DROPPED.labels('rate_limited').inc()
+                return False
+            self._buckets[key] = (tokens - 1, now)
+            suppressed = self._suppressed.pop(key, 0)
+
+        if suppressed:
+            record.suppressed = suppressed
+        return True
+
+
+class NonBlockingHandler(logging.handlers.QueueHandler):
+    """
+    Queue-backed handler that writes records from a background thread.
+
+    Records are put on a bounded queue without blocking; when the queue is
+    full they are dropped and counted instead of stalling the caller.
+    Formatting happens on the listener thread.
+    """
+
+    def __init__(self, stream=None, maxsize=10000):
+        super().__init__(queue.Queue(maxsize=maxsize))
+        self.target = logging.StreamHandler(stream or sys.stderr)
+        self.listener = logging.handlers.QueueListener(self.queue, self.target, respect_handler_level=False)
+        self.listener.start()
+        atexit.register(self.stop)
+        # A forked child (e.g. an ingestion shard) gets no copy of the listener thread
+        os.register_at_fork(after_in_child=self._restart_in_child)
+
+    def _restart_in_child(self):
+        if self.listener._thread is None:
+            return
+        self.queue = queue.Queue(maxsize=self.queue.maxsize)
+        self.listener = logging.handlers.QueueListener(self.queue, self.target, respect_handler_level=False)
+        self.listener.start()
+
+    def setFormatter(self, fmt):
+        self.target.setFormatter(fmt)
+
+    def prepare(self, record):
+        # Resolve the message now, since args may be mutated after we return,
+        # and render tracebacks before their frames go away
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            LOG_RECORDS_DROPPED.labels('queue_full').inc()
+
+    def flush(self):
+        """Wait until queued records have been written"""
+        if self.listener._thread is not None:
+            self.queue.join()
+        self.target.flush()
+
+    def stop(self):
+        """Drain the queue and stop the listener thread"""
+        if self.listener._thread is None:
+            return
+        self.listener.stop()
+        self.target.flush()
+        atexit.unregister(self.stop)
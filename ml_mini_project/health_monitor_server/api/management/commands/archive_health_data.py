@@ -0,0 +1,45 @@
+"""
+Move old health data to columnar cold storage
+
+Samples older than --older-than-days (HEALTH_DATA_ARCHIVE_AFTER_DAYS by
+default) are written to per-patient, per-day archive files and deleted from
+the HealthData table; see api.archive. Samples referenced by an alert are
+kept in the database. Run it periodically, e.g. nightly from cron.
+"""
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from api import archive
+
+
+class Command(BaseCommand):
+    help = "Move health data older than a number of days to per-patient, per-day archive files"
+    
+    def add_arguments(self, parser):
+        parser.add_argument('--older-than-days', type=int,
+                            default=getattr(settings, 'HEALTH_DATA_ARCHIVE_AFTER_DAYS', 30),
+                            help="Archive samples older than this many days")
+        parser.add_argument('--patient', type=int, action='append',
+                            help="Patient id to archive (repeatable); defaults to all")
+        parser.add_argument('--dry-run', action='store_true',
+                            help="Report what would be archived without writing or deleting")
+    
+    def handle(self, *args, **options):
+        days = options['older_than_days']
+        if days < 1:
+            raise CommandError("--older-than-days must be at least 1")
+        cutoff = timezone.now() - timedelta(days=days)
+        
+        start = time.perf_counter()
+        archived, files = archive.archive_health_data(cutoff, options['patient'], options['dry_run'])
+        elapsed = time.perf_counter() - start
+        
+        verb = 'would be archived' if options['dry_run'] else 'archived'
+        self.stdout.write(self.style.SUCCESS(
+            f"{archived} samples before {cutoff:%Y-%m-%d %H:%M} {verb} "
+            f"in {files} day files ({elapsed:.1f}s)"
+        ))
@@ -0,0 +1,123 @@
+"""
+Backtest alert thresholds against stored health data
+
+Replays the fall and vitals models over historical samples (the database and
+the archive, or CSV files from the export endpoint) and reports, for a grid of
+thresholds, how many alerts each would have raised, alerts per patient-day,
+and precision/recall against alerts triaged as RESOLVED or FALSE_ALARM. The
+rows for the thresholds currently configured are marked with '*'.
+"""
+import datetime
+import time
+
+import numpy as np
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from api import backtest
+from api.ml_predictor import RISK_LEVELS, HealthPredictor
+
+DEFAULT_GRID = np.round(np.arange(0.1, 0.951, 0.05), 2)
+
+
+def thresholds(value):
+    """Comma-separated probabilities, e.g. '0.5,0.6,0.7'"""
+    try:
+        values = [float(part) for part in value.split(',')]
+    except ValueError:
+        raise CommandError(f"Invalid thresholds: {value}")
+    if not all(0 <= v <= 1 for v in values):
+        raise CommandError(f"Thresholds must be between 0 and 1: {value}")
+    return values
+
+
+class Command(BaseCommand):
+    help = "Replay the alert models over historical health data for a grid of thresholds"
+    
+    def add_arguments(self, parser):
+        parser.add_argument('--file', action='append',
+                            help="CSV exported from /api/patients/{id}/export/ (repeatable); "
+                                 "read instead of the database")
+        parser.add_argument('--patient', type=int, action='append',
+                            help="Patient id to replay (repeatable); defaults to all")
+        parser.add_argument('--start', help="Earliest sample time (ISO 8601, UTC unless given)")
+        parser.add_argument('--end', help="Sample time to stop before (ISO 8601)")
+        parser.add_argument('--no-archive', action='store_true',
+                            help="Only replay samples still in the database")
+        parser.add_argument('--fall-thresholds', type=thresholds,
+                            help="Fall probabilities to evaluate, comma-separated")
+        parser.add_argument('--vitals-thresholds', type=thresholds,
+                            help="Risk probabilities to evaluate as the alert threshold, comma-separated")
+        parser.add_argument('--chunk-size', type=int, default=100000,
+                            help="Samples loaded and scored per block")
+    
+    def handle(self, *args, **options):
+        predictor = HealthPredictor()
+        fall_grid = np.union1d(options['fall_thresholds'] or DEFAULT_GRID, [predictor.fall_threshold])
+        vitals_grid = np.union1d(options['vitals_thresholds'] or DEFAULT_GRID, [predictor.risk_bands[0]])
+        
+        start = self.parse_time(options['start'])
+        end = self.parse_time(options['end'])
+        if options['file']:
+            blocks = backtest.csv_blocks(options['file'], options['chunk_size'])
+        else:
+            blocks = backtest.database_blocks(
+                options['patient'], start, end, options['chunk_size'], not options['no_archive']
+            )
+        
+        replay = backtest.Backtest(
+            predictor, fall_grid, vitals_grid, backtest.load_labels(),
+            getattr(settings, 'FEATURE_WINDOW_SIZE', 30),
+        )
+        loading = scoring = 0.0
+        started = time.perf_counter()
+        for block in blocks:
+            loaded = time.perf_counter()
+            loading += loaded - started
+            replay.add(block)
+            started = time.perf_counter()
+            scoring += started - loaded
+        
+        if not replay.samples:
+            raise CommandError("No samples to replay")
+        
+        self.stdout.write(
+            f"{replay.samples:,} samples from {len(replay.patient_days())} patients: "
+            f"loaded in {loading:.2f}s, scored in {scoring:.2f}s "
+            f"({replay.samples / max(scoring, 1e-9):,.0f} samples/s)"
+        )
+        days = replay.patient_days()
+        self.report('Fall', replay.fall.rows(days), predictor.fall_threshold, replay.fall)
+        self.report('Vitals', replay.vitals.rows(days), predictor.risk_bands[0], replay.vitals)
+        
+        levels = ', '.join(f"{name} {count:,}" for name, count in zip(RISK_LEVELS, replay.risk_levels))
+        bands = '/'.join(f'{band:g}' for band in predictor.risk_bands)
+        self.stdout.write(f"\nVitals risk levels with bands {bands}: {levels}")
+    
+    def parse_time(self, value):
+        if value is None:
+            return None
+        parsed = parse_datetime(value)
+        if parsed is None:
+            raise CommandError(f"Invalid time: {value}")
+        if timezone.is_naive(parsed):
+            parsed = timezone.make_aware(parsed, datetime.timezone.utc)
+        return parsed
+    
+    def report(self, name, rows, current, tally):
+        self.stdout.write(
+            f"\n{name} alerts ({tally.positives} confirmed and {tally.negatives} false alarms labeled)"
+        )
+        self.stdout.write(
+            f"  {'threshold':>10}{'alerts':>10}{'per patient-day':>18}{'max':>9}{'precision':>11}{'recall':>8}"
+        )
+        for row in rows:
+            marker = '*' if np.isclose(row['threshold'], current) else ' '
+            precision = '-' if row['precision'] is None else f"{row['precision']:.2f}"
+            recall = '-' if row['recall'] is None else f"{row['recall']:.2f}"
+            self.stdout.write(
+                f"{marker} {row['threshold']:>10.2f}{row['alerts']:>10,}{row['rate_median']:>18.1f}"
+                f"{row['rate_max']:>9.1f}{precision:>11}{recall:>8}"
+            )
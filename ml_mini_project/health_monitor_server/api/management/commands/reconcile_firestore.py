@@ -0,0 +1,135 @@
+"""
+Reconcile Firestore with the Django database
+
+Firestore mirroring is best effort: a failed write is logged and counted but
+the request still succeeds, so documents can drift from their rows. This
+command walks the rows changed since the last run in (updated_at, id) order,
+reads the matching documents in batches, and rewrites the ones that differ
+with batched writes. Progress is stored per collection in SyncWatermark after
+every chunk, so an interrupted run resumes where it stopped.
+"""
+import itertools
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Q
+from django.utils import timezone
+
+from api.firebase_service import to_document
+from api.models import Patient, Guardian, HealthData, Alert, SyncWatermark
+
+COLLECTIONS = {
+    'patients': Patient,
+    'guardians': Guardian,
+    'health_data': HealthData,
+    'alerts': Alert,
+}
+
+# Firestore limit on writes per batch
+MAX_CHUNK_SIZE = 500
+
+_MISSING = object()
+
+
+def differs(expected, stored):
+    """True if a stored document is missing or disagrees with any mirrored field"""
+    if stored is None:
+        return True
+    return any(stored.get(name, _MISSING) != value for name, value in expected.items())
+
+
+class Command(BaseCommand):
+    help = "Find rows that changed since the last run and repair their Firestore documents"
+    
+    def add_arguments(self, parser):
+        parser.add_argument('--collection', action='append', choices=sorted(COLLECTIONS),
+                            help="Collection to reconcile (repeatable); defaults to all")
+        parser.add_argument('--chunk-size', type=int, default=MAX_CHUNK_SIZE,
+                            help=f"Rows read and written per batch (at most {MAX_CHUNK_SIZE})")
+        parser.add_argument('--full', action='store_true',
+                            help="Ignore the watermark and check every row")
+        parser.add_argument('--dry-run', action='store_true',
+                            help="Report differences without writing or moving the watermark")
+        parser.add_argument('--settle', type=float, default=5.0,
+                            help="Skip rows changed in the last N seconds, whose transactions "
+                                 "may still be committing")
+    
+    def handle(self, *args, **options):
+        from api.views import firebase_repository
+        service = firebase_repository.firebase_service
+        if not service.initialized or not service.db:
+            raise CommandError("Firebase is not initialized")
+        
+        chunk_size = options['chunk_size']
+        if not 0 < chunk_size <= MAX_CHUNK_SIZE:
+            raise CommandError(f"--chunk-size must be between 1 and {MAX_CHUNK_SIZE}")
+        
+        for collection in options['collection'] or COLLECTIONS:
+            self.reconcile(service, firebase_repository, collection, chunk_size, options)
+    
+    def reconcile(self, service, repository, collection, chunk_size, options):
+        """Check and repair one collection from its watermark onwards"""
+        model = COLLECTIONS[collection]
+        dry_run = options['dry_run']
+        watermark, _ = SyncWatermark.objects.get_or_create(collection=collection)
+        
+        rows = model.objects.filter(updated_at__lte=timezone.now() - timedelta(seconds=options['settle']))
+        if watermark.updated_at is not None and not options['full']:
+            rows = rows.filter(
+                Q(updated_at__gt=watermark.updated_at) |
+                Q(updated_at=watermark.updated_at, id__gt=watermark.last_id)
+            )
+        rows = rows.order_by('updated_at', 'id')
+        total = rows.count()
+        
+        checked = repaired = 0
+        start = time.perf_counter()
+        iterator = rows.iterator(chunk_size=chunk_size)
+        while True:
+            chunk = list(itertools.islice(iterator, chunk_size))
+            if not chunk:
+                break
+            
+            stored = service.get_documents(collection, [row.id for row in chunk])
+            if stored is None:
+                raise CommandError(f"Reading {collection} from Firestore failed after {checked} rows")
+            
+            repairs = []
+            for row in chunk:
+                expected = to_document(row)
+                if differs(expected, stored.get(str(row.id))):
+                    repairs.append((row, expected))
+            
+            if repairs and not dry_run:
+                written = service.batch_write(
+                    collection, ((row.id, data) for row, data in repairs),
+                    merge=False, batch_size=chunk_size
+                )
+                for row, _ in repairs:
+                    repository.invalidate(collection, 'doc', row.id)
+                    if hasattr(row, 'patient_id'):
+                        repository.invalidate(collection, row.patient_id)
+                if written < len(repairs):
+                    raise CommandError(f"Writing {collection} to Firestore failed after {checked} rows")
+            
+            checked += len(chunk)
+            repaired += len(repairs)
+            if not dry_run:
+                watermark.updated_at = chunk[-1].updated_at
+                watermark.last_id = chunk[-1].id
+                watermark.checked += len(chunk)
+                watermark.repaired += len(repairs)
+                watermark.save()
+            
+            elapsed = time.perf_counter() - start
+            self.stdout.write(
+                f"{collection}: {checked}/{total} checked, {repaired} "
+                f"{'differ' if dry_run else 'repaired'} ({checked / elapsed:,.0f} rows/s)"
+            )
+        
+        if not dry_run:
+            watermark.last_run = timezone.now()
+            watermark.save(update_fields=['last_run'])
+        verb = 'differ' if dry_run else 'repaired'
+        self.stdout.write(self.style.SUCCESS(f"{collection}: {checked} checked, {repaired} {verb}"))
@@ -0,0 +1,40 @@
+"""
+Run the ingestion shard processes
+
+Starts one shard process per worker, each serving the samples of the devices
+the consistent-hash ring gives it on a Unix socket in INGEST_SHARD_DIR (see
+api.sharding), and supervises them: a shard that exits is taken off the ring
+and restarted, and put back once it listens again. Web workers with the same
+INGEST_SHARD_DIR forward ingestion to these shards.
+"""
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from api import sharding
+
+
+class Command(BaseCommand):
+    help = "Start and supervise the ingestion shard processes"
+    
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=getattr(settings, 'INGEST_SHARD_WORKERS', 1),
+                            help="Shard processes to run (defaults to INGEST_SHARD_WORKERS)")
+        parser.add_argument('--directory', default=getattr(settings, 'INGEST_SHARD_DIR', ''),
+                            help="Directory for the ring and the sockets (defaults to INGEST_SHARD_DIR)")
+    
+    def handle(self, *args, **options):
+        if not options['directory']:
+            raise CommandError("Set INGEST_SHARD_DIR or pass --directory")
+        if options['workers'] < 1:
+            raise CommandError("--workers must be at least 1")
+        
+        supervisor = sharding.Supervisor(options['directory'], options['workers'])
+        supervisor.start()
+        self.stdout.write(
+            f"{len(supervisor.members)} of {options['workers']} shards listening in {options['directory']} "
+            f"(ring generation {supervisor.generation})"
+        )
+        try:
+            supervisor.run()
+        except KeyboardInterrupt:
+            self.stdout.write("Stopping shards")
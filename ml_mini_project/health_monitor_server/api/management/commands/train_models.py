@@ -0,0 +1,105 @@
+"""
+Train the fall and vitals models from stored health data
+
+Streams samples from the database and the archive in chunks, builds windowed
+feature matrices, labels them from triaged alerts (see api.training),
+cross-validates the candidate estimators in parallel and saves the best as a
+new version in the model registry (ML_MODEL_DIR). Restart the server to load
+the new versions.
+"""
+import datetime
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from api import backtest, model_registry, training
+
+
+class Command(BaseCommand):
+    help = "Train the fall and vitals models on stored health data and save new versions"
+    
+    def add_arguments(self, parser):
+        parser.add_argument('--model', action='append', choices=list(training.ALERT_TYPES),
+                            help="Model to train (repeatable); defaults to both")
+        parser.add_argument('--estimator', action='append', choices=list(training.CANDIDATES),
+                            help="Candidate estimator to cross-validate (repeatable); defaults to all")
+        parser.add_argument('--patient', type=int, action='append',
+                            help="Patient id to train on (repeatable); defaults to all")
+        parser.add_argument('--start', help="Earliest sample time (ISO 8601, UTC unless given)")
+        parser.add_argument('--end', help="Sample time to stop before (ISO 8601)")
+        parser.add_argument('--no-archive', action='store_true',
+                            help="Only use samples still in the database")
+        parser.add_argument('--max-unlabeled', type=int, default=500000,
+                            help="Samples without alerts kept as negatives (a uniform sample)")
+        parser.add_argument('--folds', type=int, default=5, help="Cross-validation folds")
+        parser.add_argument('--jobs', type=int, default=-1,
+                            help="Parallel cross-validation jobs (-1 uses every core)")
+        parser.add_argument('--chunk-size', type=int, default=100000,
+                            help="Samples loaded per block")
+    
+    def handle(self, *args, **options):
+        window_size = getattr(settings, 'FEATURE_WINDOW_SIZE', 30)
+        data = training.TrainingData(
+            backtest.load_labels(), training.alerted_ids(), options['max_unlabeled'], window_size
+        )
+        started = time.perf_counter()
+        for block in backtest.database_blocks(
+            options['patient'], self.parse_time(options['start']), self.parse_time(options['end']),
+            options['chunk_size'], not options['no_archive'],
+        ):
+            data.add(block)
+        if not data.samples:
+            raise CommandError("No samples to train on")
+        first, last = data.time_range()
+        self.stdout.write(
+            f"{data.samples:,} samples from {data.patients} patients "
+            f"({first:%Y-%m-%d} to {last:%Y-%m-%d}) loaded in {time.perf_counter() - started:.1f}s"
+        )
+        
+        for name in options['model'] or list(training.ALERT_TYPES):
+            X, y = data.dataset(training.ALERT_TYPES[name])
+            try:
+                estimator, exported, metadata = training.train(
+                    X, y, options['estimator'], options['folds'], options['jobs']
+                )
+            except ValueError as e:
+                raise CommandError(f"{name}: {e}")
+            metadata.update({
+                'window_size': window_size,
+                'data': {'start': first.isoformat(), 'end': last.isoformat(), 'patients': data.patients},
+            })
+            version = model_registry.save(name, estimator, metadata, exported)
+            
+            self.stdout.write(f"\n{name}: {metadata['positives']:,} positive, {metadata['negatives']:,} negative samples")
+            for candidate, scores in metadata['cross_validation']['scores'].items():
+                marker = '*' if candidate == metadata['estimator'] else ' '
+                self.stdout.write(
+                    f"{marker} {candidate:<10} average precision {scores['average_precision']:.3f}  "
+                    f"ROC AUC {scores['roc_auc']:.3f}"
+                )
+            latency = metadata['inference_seconds_per_row']
+            self.stdout.write(self.style.SUCCESS(
+                f"Saved version {version} ({metadata['estimator']}, trained in {metadata['training_seconds']:.1f}s, "
+                f"{latency['single'] * 1e6:.0f} us per single row, {latency['batch'] * 1e6:.1f} us per row batched)"
+            ))
+            if metadata['export']:
+                latency = metadata['export']['inference_seconds_per_row']
+                self.stdout.write(
+                    f"  NumPy export: {latency['single'] * 1e6:.0f} us per single row, "
+                    f"{latency['batch'] * 1e6:.1f} us per row batched"
+                )
+            else:
+                self.stdout.write("  No NumPy export; the joblib artifact will be loaded")
+    
+    def parse_time(self, value):
+        if value is None:
+            return None
+        parsed = parse_datetime(value)
+        if parsed is None:
+            raise CommandError(f"Invalid time: {value}")
+        if timezone.is_naive(parsed):
+            parsed = timezone.make_aware(parsed, datetime.timezone.utc)
+        return parsed
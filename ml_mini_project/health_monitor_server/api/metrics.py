@@ -0,0 +1,347 @@
+"""
+In-process metrics for the health monitoring API.
+
+Counters and histograms are kept in memory and rendered in the Prometheus
+text exposition format by the ``/metrics`` endpoint. ``StageTimer`` breaks a
+request down into named stages (database insert, Firestore write, ML scoring,
+...) and can also report them to the client as a ``Server-Timing`` header.
+
+When both ``METRICS_ENABLED`` and ``SERVER_TIMING_ENABLED`` are off,
+``stage_timer()`` hands out a shared no-op timer so instrumented code pays
+only for an empty ``with`` block.
+"""
+import bisect
+import threading
+import time
+
+from django.conf import settings
+
+# Bucket upper bounds in seconds, tuned for request stages (sub-ms to seconds)
+DEFAULT_BUCKETS = (
+    0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+    0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0,
+)
+
+
+def metrics_enabled():
+    """Return True if metrics collection is turned on"""
+    return getattr(settings, 'METRICS_ENABLED', True)
+
+
+def server_timing_enabled():
+    """Return True if Server-Timing headers should be added to responses"""
+    return getattr(settings, 'SERVER_TIMING_ENABLED', False)
+
+
+def _escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(labelnames, labelvalues, extra=None):
+    pairs = [f'{name}="{_escape_label(value)}"' for name, value in zip(labelnames, labelvalues)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return repr(value)
+    return str(value)
+
+
+class MetricsRegistry:
+    """Collection of metrics rendered together by the /metrics endpoint"""
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        """Add a metric to the registry"""
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f"Metric {metric.name} is already registered")
+            self._metrics[metric.name] = metric
+        return metric
+
+    def get(self, name):
+        """Get a registered metric by name"""
+        return self._metrics.get(name)
+
+    def render(self):
+        """Render all metrics in the Prometheus text exposition format"""
+        lines = []
+        for metric in list(self._metrics.values()):
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = MetricsRegistry()
+
+
+class _Metric:
+    """Base class for labelled metrics"""
+    type_name = 'untyped'
+
+    def __init__(self, name, documentation, labelnames=(), registry=REGISTRY):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children = {}
+        self._lock = threading.Lock()
+        if registry is not None:
+            registry.register(self)
+
+    def labels(self, *labelvalues):
+        """Get the child metric for the given label values"""
+        child = self._children.get(labelvalues)
+        if child is None:
+            if len(labelvalues) != len(self.labelnames):
+                raise ValueError(f"{self.name} expects labels {self.labelnames}")
+            with self._lock:
+                child = self._children.setdefault(labelvalues, self._new_child())
+        return child
+
+    def clear(self):
+        """Drop all recorded values"""
+        with self._lock:
+            self._children = {}
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def render(self):
+        lines = [
+            f'# HELP {self.name} {self.documentation}',
+            f'# TYPE {self.name} {self.type_name}',
+        ]
+        for labelvalues, child in sorted(self._children.items()):
+            lines.extend(self._render_child(labelvalues, child))
+        return lines
+
+
+class _CounterChild:
+    __slots__ = ('value', '_lock')
+
+    def __init__(self):
+        self.value = 0
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+
+class Counter(_Metric):
+    """Monotonically increasing counter"""
+    type_name = 'counter'
+
+    def _new_child(self):
+        return _CounterChild()
+
+    def inc(self, amount=1):
+        """Increment the unlabelled counter"""
+        self.labels().inc(amount)
+
+    def value(self, *labelvalues):
+        """Current value for the given label values"""
+        child = self._children.get(labelvalues)
+        return child.value if child else 0
+
+    def _render_child(self, labelvalues, child):
+        return [f'{self.name}{_format_labels(self.labelnames, labelvalues)} {_format_value(child.value)}']
+
+
+class _GaugeChild:
+    __slots__ = ('value', '_lock')
+
+    def __init__(self):
+        self.value = 0
+        self._lock = threading.Lock()
+
+    def set(self, value):
+        self.value = value
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+    def dec(self, amount=1):
+        self.inc(-amount)
+
+
+class Gauge(_Metric):
+    """Value that can go up and down"""
+    type_name = 'gauge'
+
+    def _new_child(self):
+        return _GaugeChild()
+
+    def set(self, value):
+        """Set the unlabelled gauge"""
+        self.labels().set(value)
+
+    def value(self, *labelvalues):
+        """Current value for the given label values"""
+        child = self._children.get(labelvalues)
+        return child.value if child else 0
+
+    def _render_child(self, labelvalues, child):
+        return [f'{self.name}{_format_labels(self.labelnames, labelvalues)} {_format_value(child.value)}']
+
+
+class _HistogramChild:
+    __slots__ = ('upper_bounds', 'counts', 'sum', 'count', '_lock')
+
+    def __init__(self, upper_bounds):
+        self.upper_bounds = upper_bounds
+        self.counts = [0] * (len(upper_bounds) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        index = bisect.bisect_left(self.upper_bounds, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.sum += value
+            self.count += 1
+
+
+class Histogram(_Metric):
+    """Distribution of observed values in fixed buckets"""
+    type_name = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS, registry=REGISTRY):
+        self.upper_bounds = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames, registry)
+
+    def _new_child(self):
+        return _HistogramChild(self.upper_bounds)
+
+    def observe(self, value):
+        """Record a value on the unlabelled histogram"""
+        self.labels().observe(value)
+
+    def _render_child(self, labelvalues, child):
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.upper_bounds + (float('inf'),), child.counts):
+            cumulative += count
+            le = f'le="{_format_value(float(bound))}"'
+            lines.append(f'{self.name}_bucket{_format_labels(self.labelnames, labelvalues, le)} {cumulative}')
+        labels = _format_labels(self.labelnames, labelvalues)
+        lines.append(f'{self.name}_sum{labels} {child.sum}')
+        lines.append(f'{self.name}_count{labels} {child.count}')
+        return lines
+
+
+class _Stage:
+    """Context manager timing a single stage of a StageTimer"""
+    __slots__ = ('timer', 'name', 'start')
+
+    def __init__(self, timer, name):
+        self.timer = timer
+        self.name = name
+
+    def __enter__(self):
+        self.timer.current = self.name
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        elapsed = time.perf_counter() - self.start
+        durations = self.timer.durations
+        durations[self.name] = durations.get(self.name, 0.0) + elapsed
+        if exc_type is None:
+            self.timer.current = None
+        return False
+
+
+class StageTimer:
+    """
+    Per-request timer that accumulates time spent in named stages.
+
+    Stages entered more than once in a request (e.g. one notify per alert)
+    are summed, so the histogram reports time per request spent in a stage.
+    """
+
+    def __init__(self, stage_histogram, request_histogram=None, server_timing=False):
+        self.stage_histogram = stage_histogram
+        self.request_histogram = request_histogram
+        self.server_timing = server_timing
+        self.durations = {}
+        self.current = None
+        self.started = time.perf_counter()
+
+    def stage(self, name):
+        """Time the enclosed block as the given stage"""
+        return _Stage(self, name)
+
+    def record_error(self, counter):
+        """Count a failure against the stage that was running when it happened"""
+        if self.stage_histogram is None:
+            return
+        counter.labels(self.current or 'unknown').inc()
+
+    def header_value(self, total):
+        """Format recorded stages as a Server-Timing header value"""
+        parts = [f'{name};dur={duration * 1000:.2f}' for name, duration in self.durations.items()]
+        parts.append(f'total;dur={total * 1000:.2f}')
+        return ', '.join(parts)
+
+    def finish(self, response):
+        """Record the stage timings and return the response"""
+        total = time.perf_counter() - self.started
+        if self.stage_histogram is not None:
+            for name, duration in self.durations.items():
+                self.stage_histogram.labels(name).observe(duration)
+        if self.request_histogram is not None:
+            self.request_histogram.observe(total)
+        if self.server_timing:
+            response['Server-Timing'] = self.header_value(total)
+        return response
+
+
+class _NullStage:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+class _NullTimer:
+    """Stand-in for StageTimer when metrics are disabled"""
+    __slots__ = ()
+    current = None
+    durations = {}
+
+    def stage(self, name):
+        return _NULL_STAGE
+
+    def record_error(self, counter):
+        pass
+
+    def finish(self, response):
+        return response
+
+
+_NULL_STAGE = _NullStage()
+NULL_TIMER = _NullTimer()
+
+
+def stage_timer(stage_histogram, request_histogram=None):
+    """Create a StageTimer, or the shared no-op timer when timing is disabled"""
+    collect = metrics_enabled()
+    server_timing = server_timing_enabled()
+    if not collect and not server_timing:
+        return NULL_TIMER
+    if not collect:
+        stage_histogram = request_histogram = None
+    return StageTimer(stage_histogram, request_histogram, server_timing=server_timing)
@@ -0,0 +1,51 @@
+# Generated by Django 4.2.7 on 2026-10-19 06:34
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SyncWatermark',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('collection', models.CharField(max_length=50, unique=True)),
+                ('updated_at', models.DateTimeField(blank=True, help_text='updated_at of the last reconciled row', null=True)),
+                ('last_id', models.BigIntegerField(default=0, help_text='id of the last reconciled row')),
+                ('checked', models.BigIntegerField(default=0, help_text='Rows checked in total')),
+                ('repaired', models.BigIntegerField(default=0, help_text='Documents rewritten in total')),
+                ('last_run', models.DateTimeField(blank=True, null=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='alert',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.AddField(
+            model_name='healthdata',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.AddIndex(
+            model_name='alert',
+            index=models.Index(fields=['updated_at', 'id'], name='api_alert_updated_602c36_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='guardian',
+            index=models.Index(fields=['updated_at', 'id'], name='api_guardia_updated_e2663d_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='healthdata',
+            index=models.Index(fields=['updated_at', 'id'], name='api_healthd_updated_193088_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='patient',
+            index=models.Index(fields=['updated_at', 'id'], name='api_patient_updated_b7f876_idx'),
+        ),
+    ]
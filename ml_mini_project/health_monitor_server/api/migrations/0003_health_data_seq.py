@@ -0,0 +1,22 @@
+# Generated by Django 4.2.7 on 2026-10-19 06:41
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0002_sync_watermarks'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='healthdata',
+            name='seq',
+            field=models.BigIntegerField(blank=True, help_text='Device sequence number of the sample', null=True),
+        ),
+        migrations.AddConstraint(
+            model_name='healthdata',
+            constraint=models.UniqueConstraint(fields=('patient', 'seq'), name='unique_health_data_seq'),
+        ),
+    ]
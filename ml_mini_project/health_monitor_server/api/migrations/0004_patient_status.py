@@ -0,0 +1,68 @@
+# Generated by Django 4.2.7 on 2026-10-19 07:56
+
+from django.db import migrations, models
+from django.db.models import Count
+import django.db.models.deletion
+
+
+def create_statuses(apps, schema_editor):
+    """
+    Give existing patients a status row from their latest sample and open alerts
+
+    Scores are not stored with samples, so risk stays unknown until the next one.
+    """
+    Patient = apps.get_model('api', 'Patient')
+    HealthData = apps.get_model('api', 'HealthData')
+    Alert = apps.get_model('api', 'Alert')
+    PatientStatus = apps.get_model('api', 'PatientStatus')
+    vitals = ('heart_rate', 'spo2', 'temperature', 'systolic_bp', 'diastolic_bp', 'respiratory_rate')
+
+    def alert_counts(statuses):
+        alerts = Alert.objects.filter(status__in=statuses).order_by()
+        return dict(alerts.values_list('patient_id').annotate(Count('id')))
+
+    open_alerts = alert_counts(['NEW', 'ACKNOWLEDGED'])
+    new_alerts = alert_counts(['NEW'])
+    statuses = []
+    for patient_id in Patient.objects.values_list('id', flat=True).iterator():
+        latest = (HealthData.objects.filter(patient_id=patient_id).order_by('-timestamp', '-id')
+                  .values('timestamp', *vitals).first()) or {}
+        statuses.append(PatientStatus(
+            patient_id=patient_id,
+            last_seen=latest.get('timestamp'),
+            open_alerts=open_alerts.get(patient_id, 0),
+            new_alerts=new_alerts.get(patient_id, 0),
+            **{name: latest.get(name) for name in vitals},
+        ))
+    PatientStatus.objects.bulk_create(statuses, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0003_health_data_seq'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PatientStatus',
+            fields=[
+                ('patient', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='status', serialize=False, to='api.patient')),
+                ('last_seen', models.DateTimeField(blank=True, help_text='Time of the latest sample', null=True)),
+                ('heart_rate', models.FloatField(blank=True, null=True)),
+                ('spo2', models.FloatField(blank=True, null=True)),
+                ('temperature', models.FloatField(blank=True, null=True)),
+                ('systolic_bp', models.IntegerField(blank=True, null=True)),
+                ('diastolic_bp', models.IntegerField(blank=True, null=True)),
+                ('respiratory_rate', models.FloatField(blank=True, null=True)),
+                ('risk_level', models.CharField(blank=True, choices=[('NORMAL', 'Normal'), ('ELEVATED', 'Elevated'), ('HIGH', 'High'), ('CRITICAL', 'Critical')], max_length=20, null=True)),
+                ('risk_rank', models.SmallIntegerField(blank=True, help_text='Index of risk_level in RISK_LEVELS', null=True)),
+                ('risk_probability', models.FloatField(blank=True, null=True)),
+                ('fall_probability', models.FloatField(blank=True, null=True)),
+                ('open_alerts', models.IntegerField(default=0, help_text='NEW and ACKNOWLEDGED alerts')),
+                ('new_alerts', models.IntegerField(default=0, help_text='Alerts nobody has acknowledged yet')),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.RunPython(create_statuses, migrations.RunPython.noop),
+    ]
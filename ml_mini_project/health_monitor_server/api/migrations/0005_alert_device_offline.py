@@ -0,0 +1,18 @@
+# Generated by Django 4.2.7 on 2026-10-19 08:03
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0004_patient_status'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='alert',
+            name='type',
+            field=models.CharField(choices=[('FALL', 'Fall Detection'), ('VITALS', 'Abnormal Vitals'), ('LOCATION', 'Location Alert'), ('ACTIVITY', 'Activity Alert'), ('MEDICATION', 'Medication Reminder'), ('DEVICE_OFFLINE', 'Device Offline'), ('OTHER', 'Other')], max_length=20),
+        ),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 4.2.7 on 2026-10-19 08:26
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0005_alert_device_offline'),
+    ]
+
+    operations = [
+        migrations.RemoveConstraint(
+            model_name='healthdata',
+            name='unique_health_data_seq',
+        ),
+        migrations.AddField(
+            model_name='healthdata',
+            name='boot',
+            field=models.BigIntegerField(default=0, help_text='Device boot the sequence number was counted in'),
+        ),
+        migrations.AddConstraint(
+            model_name='healthdata',
+            constraint=models.UniqueConstraint(fields=('patient', 'boot', 'seq'), name='unique_health_data_boot_seq'),
+        ),
+    ]
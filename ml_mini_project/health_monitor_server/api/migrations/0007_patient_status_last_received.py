@@ -0,0 +1,26 @@
+# Generated by Django 4.2.7 on 2026-10-19 08:42
+
+from django.db import migrations, models
+from django.db.models import F
+
+
+def copy_last_seen(apps, schema_editor):
+    """Start from the latest sample times, so devices are tracked again after the upgrade"""
+    PatientStatus = apps.get_model('api', 'PatientStatus')
+    PatientStatus.objects.update(last_received=F('last_seen'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0006_health_data_boot'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='patientstatus',
+            name='last_received',
+            field=models.DateTimeField(blank=True, help_text='Server time the device last reported, for liveness', null=True),
+        ),
+        migrations.RunPython(copy_last_seen, migrations.RunPython.noop),
+    ]
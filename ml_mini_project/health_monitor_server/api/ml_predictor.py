@@ -1,26 +1,26 @@
 """
 Machine Learning models for health data analysis
 """
-import os
 import numpy as np
-import joblib
-from pathlib import Path
 from django.conf import settings
 
+from . import model_registry
+from .models import RISK_LEVELS
+
 class HealthPredictor:
     """Class to handle all ML predictions for health data"""
     
     def __init__(self):
         """Initialize ML models"""
-        # In a real application, you would load pre-trained models here
-        # For this example, we'll simulate predictions
-        self.fall_model = self._create_dummy_fall_model()
-        self.vitals_model = self._create_dummy_vitals_model()
+        # Fall probability that raises an alert, and the risk probabilities at
+        # which vitals become ELEVATED, HIGH and CRITICAL (see backtest_thresholds)
+        self.fall_threshold = getattr(settings, 'FALL_ALERT_THRESHOLD', 0.6)
+        self.risk_bands = tuple(getattr(settings, 'VITALS_RISK_BANDS', (0.3, 0.6, 0.8)))
         
-        # These would be the paths to your actual models
-        # base_dir = Path(__file__).resolve().parent.parent
-        # self.fall_model = joblib.load(os.path.join(base_dir, 'ml_models', 'fall_detection_model.pkl'))
-        # self.vitals_model = joblib.load(os.path.join(base_dir, 'ml_models', 'vitals_risk_model.pkl'))
+        # Models trained by `manage.py train_models` (see api.model_registry);
+        # until one is trained, predictions are simulated
+        self.fall_model = model_registry.load(model_registry.FALL_MODEL) or self._create_dummy_fall_model()
+        self.vitals_model = model_registry.load(model_registry.VITALS_MODEL) or self._create_dummy_vitals_model()
     
     def _create_dummy_fall_model(self):
         """Create a dummy fall detection model for demonstration"""
@@ -31,14 +31,14 @@ class HealthPredictor:
                 - High acceleration values (sudden movements)
                 - High gyroscope values (rapid rotation)
                 """
-                # X should have format [acc_x, acc_y, acc_z, gyr_x, gyr_y, gyr_z]
-                acc_x, acc_y, acc_z, gyr_x, gyr_y, gyr_z = X[0]
+                # Each row of X has format [acc_x, acc_y, acc_z, gyr_x, gyr_y, gyr_z]
+                X = np.asarray(X, dtype=float)
                 
                 # Calculate acceleration magnitude
-                acc_mag = np.sqrt(acc_x**2 + acc_y**2 + acc_z**2)
+                acc_mag = np.sqrt((X[:, 0:3] ** 2).sum(axis=1))
                 
                 # Calculate gyroscope magnitude
-                gyr_mag = np.sqrt(gyr_x**2 + gyr_y**2 + gyr_z**2)
+                gyr_mag = np.sqrt((X[:, 3:6] ** 2).sum(axis=1))
                 
                 # Fall detection logic
                 # In a real system, this would be a trained model
@@ -47,14 +47,14 @@ class HealthPredictor:
                 # Normal standing acceleration is around 9.8 m/s² (gravity)
                 # If the acceleration is much different from gravity, it could be a fall
                 gravity = 9.8
-                acc_diff = abs(acc_mag - gravity)
+                acc_diff = np.abs(acc_mag - gravity)
                 
                 # Combine factors to get a probability
                 # Higher values of both increase the probability
-                fall_prob = min(0.95, (acc_diff * 0.15 + gyr_mag * 0.01))
+                fall_prob = np.minimum(0.95, (acc_diff * 0.15 + gyr_mag * 0.01))
                 
                 # Return probability matrix (for binary classification: not fall, fall)
-                return np.array([[1 - fall_prob, fall_prob]])
+                return np.column_stack([1 - fall_prob, fall_prob])
         
         return DummyFallModel()
     
@@ -68,34 +68,76 @@ class HealthPredictor:
                 - Heart rate: 60-100 bpm
                 - SpO2: 95-100%
                 """
-                heart_rate, spo2 = X[0]
+                X = np.asarray(X, dtype=float)
+                heart_rate, spo2 = X[:, 0], X[:, 1]
                 
                 # Calculate risk based on how far values are from normal ranges
-                hr_risk = 0
-                if heart_rate < 50:
-                    hr_risk = (50 - heart_rate) * 0.05  # Bradycardia risk
-                elif heart_rate > 100:
-                    hr_risk = (heart_rate - 100) * 0.025  # Tachycardia risk
+                hr_risk = np.where(
+                    heart_rate < 50, (50 - heart_rate) * 0.05,  # Bradycardia risk
+                    np.where(heart_rate > 100, (heart_rate - 100) * 0.025, 0.0)  # Tachycardia risk
+                )
                 
-                spo2_risk = 0
-                if spo2 < 95:
-                    spo2_risk = (95 - spo2) * 0.1  # Hypoxemia risk
+                spo2_risk = np.where(spo2 < 95, (95 - spo2) * 0.1, 0.0)  # Hypoxemia risk
                 
                 # Combine risks (higher weight for SpO2 as it's more critical)
-                total_risk = min(0.95, hr_risk + spo2_risk * 1.5)
+                total_risk = np.minimum(0.95, hr_risk + spo2_risk * 1.5)
                 
                 # Return probability matrix (for binary classification: normal, risk)
-                return np.array([[1 - total_risk, total_risk]])
+                return np.column_stack([1 - total_risk, total_risk])
         
         return DummyVitalsModel()
     
-    def predict_fall(self, acc_x, acc_y, acc_z, gyr_x, gyr_y, gyr_z):
+    def uses_features(self, model=None):
+        """Whether a model (by default, either model) is scored on windowed feature vectors"""
+        models = (self.fall_model, self.vitals_model) if model is None else (model,)
+        return any(getattr(m, 'feature_names', None) for m in models)
+    
+    def _probabilities(self, model, readings, features):
+        if features is not None and self.uses_features(model):
+            X = np.asarray(features, dtype=float)
+        else:
+            X = np.asarray(readings, dtype=float)
+        return np.asarray(model.predict_proba(X))[:, 1]
+    
+    def fall_probabilities(self, imu, features=None):
+        """
+        Fall probability for each row of an (n, 6) array of accelerometer and gyroscope readings,
+        or of the (n, len(FEATURE_NAMES)) feature matrix for models that use it
+        """
+        return self._probabilities(self.fall_model, imu, features)
+    
+    def vitals_probabilities(self, vitals, features=None):
+        """
+        Risk probability for each row of an (n, 2) array of [heart_rate, spo2],
+        or of the (n, len(FEATURE_NAMES)) feature matrix for models that use it
+        """
+        return self._probabilities(self.vitals_model, vitals, features)
+    
+    def risk_levels(self, probabilities, bands=None):
+        """Index into RISK_LEVELS for each risk probability"""
+        return np.searchsorted(bands or self.risk_bands, probabilities, side='right')
+    
+    def could_alert(self, imu, vitals):
+        """
+        Whether one reading, [acc_x, ..., gyr_z] and [heart_rate, spo2], could raise an alert
+        
+        Models scored on windowed feature vectors cannot be judged on the
+        reading alone, so with those every reading could.
+        """
+        if self.uses_features():
+            return True
+        fall_probability = self.fall_probabilities(np.array([imu], dtype=float))[0]
+        risk_probability = self.vitals_probabilities(np.array([vitals], dtype=float))[0]
+        return bool(fall_probability >= self.fall_threshold or self.risk_levels(risk_probability) > 0)
+    
+    def predict_fall(self, acc_x, acc_y, acc_z, gyr_x, gyr_y, gyr_z, features=None):
         """
         Predict if a fall has occurred based on sensor data
         
         Args:
             acc_x, acc_y, acc_z: Accelerometer values
             gyr_x, gyr_y, gyr_z: Gyroscope values
+            features: Optional windowed feature vector, as for predict_vitals_risk
             
         Returns:
             Dictionary with prediction results
@@ -105,51 +147,45 @@ class HealthPredictor:
             float(acc_x[-1]), float(acc_y[-1]), float(acc_z[-1]),
             float(gyr_x[-1]), float(gyr_y[-1]), float(gyr_z[-1])
         ]])
+        if features is not None:
+            features = np.asarray(features, dtype=float).reshape(1, -1)
         
         # Make prediction
-        prediction = self.fall_model.predict_proba(X)
-        fall_probability = prediction[0][1]  # Probability of the positive class (fall)
+        fall_probability = self.fall_probabilities(X, features)[0]  # Probability of the positive class (fall)
         
         # Determine if it's an anomaly based on threshold
-        threshold = 0.6  # Adjust based on your needs
-        is_anomaly = fall_probability >= threshold
+        is_anomaly = fall_probability >= self.fall_threshold
         
         return {
             'is_anomaly': is_anomaly,
             'fall_probability': fall_probability,
         }
     
-    def predict_vitals_risk(self, heart_rate, spo2):
+    def predict_vitals_risk(self, heart_rate, spo2, features=None):
         """
         Predict health risk based on vital signs
         
         Args:
             heart_rate: Heart rate in BPM
             spo2: Blood oxygen saturation percentage
+            features: Optional windowed feature vector (see api.features.FEATURE_NAMES),
+                used instead of the raw readings by models that declare ``feature_names``
             
         Returns:
             Dictionary with prediction results
         """
         # Prepare input data
-        X = np.array([[float(heart_rate), float(spo2)]])
+        vitals = np.array([[float(heart_rate), float(spo2)]])
+        if features is not None:
+            features = np.asarray(features, dtype=float).reshape(1, -1)
         
         # Make prediction
-        prediction = self.vitals_model.predict_proba(X)
-        risk_probability = prediction[0][1]  # Probability of the positive class (risk)
+        risk_probability = self.vitals_probabilities(vitals, features)[0]  # Probability of the positive class (risk)
         
         # Determine risk level based on probability
-        if risk_probability < 0.3:
-            risk_level = "NORMAL"
-            is_anomaly = False
-        elif risk_probability < 0.6:
-            risk_level = "ELEVATED"
-            is_anomaly = True
-        elif risk_probability < 0.8:
-            risk_level = "HIGH"
-            is_anomaly = True
-        else:
-            risk_level = "CRITICAL"
-            is_anomaly = True
+        level = int(self.risk_levels(risk_probability))
+        risk_level = RISK_LEVELS[level]
+        is_anomaly = level > 0
         
         return {
             'is_anomaly': is_anomaly,
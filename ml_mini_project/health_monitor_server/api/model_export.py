@@ -0,0 +1,224 @@
+"""
+NumPy-only exports of trained models.
+
+scikit-learn's ``predict_proba`` validates its input and dispatches through
+several layers on every call, which costs milliseconds for a random forest
+scoring a single row, the way ingestion calls it. ``export()`` flattens a
+fitted binary classifier into plain arrays:
+
+- ``SimpleImputer`` and ``StandardScaler`` steps into fill values, means and
+  scales,
+- ``LogisticRegression`` into a coefficient vector and intercept,
+- ``DecisionTreeClassifier`` and ``RandomForestClassifier`` into one set of
+  node arrays (children, feature, threshold, positive-class probability)
+  for all trees, walked level by level for every row and tree at once.
+
+``ExportedModel.predict_proba`` gives the same probabilities as the original
+estimator; exports are saved as ``.npz`` files by the model registry, and
+loading them needs neither scikit-learn nor unpickling.
+"""
+import numpy as np
+
+LINEAR = 'linear'
+TREES = 'trees'
+
+# Rows walked through the trees at a time
+TREE_CHUNK_ROWS = 512
+
+
+def _float32_thresholds(thresholds):
+    """
+    Largest float32 at or below each threshold
+
+    For a float32 input x, ``x <= t`` and ``x <= _float32_thresholds(t)`` agree,
+    so the comparison can stay in float32.
+    """
+    rounded = thresholds.astype(np.float32)
+    above = rounded.astype(np.float64) > thresholds
+    rounded[above] = np.nextafter(rounded[above], np.float32(-np.inf))
+    return rounded
+
+
+class ExportedModel:
+    """A binary classifier as arrays, scored with vectorized NumPy"""
+
+    def __init__(self, arrays):
+        """
+        Args:
+            arrays: dict of arrays as built by export() or read from a .npz file
+        """
+        self.arrays = arrays
+        self.kind = str(arrays['kind'])
+        self.columns = arrays['columns']   # input columns kept by the imputer
+        self.fill = arrays['fill']         # value replacing NaN, per kept column
+        self.mean = arrays['mean']
+        self.scale = arrays['scale']
+        if self.kind == LINEAR:
+            self.coef = arrays['coef']
+            self.intercept = float(arrays['intercept'])
+        else:
+            self.roots = arrays['roots'].astype(np.int32)
+            self.children = arrays['children'].astype(np.int32).ravel()  # right, left of each node
+            self.feature = arrays['feature'].astype(np.int32)
+            self.threshold = _float32_thresholds(arrays['threshold'])
+            self.missing_left = arrays['missing_left']
+            self.probability = arrays['probability']
+            self.depth = int(arrays['depth'])
+
+    def _transform(self, X):
+        X = np.asarray(X, dtype=np.float64)
+        if X.ndim == 1:
+            X = X.reshape(1, -1)
+        X = X[:, self.columns]
+        X = np.where(np.isnan(X), self.fill, X)
+        return (X - self.mean) / self.scale
+
+    def _trees(self, X):
+        # Trees compare float32 inputs against their thresholds, as scikit-learn does
+        X = X.astype(np.float32)
+        missing = np.isnan(X).any()
+        probabilities = np.empty(len(X))
+        # Rows are walked in chunks that keep the node indices in cache
+        for start in range(0, len(X), TREE_CHUNK_ROWS):
+            rows = X[start:start + TREE_CHUNK_ROWS]
+            values = rows.ravel()
+            offsets = (np.arange(len(rows), dtype=np.int32) * X.shape[1])[:, None]
+            node = np.repeat(self.roots[None, :], len(rows), axis=0)
+            # Leaves are their own children, so rows that reached one stay there
+            for _ in range(self.depth):
+                value = values[offsets + self.feature[node]]
+                go_left = value <= self.threshold[node]
+                if missing:
+                    go_left |= np.isnan(value) & self.missing_left[node]
+                node = self.children[node * 2 + go_left]
+            probabilities[start:start + TREE_CHUNK_ROWS] = self.probability[node].mean(axis=1)
+        return probabilities
+
+    def positive_probabilities(self, X):
+        X = self._transform(X)
+        if self.kind == LINEAR:
+            with np.errstate(over='ignore'):
+                return 1.0 / (1.0 + np.exp(-(X @ self.coef + self.intercept)))
+        return self._trees(X)
+
+    def predict_proba(self, X):
+        positive = self.positive_probabilities(X)
+        return np.column_stack([1 - positive, positive])
+
+
+def _linear(model):
+    coef = model.coef_.ravel().astype(np.float64)
+    intercept = float(model.intercept_[0])
+    # Binary models are one-vs-rest unless multinomial is asked for explicitly
+    if model.multi_class == 'multinomial':
+        # softmax([-d, d]) is the logistic function of 2d
+        coef, intercept = coef * 2, intercept * 2
+    return {'kind': np.array(LINEAR), 'coef': coef, 'intercept': np.array(intercept)}
+
+
+def _trees(estimators):
+    roots, children, feature, threshold, missing_left, probability = [], [], [], [], [], []
+    offset = depth = 0
+    for estimator in estimators:
+        tree = estimator.tree_
+        nodes = np.arange(tree.node_count)
+        is_leaf = tree.children_left < 0
+        roots.append(offset)
+        children.append(np.column_stack([
+            np.where(is_leaf, nodes, tree.children_right), np.where(is_leaf, nodes, tree.children_left),
+        ]) + offset)
+        feature.append(np.where(is_leaf, 0, tree.feature))
+        threshold.append(tree.threshold)
+        missing = getattr(tree, 'missing_go_to_left', None)
+        missing_left.append(np.zeros(tree.node_count, dtype=bool) if missing is None else missing.astype(bool))
+        counts = tree.value[:, 0, :]
+        totals = counts.sum(axis=1)
+        probability.append(np.divide(counts[:, 1], totals, out=np.zeros(len(totals)), where=totals > 0))
+        offset += tree.node_count
+        depth = max(depth, tree.max_depth)
+    return {
+        'kind': np.array(TREES),
+        'roots': np.array(roots, dtype=np.int64),
+        'children': np.concatenate(children).astype(np.int64),
+        'feature': np.concatenate(feature).astype(np.int64),
+        'threshold': np.concatenate(threshold),
+        'missing_left': np.concatenate(missing_left),
+        'probability': np.concatenate(probability),
+        'depth': np.array(depth),
+    }
+
+
+def export(estimator, n_features):
+    """
+    Export a fitted binary classifier
+
+    Args:
+        estimator: LogisticRegression, DecisionTreeClassifier or
+            RandomForestClassifier, alone or as the last step of a Pipeline
+            whose other steps are SimpleImputer and StandardScaler
+        n_features: Columns of the input matrix
+
+    Returns:
+        ExportedModel
+
+    Raises:
+        TypeError: for estimators or steps that cannot be exported
+    """
+    from sklearn.ensemble import RandomForestClassifier
+    from sklearn.impute import SimpleImputer
+    from sklearn.linear_model import LogisticRegression
+    from sklearn.pipeline import Pipeline
+    from sklearn.preprocessing import StandardScaler
+    from sklearn.tree import DecisionTreeClassifier
+
+    steps = [step for _, step in estimator.steps] if isinstance(estimator, Pipeline) else [estimator]
+    *transforms, model = steps
+    if list(getattr(model, 'classes_', [])) != [0, 1]:
+        raise TypeError("Only binary classifiers with classes 0 and 1 can be exported")
+
+    columns = np.arange(n_features)
+    fill = np.full(n_features, np.nan)  # no imputer: NaN reaches the model
+    mean = np.zeros(n_features)
+    scale = np.ones(n_features)
+    for index, step in enumerate(transforms):
+        if isinstance(step, SimpleImputer) and index == 0:
+            if step.strategy == 'constant' or step.add_indicator:
+                raise TypeError("SimpleImputer with constant fills or indicators cannot be exported")
+            statistics = step.statistics_.astype(np.float64)
+            if step.keep_empty_features:
+                # Columns that were empty in training are filled with 0
+                keep = np.ones(n_features, dtype=bool)
+                statistics = np.where(np.isnan(statistics), 0.0, statistics)
+            else:
+                keep = ~np.isnan(statistics)
+            columns, fill = columns[keep], statistics[keep]
+            mean, scale = mean[keep], scale[keep]
+        elif isinstance(step, StandardScaler) and index == len(transforms) - 1:
+            if step.with_mean:
+                mean = step.mean_.astype(np.float64)
+            if step.with_std:
+                scale = step.scale_.astype(np.float64)
+        else:
+            raise TypeError(f"Cannot export {type(step).__name__} at step {index}")
+
+    if isinstance(model, LogisticRegression):
+        arrays = _linear(model)
+    elif isinstance(model, DecisionTreeClassifier):
+        arrays = _trees([model])
+    elif isinstance(model, RandomForestClassifier):
+        arrays = _trees(model.estimators_)
+    else:
+        raise TypeError(f"Cannot export {type(model).__name__}")
+    arrays.update({'columns': columns, 'fill': fill, 'mean': mean, 'scale': scale})
+    return ExportedModel(arrays)
+
+
+def save(exported, stream):
+    """Write an ExportedModel as .npz"""
+    np.savez(stream, **exported.arrays)
+
+
+def load(path):
+    """Read an ExportedModel written by save()"""
+    with np.load(path) as arrays:
+        return ExportedModel({name: arrays[name] for name in arrays.files})
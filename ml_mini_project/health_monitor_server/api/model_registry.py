@@ -0,0 +1,166 @@
+"""
+Versioned model artifacts.
+
+``manage.py train_models`` saves each trained model as a compressed joblib
+file with a JSON metadata file next to it, under ML_MODEL_DIR::
+
+    <ML_MODEL_DIR>/<name>/<version>.joblib
+    <ML_MODEL_DIR>/<name>/<version>.json
+    <ML_MODEL_DIR>/<name>/<version>.npz     (if the model could be exported)
+
+Versions are UTC timestamps, so the newest sorts last. HealthPredictor loads
+the newest version of each model, or the one pinned by ML_MODEL_VERSIONS
+(e.g. ``fall_detection_model=20240101T000000Z``). Older versions are kept for
+rollback.
+
+The ``.npz`` file is a NumPy-only export of the estimator (api.model_export)
+and is loaded instead of the joblib file unless ML_MODEL_EXPORTED is off;
+joblib itself is only imported to read or write a joblib file.
+"""
+import datetime
+import json
+import logging
+import os
+import tempfile
+
+from django.conf import settings
+
+from . import model_export
+from .features import FEATURE_NAMES
+
+logger = logging.getLogger(__name__)
+
+FALL_MODEL = 'fall_detection_model'
+VITALS_MODEL = 'vitals_risk_model'
+
+
+def model_dir():
+    return os.fspath(settings.ML_MODEL_DIR)
+
+
+def _path(name, version, extension):
+    return os.path.join(model_dir(), name, f'{version}.{extension}')
+
+
+class TrainedModel:
+    """
+    A loaded estimator with its metadata
+
+    Exposes ``predict_proba`` and ``feature_names`` the way HealthPredictor
+    expects of its models.
+    """
+
+    def __init__(self, name, version, estimator, metadata):
+        """
+        Args:
+            estimator: The fitted scikit-learn estimator, or its ExportedModel
+        """
+        self.name = name
+        self.version = version
+        self.estimator = estimator
+        self.metadata = metadata
+        self.feature_names = tuple(metadata['feature_names'])
+        self.exported = isinstance(estimator, model_export.ExportedModel)
+
+    def predict_proba(self, X):
+        return self.estimator.predict_proba(X)
+
+    def __repr__(self):
+        return f'<TrainedModel {self.name} {self.version}{" exported" if self.exported else ""}>'
+
+
+def versions(name):
+    """Saved versions of a model, oldest first"""
+    try:
+        names = os.listdir(os.path.join(model_dir(), name))
+    except FileNotFoundError:
+        return []
+    saved = {entry[:-len('.joblib')] for entry in names if entry.endswith('.joblib')}
+    return sorted(version for version in saved if f'{version}.json' in names)
+
+
+def _new_version(name):
+    version = datetime.datetime.now(datetime.timezone.utc).strftime('%Y%m%dT%H%M%SZ')
+    existing = set(versions(name))
+    candidate, suffix = version, 1
+    while candidate in existing:
+        suffix += 1
+        candidate = f'{version}-{suffix}'
+    return candidate
+
+
+def _write_atomic(path, write):
+    handle, temporary = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+    try:
+        with os.fdopen(handle, 'wb') as stream:
+            write(stream)
+        os.replace(temporary, path)
+    except BaseException:
+        os.unlink(temporary)
+        raise
+
+
+def save(name, estimator, metadata, exported=None):
+    """
+    Save a new version of a model
+
+    Args:
+        estimator: Fitted estimator with predict_proba
+        metadata: JSON-serializable dict; ``feature_names`` is required
+        exported: Optional ExportedModel of the estimator
+
+    Returns:
+        The version saved
+    """
+    import joblib
+
+    os.makedirs(os.path.join(model_dir(), name), exist_ok=True)
+    version = _new_version(name)
+    metadata = dict(metadata, name=name, version=version)
+    _write_atomic(_path(name, version, 'joblib'), lambda stream: joblib.dump(estimator, stream, compress=3))
+    if exported is not None:
+        _write_atomic(_path(name, version, 'npz'), lambda stream: model_export.save(exported, stream))
+    # Metadata last: a version only counts once both files exist
+    _write_atomic(_path(name, version, 'json'),
+                  lambda stream: stream.write(json.dumps(metadata, indent=2, default=str).encode()))
+    return version
+
+
+def read_metadata(name, version):
+    with open(_path(name, version, 'json')) as stream:
+        return json.load(stream)
+
+
+def load(name, version=None):
+    """
+    Load a model, by default the newest version
+
+    Returns:
+        TrainedModel, or None if there is no usable version (none saved, or
+        trained on a different feature schema than api.features provides)
+    """
+    if version is None:
+        version = getattr(settings, 'ML_MODEL_VERSIONS', {}).get(name)
+    if version is None:
+        saved = versions(name)
+        if not saved:
+            return None
+        version = saved[-1]
+    try:
+        info = read_metadata(name, version)
+    except FileNotFoundError:
+        logger.warning("Model %s version %s not found", name, version,
+                       extra={'event': 'model.missing', 'model': name, 'version': version})
+        return None
+    if tuple(info.get('feature_names', ())) != FEATURE_NAMES:
+        logger.warning("Model %s version %s was trained on other features, not loading", name, version,
+                       extra={'event': 'model.schema_mismatch', 'model': name, 'version': version})
+        return None
+    exported = _path(name, version, 'npz')
+    if getattr(settings, 'ML_MODEL_EXPORTED', True) and os.path.exists(exported):
+        estimator = model_export.load(exported)
+    else:
+        import joblib
+
+        estimator = joblib.load(_path(name, version, 'joblib'))
+    return TrainedModel(name, version, estimator, info)
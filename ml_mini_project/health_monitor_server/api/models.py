@@ -1,7 +1,42 @@
-from django.db import models
+from django.db import models, transaction
+from django.db.models import Count, OuterRef, Q, Subquery
+from django.db.models.functions import Coalesce
 from django.utils import timezone
 
-class Patient(models.Model):
+# Vitals risk levels, from no risk up; a reading is anomalous above NORMAL
+RISK_LEVELS = ('NORMAL', 'ELEVATED', 'HIGH', 'CRITICAL')
+
+# Alert statuses that still need a guardian's attention
+OPEN_ALERT_STATUSES = ('NEW', 'ACKNOWLEDGED')
+
+class ChangeTrackingMixin:
+    """
+    Track which fields changed since the instance was loaded from the database
+    or last mirrored to Firestore, so the mirror can send only those fields.
+    """
+    
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._synced_values = dict(zip(field_names, values))
+        return instance
+    
+    def get_changed_fields(self):
+        """Attnames changed since load or last sync, or None if never loaded or synced"""
+        synced = getattr(self, '_synced_values', None)
+        if synced is None:
+            return None
+        return [name for name, value in synced.items() if self.__dict__.get(name, value) != value]
+    
+    def mark_synced(self):
+        """Record the current field values as mirrored"""
+        self._synced_values = {
+            field.attname: self.__dict__[field.attname]
+            for field in self._meta.concrete_fields
+            if field.attname in self.__dict__
+        }
+
+class Patient(ChangeTrackingMixin, models.Model):
     """Model representing a patient"""
     name = models.CharField(max_length=100)
     age = models.IntegerField()
@@ -16,10 +51,13 @@ class Patient(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     
+    class Meta:
+        indexes = [models.Index(fields=['updated_at', 'id'])]
+    
     def __str__(self):
         return f"{self.name} ({self.age})"
 
-class Guardian(models.Model):
+class Guardian(ChangeTrackingMixin, models.Model):
     """Model representing a patient's guardian"""
     patient = models.ForeignKey(Patient, on_delete=models.CASCADE, related_name='guardians')
     name = models.CharField(max_length=100)
@@ -38,10 +76,13 @@ class Guardian(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     
+    class Meta:
+        indexes = [models.Index(fields=['updated_at', 'id'])]
+    
     def __str__(self):
         return f"{self.name} ({self.relationship} of {self.patient.name})"
 
-class HealthData(models.Model):
+class HealthData(ChangeTrackingMixin, models.Model):
     """Model storing health data from IoT devices"""
     patient = models.ForeignKey(Patient, on_delete=models.CASCADE, related_name='health_data')
     timestamp = models.DateTimeField(default=timezone.now)
@@ -69,13 +110,53 @@ class HealthData(models.Model):
     diastolic_bp = models.IntegerField(null=True, blank=True, help_text="Diastolic blood pressure")
     respiratory_rate = models.FloatField(null=True, blank=True, help_text="Respiratory rate in breaths per minute")
     
+    # Device sample number (or sample timestamp in ms), used to drop retried uploads;
+    # a device's counter restarts when it reboots, so numbers are unique per boot
+    seq = models.BigIntegerField(null=True, blank=True, help_text="Device sequence number of the sample")
+    boot = models.BigIntegerField(default=0, help_text="Device boot the sequence number was counted in")
+    
+    updated_at = models.DateTimeField(auto_now=True)
+    
     class Meta:
         ordering = ['-timestamp']
+        indexes = [models.Index(fields=['updated_at', 'id'])]
+        constraints = [
+            models.UniqueConstraint(fields=['patient', 'boot', 'seq'], name='unique_health_data_boot_seq'),
+        ]
     
     def __str__(self):
         return f"Health data for {self.patient.name} at {self.timestamp}"
 
-class Alert(models.Model):
+class AlertQuerySet(models.QuerySet):
+    """QuerySet with bulk triage operations for alerts"""
+    
+    def set_status(self, status):
+        """
+        Set the status of every matching alert in a single UPDATE
+        
+        Alerts already in the target status are left untouched. Resolving also
+        stamps resolved_at.
+        
+        Returns:
+            Tuple of (rows, fields): the (id, patient_id) pairs that were
+            updated and the field values that were set
+        """
+        now = timezone.now()
+        fields = {'status': status}
+        if status == 'RESOLVED':
+            fields['resolved_at'] = now
+        
+        with transaction.atomic():
+            pending = self.exclude(status=status)
+            rows = list(pending.values_list('id', 'patient_id'))
+            if rows:
+                # update() bypasses auto_now; keep the sync watermark moving
+                pending.update(updated_at=now, **fields)
+                # update() sends no signals either; recount the patients' open alerts
+                PatientStatus.objects.refresh_alerts({patient_id for _, patient_id in rows})
+        return rows, fields
+
+class Alert(ChangeTrackingMixin, models.Model):
     """Model for health alerts"""
     patient = models.ForeignKey(Patient, on_delete=models.CASCADE, related_name='alerts')
     timestamp = models.DateTimeField(default=timezone.now)
@@ -85,6 +166,7 @@ class Alert(models.Model):
         ('LOCATION', 'Location Alert'),
         ('ACTIVITY', 'Activity Alert'),
         ('MEDICATION', 'Medication Reminder'),
+        ('DEVICE_OFFLINE', 'Device Offline'),
         ('OTHER', 'Other')
     ])
     message = models.TextField()
@@ -96,9 +178,13 @@ class Alert(models.Model):
         ('FALSE_ALARM', 'False Alarm')
     ])
     resolved_at = models.DateTimeField(null=True, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    objects = AlertQuerySet.as_manager()
     
     class Meta:
         ordering = ['-timestamp']
+        indexes = [models.Index(fields=['updated_at', 'id'])]
     
     def __str__(self):
         return f"{self.type} alert for {self.patient.name} at {self.timestamp}"
@@ -112,4 +198,108 @@ class Alert(models.Model):
         """Mark alert as resolved"""
         self.status = 'RESOLVED'
         self.resolved_at = timezone.now()
-        self.save()
\ No newline at end of file
+        self.save()
+
+class PatientStatusQuerySet(models.QuerySet):
+    """Upkeep of the per-patient summary rows"""
+    
+    def record_sample(self, patient_id, sample, vitals=None, fall=None, received=None):
+        """
+        Make a sample the patient's latest, unless a newer one already is
+        
+        Args:
+            sample: Dict with the sample's timestamp and vital sign fields
+            vitals: Optional predict_vitals_risk() result for the sample
+            fall: Optional predict_fall() result for the sample
+            received: Optional server time the sample arrived, see record_received()
+        """
+        now = timezone.now()
+        fields = {name: sample.get(name) for name in PatientStatus.VITAL_FIELDS}
+        fields.update(last_seen=sample['timestamp'], updated_at=now)
+        if received is not None:
+            fields['last_received'] = received
+        if vitals is not None:
+            fields.update(
+                risk_level=vitals['risk_level'],
+                risk_rank=RISK_LEVELS.index(vitals['risk_level']),
+                risk_probability=float(vitals['risk_probability']),
+            )
+        if fall is not None:
+            fields['fall_probability'] = float(fall['fall_probability'])
+        
+        newer = Q(last_seen__isnull=True) | Q(last_seen__lte=sample['timestamp'])
+        if not self.filter(newer, patient_id=patient_id).update(**fields):
+            # No row yet (e.g. for patients created with bulk_create), or a newer sample
+            _, created = self.get_or_create(patient_id=patient_id, defaults=fields)
+            if not created and received is not None:
+                # The device is reporting even though the sample is not its latest
+                self.record_received(patient_id, received)
+    
+    def record_received(self, patient_id, received=None):
+        """Record that the patient's device reported, at server time ``received`` (default now)"""
+        received = received or timezone.now()
+        later = Q(last_received__isnull=True) | Q(last_received__lt=received)
+        if not self.filter(later, patient_id=patient_id).update(last_received=received):
+            self.get_or_create(patient_id=patient_id, defaults={'last_received': received})
+    
+    def refresh_alerts(self, patient_ids):
+        """Recount the open alerts of some patients, in a single UPDATE"""
+        alerts = Alert.objects.filter(patient=OuterRef('patient')).order_by().values('patient')
+        
+        def count(statuses):
+            counts = alerts.filter(status__in=statuses).annotate(count=Count('id')).values('count')
+            return Coalesce(Subquery(counts), 0)
+        
+        self.filter(patient_id__in=list(patient_ids)).update(
+            open_alerts=count(OPEN_ALERT_STATUSES), new_alerts=count(['NEW']), updated_at=timezone.now()
+        )
+
+class PatientStatus(models.Model):
+    """
+    Summary of a patient's current state, for the dashboard
+    
+    Kept up to date as samples are ingested or backfilled and as alerts change,
+    so the dashboard reads one row per patient instead of their history.
+    """
+    VITAL_FIELDS = ('heart_rate', 'spo2', 'temperature', 'systolic_bp', 'diastolic_bp', 'respiratory_rate')
+    
+    patient = models.OneToOneField(Patient, on_delete=models.CASCADE, primary_key=True, related_name='status')
+    last_seen = models.DateTimeField(null=True, blank=True, help_text="Time of the latest sample")
+    last_received = models.DateTimeField(null=True, blank=True,
+                                         help_text="Server time the device last reported, for liveness")
+    
+    # Vital signs of the latest sample
+    heart_rate = models.FloatField(null=True, blank=True)
+    spo2 = models.FloatField(null=True, blank=True)
+    temperature = models.FloatField(null=True, blank=True)
+    systolic_bp = models.IntegerField(null=True, blank=True)
+    diastolic_bp = models.IntegerField(null=True, blank=True)
+    respiratory_rate = models.FloatField(null=True, blank=True)
+    
+    # Scores of the latest sample
+    risk_level = models.CharField(max_length=20, null=True, blank=True,
+                                  choices=[(level, level.title()) for level in RISK_LEVELS])
+    risk_rank = models.SmallIntegerField(null=True, blank=True, help_text="Index of risk_level in RISK_LEVELS")
+    risk_probability = models.FloatField(null=True, blank=True)
+    fall_probability = models.FloatField(null=True, blank=True)
+    
+    open_alerts = models.IntegerField(default=0, help_text="NEW and ACKNOWLEDGED alerts")
+    new_alerts = models.IntegerField(default=0, help_text="Alerts nobody has acknowledged yet")
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    objects = PatientStatusQuerySet.as_manager()
+    
+    def __str__(self):
+        return f"Status of patient {self.patient_id}: {self.risk_level or 'unknown'} risk"
+
+class SyncWatermark(models.Model):
+    """Position of the Firestore reconciliation scan for one collection"""
+    collection = models.CharField(max_length=50, unique=True)
+    updated_at = models.DateTimeField(null=True, blank=True, help_text="updated_at of the last reconciled row")
+    last_id = models.BigIntegerField(default=0, help_text="id of the last reconciled row")
+    checked = models.BigIntegerField(default=0, help_text="Rows checked in total")
+    repaired = models.BigIntegerField(default=0, help_text="Documents rewritten in total")
+    last_run = models.DateTimeField(null=True, blank=True)
+    
+    def __str__(self):
+        return f"{self.collection} reconciled up to {self.updated_at} (id {self.last_id})"
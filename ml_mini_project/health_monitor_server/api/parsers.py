@@ -0,0 +1,43 @@
+"""
+Request parsers for the API.
+"""
+import io
+import zlib
+
+from django.conf import settings
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import JSONParser
+
+# zlib wbits for each supported Content-Encoding
+_WBITS = {
+    'gzip': 16 + zlib.MAX_WBITS,
+    'deflate': zlib.MAX_WBITS,
+}
+
+
+class CompressedJSONParser(JSONParser):
+    """
+    JSON parser that accepts gzip or deflate request bodies
+    
+    The encoding is taken from the Content-Encoding header. Decompressed
+    bodies larger than BACKFILL_MAX_BYTES are rejected.
+    """
+    
+    def parse(self, stream, media_type=None, parser_context=None):
+        request = (parser_context or {}).get('request')
+        encoding = request.META.get('HTTP_CONTENT_ENCODING', '').strip().lower() if request else ''
+        if encoding in ('', 'identity'):
+            return super().parse(stream, media_type, parser_context)
+        if encoding not in _WBITS:
+            raise ParseError(f'Unsupported Content-Encoding: {encoding}')
+        
+        limit = getattr(settings, 'BACKFILL_MAX_BYTES', 8 * 1024 * 1024)
+        decompressor = zlib.decompressobj(_WBITS[encoding])
+        try:
+            body = decompressor.decompress(stream.read(), limit + 1)
+        except zlib.error as e:
+            raise ParseError(f'Invalid {encoding} body: {e}')
+        if len(body) > limit or decompressor.unconsumed_tail:
+            raise ParseError(f'Decompressed body exceeds {limit} bytes')
+        
+        return super().parse(io.BytesIO(body), media_type, parser_context)
@@ -0,0 +1,51 @@
+"""
+JSON renderer backed by orjson when it is installed.
+
+orjson encodes dicts, lists, numbers and datetimes in C, several times faster
+than the standard library encoder DRF uses. Output matches DRF's compact JSON
+(UTC datetimes end in ``Z``; U+2028/U+2029 are escaped). Anything orjson does
+not know how to encode goes through DRF's encoder, and requests for indented
+output fall back to the stock renderer. Without orjson installed (see
+requirements-optional.txt) a warning is logged on the first response.
+"""
+import logging
+
+from rest_framework.utils.encoders import JSONEncoder
+from rest_framework.renderers import JSONRenderer
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - optional dependency
+    orjson = None
+
+logger = logging.getLogger(__name__)
+
+_default = JSONEncoder().default
+_warned = False
+
+
+def _warn_fallback():
+    global _warned
+    if not _warned:
+        _warned = True
+        logger.warning("orjson is not installed; responses are encoded with the slower standard library encoder",
+                       extra={'event': 'renderers.orjson_missing'})
+
+
+class FastJSONRenderer(JSONRenderer):
+    """JSONRenderer that encodes with orjson when available"""
+    
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        indent = self.get_indent(accepted_media_type, renderer_context or {})
+        if orjson is None:
+            _warn_fallback()
+        if orjson is None or indent is not None or not self.compact or self.ensure_ascii:
+            return super().render(data, accepted_media_type, renderer_context)
+        
+        ret = orjson.dumps(data, default=_default, option=orjson.OPT_UTC_Z)
+        # Same escaping DRF applies so the output is safe inside <script> tags
+        if b'\xe2\x80\xa8' in ret or b'\xe2\x80\xa9' in ret:
+            ret = ret.replace(b'\xe2\x80\xa8', b'\\u2028').replace(b'\xe2\x80\xa9', b'\\u2029')
+        return ret
@@ -1,5 +1,8 @@
+from django.conf import settings
+from django.db import models
+from django.utils import timezone
 from rest_framework import serializers
-from .models import Patient, Guardian, HealthData, Alert
+from .models import Patient, Guardian, HealthData, Alert, PatientStatus
 
 class PatientSerializer(serializers.ModelSerializer):
     """Serializer for Patient model"""
@@ -56,4 +59,112 @@ class AlertSerializer(serializers.ModelSerializer):
         ]
     
     def get_patient_name(self, obj):
-        return obj.patient.name if obj.patient else None
\ No newline at end of file
+        return obj.patient.name if obj.patient else None
+
+class PatientStatusSerializer(serializers.ModelSerializer):
+    """Serializer for a patient's dashboard row"""
+    patient_name = serializers.SerializerMethodField()
+    
+    class Meta:
+        model = PatientStatus
+        fields = [
+            'patient', 'patient_name', 'last_seen',
+            'heart_rate', 'spo2', 'temperature', 'systolic_bp', 'diastolic_bp', 'respiratory_rate',
+            'risk_level', 'risk_probability', 'fall_probability',
+            'open_alerts', 'new_alerts', 'updated_at'
+        ]
+    
+    def get_patient_name(self, obj):
+        return obj.patient.name if obj.patient else None
+
+class RowSerializer:
+    """
+    Fast read-only rendering of a ModelSerializer's output from values_list() rows
+    
+    The column list is worked out once from the serializer's Meta.fields:
+    relations become their ``<name>_id`` column and other computed fields are
+    mapped to a lookup (e.g. ``patient_name='patient__name'``, fetched with a
+    join instead of a query per row). Each row is then a plain dict with the
+    same keys as the serializer output; datetimes are left for the renderer to
+    encode, as DRF would.
+    """
+    
+    def __init__(self, serializer_class, **lookups):
+        model = serializer_class.Meta.model
+        self.keys = tuple(serializer_class.Meta.fields)
+        self.columns = []
+        datetimes = []
+        for index, name in enumerate(self.keys):
+            if name in lookups:
+                self.columns.append(lookups[name])
+                continue
+            field = model._meta.get_field(name)
+            self.columns.append(field.attname)
+            if isinstance(field, models.DateTimeField):
+                datetimes.append(index)
+        self.datetimes = tuple(datetimes)
+    
+    def values(self, queryset):
+        """The values_list() queryset of the columns to render"""
+        return queryset.values_list(*self.columns)
+    
+    def rows(self, queryset):
+        """Evaluate a queryset into a list of serializer-shaped dicts"""
+        return self.convert(self.values(queryset))
+    
+    def convert(self, rows):
+        """Turn values_list() tuples (e.g. a page of them) into dicts"""
+        keys = self.keys
+        if not self.datetimes or not settings.USE_TZ or timezone.get_current_timezone_name() == 'UTC':
+            return [dict(zip(keys, row)) for row in rows]
+        
+        # DRF renders datetimes in the current time zone; the database returns UTC
+        result = []
+        for row in rows:
+            item = dict(zip(keys, row))
+            for index in self.datetimes:
+                value = row[index]
+                if value is not None:
+                    item[keys[index]] = timezone.localtime(value)
+            result.append(item)
+        return result
+
+health_data_rows = RowSerializer(HealthDataSerializer, patient_name='patient__name')
+alert_rows = RowSerializer(AlertSerializer, patient_name='patient__name')
+patient_status_rows = RowSerializer(PatientStatusSerializer, patient_name='patient__name')
+
+class AlertFilterSerializer(serializers.Serializer):
+    """Selects alerts for a bulk status change"""
+    patient = serializers.IntegerField(required=False)
+    type = serializers.ChoiceField(choices=Alert._meta.get_field('type').choices, required=False)
+    status = serializers.ChoiceField(choices=Alert._meta.get_field('status').choices, required=False)
+    before = serializers.DateTimeField(required=False)
+
+class AlertBulkStatusSerializer(serializers.Serializer):
+    """Input for changing the status of many alerts at once"""
+    status = serializers.ChoiceField(choices=Alert._meta.get_field('status').choices)
+    ids = serializers.ListField(child=serializers.IntegerField(), required=False, allow_empty=False)
+    filters = AlertFilterSerializer(required=False)
+    
+    def validate(self, data):
+        if ('ids' in data) == ('filters' in data):
+            raise serializers.ValidationError("Provide either 'ids' or 'filters'")
+        if 'filters' in data and not data['filters']:
+            raise serializers.ValidationError("'filters' must select on at least one field")
+        return data
+    
+    def get_queryset(self):
+        """Alerts selected by the validated ids or filters"""
+        queryset = Alert.objects.all()
+        if 'ids' in self.validated_data:
+            return queryset.filter(id__in=self.validated_data['ids'])
+        filters = self.validated_data['filters']
+        if 'patient' in filters:
+            queryset = queryset.filter(patient_id=filters['patient'])
+        if 'type' in filters:
+            queryset = queryset.filter(type=filters['type'])
+        if 'status' in filters:
+            queryset = queryset.filter(status=filters['status'])
+        if 'before' in filters:
+            queryset = queryset.filter(timestamp__lt=filters['before'])
+        return queryset
@@ -0,0 +1,528 @@
+"""
+Ingestion sharded by device across worker processes.
+
+Feature windows (api.features), dedup windows (api.dedup) and liveness
+deadlines (api.liveness) are kept per patient in process memory, which only
+works while every sample of a patient reaches the same process. With
+``INGEST_SHARD_DIR`` set, web workers stop ingesting themselves: a
+``ShardRouter`` hashes each sample's ``user_id`` onto a consistent-hash ring
+of shard processes and forwards it over a Unix socket in that directory.
+The shards, started by ``manage.py run_ingest_shards``, run the normal
+ingestion code and send back the rendered response with its headers. The
+per-device rate limit (api.throttling) is applied by the owning shard, which
+sees all of a device's samples.
+
+The supervisor publishes the ring in ``ring.json`` with a generation number
+that it bumps whenever a shard exits or comes back. Routers reload it when it
+changes; a shard that sees a newer generation drops the state of the devices
+it no longer owns, and the ones it gains are loaded from the database on
+their next sample, as after a restart. Consistent hashing moves only the
+devices of the shard that left or joined. A router that cannot reach a shard
+sends its devices to the next shard on the ring until the generation changes.
+"""
+import bisect
+import hashlib
+import json
+import logging
+import os
+import signal
+import socket
+import socketserver
+import struct
+import threading
+import time
+
+from django.conf import settings
+from django.http import HttpResponse
+
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+SHARD_REQUESTS = metrics.Counter(
+    'ingest_shard_requests_total',
+    'Requests forwarded to ingestion shards, by shard and result',
+    ['shard', 'result'],
+)
+SHARD_REBALANCES = metrics.Counter(
+    'ingest_shard_rebalances_total',
+    'Ring changes applied by this shard, and the devices whose state it dropped',
+    ['kind'],
+)
+
+RING_FILE = 'ring.json'
+
+_REQUEST = struct.Struct('!I')
+_REPLY = struct.Struct('!IHI')  # body size, status, headers size
+
+
+def _hash(key):
+    return int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), 'big')
+
+
+class HashRing:
+    """Consistent-hash ring of nodes, each placed at ``replicas`` points"""
+
+    def __init__(self, nodes=(), replicas=128):
+        self.replicas = replicas
+        self.nodes = set()
+        self._points = []
+        self._owners = []
+        for node in nodes:
+            self.add(node)
+
+    def __len__(self):
+        return len(self.nodes)
+
+    def add(self, node):
+        if node in self.nodes:
+            return
+        self.nodes.add(node)
+        for replica in range(self.replicas):
+            point = _hash(f'{node}#{replica}')
+            index = bisect.bisect(self._points, point)
+            self._points.insert(index, point)
+            self._owners.insert(index, node)
+
+    def remove(self, node):
+        if node not in self.nodes:
+            return
+        self.nodes.discard(node)
+        kept = [(point, owner) for point, owner in zip(self._points, self._owners) if owner != node]
+        self._points = [point for point, _ in kept]
+        self._owners = [owner for _, owner in kept]
+
+    def node_for(self, key, exclude=()):
+        """Node owning key: the first clockwise from its hash, skipping excluded nodes"""
+        if not self._points:
+            return None
+        index = bisect.bisect(self._points, _hash(str(key)))
+        for offset in range(len(self._points)):
+            owner = self._owners[(index + offset) % len(self._points)]
+            if owner not in exclude:
+                return owner
+        return None
+
+
+def read_ring(directory):
+    """Generation and shard names published in directory, or (0, [])"""
+    try:
+        with open(os.path.join(directory, RING_FILE)) as f:
+            ring = json.load(f)
+    except FileNotFoundError:
+        return 0, []
+    return ring['generation'], ring['shards']
+
+
+def write_ring(directory, generation, shards):
+    """Publish a ring atomically, so readers never see a partial file"""
+    path = os.path.join(directory, RING_FILE)
+    with open(path + '.tmp', 'w') as f:
+        json.dump({'generation': generation, 'shards': sorted(shards)}, f)
+    os.replace(path + '.tmp', path)
+
+
+def socket_path(directory, name):
+    return os.path.join(directory, f'{name}.sock')
+
+
+def _recv_exactly(sock, size):
+    buffer = bytearray()
+    while len(buffer) < size:
+        chunk = sock.recv(size - len(buffer))
+        if not chunk:
+            return None
+        buffer += chunk
+    return bytes(buffer)
+
+
+class ShardUnavailable(Exception):
+    """No shard could take the request"""
+
+
+class ShardRouter:
+    """Forwards requests to the shard owning their device, over per-thread connections"""
+
+    def __init__(self, directory, replicas=128, timeout=30.0, refresh=1.0):
+        """
+        Args:
+            directory: Directory holding ring.json and the shards' sockets
+            timeout: Seconds to wait for a shard's reply
+            refresh: Seconds between checks of ring.json for a new generation
+        """
+        self.directory = directory
+        self.replicas = replicas
+        self.timeout = timeout
+        self.refresh = refresh
+        self.generation = 0
+        self.ring = HashRing(replicas=replicas)
+        self._down = set()
+        self._mtime = None
+        self._checked = 0.0
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def _reload(self):
+        now = time.monotonic()
+        if now - self._checked < self.refresh:
+            return
+        with self._lock:
+            self._checked = now
+            try:
+                mtime = os.stat(os.path.join(self.directory, RING_FILE)).st_mtime_ns
+            except FileNotFoundError:
+                mtime = None
+            if mtime == self._mtime:
+                return
+            generation, shards = read_ring(self.directory)
+            self.ring = HashRing(shards, self.replicas)
+            self.generation = generation
+            self._down = set()
+            self._mtime = mtime
+
+    def _connection(self, shard):
+        connections = self._local.__dict__.setdefault('connections', {})
+        sock = connections.get(shard)
+        if sock is None:
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.settimeout(self.timeout)
+            try:
+                sock.connect(socket_path(self.directory, shard))
+            except OSError:
+                sock.close()
+                raise
+            connections[shard] = sock
+        return sock
+
+    def _close(self, shard):
+        sock = self._local.__dict__.get('connections', {}).pop(shard, None)
+        if sock is not None:
+            sock.close()
+
+    def shard_for(self, user_id):
+        self._reload()
+        return self.ring.node_for(user_id, exclude=self._down)
+
+    def forward(self, op, data, load_shedding=False):
+        """
+        Send a request to the shard owning data['user_id']
+
+        Returns:
+            Tuple of (HTTP status, dict of response headers, rendered JSON body)
+
+        Raises:
+            ShardUnavailable: if no shard answered
+        """
+        self._reload()
+        if hasattr(data, 'dict'):
+            data = data.dict()  # form-encoded QueryDict
+        message = json.dumps({
+            'op': op, 'generation': self.generation, 'load_shedding': load_shedding, 'data': data,
+        }).encode()
+        user_id = data.get('user_id')
+        retried = None
+        while True:
+            shard = self.ring.node_for(user_id, exclude=self._down)
+            if shard is None:
+                raise ShardUnavailable("No ingestion shard is reachable")
+            reused = shard in self._local.__dict__.get('connections', {})
+            try:
+                sock = self._connection(shard)
+                sock.sendall(_REQUEST.pack(len(message)) + message)
+                header = _recv_exactly(sock, _REPLY.size)
+                if header is None:
+                    raise ConnectionError(f"Shard {shard} closed the connection")
+                size, status, headers_size = _REPLY.unpack(header)
+                reply = _recv_exactly(sock, headers_size + size)
+                if reply is None:
+                    raise ConnectionError(f"Shard {shard} closed the connection")
+            except socket.timeout:
+                # The shard may still store the sample; do not send it to another one
+                self._close(shard)
+                SHARD_REQUESTS.labels(shard, 'timeout').inc()
+                raise ShardUnavailable(f"Shard {shard} did not answer in time")
+            except OSError:
+                self._close(shard)
+                if reused and retried != shard:
+                    # The shard may have restarted since this connection was opened
+                    retried = shard
+                    continue
+                SHARD_REQUESTS.labels(shard, 'unreachable').inc()
+                logger.warning("Ingestion shard %s is unreachable", shard,
+                               extra={'event': 'sharding.shard_down', 'shard': shard})
+                with self._lock:
+                    self._down.add(shard)
+                continue
+            SHARD_REQUESTS.labels(shard, 'ok').inc()
+            return status, json.loads(reply[:headers_size]), reply[headers_size:]
+
+    def respond(self, op, data, load_shedding=False):
+        """forward() as an HTTP response, 503 if no shard answered"""
+        try:
+            status, headers, body = self.forward(op, data, load_shedding)
+        except ShardUnavailable as e:
+            status, headers, body = 503, {}, json.dumps({'error': str(e)}).encode()
+        response = HttpResponse(body, status=status, content_type='application/json')
+        for name, value in headers.items():
+            response[name] = value
+        return response
+
+
+_router = None
+_router_lock = threading.Lock()
+
+
+def get_router():
+    """The process's ShardRouter, or None when ingestion is not sharded"""
+    global _router
+    directory = getattr(settings, 'INGEST_SHARD_DIR', '')
+    if not directory:
+        return None
+    if _router is None or _router.directory != directory:
+        with _router_lock:
+            if _router is None or _router.directory != directory:
+                _router = ShardRouter(directory, timeout=getattr(settings, 'INGEST_SHARD_TIMEOUT', 30.0))
+    return _router
+
+
+def routing():
+    """Whether this process forwards ingestion to shards rather than ingesting itself"""
+    return current is None and bool(getattr(settings, 'INGEST_SHARD_DIR', ''))
+
+
+class Shard:
+    """One shard's view of the ring and the devices whose state it holds"""
+
+    def __init__(self, name, directory, replicas=128):
+        self.name = name
+        self.directory = directory
+        self.replicas = replicas
+        self.generation, shards = read_ring(directory)
+        # Until the supervisor publishes a ring with this shard, assume it will
+        self.ring = HashRing(set(shards) | {name}, replicas)
+        self._users = set()
+        self._lock = threading.Lock()
+
+    def owns(self, user_id):
+        return self.ring.node_for(user_id) == self.name
+
+    def handle(self, message):
+        """Run one request; returns (HTTP status, dict of response headers, rendered JSON body)"""
+        from rest_framework.exceptions import Throttled
+        from rest_framework.response import Response
+
+        from . import throttling
+        from .renderers import FastJSONRenderer
+        from .views import _backfill_health_data, _process_health_data
+
+        request = json.loads(message)
+        if request['generation'] > self.generation:
+            self.rebalance()
+        data = request['data']
+        user_id = data.get('user_id')
+        if request['op'] == 'backfill':
+            response = _backfill_health_data(data)
+        else:
+            allowed, wait = throttling.take_device_token(user_id, data)
+            if allowed:
+                response = _process_health_data(data, request.get('load_shedding', False))
+            else:
+                throttled = Throttled(wait)
+                response = Response({'detail': throttled.detail}, status=throttled.status_code,
+                                    headers={'Retry-After': '%d' % throttled.wait})
+        if isinstance(user_id, str) and response.status_code < 400:
+            self._users.add(user_id)
+        headers = {name: value for name, value in response.items() if name.lower() != 'content-type'}
+        return response.status_code, headers, FastJSONRenderer().render(response.data)
+
+    def rebalance(self):
+        """Load the published ring and drop the state of devices now owned by other shards"""
+        from . import cache, liveness
+        from .dedup import seq_window
+        from .features import feature_store
+        from .models import Patient
+
+        with self._lock:
+            generation, shards = read_ring(self.directory)
+            if generation <= self.generation:
+                return
+            self.generation = generation
+            self.ring = HashRing(shards, self.replicas)
+            lost = {user_id for user_id in self._users | set(liveness.tracker.devices())
+                    if not self.owns(user_id)}
+            for user_id in lost:
+                liveness.tracker.forget(user_id)
+                try:
+                    patient = cache.get_patient_by_user_id(user_id)
+                except Patient.DoesNotExist:
+                    continue
+                feature_store.reset(patient.id)
+                seq_window.reset(patient.id)
+            self._users -= lost
+        # Silent devices gained from a shard that left are tracked from their last sample
+        liveness.seed(self.owns)
+        SHARD_REBALANCES.labels('ring').inc()
+        SHARD_REBALANCES.labels('devices_dropped').inc(len(lost))
+        logger.info("Shard %s moved to ring generation %d and dropped %d devices", self.name, generation,
+                    len(lost), extra={'event': 'sharding.rebalanced', 'shard': self.name})
+
+
+# The Shard this process serves, if it is a shard worker
+current = None
+
+
+class _ShardHandler(socketserver.BaseRequestHandler):
+    def setup(self):
+        self.server.connections.add(self.request)
+
+    def finish(self):
+        self.server.connections.discard(self.request)
+
+    def handle(self):
+        from django.db import close_old_connections
+
+        while True:
+            header = _recv_exactly(self.request, _REQUEST.size)
+            if header is None:
+                return
+            message = _recv_exactly(self.request, _REQUEST.unpack(header)[0])
+            if message is None:
+                return
+            close_old_connections()
+            try:
+                status, headers, body = self.server.shard.handle(message)
+            except Exception as e:
+                logger.exception("Shard request failed", extra={'event': 'sharding.request_failed'})
+                status, headers, body = 500, {}, json.dumps({'error': str(e)}).encode()
+            headers = json.dumps(headers).encode()
+            self.request.sendall(_REPLY.pack(len(body), status, len(headers)) + headers + body)
+
+
+class ShardServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """Answers a Shard's requests on a Unix socket, one thread per connection"""
+    daemon_threads = True
+
+    def __init__(self, path, shard):
+        self.shard = shard
+        self.connections = set()
+        super().__init__(path, _ShardHandler)
+
+    def server_close(self):
+        """Stop listening and hang up on connected routers, as an exiting process would"""
+        super().server_close()
+        for connection in list(self.connections):
+            try:
+                connection.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+
+def serve(name, directory):
+    """Run a shard worker: warm up, then answer requests on its socket until terminated"""
+    global current
+    from . import warmup
+
+    current = Shard(name, directory)
+    warmup.run()
+    path = socket_path(directory, name)
+    # Bind under a temporary name, so the socket appears only once it accepts connections
+    if os.path.exists(path + '.tmp'):
+        os.unlink(path + '.tmp')
+    server = ShardServer(path + '.tmp', current)
+    os.replace(path + '.tmp', path)
+    signal.signal(signal.SIGTERM, lambda signum, frame: threading.Thread(target=server.shutdown).start())
+    logger.info("Ingestion shard %s listening on %s", name, path,
+                extra={'event': 'sharding.listening', 'shard': name})
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        if os.path.exists(path):
+            os.unlink(path)
+        # Worker processes exit without running atexit hooks
+        from .views import firebase_repository
+        firebase_repository.health_data_buffer.flush()
+
+
+class Supervisor:
+    """Starts the shard processes, publishes the ring and restarts shards that exit"""
+
+    def __init__(self, directory, workers, startup_timeout=120.0):
+        self.directory = directory
+        self.names = [f'shard-{index}' for index in range(workers)]
+        self.startup_timeout = startup_timeout
+        self.generation = read_ring(directory)[0]
+        self.members = set()
+        self.processes = {}
+        self._stopping = False
+
+    def _spawn(self, name):
+        import multiprocessing
+
+        from django.db import connections
+
+        path = socket_path(self.directory, name)
+        if os.path.exists(path):
+            os.unlink(path)
+        # Children must not share the parent's database connections
+        connections.close_all()
+        process = multiprocessing.get_context('fork').Process(target=serve, args=(name, self.directory),
+                                                              name=name, daemon=True)
+        process.start()
+        self.processes[name] = (process, time.monotonic())
+
+    def _publish(self):
+        self.generation += 1
+        write_ring(self.directory, self.generation, self.members)
+        logger.info("Published ring generation %d with %d shards", self.generation, len(self.members),
+                    extra={'event': 'sharding.ring', 'shards': sorted(self.members)})
+
+    def start(self):
+        os.makedirs(self.directory, exist_ok=True)
+        self.members = set()
+        self._publish()
+        for name in self.names:
+            self._spawn(name)
+        self.poll(wait=True)
+
+    def poll(self, wait=False):
+        """Add shards that came up and replace the ones that exited; returns whether the ring changed"""
+        deadline = time.monotonic() + self.startup_timeout
+        changed = False
+        while True:
+            for name, (process, started) in list(self.processes.items()):
+                if not process.is_alive():
+                    logger.warning("Ingestion shard %s exited with code %s", name, process.exitcode,
+                                   extra={'event': 'sharding.shard_exited', 'shard': name})
+                    if name in self.members:
+                        self.members.discard(name)
+                        self._publish()
+                        changed = True
+                    if not self._stopping:
+                        self._spawn(name)
+                elif name not in self.members and os.path.exists(socket_path(self.directory, name)):
+                    self.members.add(name)
+                    self._publish()
+                    changed = True
+            if not wait or len(self.members) == len(self.names) or time.monotonic() > deadline:
+                return changed
+            time.sleep(0.05)
+
+    def run(self, interval=0.5):
+        """Supervise until interrupted"""
+        try:
+            while True:
+                self.poll()
+                time.sleep(interval)
+        finally:
+            self.stop()
+
+    def stop(self):
+        self._stopping = True
+        for process, _ in self.processes.values():
+            if process.is_alive():
+                process.terminate()
+        for process, _ in self.processes.values():
+            process.join(10)
+        self.members = set()
+        self._publish()
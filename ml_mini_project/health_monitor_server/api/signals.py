@@ -0,0 +1,59 @@
+"""
+Signal handlers for the API app.
+
+Connected in ``ApiConfig.ready()``.
+"""
+from django.conf import settings
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from . import cache, state_table
+from .models import Alert, Guardian, Patient, PatientStatus
+
+
+@receiver(post_save, sender=Patient)
+@receiver(post_delete, sender=Patient)
+def invalidate_patient_cache(sender, instance, **kwargs):
+    """Drop cached lookups for a patient when it changes"""
+    cache.invalidate_patient(instance)
+
+
+@receiver(post_save, sender=Patient)
+def create_patient_status(sender, instance, created, raw=False, **kwargs):
+    """Give every new patient a dashboard status row"""
+    if created and not raw:
+        PatientStatus.objects.get_or_create(patient=instance)
+
+
+@receiver(post_delete, sender=Patient)
+def clear_latest_state(sender, instance, **kwargs):
+    """Empty a deleted patient's row in the shared latest-state table"""
+    table = state_table.get_table()
+    if table is not None:
+        table.clear(instance.id)
+
+
+@receiver(post_save, sender=Alert)
+@receiver(post_delete, sender=Alert)
+def refresh_patient_alerts(sender, instance, raw=False, **kwargs):
+    """Recount a patient's open alerts when one of them changes"""
+    if not raw:
+        PatientStatus.objects.refresh_alerts([instance.patient_id])
+
+
+@receiver(post_save, sender=Guardian)
+@receiver(post_delete, sender=Guardian)
+def invalidate_guardian_cache(sender, instance, **kwargs):
+    """Drop cached guardian lists when a guardian changes"""
+    cache.invalidate_guardian(instance)
+
+
+@receiver(connection_created)
+def configure_sqlite_connection(sender, connection, **kwargs):
+    """Apply SQLITE_PRAGMAS to new SQLite connections"""
+    if connection.vendor != 'sqlite':
+        return
+    with connection.cursor() as cursor:
+        for pragma, value in getattr(settings, 'SQLITE_PRAGMAS', {}).items():
+            cursor.execute(f'PRAGMA {pragma} = {value}')
@@ -0,0 +1,275 @@
+"""
+Latest reading of every patient in a memory-mapped table shared by processes.
+
+With ``LATEST_STATE_PATH`` set (e.g. a file in /dev/shm), ingestion writes
+each patient's latest vitals, risk and last-seen time into a fixed-layout
+NumPy structured array mapped from that file, one 64-byte row per patient id
+(the slot). Every worker process maps the same file, so
+``GET /api/patients/{id}/latest/`` is answered from memory in any of them,
+without a query.
+
+Rows are versioned like a seqlock. A writer makes the row's sequence number
+odd, copies the data in and makes it even again. A reader copies the row
+between two reads of the sequence number and retries when they differ or
+are odd, so it never returns a half-written row and never blocks a writer.
+Writers to the same row take a byte-range lock on it, since two worker
+processes may store samples of one device at once (without sharding, see
+api.sharding); readers take no lock.
+
+This relies on aligned 8-byte stores being atomic and on stores becoming
+visible in program order, as on x86-64. Patients with ids beyond
+``LATEST_STATE_CAPACITY``, and rows that stay busy through every retry, are
+read from the database instead.
+"""
+import contextlib
+import datetime
+import fcntl
+import math
+import os
+import threading
+
+from django.conf import settings
+
+from .models import RISK_LEVELS, PatientStatus
+
+MAGIC = b'HMLATEST'
+LAYOUT_VERSION = 1
+
+# Row fields besides the sequence number, in order
+FIELDS = (
+    ('patient_id', '<i8'),
+    ('last_seen', '<f8'),
+    ('heart_rate', '<f4'),
+    ('spo2', '<f4'),
+    ('temperature', '<f4'),
+    ('systolic_bp', '<f4'),
+    ('diastolic_bp', '<f4'),
+    ('respiratory_rate', '<f4'),
+    ('risk_probability', '<f4'),
+    ('fall_probability', '<f4'),
+    ('risk_rank', '<i1'),
+)
+ROW_SIZE = 64   # one cache line, so rows written by different processes do not share one
+HEADER_SIZE = 64
+
+# Reads retried before a busy row is left to the database
+READ_RETRIES = 100
+
+
+def _dtypes():
+    import numpy as np
+
+    data = np.dtype({
+        'names': [name for name, _ in FIELDS],
+        'formats': [dtype for _, dtype in FIELDS],
+        'offsets': [0, 8, 16, 20, 24, 28, 32, 36, 40, 44, 48],
+        'itemsize': ROW_SIZE - 8,
+    })
+    row = np.dtype({'names': ['seq', 'data'], 'formats': ['<u8', data], 'offsets': [0, 8],
+                    'itemsize': ROW_SIZE})
+    return data, row
+
+
+def _header(capacity):
+    return MAGIC + LAYOUT_VERSION.to_bytes(4, 'little') + ROW_SIZE.to_bytes(4, 'little') + \
+        capacity.to_bytes(8, 'little')
+
+
+class LatestStateTable:
+    """Fixed-size table of patients' latest readings in a shared file"""
+
+    def __init__(self, path, capacity):
+        """
+        Args:
+            path: File to map, created if missing; every process must use the same capacity
+            capacity: Rows, i.e. the highest patient id kept + 1
+
+        Raises:
+            ValueError: if the file exists with another layout or capacity
+        """
+        import mmap
+
+        import numpy as np
+
+        self.path = path
+        self.capacity = capacity
+        self._data_dtype, row_dtype = _dtypes()
+        size = HEADER_SIZE + capacity * ROW_SIZE
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            fcntl.lockf(self._fd, fcntl.LOCK_EX, HEADER_SIZE, 0)
+            try:
+                header = os.pread(self._fd, len(_header(capacity)), 0)
+                if not header.strip(b'\0'):
+                    # A new (or truncated-to-zero) file; new pages of a file read as zeros, i.e. empty rows
+                    os.ftruncate(self._fd, size)
+                    os.pwrite(self._fd, _header(capacity), 0)
+                elif header != _header(capacity):
+                    raise ValueError(f"{path} holds a table with another layout or capacity")
+            finally:
+                fcntl.lockf(self._fd, fcntl.LOCK_UN, HEADER_SIZE, 0)
+            self._mmap = mmap.mmap(self._fd, size)
+        except BaseException:
+            os.close(self._fd)
+            raise
+        self.rows = np.frombuffer(self._mmap, dtype=row_dtype, count=capacity, offset=HEADER_SIZE)
+        self._seq = self.rows['seq']
+        self._data = self.rows['data']
+        self._lock = threading.Lock()
+
+    def close(self):
+        del self.rows, self._seq, self._data
+        self._mmap.close()
+        os.close(self._fd)
+
+    def write(self, patient_id, last_seen, values):
+        """
+        Store a patient's reading unless the row already holds a newer one
+
+        Args:
+            last_seen: Sample time in epoch seconds
+            values: Dict of vital sign, probability and risk_level values; None
+                stores a value as unknown, a missing key keeps the row's value
+
+        Returns:
+            Whether the reading was stored (False also for ids beyond the capacity)
+        """
+        if not 0 < patient_id < self.capacity:
+            return False
+        record = self._record(patient_id, last_seen, values)
+        with self._row_lock(patient_id):
+            current = self._data[patient_id]
+            if current['patient_id'] == patient_id:
+                if current['last_seen'] > last_seen:
+                    return False
+                for name in self._kept(values):
+                    record[name] = current[name]
+            self._store(patient_id, record)
+        return True
+
+    @contextlib.contextmanager
+    def _row_lock(self, patient_id):
+        # fcntl locks exclude other processes only, the thread lock other threads
+        offset = HEADER_SIZE + patient_id * ROW_SIZE
+        with self._lock:
+            fcntl.lockf(self._fd, fcntl.LOCK_EX, ROW_SIZE, offset)
+            try:
+                yield
+            finally:
+                fcntl.lockf(self._fd, fcntl.LOCK_UN, ROW_SIZE, offset)
+
+    def _store(self, patient_id, record):
+        seq = int(self._seq[patient_id])
+        self._seq[patient_id] = seq + 1 | 1   # odd: being written
+        self._data[patient_id] = record
+        self._seq[patient_id] = seq + 2 & ~1  # even again, and never the value a reader started with
+
+    def _record(self, patient_id, last_seen, values):
+        import numpy as np
+
+        record = np.zeros((), dtype=self._data_dtype)
+        for name, _ in FIELDS[2:-1]:
+            value = values.get(name)
+            record[name] = np.nan if value is None else value
+        risk_level = values.get('risk_level')
+        record['risk_rank'] = -1 if risk_level is None else RISK_LEVELS.index(risk_level)
+        record['patient_id'] = patient_id
+        record['last_seen'] = last_seen
+        return record
+
+    @staticmethod
+    def _kept(values):
+        for name, _ in FIELDS[2:-1]:
+            if name not in values:
+                yield name
+        if 'risk_level' not in values:
+            yield 'risk_rank'
+
+    def clear(self, patient_id):
+        """Empty a patient's row"""
+        import numpy as np
+
+        if 0 < patient_id < self.capacity:
+            with self._row_lock(patient_id):
+                self._store(patient_id, np.zeros((), dtype=self._data_dtype))
+
+    def read_record(self, patient_id):
+        """
+        Consistent copy of a patient's row as a NumPy record
+
+        Returns:
+            The record, or None if the row is empty, out of range, or was being
+            written on every try
+        """
+        if not 0 < patient_id < self.capacity:
+            return None
+        seq, data = self._seq, self._data
+        for _ in range(READ_RETRIES):
+            before = int(seq[patient_id])
+            if before & 1:
+                continue
+            record = data[patient_id].copy()
+            if seq[patient_id] == before:
+                return record if record['patient_id'] == patient_id else None
+        return None
+
+    def read(self, patient_id):
+        """A patient's latest reading as a dict, or None (see read_record())"""
+        record = self.read_record(patient_id)
+        if record is None:
+            return None
+        reading = {'patient': patient_id}
+        reading['last_seen'] = datetime.datetime.fromtimestamp(float(record['last_seen']), tz=datetime.timezone.utc)
+        for name, _ in FIELDS[2:-1]:
+            value = float(record[name])
+            # Stored as float32; give back the decimal value that was written, not 0.8999999761...
+            reading[name] = None if math.isnan(value) else float(f'{value:.7g}')
+        rank = int(record['risk_rank'])
+        reading['risk_level'] = RISK_LEVELS[rank] if rank >= 0 else None
+        return reading
+
+
+_table = None
+_table_lock = threading.Lock()
+
+
+def get_table():
+    """The process's mapping of LATEST_STATE_PATH, or None when the table is off"""
+    global _table
+    path = getattr(settings, 'LATEST_STATE_PATH', '')
+    if not path:
+        return None
+    if _table is None or _table.path != str(path):
+        with _table_lock:
+            if _table is None or _table.path != str(path):
+                _table = LatestStateTable(str(path), getattr(settings, 'LATEST_STATE_CAPACITY', 100000))
+    return _table
+
+
+def record_sample(patient_id, sample, vitals=None, fall=None):
+    """Write a stored sample to the table, like PatientStatus.objects.record_sample()"""
+    table = get_table()
+    if table is None:
+        return False
+    # Like the status row, keep the last scores when this sample has none
+    values = {name: sample.get(name) for name in PatientStatus.VITAL_FIELDS}
+    if vitals is not None:
+        values.update(risk_level=vitals['risk_level'], risk_probability=float(vitals['risk_probability']))
+    if fall is not None:
+        values['fall_probability'] = float(fall['fall_probability'])
+    return table.write(patient_id, sample['timestamp'].timestamp(), values)
+
+
+def latest(patient_id):
+    """A patient's latest reading from the table, or None to read it from the database"""
+    table = get_table()
+    return table.read(patient_id) if table is not None else None
+
+
+def reset():
+    """Unmap the table, so the next use maps LATEST_STATE_PATH again"""
+    global _table
+    with _table_lock:
+        if _table is not None:
+            _table.close()
+        _table = None
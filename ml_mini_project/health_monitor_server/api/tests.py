@@ -1,8 +1,269 @@
-from django.test import TestCase
+from django.test import TestCase, override_settings
 from django.urls import reverse
 from rest_framework import status
 from rest_framework.test import APITestCase
-from .models import Patient, Guardian, HealthData, Alert
+from .models import Patient, Guardian, HealthData, Alert, PatientStatus, SyncWatermark
+from . import (
+    archive, backfill, backtest, cache, liveness, metrics, model_export, model_registry, sharding, state_table,
+    throttling, training, views, warmup,
+)
+from .dedup import DUPLICATE, NEW, UNKNOWN, SeqWindow, seq_window
+from .features import (
+    CHANNELS, FEATURE_NAMES, FeatureStore, compute_features, feature_store, sample_row, sliding_windows,
+)
+from .firebase_service import FIREBASE_OPERATIONS, FirebaseService
+from .logging_utils import NonBlockingHandler, RateLimitFilter, StructuredFormatter
+from .ml_predictor import HealthPredictor
+from .renderers import FastJSONRenderer
+from .serializers import AlertSerializer, HealthDataSerializer, alert_rows, health_data_rows
+from .write_buffer import WriteBuffer
+from rest_framework.renderers import JSONRenderer
+from django.conf import settings
+from django.core.management import CommandError, call_command
+from django.db import DatabaseError
+from django.utils import timezone
+from google.api_core.exceptions import NotFound
+from unittest import mock
+import csv
+import datetime
+import gzip
+import io
+import itertools
+import json
+import logging
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import warnings
+import numpy as np
+from sklearn.ensemble import GradientBoostingClassifier
+from sklearn.impute import SimpleImputer
+from sklearn.linear_model import LogisticRegression
+from sklearn.pipeline import make_pipeline
+from sklearn.preprocessing import StandardScaler
+from sklearn.tree import DecisionTreeClassifier
+
+
+class FakeDocumentSnapshot:
+    """Minimal stand-in for a Firestore DocumentSnapshot"""
+    
+    def __init__(self, doc_id, data, field_paths=None):
+        self.id = doc_id
+        if data is not None and field_paths:
+            data = {key: value for key, value in data.items() if key in field_paths}
+        self._data = data
+        self.exists = data is not None
+    
+    def to_dict(self):
+        return dict(self._data) if self._data is not None else None
+
+
+class FakeDocument:
+    """Minimal stand-in for a Firestore DocumentReference"""
+    
+    def __init__(self, store, collection, doc_id):
+        self.store = store
+        self.collection = collection
+        self.id = doc_id
+    
+    def set(self, data, merge=False):
+        documents = self.store.data.setdefault(self.collection, {})
+        if merge:
+            self.store.writes.append(('merge', self.collection, self.id, dict(data)))
+            documents.setdefault(self.id, {}).update(data)
+        else:
+            self.store.writes.append(('set', self.collection, self.id, dict(data)))
+            documents[self.id] = dict(data)
+        self.store.notify(self.collection)
+    
+    def update(self, data):
+        if self.id not in self.store.data.get(self.collection, {}):
+            raise NotFound(f"No document to update: {self.collection}/{self.id}")
+        self.store.writes.append(('update', self.collection, self.id, dict(data)))
+        self.store.data[self.collection][self.id].update(data)
+        self.store.notify(self.collection)
+    
+    def delete(self):
+        self.store.writes.append(('delete', self.collection, self.id, {}))
+        self.store.data.get(self.collection, {}).pop(self.id, None)
+        self.store.notify(self.collection)
+    
+    def get(self, field_paths=None, timeout=None):
+        self.store.reads += 1
+        return FakeDocumentSnapshot(self.id, self.store.data.get(self.collection, {}).get(self.id), field_paths)
+
+
+class FakeWatch:
+    """Handle returned by FakeQuery.on_snapshot"""
+    
+    def __init__(self, store, collection, callback):
+        self.store = store
+        self.collection = collection
+        self.callback = callback
+    
+    def unsubscribe(self):
+        self.store.watches.remove(self)
+
+
+class FakeQuery:
+    """Minimal stand-in for a Firestore Query supporting the operations the API uses"""
+    
+    def __init__(self, store, name, filters=(), order=None, cursor=None, fields=None, count=None):
+        self.store = store
+        self.name = name
+        self.filters = filters
+        self.order = order
+        self.cursor = cursor
+        self.fields = fields
+        self.count = count
+    
+    def _copy(self, **changes):
+        state = dict(filters=self.filters, order=self.order, cursor=self.cursor,
+                     fields=self.fields, count=self.count)
+        state.update(changes)
+        return FakeQuery(self.store, self.name, **state)
+    
+    def where(self, filter):
+        return self._copy(filters=self.filters + ((filter.field_path, filter.op_string, filter.value),))
+    
+    def order_by(self, field, direction='ASCENDING'):
+        return self._copy(order=(field, direction == 'DESCENDING'))
+    
+    def start_after(self, fields):
+        return self._copy(cursor=fields)
+    
+    def select(self, fields):
+        return self._copy(fields=list(fields))
+    
+    def limit(self, count):
+        return self._copy(count=count)
+    
+    def _matches(self, data):
+        ops = {'==': lambda a, b: a == b, '<': lambda a, b: a < b, '<=': lambda a, b: a <= b,
+               '>': lambda a, b: a > b, '>=': lambda a, b: a >= b, 'in': lambda a, b: a in b}
+        return all(field in data and ops[op](data[field], value) for field, op, value in self.filters)
+    
+    def stream(self):
+        docs = [(doc_id, data) for doc_id, data in self.store.data.get(self.name, {}).items()
+                if self._matches(data)]
+        if self.order:
+            field, descending = self.order
+            docs = [doc for doc in docs if field in doc[1]]
+            docs.sort(key=lambda doc: doc[1][field], reverse=descending)
+            if self.cursor is not None:
+                value = self.cursor[field]
+                docs = [doc for doc in docs if (doc[1][field] < value if descending else doc[1][field] > value)]
+        if self.count is not None:
+            docs = docs[:self.count]
+        for doc_id, data in docs:
+            self.store.reads += 1
+            yield FakeDocumentSnapshot(doc_id, data, self.fields)
+    
+    def on_snapshot(self, callback):
+        watch = FakeWatch(self.store, self.name, callback)
+        self.store.watches.append(watch)
+        callback([], [], None)
+        return watch
+
+
+class FakeCollection(FakeQuery):
+    """Minimal stand-in for a Firestore CollectionReference"""
+    
+    def __init__(self, store, name):
+        super().__init__(store, name)
+    
+    def document(self, doc_id):
+        return FakeDocument(self.store, self.name, doc_id)
+
+
+class FakeWriteBatch:
+    """Minimal stand-in for a Firestore WriteBatch"""
+    
+    def __init__(self, store):
+        self.store = store
+        self.operations = []
+    
+    def set(self, reference, data, merge=False):
+        self.operations.append((reference, data, merge))
+    
+    def commit(self):
+        assert len(self.operations) <= 500, "Firestore batches are limited to 500 writes"
+        self.store.commits += 1
+        for reference, data, merge in self.operations:
+            reference.set(data, merge=merge)
+
+
+class FakeFirestore:
+    """In-process Firestore client that records every read and write"""
+    
+    def __init__(self):
+        self.data = {}
+        self.writes = []
+        self.reads = 0
+        self.commits = 0
+        self.batch_reads = 0
+        self.watches = []
+    
+    def collection(self, name):
+        return FakeCollection(self, name)
+    
+    def batch(self):
+        return FakeWriteBatch(self)
+    
+    def get_all(self, references):
+        self.batch_reads += 1
+        for reference in references:
+            yield reference.get()
+    
+    def notify(self, collection):
+        for watch in list(self.watches):
+            if watch.collection == collection:
+                watch.callback([], [], None)
+
+
+class CacheResetMixin:
+    """Start each test with empty lookup caches, feature and dedup windows (rollbacks do not fire signals)"""
+    
+    def setUp(self):
+        super().setUp()
+        cache.clear_all()
+        feature_store.reset()
+        seq_window.reset()
+        throttling.reset()
+        liveness.reset()
+        state_table.reset()
+
+
+class FakeFirebaseMixin:
+    """Point the API's Firebase services at an in-process fake Firestore"""
+    
+    def setUp(self):
+        super().setUp()
+        self.firestore = FakeFirestore()
+        services = [views.firebase_service, views.firebase_repository.firebase_service]
+        # Saved through the private attributes: reading the properties would initialize
+        # the real Firebase Admin SDK
+        self._saved_firebase_state = [(service, service._initialized, service._db) for service in services]
+        for service in services:
+            service.initialized = True
+            service.db = self.firestore
+        views.firebase_repository.cache.clear()
+        # Write buffered documents straight away, so tests see them without waiting
+        self._saved_buffer = views.firebase_repository.health_data_buffer
+        views.firebase_repository.health_data_buffer = WriteBuffer(
+            'health_data', views.firebase_repository._write_health_data, max_batch=1
+        )
+    
+    def tearDown(self):
+        views.firebase_repository.close()
+        views.firebase_repository.health_data_buffer = self._saved_buffer
+        for service, initialized, db in self._saved_firebase_state:
+            service._initialized = initialized
+            service._db = db
+        super().tearDown()
 
 
 class PatientModelTest(TestCase):
@@ -142,10 +403,11 @@ class AlertModelTest(TestCase):
         self.assertIsNotNone(self.alert.resolved_at)
 
 
-class APITests(APITestCase):
+class APITests(CacheResetMixin, FakeFirebaseMixin, APITestCase):
     """Test the API endpoints"""
     
     def setUp(self):
+        super().setUp()
         self.patient = Patient.objects.create(
             name="API Test Patient",
             age=70,
@@ -202,4 +464,2226 @@ class APITests(APITestCase):
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         
         # Verify data was saved
-        self.assertTrue(HealthData.objects.filter(patient=self.patient).exists())
\ No newline at end of file
+        self.assertTrue(HealthData.objects.filter(patient=self.patient).exists())
+
+
+class IngestMetricsTests(CacheResetMixin, FakeFirebaseMixin, APITestCase):
+    """Test per-stage latency instrumentation of health data ingestion"""
+    
+    def setUp(self):
+        super().setUp()
+        self.patient = Patient.objects.create(
+            name="Metrics Patient",
+            age=80,
+            gender="MALE",
+            user_id="metrics123"
+        )
+        self.payload = {
+            'user_id': self.patient.user_id,
+            'heart_rate': 150.0,
+            'spo2': 85.0,
+            'accelerometer_x': 0.1,
+            'accelerometer_y': 0.2,
+            'accelerometer_z': 9.8,
+            'gyroscope_x': 0.5,
+            'gyroscope_y': -0.2,
+            'gyroscope_z': 0.1
+        }
+    
+    def test_metrics_endpoint_exposes_stage_histograms(self):
+        """Test that each ingestion stage is exported as a histogram"""
+        response = self.client.post('/api/health-data/', self.payload, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        
+        response = self.client.get('/metrics')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        body = response.content.decode()
+        for stage in ['validate', 'patient_lookup', 'insert', 'firebase_save', 'predict', 'alert_create', 'notify']:
+            self.assertIn(f'health_ingest_stage_seconds_count{{stage="{stage}"}}', body)
+        self.assertIn('health_ingest_request_seconds_count', body)
+    
+    def test_errors_are_counted_by_stage(self):
+        """Test that a failing stage is recorded and still returns a 500"""
+        before = views.INGEST_ERRORS.value('insert')
+        with mock.patch.object(HealthData.objects, 'create', side_effect=DatabaseError("disk full")), \
+                self.assertLogs('api.views', level='ERROR'):
+            response = self.client.post('/api/health-data/', self.payload, format='json')
+        self.assertEqual(response.status_code, status.HTTP_500_INTERNAL_SERVER_ERROR)
+        self.assertEqual(views.INGEST_ERRORS.value('insert'), before + 1)
+    
+    @override_settings(SERVER_TIMING_ENABLED=True)
+    def test_server_timing_header(self):
+        """Test that stage durations are reported in a Server-Timing header"""
+        response = self.client.post('/api/health-data/', self.payload, format='json')
+        self.assertIn('insert;dur=', response['Server-Timing'])
+        self.assertIn('total;dur=', response['Server-Timing'])
+    
+    @override_settings(METRICS_ENABLED=False, SERVER_TIMING_ENABLED=False)
+    def test_disabled_metrics_use_null_timer(self):
+        """Test that disabling metrics hands out the no-op timer and hides /metrics"""
+        self.assertIs(metrics.stage_timer(views.INGEST_STAGE_SECONDS), metrics.NULL_TIMER)
+        response = self.client.post('/api/health-data/', self.payload, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotIn('Server-Timing', response)
+        self.assertEqual(self.client.get('/metrics').status_code, status.HTTP_404_NOT_FOUND)
+    
+    def test_histogram_rendering(self):
+        """Test the Prometheus text format for a histogram"""
+        histogram = metrics.Histogram('test_seconds', 'Test histogram', ['stage'],
+                                      buckets=(0.1, 1.0), registry=None)
+        histogram.labels('a').observe(0.05)
+        histogram.labels('a').observe(0.5)
+        histogram.labels('a').observe(5)
+        lines = histogram.render()
+        self.assertIn('test_seconds_bucket{stage="a",le="0.1"} 1', lines)
+        self.assertIn('test_seconds_bucket{stage="a",le="1.0"} 2', lines)
+        self.assertIn('test_seconds_bucket{stage="a",le="+Inf"} 3', lines)
+        self.assertIn('test_seconds_count{stage="a"} 3', lines)
+
+
+class FirebaseLoggingTests(FakeFirebaseMixin, TestCase):
+    """Test structured, rate-limited logging in the Firebase service"""
+    
+    def setUp(self):
+        super().setUp()
+        self.patient = Patient.objects.create(
+            name="Logging Patient",
+            age=70,
+            gender="FEMALE",
+            user_id="logging123"
+        )
+        self.health_data = HealthData.objects.create(
+            patient=self.patient,
+            heart_rate=72.0,
+            spo2=98.0,
+            accelerometer_x=0.1,
+            accelerometer_y=0.2,
+            accelerometer_z=9.8,
+            gyroscope_x=0.5,
+            gyroscope_y=-0.2,
+            gyroscope_z=0.1
+        )
+    
+    def _record(self, msg, event=None):
+        record = logging.LogRecord('api.test', logging.WARNING, __file__, 1, msg, (), None)
+        if event:
+            record.event = event
+        return record
+    
+    def test_successful_save_is_counted_not_logged(self):
+        """Test that a successful save increments a counter without an INFO line"""
+        before = FIREBASE_OPERATIONS.value('save_health_data', 'ok')
+        service = views.firebase_repository.firebase_service
+        with self.assertNoLogs('api.firebase_service', level='INFO'):
+            self.assertTrue(service.add_health_data_to_firebase(self.patient.id, self.health_data))
+        self.assertEqual(FIREBASE_OPERATIONS.value('save_health_data', 'ok'), before + 1)
+        self.assertEqual(self.firestore.data['health_data'][str(self.health_data.id)]['patient_id'],
+                         str(self.patient.id))
+    
+    def test_failed_save_is_logged_with_context(self):
+        """Test that failures are logged with the operation and document"""
+        service = views.firebase_repository.firebase_service
+        service.db = object()
+        with self.assertLogs('api.firebase_service', level='WARNING') as logs:
+            self.assertFalse(service.add_health_data_to_firebase(self.patient.id, self.health_data))
+        self.assertEqual(logs.records[0].operation, 'save_health_data')
+        self.assertEqual(logs.records[0].document_id, self.health_data.id)
+    
+    def test_rate_limit_filter_suppresses_per_event(self):
+        """Test that each message type gets its own budget and reports suppressions"""
+        rate_filter = RateLimitFilter(rate=2, per=3600)
+        results = [rate_filter.filter(self._record('save failed', 'firebase.failed')) for _ in range(5)]
+        self.assertEqual(results, [True, True, False, False, False])
+        self.assertTrue(rate_filter.filter(self._record('other', 'firebase.not_initialized')))
+        
+        # Refill the bucket and check the suppressed count is carried on the next record
+        rate_filter._buckets['firebase.failed'] = (2, 0)
+        record = self._record('save failed', 'firebase.failed')
+        self.assertTrue(rate_filter.filter(record))
+        self.assertEqual(record.suppressed, 3)
+    
+    def test_rate_limit_filter_sampling(self):
+        """Test that sampled events keep every Nth record"""
+        rate_filter = RateLimitFilter(rate=100, per=1, sample_every={'firebase.notification.sent': 3})
+        results = [rate_filter.filter(self._record('sent', 'firebase.notification.sent')) for _ in range(6)]
+        self.assertEqual(results, [True, False, False, True, False, False])
+    
+    def test_nonblocking_handler_writes_structured_lines(self):
+        """Test that queued records are written as JSON by the listener thread"""
+        stream = io.StringIO()
+        handler = NonBlockingHandler(stream=stream)
+        handler.setFormatter(StructuredFormatter())
+        test_logger = logging.getLogger('api.tests.nonblocking')
+        test_logger.propagate = False
+        test_logger.addHandler(handler)
+        try:
+            test_logger.warning("Saved %s", 'doc-1', extra={'event': 'test.saved', 'collection': 'alerts'})
+            handler.flush()
+        finally:
+            test_logger.removeHandler(handler)
+            handler.stop()
+        entry = json.loads(stream.getvalue().splitlines()[0])
+        self.assertEqual(entry['msg'], 'Saved doc-1')
+        self.assertEqual(entry['event'], 'test.saved')
+        self.assertEqual(entry['collection'], 'alerts')
+
+
+class PatientCacheTests(CacheResetMixin, FakeFirebaseMixin, APITestCase):
+    """Test the patient and guardian lookup caches"""
+    
+    def setUp(self):
+        super().setUp()
+        self.patient = Patient.objects.create(
+            name="Cache Patient",
+            age=75,
+            gender="FEMALE",
+            user_id="cache123"
+        )
+        self.guardian = Guardian.objects.create(
+            patient=self.patient,
+            name="Cache Guardian",
+            relationship="CHILD",
+            phone_number="555-0100",
+            notification_enabled=True
+        )
+        self.payload = {
+            'user_id': self.patient.user_id,
+            'heart_rate': 150.0,
+            'spo2': 85.0,
+            'accelerometer_x': 0.1,
+            'accelerometer_y': 0.2,
+            'accelerometer_z': 9.8,
+            'gyroscope_x': 0.5,
+            'gyroscope_y': -0.2,
+            'gyroscope_z': 0.1
+        }
+    
+    def test_repeated_ingestion_skips_lookup_queries(self):
+        """Test that the second sample for a device is served from the cache"""
+        hits = cache.CACHE_REQUESTS.value('patient_by_user_id', 'hit')
+        self.client.post('/api/health-data/', self.payload, format='json')
+        
+        # Health data insert, dashboard status update, alert insert and open alert recount only
+        with self.assertNumQueries(4):
+            response = self.client.post('/api/health-data/', self.payload, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(cache.CACHE_REQUESTS.value('patient_by_user_id', 'hit'), hits + 1)
+    
+    def test_patient_save_invalidates_user_id(self):
+        """Test that changing a patient's user_id drops the old cache entry"""
+        self.assertEqual(cache.get_patient_by_user_id('cache123'), self.patient)
+        self.patient.user_id = 'cache456'
+        self.patient.save()
+        with self.assertRaises(Patient.DoesNotExist):
+            cache.get_patient_by_user_id('cache123')
+        self.assertEqual(cache.get_patient_by_user_id('cache456').pk, self.patient.pk)
+    
+    def test_guardian_changes_invalidate_notifiable_list(self):
+        """Test that guardian saves and deletes refresh the notifiable list"""
+        self.assertEqual(cache.get_notifiable_guardians(self.patient), [self.guardian])
+        self.guardian.notification_enabled = False
+        self.guardian.save()
+        self.assertEqual(cache.get_notifiable_guardians(self.patient), [])
+        
+        other = Guardian.objects.create(
+            patient=self.patient,
+            name="Other Guardian",
+            relationship="SPOUSE",
+            phone_number="555-0101"
+        )
+        self.assertEqual(cache.get_notifiable_guardians(self.patient), [other])
+        other.delete()
+        self.assertEqual(cache.get_notifiable_guardians(self.patient), [])
+    
+    def test_entries_expire_after_ttl(self):
+        """Test that entries are reloaded once their TTL has passed"""
+        ttl_cache = cache.TTLCache('test_ttl', ttl=0)
+        loads = []
+        ttl_cache.get('key', lambda: loads.append(1))
+        ttl_cache.get('key', lambda: loads.append(1))
+        self.assertEqual(len(loads), 2)
+    
+    def test_maxsize_evicts_oldest(self):
+        """Test that the cache stays within its size bound"""
+        ttl_cache = cache.TTLCache('test_maxsize', ttl=60, maxsize=2)
+        for key in ['a', 'b', 'c']:
+            ttl_cache.set(key, key)
+        self.assertEqual(len(ttl_cache), 2)
+        self.assertIsNone(ttl_cache.peek('a'))
+        self.assertEqual(ttl_cache.peek('c'), 'c')
+
+
+class DatabaseSettingsTests(TestCase):
+    """Test database connection configuration"""
+    
+    def test_sqlite_pragmas_applied(self):
+        """Test that new SQLite connections get the configured pragmas"""
+        from django.db import connection
+        if connection.vendor != 'sqlite':
+            self.skipTest("SQLite only")
+        with connection.cursor() as cursor:
+            cursor.execute('PRAGMA synchronous')
+            self.assertEqual(cursor.fetchone()[0], 1)  # NORMAL
+            cursor.execute('PRAGMA busy_timeout')
+            self.assertEqual(cursor.fetchone()[0], 5000)
+
+
+class FeatureExtractionTests(CacheResetMixin, FakeFirebaseMixin, APITestCase):
+    """Test windowed feature extraction"""
+    
+    def setUp(self):
+        super().setUp()
+        self.patient = Patient.objects.create(
+            name="Feature Patient",
+            age=68,
+            gender="MALE",
+            user_id="features123"
+        )
+    
+    def _sample(self, t, heart_rate=60.0, spo2=98.0, **extra):
+        sample = {
+            'timestamp': float(t), 'heart_rate': heart_rate, 'spo2': spo2,
+            'accelerometer_x': 0.0, 'accelerometer_y': 0.0, 'accelerometer_z': 9.8,
+            'gyroscope_x': 0.0, 'gyroscope_y': 0.0, 'gyroscope_z': 0.0,
+        }
+        sample.update(extra)
+        return sample
+    
+    def test_window_features(self):
+        """Test the derived features over a window"""
+        store = FeatureStore(window_size=4, loader=None)
+        store.update(1, self._sample(0, heart_rate=60, spo2=98, systolic_bp=120, diastolic_bp=80))
+        store.update(1, self._sample(60, heart_rate=75, spo2=97))
+        vector = store.update(1, self._sample(120, heart_rate=60, spo2=96, temperature=37.0))
+        features = dict(zip(FEATURE_NAMES, vector))
+        
+        self.assertEqual(features['heart_rate'], 60)
+        self.assertEqual(features['hr_mean'], 65)
+        # Beat intervals 1000 -> 800 -> 1000 ms
+        self.assertAlmostEqual(features['hrv_rmssd'], 200.0)
+        self.assertAlmostEqual(features['spo2_slope'], -1.0)
+        self.assertEqual(features['pulse_pressure'], 40)
+        self.assertEqual(features['temperature'], 37.0)
+        self.assertTrue(np.isnan(features['respiratory_rate']))
+        self.assertAlmostEqual(features['activity_level'], 0.0)
+    
+    def test_window_is_bounded(self):
+        """Test that only the latest window_size samples are used"""
+        store = FeatureStore(window_size=2, loader=None)
+        for t, heart_rate in enumerate([200, 60, 80]):
+            vector = store.update(1, self._sample(t, heart_rate=heart_rate))
+        self.assertEqual(dict(zip(FEATURE_NAMES, vector))['hr_mean'], 70)
+    
+    def test_windows_are_loaded_outside_the_lock(self):
+        """Test that seeding a window does not hold the store's lock, and a concurrent load is not used twice"""
+        loads = []
+        def loader(patient_id, limit):
+            self.assertFalse(store._lock.locked())
+            loads.append(patient_id)
+            if loads == [1, 2]:
+                # Another thread seeds the same window meanwhile
+                store.update(2, self._sample(0, heart_rate=90))
+            return [sample_row(self._sample(0, heart_rate=60))]
+        
+        store = FeatureStore(window_size=3, loader=loader)
+        vectors = store.update_many([1, 2], [self._sample(60, heart_rate=80), self._sample(60, heart_rate=70)])
+        features = [dict(zip(FEATURE_NAMES, vector)) for vector in vectors]
+        self.assertEqual(features[0]['hr_mean'], 70)
+        # The window loaded by the other thread is kept, with both samples
+        self.assertEqual(features[1]['hr_mean'], np.mean([60, 90, 70]))
+        self.assertEqual(loads, [1, 2, 2])
+    
+    def test_batch_matches_incremental(self):
+        """Test that sliding windows over a batch give the same features as incremental updates"""
+        rng = np.random.default_rng(0)
+        store = FeatureStore(window_size=5, loader=None)
+        samples = [self._sample(t, heart_rate=rng.uniform(50, 120), spo2=rng.uniform(88, 100)) for t in range(12)]
+        incremental = np.array([store.update(1, sample) for sample in samples])
+        
+        rows = np.array([[sample.get(name, np.nan) for name in CHANNELS] for sample in samples], dtype=float)
+        batch = compute_features(sliding_windows(rows, 5))
+        np.testing.assert_allclose(batch, incremental)
+    
+    def test_ingestion_stores_optional_readings(self):
+        """Test that optional sensor readings are stored and windows are seeded from the database"""
+        payload = {
+            'user_id': self.patient.user_id,
+            'heart_rate': 72.0, 'spo2': 98.0,
+            'accelerometer_x': 0.1, 'accelerometer_y': 0.2, 'accelerometer_z': 9.8,
+            'gyroscope_x': 0.5, 'gyroscope_y': -0.2, 'gyroscope_z': 0.1,
+            'temperature': 36.8, 'systolic_bp': 130, 'diastolic_bp': 85,
+        }
+        response = self.client.post('/api/health-data/', payload, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        health_data = HealthData.objects.get(id=response.data['health_data_id'])
+        self.assertEqual(health_data.temperature, 36.8)
+        self.assertEqual(health_data.systolic_bp, 130)
+        self.assertIsNone(health_data.respiratory_rate)
+        
+        # A fresh process seeds the window from stored samples
+        feature_store.reset()
+        vector = feature_store.update(self.patient.id, dict(payload, timestamp=health_data.timestamp, systolic_bp=None))
+        self.assertEqual(dict(zip(FEATURE_NAMES, vector))['pulse_pressure'], 45)
+    
+    def test_feature_models_receive_feature_vector(self):
+        """Test that models declaring feature_names are given the feature vector"""
+        class FeatureModel:
+            feature_names = FEATURE_NAMES
+            
+            def predict_proba(self, X):
+                self.seen = X
+                return np.array([[1.0, 0.0]])
+        
+        predictor = HealthPredictor()
+        predictor.vitals_model = FeatureModel()
+        vector = np.arange(len(FEATURE_NAMES), dtype=float)
+        predictor.predict_vitals_risk(72, 98, features=vector)
+        self.assertEqual(predictor.vitals_model.seen.shape, (1, len(FEATURE_NAMES)))
+
+
+class FirebaseRepositoryReadTests(FakeFirebaseMixin, TestCase):
+    """Test the Firestore read path against an in-process fake"""
+    
+    def setUp(self):
+        super().setUp()
+        self.repository = views.firebase_repository
+        for i in range(1, 6):
+            self.firestore.data.setdefault('health_data', {})[str(i)] = {
+                'id': i, 'patient_id': '1', 'heart_rate': 70 + i, 'spo2': 97.0
+            }
+            self.firestore.data.setdefault('patients', {})[str(i)] = {'id': i, 'name': f"Patient {i}"}
+        self.firestore.data['health_data']['6'] = {'id': 6, 'patient_id': '2', 'heart_rate': 90, 'spo2': 95.0}
+        self.firestore.data['alerts'] = {
+            '1': {'id': 1, 'patient_id': '1', 'type': 'FALL', 'status': 'NEW'},
+            '2': {'id': 2, 'patient_id': '1', 'type': 'VITALS', 'status': 'NEW'},
+        }
+        self.firestore.data['guardians'] = {
+            '1': {'id': 1, 'patient_id': '1', 'name': "Guardian A"},
+            '2': {'id': 2, 'patient_id': '2', 'name': "Guardian B"},
+        }
+    
+    def test_health_data_paging(self):
+        """Test that health data is paged newest first with a cursor"""
+        page, cursor = self.repository.get_patient_health_data(1, limit=2)
+        self.assertEqual([doc['id'] for doc in page], ['5', '4'])
+        page, cursor = self.repository.get_patient_health_data(1, limit=2, cursor=cursor)
+        self.assertEqual([doc['id'] for doc in page], ['3', '2'])
+        page, cursor = self.repository.get_patient_health_data(1, limit=2, cursor=cursor)
+        self.assertEqual([doc['id'] for doc in page], ['1'])
+        self.assertIsNone(cursor)
+    
+    def test_field_projection(self):
+        """Test that only the requested fields are returned"""
+        page, _ = self.repository.get_patient_health_data(1, limit=1, fields=['heart_rate'])
+        self.assertEqual(set(page[0]), {'id', 'heart_rate'})
+        guardian = self.repository.get_guardian(1, fields=['name'])
+        self.assertEqual(guardian, {'id': '1', 'name': "Guardian A"})
+    
+    def test_reads_are_cached_until_written(self):
+        """Test that repeated reads are served locally until a write invalidates them"""
+        self.assertEqual(len(self.repository.get_patient_alerts(1)[0]), 2)
+        reads = self.firestore.reads
+        self.assertEqual(len(self.repository.get_patient_alerts(1)[0]), 2)
+        self.assertEqual(self.firestore.reads, reads)
+        
+        self.repository.update_alert_status(2, 'ACKNOWLEDGED', patient_id=1)
+        self.assertEqual(self.firestore.writes[-1], ('update', 'alerts', '2', {'status': 'ACKNOWLEDGED'}))
+        alerts, _ = self.repository.get_patient_alerts(1)
+        self.assertGreater(self.firestore.reads, reads)
+        self.assertEqual(alerts[0]['status'], 'ACKNOWLEDGED')
+        self.assertEqual(self.repository.get_alert(2)['status'], 'ACKNOWLEDGED')
+    
+    def test_invalidated_scopes_are_forgotten(self):
+        """Test that generations are dropped once the reads they hid have expired"""
+        now = time.monotonic()
+        with mock.patch('api.firebase_repository.time.monotonic', return_value=now):
+            for alert_id in range(1000):
+                self.repository.invalidate('alerts', 'doc', alert_id)
+        self.assertGreaterEqual(len(self.repository._generations), 1000)
+        
+        self.repository.get_patient_alerts(1)
+        reads = self.firestore.reads
+        with mock.patch('api.firebase_repository.time.monotonic', return_value=now + self.repository.cache.ttl + 1):
+            self.repository.invalidate('alerts', 1)
+        self.assertEqual(list(self.repository._generations), [('alerts', '1')])
+        self.repository.get_patient_alerts(1)
+        self.assertGreater(self.firestore.reads, reads)
+    
+    def test_patient_scoped_queries(self):
+        """Test guardian and single-document lookups"""
+        self.assertEqual([g['name'] for g in self.repository.get_patient_guardians(2)], ["Guardian B"])
+        self.assertIsNone(self.repository.get_alert(99))
+    
+    @override_settings(FIRESTORE_CACHE_LISTENERS=True)
+    def test_snapshot_listener_invalidates_cache(self):
+        """Test that changes made outside this process invalidate cached queries"""
+        self.repository.get_patient_alerts(1)
+        self.firestore.collection('alerts').document('3').set(
+            {'id': 3, 'patient_id': '1', 'type': 'FALL', 'status': 'NEW'}
+        )
+        alerts, _ = self.repository.get_patient_alerts(1)
+        self.assertEqual([alert['id'] for alert in alerts], ['3', '2', '1'])
+    
+    def test_get_all_patients_reads_in_pages(self):
+        """Test that all patients are returned when reading page by page"""
+        patients = self.repository.firebase_service.get_all_patients(page_size=2)
+        self.assertEqual([p['name'] for p in patients], [f"Patient {i}" for i in range(1, 6)])
+
+
+class PartialFirestoreUpdateTests(CacheResetMixin, FakeFirebaseMixin, APITestCase):
+    """Test that Firestore receives only changed fields"""
+    
+    def setUp(self):
+        super().setUp()
+        self.patient = Patient.objects.create(
+            name="Partial Patient",
+            age=77,
+            gender="FEMALE",
+            user_id="partial123"
+        )
+        self.alert = Alert.objects.create(
+            patient=self.patient,
+            type="FALL",
+            message="Fall detected with 75% confidence",
+            status="NEW"
+        )
+        views.firebase_repository.save_patient(self.patient)
+        views.firebase_repository.save_alert(self.alert)
+        self.firestore.writes.clear()
+    
+    def _fields_written(self):
+        return [(op, collection, sorted(data)) for op, collection, _, data in self.firestore.writes]
+    
+    def test_new_instances_are_written_in_full(self):
+        """Test that a never-synced instance is written with set()"""
+        alert = Alert.objects.create(patient=self.patient, type="VITALS", message="High HR")
+        views.firebase_repository.save_alert(alert)
+        op, collection, doc_id, data = self.firestore.writes[-1]
+        self.assertEqual((op, collection, doc_id), ('set', 'alerts', str(alert.id)))
+        self.assertEqual(data['patient_id'], str(self.patient.id))
+        self.assertIsNone(data['health_data_id'])
+    
+    def test_acknowledge_writes_only_status(self):
+        """Test that acknowledging an alert sends a single field"""
+        response = self.client.post(f'/api/alerts/{self.alert.id}/acknowledge/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(self._fields_written(), [('update', 'alerts', ['status'])])
+        self.assertEqual(self.firestore.data['alerts'][str(self.alert.id)]['status'], 'ACKNOWLEDGED')
+    
+    def test_unchanged_save_skips_write(self):
+        """Test that re-acknowledging an acknowledged alert writes nothing"""
+        self.client.post(f'/api/alerts/{self.alert.id}/acknowledge/')
+        self.firestore.writes.clear()
+        self.client.post(f'/api/alerts/{self.alert.id}/acknowledge/')
+        self.assertEqual(self.firestore.writes, [])
+    
+    def test_patient_update_writes_changed_fields(self):
+        """Test that a PATCH mirrors only the patched fields"""
+        url = reverse('patient-detail', kwargs={'pk': self.patient.pk})
+        self.client.patch(url, {'name': "Renamed Patient", 'age': 78}, format='json')
+        self.assertEqual(self._fields_written(), [('update', 'patients', ['age', 'name'])])
+        
+        self.firestore.writes.clear()
+        self.client.patch(url, {'name': "Renamed Patient"}, format='json')
+        self.assertEqual(self.firestore.writes, [])
+    
+    def test_missing_document_falls_back_to_full_write(self):
+        """Test that an update to a document missing from Firestore writes it in full"""
+        del self.firestore.data['alerts'][str(self.alert.id)]
+        alert = Alert.objects.get(id=self.alert.id)
+        alert.status = 'RESOLVED'
+        alert.save()
+        self.assertTrue(views.firebase_repository.save_alert(alert))
+        self.assertEqual(self.firestore.writes[-1][0], 'set')
+        self.assertEqual(self.firestore.data['alerts'][str(alert.id)]['type'], 'FALL')
+
+
+class BulkAlertStatusTests(CacheResetMixin, FakeFirebaseMixin, APITestCase):
+    """Test bulk alert triage and its Firestore mirroring"""
+    
+    def setUp(self):
+        super().setUp()
+        self.patient = Patient.objects.create(
+            name="Bulk Patient",
+            age=81,
+            gender="MALE",
+            user_id="bulk123"
+        )
+        self.other = Patient.objects.create(
+            name="Other Patient",
+            age=64,
+            gender="FEMALE",
+            user_id="bulk456"
+        )
+        self.alerts = [
+            Alert.objects.create(patient=self.patient, type="VITALS", message=f"Alert {i}")
+            for i in range(5)
+        ]
+        self.other_alert = Alert.objects.create(patient=self.other, type="FALL", message="Fall")
+        self.url = '/api/alerts/bulk-status/'
+    
+    def test_bulk_status_by_ids(self):
+        """Test that alerts selected by id are updated in one statement and one batch"""
+        ids = [alert.id for alert in self.alerts[:3]]
+        # Including one recount of the patients' open alerts
+        with self.assertNumQueries(5):
+            response = self.client.post(self.url, {'status': 'ACKNOWLEDGED', 'ids': ids}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['updated'], 3)
+        self.assertEqual(
+            set(Alert.objects.filter(status='ACKNOWLEDGED').values_list('id', flat=True)), set(ids)
+        )
+        self.assertEqual(self.firestore.commits, 1)
+        self.assertEqual(
+            sorted(doc_id for _, _, doc_id, _ in self.firestore.writes), sorted(str(i) for i in ids)
+        )
+        self.assertTrue(all(data == {'status': 'ACKNOWLEDGED'} for _, _, _, data in self.firestore.writes))
+    
+    def test_bulk_resolve_by_filters(self):
+        """Test that filters select alerts and resolving stamps resolved_at"""
+        response = self.client.post(self.url, {
+            'status': 'RESOLVED',
+            'filters': {'patient': self.patient.id, 'type': 'VITALS', 'status': 'NEW'},
+        }, format='json')
+        self.assertEqual(response.data['updated'], 5)
+        self.assertFalse(Alert.objects.filter(patient=self.patient, resolved_at__isnull=True).exists())
+        self.assertEqual(Alert.objects.get(id=self.other_alert.id).status, 'NEW')
+        document = self.firestore.data['alerts'][str(self.alerts[0].id)]
+        self.assertEqual(document['status'], 'RESOLVED')
+        self.assertIn('resolved_at', document)
+    
+    def test_alerts_already_in_status_are_skipped(self):
+        """Test that a repeated bulk change writes nothing"""
+        payload = {'status': 'FALSE_ALARM', 'ids': [self.other_alert.id]}
+        self.client.post(self.url, payload, format='json')
+        self.firestore.writes.clear()
+        response = self.client.post(self.url, payload, format='json')
+        self.assertEqual(response.data['updated'], 0)
+        self.assertEqual(self.firestore.writes, [])
+    
+    def test_selection_is_required(self):
+        """Test that a request must select alerts with ids or non-empty filters"""
+        for payload in ({'status': 'RESOLVED'}, {'status': 'RESOLVED', 'filters': {}},
+                        {'status': 'RESOLVED', 'ids': [1], 'filters': {'type': 'FALL'}},
+                        {'status': 'DONE', 'ids': [1]}):
+            response = self.client.post(self.url, payload, format='json')
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(Alert.objects.exclude(status='NEW').count(), 0)
+    
+    def test_large_selection_is_split_into_batches(self):
+        """Test that Firestore writes are committed at most 500 per batch"""
+        Alert.objects.bulk_create(
+            Alert(patient=self.other, type="ACTIVITY", message=f"Bulk {i}") for i in range(1200)
+        )
+        response = self.client.post(self.url, {
+            'status': 'ACKNOWLEDGED', 'filters': {'type': 'ACTIVITY'},
+        }, format='json')
+        self.assertEqual(response.data['updated'], 1200)
+        self.assertEqual(self.firestore.commits, 3)
+        self.assertEqual(len(self.firestore.writes), 1200)
+    
+    def test_bulk_change_invalidates_cached_reads(self):
+        """Test that cached alert reads are dropped after a bulk change"""
+        views.firebase_repository.save_alert(self.other_alert)
+        self.assertEqual(views.firebase_repository.get_alert(self.other_alert.id)['status'], 'NEW')
+        self.client.post(self.url, {'status': 'ACKNOWLEDGED', 'ids': [self.other_alert.id]}, format='json')
+        self.assertEqual(views.firebase_repository.get_alert(self.other_alert.id)['status'], 'ACKNOWLEDGED')
+    
+    def test_admin_actions_use_bulk_path(self):
+        """Test that the admin actions update the database and Firestore"""
+        from django.contrib.admin.sites import site
+        from .admin import AlertAdmin
+        admin = AlertAdmin(Alert, site)
+        with mock.patch.object(admin, 'message_user') as message_user:
+            admin.mark_as_resolved(None, Alert.objects.filter(patient=self.patient))
+        message_user.assert_called_once_with(None, "5 alert(s) marked as resolved")
+        self.assertEqual(Alert.objects.filter(status='RESOLVED').count(), 5)
+        self.assertEqual(self.firestore.commits, 1)
+
+
+class ReconcileFirestoreTests(CacheResetMixin, FakeFirebaseMixin, TestCase):
+    """Test the reconcile_firestore management command"""
+    
+    def setUp(self):
+        super().setUp()
+        self.patient = Patient.objects.create(
+            name="Sync Patient",
+            age=70,
+            gender="FEMALE",
+            user_id="sync123"
+        )
+        self.alerts = [
+            Alert.objects.create(patient=self.patient, type="VITALS", message=f"Alert {i}")
+            for i in range(5)
+        ]
+        self.health_data = HealthData.objects.create(
+            patient=self.patient, heart_rate=72.0, spo2=98.0,
+            accelerometer_x=0.1, accelerometer_y=0.2, accelerometer_z=9.8,
+            gyroscope_x=0.5, gyroscope_y=-0.2, gyroscope_z=0.1
+        )
+        # Only the patient and two alerts made it to Firestore, one of them stale
+        views.firebase_repository.save_patient(self.patient)
+        views.firebase_repository.save_alert(self.alerts[0])
+        views.firebase_repository.save_alert(self.alerts[1])
+        self.firestore.data['alerts'][str(self.alerts[1].id)]['status'] = 'RESOLVED'
+        self.firestore.writes.clear()
+    
+    def reconcile(self, *args, **options):
+        out = io.StringIO()
+        call_command('reconcile_firestore', *args, settle=0, stdout=out, **options)
+        return out.getvalue()
+    
+    def test_missing_and_stale_documents_are_repaired(self):
+        """Test that only diverged documents are rewritten, in batches"""
+        output = self.reconcile(chunk_size=2)
+        self.assertIn("alerts: 5 checked, 4 repaired", output)
+        self.assertIn("health_data: 1 checked, 1 repaired", output)
+        self.assertIn("patients: 1 checked, 0 repaired", output)
+        alert_writes = [doc_id for _, collection, doc_id, _ in self.firestore.writes if collection == 'alerts']
+        self.assertNotIn(str(self.alerts[0].id), alert_writes)
+        self.assertEqual(self.firestore.data['alerts'][str(self.alerts[1].id)]['status'], 'NEW')
+        self.assertEqual(self.firestore.data['health_data'][str(self.health_data.id)]['spo2'], 98.0)
+        # 3 alert chunks, 1 chunk each for health data and patients (no guardians);
+        # every chunk but the patients one has something to repair
+        self.assertEqual(self.firestore.batch_reads, 5)
+        self.assertEqual(self.firestore.commits, 4)
+    
+    def test_watermark_makes_runs_incremental(self):
+        """Test that a second run only checks rows changed since the first"""
+        self.reconcile()
+        watermark = SyncWatermark.objects.get(collection='alerts')
+        self.assertEqual((watermark.checked, watermark.repaired), (5, 4))
+        self.assertEqual(watermark.last_id, self.alerts[-1].id)
+        
+        output = self.reconcile()
+        self.assertIn("alerts: 0 checked, 0 repaired", output)
+        
+        Alert.objects.filter(id=self.alerts[2].id).set_status('ACKNOWLEDGED')
+        self.firestore.writes.clear()
+        output = self.reconcile('--collection', 'alerts')
+        self.assertIn("alerts: 1 checked, 1 repaired", output)
+        self.assertEqual(self.firestore.data['alerts'][str(self.alerts[2].id)]['status'], 'ACKNOWLEDGED')
+    
+    def test_dry_run_reports_without_writing(self):
+        """Test that a dry run writes nothing and leaves the watermark alone"""
+        output = self.reconcile('--dry-run', '--collection', 'alerts')
+        self.assertIn("alerts: 5 checked, 4 differ", output)
+        self.assertEqual(self.firestore.writes, [])
+        self.assertIsNone(SyncWatermark.objects.get(collection='alerts').updated_at)
+    
+    def test_failed_write_keeps_watermark(self):
+        """Test that a failed batch stops the run before the watermark moves past it"""
+        with mock.patch.object(FakeWriteBatch, 'commit', side_effect=Exception("unavailable")):
+            with self.assertRaises(CommandError), self.assertLogs('api.firebase_service', 'WARNING'):
+                self.reconcile('--collection', 'alerts')
+        self.assertIsNone(SyncWatermark.objects.get(collection='alerts').updated_at)
+
+
+class FastRenderingTests(CacheResetMixin, FakeFirebaseMixin, APITestCase):
+    """Test that values()-based rendering matches the DRF serializers"""
+    
+    def setUp(self):
+        super().setUp()
+        self.patient = Patient.objects.create(
+            name="Render Patient \u2028 \u00e9",
+            age=68,
+            gender="MALE",
+            user_id="render123"
+        )
+        for i in range(30):
+            health_data = HealthData.objects.create(
+                patient=self.patient, heart_rate=60.5 + i, spo2=97.0,
+                accelerometer_x=0.1, accelerometer_y=0.2, accelerometer_z=9.8,
+                gyroscope_x=0.5, gyroscope_y=-0.2, gyroscope_z=0.1,
+                temperature=36.6 if i % 2 else None, systolic_bp=120 if i % 3 else None
+            )
+            Alert.objects.create(patient=self.patient, type="VITALS", message=f"Alert {i}",
+                                 health_data=health_data if i % 2 else None)
+        Alert.objects.filter(id__in=Alert.objects.values('id')[:5]).set_status('RESOLVED')
+    
+    def assertRendersLikeSerializer(self, rows, serializer_class, queryset):
+        expected = JSONRenderer().render(serializer_class(queryset, many=True).data)
+        self.assertEqual(FastJSONRenderer().render(rows.rows(queryset)), expected)
+        with mock.patch('api.renderers.orjson', None), mock.patch('api.renderers._warned', True):
+            self.assertEqual(FastJSONRenderer().render(rows.rows(queryset)), expected)
+    
+    def test_missing_orjson_is_logged_once(self):
+        """Test that falling back to the standard library encoder is logged on the first response only"""
+        with mock.patch('api.renderers.orjson', None), mock.patch('api.renderers._warned', False):
+            with self.assertLogs('api.renderers', 'WARNING') as logs:
+                FastJSONRenderer().render({'a': 1})
+                FastJSONRenderer().render({'a': 2})
+        self.assertEqual(len(logs.records), 1)
+    
+    def test_rows_match_serializer_output(self):
+        """Test byte-identical output for health data and alerts"""
+        self.assertRendersLikeSerializer(health_data_rows, HealthDataSerializer, HealthData.objects.all())
+        self.assertRendersLikeSerializer(alert_rows, AlertSerializer, Alert.objects.all())
+    
+    def test_rows_follow_current_time_zone(self):
+        """Test that datetimes are rendered in the active time zone like DRF does"""
+        with timezone.override('Asia/Kolkata'):
+            self.assertRendersLikeSerializer(alert_rows, AlertSerializer, Alert.objects.all())
+    
+    def test_patient_listings_use_constant_queries(self):
+        """Test that listing a patient's data no longer queries once per row"""
+        # Patient, ETag aggregate, rows
+        with self.assertNumQueries(3):
+            response = self.client.get(f'/api/patients/{self.patient.id}/health_data/')
+        self.assertEqual(len(response.json()), 30)
+        with self.assertNumQueries(3):
+            response = self.client.get(f'/api/patients/{self.patient.id}/alerts/')
+        self.assertEqual(response.json()[0]['patient_name'], self.patient.name)
+    
+    def test_paginated_alert_list(self):
+        """Test that the alert list keeps DRF pagination"""
+        response = self.client.get('/api/alerts/?page=2')
+        body = response.json()
+        self.assertEqual(body['count'], 30)
+        self.assertEqual(len(body['results']), 10)
+        expected = AlertSerializer(Alert.objects.order_by('-timestamp')[20:], many=True).data
+        self.assertEqual(body['results'], json.loads(JSONRenderer().render(expected)))
+    
+    def test_indented_output_falls_back(self):
+        """Test that an indent request is honoured"""
+        rendered = FastJSONRenderer().render({'a': 1}, 'application/json; indent=2')
+        self.assertEqual(rendered, b'{\n  "a": 1\n}')
+
+
+class ConditionalGetTests(CacheResetMixin, FakeFirebaseMixin, APITestCase):
+    """Test ETag / Last-Modified handling on polled endpoints"""
+    
+    def setUp(self):
+        super().setUp()
+        self.patient = Patient.objects.create(
+            name="Polled Patient",
+            age=74,
+            gender="FEMALE",
+            user_id="poll123"
+        )
+        for i in range(50):
+            Alert.objects.create(patient=self.patient, type="VITALS", message=f"Alert {i}")
+        self.url = f'/api/patients/{self.patient.id}/alerts/'
+    
+    def test_repeated_poll_returns_304_without_rows(self):
+        """Test that an unchanged resource costs two small queries and no body"""
+        first = self.client.get(self.url)
+        self.assertEqual(first.status_code, status.HTTP_200_OK)
+        self.assertGreater(len(first.content), 5000)
+        # Deletes leave no date behind, so lists are validated by ETag only
+        self.assertNotIn('Last-Modified', first.headers)
+        
+        # Patient lookup and the ETag aggregate; the alert rows are never read
+        with self.assertNumQueries(2):
+            second = self.client.get(self.url, HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(second.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(len(second.content), 0)
+        self.assertEqual(second['ETag'], first['ETag'])
+    
+    def test_last_modified_only_for_settled_instances(self):
+        """Test that Last-Modified is sent for single objects unless they changed this second"""
+        url = f'/api/patients/{self.patient.id}/'
+        Patient.objects.filter(id=self.patient.id).update(updated_at=timezone.now() - datetime.timedelta(seconds=5))
+        first = self.client.get(url)
+        self.assertIn('Last-Modified', first.headers)
+        self.assertEqual(self.client.get(url, HTTP_IF_MODIFIED_SINCE=first['Last-Modified']).status_code,
+                         status.HTTP_304_NOT_MODIFIED)
+        
+        # A write within the current second cannot be told apart by a whole-second date
+        Patient.objects.filter(id=self.patient.id).update(name="Renamed", updated_at=timezone.now())
+        response = self.client.get(url, HTTP_IF_MODIFIED_SINCE=first['Last-Modified'])
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotIn('Last-Modified', response.headers)
+        self.assertEqual(response.data['name'], "Renamed")
+    
+    def test_changes_invalidate_etag(self):
+        """Test that inserts, edits, deletes and patient renames all change the ETag"""
+        etag = self.client.get(self.url)['ETag']
+        changes = [
+            lambda: Alert.objects.create(patient=self.patient, type="FALL", message="Fall"),
+            lambda: Alert.objects.filter(id=Alert.objects.order_by('id')[3].id).set_status('RESOLVED'),
+            lambda: Alert.objects.filter(id=Alert.objects.order_by('id')[5].id).delete(),
+            lambda: Patient.objects.filter(id=self.patient.id).update(
+                name="Renamed", updated_at=timezone.now()),
+        ]
+        for change in changes:
+            change()
+            response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertNotEqual(response['ETag'], etag)
+            etag = response['ETag']
+    
+    def test_health_data_window_and_single_objects(self):
+        """Test conditional GET on health data, patient and alert detail endpoints"""
+        HealthData.objects.create(
+            patient=self.patient, heart_rate=72.0, spo2=98.0,
+            accelerometer_x=0.1, accelerometer_y=0.2, accelerometer_z=9.8,
+            gyroscope_x=0.5, gyroscope_y=-0.2, gyroscope_z=0.1
+        )
+        alert = Alert.objects.first()
+        etags = {}
+        for url in (f'/api/patients/{self.patient.id}/health_data/',
+                    f'/api/patients/{self.patient.id}/', f'/api/alerts/{alert.id}/', '/api/alerts/'):
+            first = self.client.get(url)
+            self.assertEqual(first.status_code, status.HTTP_200_OK, url)
+            second = self.client.get(url, HTTP_IF_NONE_MATCH=first['ETag'])
+            self.assertEqual(second.status_code, status.HTTP_304_NOT_MODIFIED, url)
+            etags[url] = first['ETag']
+        
+        self.client.post(f'/api/alerts/{alert.id}/acknowledge/')
+        for url in (f'/api/alerts/{alert.id}/', '/api/alerts/'):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etags[url])
+            self.assertEqual(response.status_code, status.HTTP_200_OK, url)
+
+
+class IngestDedupTests(CacheResetMixin, FakeFirebaseMixin, APITestCase):
+    """Test that retried uploads are stored, alerted and pushed once"""
+    
+    def setUp(self):
+        super().setUp()
+        self.patient = Patient.objects.create(
+            name="Retry Patient",
+            age=79,
+            gender="MALE",
+            user_id="retry123"
+        )
+        self.url = reverse('process-health-data')
+    
+    def sample(self, **extra):
+        sample = {
+            'user_id': 'retry123',
+            'heart_rate': 150,
+            'spo2': 85,
+            'accelerometer_x': 0.1,
+            'accelerometer_y': 0.2,
+            'accelerometer_z': 9.8,
+            'gyroscope_x': 0.5,
+            'gyroscope_y': -0.2,
+            'gyroscope_z': 0.1,
+        }
+        sample.update(extra)
+        return sample
+    
+    def test_retry_is_acknowledged_without_side_effects(self):
+        """Test that a retried seq returns the stored id without a query for the check"""
+        first = self.client.post(self.url, self.sample(seq=7), format='json')
+        alerts = Alert.objects.count()
+        self.assertGreater(alerts, 0)
+        pushes = len(self.firestore.writes)
+        
+        # Only the id lookup for the response; the duplicate check is in memory
+        with self.assertNumQueries(1):
+            retry = self.client.post(self.url, self.sample(seq=7), format='json')
+        self.assertEqual(retry.status_code, status.HTTP_200_OK)
+        self.assertEqual(retry.data, {'health_data_id': first.data['health_data_id'], 'duplicate': True})
+        self.assertEqual(HealthData.objects.count(), 1)
+        self.assertEqual(Alert.objects.count(), alerts)
+        self.assertEqual(len(self.firestore.writes), pushes)
+    
+    def test_out_of_order_samples_within_window(self):
+        """Test that late samples are accepted once and repeats are dropped"""
+        for seq in (10, 12, 11, 12, 9, 11):
+            self.client.post(self.url, self.sample(seq=seq), format='json')
+        self.assertEqual(
+            sorted(HealthData.objects.values_list('seq', flat=True)), [9, 10, 11, 12]
+        )
+    
+    def test_restart_falls_back_to_database(self):
+        """Test that duplicates are caught after the in-memory windows are lost"""
+        self.client.post(self.url, self.sample(seq=3), format='json')
+        seq_window.reset()
+        retry = self.client.post(self.url, self.sample(seq=3), format='json')
+        self.assertTrue(retry.data['duplicate'])
+        self.assertEqual(HealthData.objects.count(), 1)
+    
+    def test_constraint_catches_concurrent_retry(self):
+        """Test that the unique constraint backs up the in-memory check"""
+        self.client.post(self.url, self.sample(seq=5), format='json')
+        with mock.patch.object(seq_window, 'check', return_value=NEW):
+            retry = self.client.post(self.url, self.sample(seq=5), format='json')
+        self.assertTrue(retry.data['duplicate'])
+        self.assertEqual(HealthData.objects.count(), 1)
+    
+    def test_device_timestamp_is_used_as_seq(self):
+        """Test that a sample timestamp identifies the sample when no seq is sent"""
+        payload = self.sample(timestamp='2024-03-01T12:00:00.250Z')
+        self.client.post(self.url, payload, format='json')
+        retry = self.client.post(self.url, payload, format='json')
+        self.assertTrue(retry.data['duplicate'])
+        health_data = HealthData.objects.get()
+        self.assertEqual(health_data.seq, 1709294400250)
+        self.assertEqual(health_data.timestamp.isoformat(), '2024-03-01T12:00:00.250000+00:00')
+    
+    def test_samples_without_seq_are_not_deduplicated(self):
+        """Test that devices that send neither seq nor timestamp work as before"""
+        self.client.post(self.url, self.sample(), format='json')
+        self.client.post(self.url, self.sample(), format='json')
+        self.assertEqual(HealthData.objects.filter(seq__isnull=True).count(), 2)
+    
+    def test_invalid_seq_and_timestamp(self):
+        """Test that malformed or future identifiers are rejected"""
+        future = (timezone.now() + timezone.timedelta(hours=1)).isoformat()
+        for extra in ({'seq': -1}, {'seq': 'abc'}, {'timestamp': 'yesterday'}, {'timestamp': future}):
+            response = self.client.post(self.url, self.sample(**extra), format='json')
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST, extra)
+    
+    def test_window_bitmask(self):
+        """Test the sliding window directly, including numbers older than it"""
+        window = SeqWindow(size=8, loader=lambda patient_id, limit: (0, [5, 3]))
+        self.assertEqual(window.check(1, 5), DUPLICATE)
+        self.assertEqual(window.check(1, 4), NEW)
+        window.add(1, 20)
+        self.assertEqual(window.check(1, 12), UNKNOWN)
+        self.assertEqual(window.check(1, 13), NEW)
+        self.assertEqual(window.check(1, 20), DUPLICATE)
+        window.add(1, 13)
+        self.assertEqual(window.check(1, 13), DUPLICATE)
+        
+        # Another boot is left to the database until one of its numbers is stored
+        self.assertEqual(window.check(1, 0, boot=1), UNKNOWN)
+        window.add(1, 0, boot=1)
+        self.assertEqual(window.check(1, 0, boot=1), DUPLICATE)
+        self.assertEqual(window.check(1, 1, boot=1), NEW)
+        self.assertEqual(window.check(1, 13), UNKNOWN)
+    
+    def test_counter_restarts_after_reboot(self):
+        """Test that a rebooted device's numbers are new in its new boot, and retries still dropped"""
+        for seq in (0, 1, 2):
+            self.client.post(self.url, self.sample(seq=seq, boot=1), format='json')
+        for seq in (0, 1, 1):
+            response = self.client.post(self.url, self.sample(seq=seq, boot=2), format='json')
+        self.assertTrue(response.data['duplicate'])
+        retry = self.client.post(self.url, self.sample(seq=2, boot=1), format='json')
+        self.assertTrue(retry.data['duplicate'])
+        # A late sample of the previous boot is stored without moving the window back to it
+        self.assertNotIn('duplicate', self.client.post(self.url, self.sample(seq=3, boot=1), format='json').data)
+        self.assertEqual(seq_window.check(self.patient.id, 1, boot=2), DUPLICATE)
+        self.assertEqual(
+            sorted(HealthData.objects.values_list('boot', 'seq')), [(1, 0), (1, 1), (1, 2), (1, 3), (2, 0), (2, 1)]
+        )
+        
+        # After a restart the window picks up the latest boot
+        seq_window.reset()
+        with self.assertNumQueries(2):
+            self.assertEqual(seq_window.check(self.patient.id, 1, boot=2), DUPLICATE)
+        self.assertEqual(seq_window.check(self.patient.id, 2, boot=2), NEW)
+        for invalid in ({'boot': 'x'}, {'boot': 2 ** 63}, {'seq': str(2 ** 63)}, {'timestamp': 1e20}):
+            with self.subTest(invalid):
+                response = self.client.post(self.url, self.sample(**invalid), format='json')
+                self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class BackfillTests(CacheResetMixin, FakeFirebaseMixin, APITestCase):
+    """Test store-and-forward backfill of buffered samples"""
+    
+    FIELDS = ['seq', 'timestamp', 'heart_rate', 'spo2', 'accelerometer_x', 'accelerometer_y',
+              'accelerometer_z', 'gyroscope_x', 'gyroscope_y', 'gyroscope_z', 'temperature']
+    START = 1709280000  # 2024-03-01T08:00:00Z
+    
+    def setUp(self):
+        super().setUp()
+        self.patient = Patient.objects.create(
+            name="Offline Patient",
+            age=83,
+            gender="FEMALE",
+            user_id="offline123"
+        )
+        Guardian.objects.create(patient=self.patient, name="Guardian", relationship="CHILD",
+                                phone_number="1234567890", fcm_token="token")
+        self.url = reverse('backfill-health-data')
+    
+    def rows(self, count, first=0, anomalous=()):
+        return [
+            [seq, self.START + seq, 150.0 if seq in anomalous else 72.0, 85.0 if seq in anomalous else 98.0,
+             0.1, 0.2, 9.8, 0.5, -0.2, 0.1, 36.6 if seq % 2 else None]
+            for seq in range(first, first + count)
+        ]
+    
+    def post(self, rows, encoding='gzip'):
+        body = json.dumps({'user_id': 'offline123', 'fields': self.FIELDS, 'rows': rows}).encode()
+        if encoding == 'gzip':
+            body = gzip.compress(body)
+        headers = {'HTTP_CONTENT_ENCODING': encoding} if encoding else {}
+        return self.client.post(self.url, body, content_type='application/json', **headers)
+    
+    def test_chunk_is_stored_with_original_timestamps_without_pushes(self):
+        """Test that a gzip chunk is bulk inserted and anomalies become one alert per episode"""
+        # Scored a chunk at a time, not with per-sample predictions
+        with mock.patch.object(views.firebase_service, 'send_alert_to_guardians') as send, \
+                mock.patch.object(views.health_predictor, 'predict_fall') as predict_fall, \
+                mock.patch.object(views.health_predictor, 'predict_vitals_risk') as predict_vitals_risk:
+            response = self.post(self.rows(120, anomalous=range(40, 50)))
+        send.assert_not_called()
+        predict_fall.assert_not_called()
+        predict_vitals_risk.assert_not_called()
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual((response.data['inserted'], response.data['duplicates']), (120, 0))
+        
+        self.assertEqual(HealthData.objects.filter(patient=self.patient).count(), 120)
+        first = HealthData.objects.get(seq=0)
+        self.assertEqual(first.timestamp.isoformat(), '2024-03-01T08:00:00+00:00')
+        self.assertIsNone(first.temperature)
+        
+        alerts = Alert.objects.filter(patient=self.patient)
+        self.assertEqual(alerts.count(), 1)
+        alert = alerts.get()
+        self.assertEqual(alert.type, 'VITALS')
+        self.assertEqual(alert.timestamp, HealthData.objects.get(seq=40).timestamp)
+        self.assertIn("while the device was offline", alert.message)
+        self.assertIn("10 samples", alert.message)
+        self.assertEqual(PatientStatus.objects.get(patient=self.patient).risk_level, 'NORMAL')
+        # The alert is mirrored, the backfilled samples are left to reconciliation
+        self.assertEqual({collection for _, collection, _, _ in self.firestore.writes}, {'alerts'})
+    
+    def test_resent_chunk_is_skipped(self):
+        """Test that overlapping chunks insert only new samples and rescore only those"""
+        self.post(self.rows(60, anomalous=range(10, 12)))
+        response = self.post(self.rows(60, first=30, anomalous=range(10, 12)))
+        self.assertEqual((response.data['inserted'], response.data['duplicates']), (30, 30))
+        self.assertEqual(HealthData.objects.count(), 90)
+        self.assertEqual(Alert.objects.count(), 1)
+        
+        # The same numbers from after a reboot are new samples
+        rows = [[seq, self.START + 3600 + seq, 72.0, 98.0, 0.1, 0.2, 9.8, 0.5, -0.2, 0.1, None, 1] for seq in range(10)]
+        body = {'user_id': 'offline123', 'fields': self.FIELDS + ['boot'], 'rows': rows}
+        response = self.client.post(self.url, body, format='json')
+        self.assertEqual((response.data['inserted'], response.data['duplicates']), (10, 0))
+    
+    def test_backfill_reseeds_live_windows(self):
+        """Test that live ingestion after a backfill sees the backfilled samples"""
+        feature_store.update(self.patient.id, {'heart_rate': 60, 'spo2': 97})
+        seq_window.add(self.patient.id, 5)
+        self.post(self.rows(40), encoding=None)
+        self.assertEqual(seq_window.check(self.patient.id, 39), DUPLICATE)
+        vector = feature_store.update(self.patient.id, {'heart_rate': 60, 'spo2': 97})
+        # Mean over 29 backfilled samples at 72 bpm and the new one at 60
+        self.assertAlmostEqual(dict(zip(FEATURE_NAMES, vector))['hr_mean'], (29 * 72 + 60) / 30)
+    
+    def test_invalid_chunks_are_rejected(self):
+        """Test validation of fields, rows, size and encoding"""
+        bad_row = self.rows(2)
+        bad_row[1][2] = 'fast'
+        self.assertEqual(self.post(bad_row).status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.post([[1, 2]]).status_code, status.HTTP_400_BAD_REQUEST)
+        for index, value in ((1, 1e20), (0, 2 ** 63), (2, 10 ** 400)):
+            out_of_range = self.rows(1)
+            out_of_range[0][index] = value
+            self.assertEqual(self.post(out_of_range).status_code, status.HTTP_400_BAD_REQUEST)
+        with override_settings(BACKFILL_MAX_SAMPLES=10):
+            self.assertEqual(self.post(self.rows(11)).status_code, status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+        with override_settings(BACKFILL_MAX_BYTES=100):
+            self.assertEqual(self.post(self.rows(11)).status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.post(self.url, b'not gzip', content_type='application/json',
+                                    HTTP_CONTENT_ENCODING='gzip')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(HealthData.objects.count(), 0)
+
+
+@override_settings(INGEST_DEVICE_RATE=1, INGEST_DEVICE_BURST=3, INGEST_GLOBAL_RATE=0,
+                   INGEST_RATE_LIMIT_BACKEND='local')
+class IngestThrottleTests(CacheResetMixin, FakeFirebaseMixin, APITestCase):
+    """Test per-device and global rate limits and load shedding on ingestion"""
+    
+    def setUp(self):
+        super().setUp()
+        for user_id in ('busy123', 'quiet123'):
+            Patient.objects.create(name=user_id, age=70, gender="OTHER", user_id=user_id)
+        self.url = reverse('process-health-data')
+        self.now = 1000.0
+        patcher = mock.patch.object(throttling.LocalBuckets, 'clock', staticmethod(lambda: self.now))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+    
+    def sample(self, user_id='busy123', **extra):
+        sample = {
+            'user_id': user_id,
+            'heart_rate': 72,
+            'spo2': 98,
+            'accelerometer_x': 0.1,
+            'accelerometer_y': 0.2,
+            'accelerometer_z': 9.8,
+            'gyroscope_x': 0.5,
+            'gyroscope_y': -0.2,
+            'gyroscope_z': 0.1,
+        }
+        sample.update(extra)
+        return sample
+    
+    def post(self, **kwargs):
+        return self.client.post(self.url, self.sample(**kwargs), format='json')
+    
+    def mirrored(self):
+        return len(self.firestore.data.get('health_data', {}))
+    
+    def test_device_limit(self):
+        """Test that a device over its burst gets 429 without affecting other devices"""
+        for _ in range(3):
+            self.assertEqual(self.post().status_code, status.HTTP_200_OK)
+        response = self.post()
+        self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        self.assertEqual(response['Retry-After'], '1')
+        self.assertEqual(self.post(user_id='quiet123').status_code, status.HTTP_200_OK)
+        
+        self.now += 1
+        self.assertEqual(self.post().status_code, status.HTTP_200_OK)
+        self.assertEqual(HealthData.objects.filter(patient__user_id='busy123').count(), 4)
+        
+        # A reading that could raise an alert is never turned away
+        self.assertEqual(self.post().status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        self.assertEqual(self.post(spo2=85).status_code, status.HTTP_200_OK)
+        self.assertEqual(Alert.objects.count(), 1)
+    
+    def test_device_limit_on_owning_shard(self):
+        """Test that with sharding the owning shard applies the device limit, not the web worker"""
+        directory = tempfile.mkdtemp()
+        sharding.write_ring(directory, 1, ['shard-0'])
+        shard = sharding.Shard('shard-0', directory)
+        message = {'op': 'ingest', 'generation': 1, 'load_shedding': False, 'data': self.sample()}
+        for _ in range(3):
+            self.assertEqual(shard.handle(json.dumps(message))[0], status.HTTP_200_OK)
+        status_code, headers, body = shard.handle(json.dumps(message))
+        self.assertEqual((status_code, headers['Retry-After']), (status.HTTP_429_TOO_MANY_REQUESTS, '1'))
+        self.assertIn('detail', json.loads(body))
+        self.assertEqual(HealthData.objects.count(), 3)
+        message['data'] = self.sample(heart_rate=150)
+        self.assertEqual(shard.handle(json.dumps(message))[0], status.HTTP_200_OK)
+        
+        request = mock.Mock(data=self.sample(), META={'REMOTE_ADDR': '10.0.0.1'})
+        with override_settings(INGEST_SHARD_DIR=directory):
+            self.assertTrue(throttling.IngestRateThrottle().allow_request(request, None))
+    
+    @override_settings(INGEST_DEVICE_RATE=0, INGEST_GLOBAL_RATE=1, INGEST_GLOBAL_BURST=10,
+                       INGEST_GLOBAL_RESERVE=0.5, INGEST_SHED_LEVEL=0.8)
+    def test_global_reserve_and_shedding(self):
+        """Test that normal readings are shed before readings that could alert"""
+        # Above the shed level: stored and mirrored
+        self.assertEqual(self.post().status_code, status.HTTP_200_OK)
+        self.assertEqual(self.mirrored(), 1)
+        
+        # Below it: still stored, but normal readings are not mirrored
+        for _ in range(4):
+            self.assertEqual(self.post().status_code, status.HTTP_200_OK)
+        self.assertEqual(self.mirrored(), 2)
+        self.assertEqual(HealthData.objects.count(), 5)
+        
+        # The last half of the bucket is kept for readings that could alert
+        self.assertEqual(self.post().status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        response = self.post(heart_rate=150, spo2=85)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIn('health_data_id', response.data)
+        self.assertEqual(self.mirrored(), 3)
+        self.assertEqual(Alert.objects.count(), 1)
+        
+        # Even once the bucket is empty
+        for _ in range(5):
+            self.assertEqual(self.post(spo2=85).status_code, status.HTTP_200_OK)
+        self.assertEqual(self.mirrored(), 8)
+    
+    @override_settings(INGEST_RATE_LIMIT_BACKEND='cache')
+    def test_cache_backend(self):
+        """Test that buckets kept in the Django cache are shared between stores"""
+        from django.core.cache import cache as django_cache
+        self.addCleanup(django_cache.clear)
+        # The test cache is process-local, which is worth a warning outside tests
+        with mock.patch.object(throttling.CacheBuckets, 'clock', staticmethod(lambda: self.now)), \
+                self.assertLogs('api.throttling', 'WARNING'):
+            for _ in range(3):
+                self.assertEqual(self.post().status_code, status.HTTP_200_OK)
+            # Another process would build its own store over the same cache
+            throttling.reset()
+            self.assertEqual(self.post().status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+    
+    def test_could_alert(self):
+        """Test the pre-scoring check used to pick what to shed, against the predictor's thresholds"""
+        self.assertFalse(throttling.could_alert(self.sample()))
+        self.assertTrue(throttling.could_alert(self.sample(spo2=90)))
+        self.assertTrue(throttling.could_alert(self.sample(accelerometer_z=25)))
+        self.assertTrue(throttling.could_alert(self.sample(heart_rate='fast')))
+        # |acc| 11.8 with 30 deg/s of rotation scores 0.6, the default alert threshold
+        edge = self.sample(accelerometer_x=0, accelerometer_y=0, accelerometer_z=11.8,
+                           gyroscope_x=30, gyroscope_y=0, gyroscope_z=0)
+        self.assertTrue(throttling.could_alert(edge))
+        with override_settings(FALL_ALERT_THRESHOLD=0.7):
+            with mock.patch.object(views, 'health_predictor', HealthPredictor()):
+                self.assertFalse(throttling.could_alert(edge))
+                # A model scored on windowed features cannot be judged on one reading
+                views.health_predictor.vitals_model.feature_names = FEATURE_NAMES
+                self.assertTrue(throttling.could_alert(self.sample()))
+
+
+class PriorityLaneTests(CacheResetMixin, FakeFirebaseMixin, APITestCase):
+    """Test that anomalies are pushed first and normal readings are mirrored in batches"""
+    
+    def setUp(self):
+        super().setUp()
+        self.patient = Patient.objects.create(name="Lane Patient", age=81, gender="FEMALE", user_id="lane123")
+        self.url = reverse('process-health-data')
+        views.firebase_repository.health_data_buffer = WriteBuffer(
+            'health_data', views.firebase_repository._write_health_data, max_batch=3, max_delay=60
+        )
+    
+    def sample(self, **extra):
+        sample = {
+            'user_id': 'lane123',
+            'heart_rate': 72,
+            'spo2': 98,
+            'accelerometer_x': 0.1,
+            'accelerometer_y': 0.2,
+            'accelerometer_z': 9.8,
+            'gyroscope_x': 0.5,
+            'gyroscope_y': -0.2,
+            'gyroscope_z': 0.1,
+        }
+        sample.update(extra)
+        return sample
+    
+    def mirrored(self):
+        return len(self.firestore.data.get('health_data', {}))
+    
+    def test_anomaly_is_pushed_before_it_is_stored(self):
+        """Test that guardians are notified before the sample and alert are written"""
+        stored_at_push = []
+        with mock.patch.object(views.firebase_service, 'send_alert_to_guardians',
+                               side_effect=lambda *args: stored_at_push.append(
+                                   (HealthData.objects.count(), Alert.objects.count(), self.mirrored()))):
+            response = self.client.post(self.url, self.sample(heart_rate=150, spo2=85), format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(stored_at_push, [(0, 0, 0)])
+        self.assertEqual(len(response.data['alerts_created']), 1)
+        # Anomalous samples are mirrored straight away, since the alert links to them
+        self.assertEqual(self.mirrored(), 1)
+        self.assertEqual(len(views.firebase_repository.health_data_buffer), 0)
+    
+    def test_normal_readings_are_mirrored_in_batches(self):
+        """Test that normal readings are written once a batch is full or on flush"""
+        with mock.patch.object(views.firebase_service, 'send_alert_to_guardians') as send:
+            for _ in range(2):
+                self.client.post(self.url, self.sample(), format='json')
+            self.assertEqual((self.mirrored(), self.firestore.commits), (0, 0))
+            self.client.post(self.url, self.sample(), format='json')
+            self.assertEqual((self.mirrored(), self.firestore.commits), (3, 1))
+            
+            self.client.post(self.url, self.sample(), format='json')
+            self.assertEqual(views.firebase_repository.health_data_buffer.flush(), 1)
+            self.assertEqual((self.mirrored(), self.firestore.commits), (4, 2))
+        send.assert_not_called()
+        self.assertEqual(HealthData.objects.count(), 4)
+    
+    def test_write_buffer_bounds(self):
+        """Test that repeated documents are coalesced and the oldest dropped when full"""
+        written = []
+        buffer = WriteBuffer('test', written.extend, max_batch=10, max_delay=60, max_pending=2)
+        buffer.add(1, {'v': 1})
+        buffer.add(1, {'v': 2})
+        self.assertEqual(len(buffer), 1)
+        buffer.add(2, {'v': 1})
+        buffer.add(3, {'v': 1})
+        self.assertEqual(buffer.flush(), 2)
+        self.assertEqual(written, [(2, {'v': 1}), (3, {'v': 1})])
+
+
+class ArchiveTests(CacheResetMixin, FakeFirebaseMixin, APITestCase):
+    """Test moving old health data to archive files and reading it back"""
+    
+    def setUp(self):
+        super().setUp()
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.enterContext(override_settings(HEALTH_DATA_ARCHIVE_DIR=directory.name))
+        self.directory = directory.name
+        
+        self.patient = Patient.objects.create(name="Archive Patient", age=88, gender="MALE", user_id="archive123")
+        now = timezone.now()
+        self.old = (now - datetime.timedelta(days=40)).replace(hour=1, minute=0, second=0, microsecond=0)
+        # Three old days (odd samples with optional readings and seqs), and a recent hour
+        for i in range(6):
+            self.sample(self.old + datetime.timedelta(hours=10 * i), seq=i if i % 2 else None,
+                        temperature=36.6 if i % 2 else None, systolic_bp=120 + i)
+        for i in range(3):
+            self.sample(now - datetime.timedelta(minutes=10 * i))
+        # An old sample an alert points to stays in the database
+        flagged = self.sample(self.old + datetime.timedelta(minutes=1), heart_rate=150.0)
+        Alert.objects.create(patient=self.patient, type='VITALS', message="High", health_data=flagged)
+    
+    def sample(self, timestamp, **fields):
+        values = dict(heart_rate=72.0, spo2=98.0, accelerometer_x=0.1, accelerometer_y=0.2,
+                      accelerometer_z=9.8, gyroscope_x=0.5, gyroscope_y=-0.2, gyroscope_z=0.1)
+        values.update(fields)
+        return HealthData.objects.create(patient=self.patient, timestamp=timestamp, **values)
+    
+    def archive(self, *args):
+        out = io.StringIO()
+        call_command('archive_health_data', '--older-than-days', '7', *args, stdout=out)
+        return out.getvalue()
+    
+    def export(self, **params):
+        url = reverse('patient-export', args=[self.patient.id])
+        response = self.client.get(url, params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return list(csv.DictReader(io.StringIO(b''.join(response.streaming_content).decode())))
+    
+    def test_archive_moves_old_rows(self):
+        """Test that old rows are written per day and removed from the table"""
+        self.assertIn('6 samples', self.archive())
+        self.assertEqual(HealthData.objects.count(), 4)
+        days = archive.days(self.patient.id)
+        self.assertEqual(days, [self.old.date() + datetime.timedelta(days=i) for i in range(3)])
+        self.assertEqual([len(archive.read_day(self.patient.id, day)['id']) for day in days], [3, 2, 1])
+        # Nothing left to move
+        self.assertIn('0 samples', self.archive())
+    
+    def test_archived_samples_keep_boot_and_are_not_backfilled_again(self):
+        """Test that boots are archived and a late backfill skips sequence numbers already archived"""
+        HealthData.objects.filter(seq=3).update(boot=2)
+        self.archive()
+        records = [record for record in archive.history(self.patient.id) if record['seq'] is not None]
+        self.assertEqual([(record['boot'], record['seq']) for record in records], [(0, 1), (2, 3), (0, 5)])
+        
+        def resent(seq, boot, hours):
+            return dict(seq=seq, boot=boot, timestamp=self.old + datetime.timedelta(hours=hours), heart_rate=72.0,
+                        spo2=98.0, accelerometer_x=0.1, accelerometer_y=0.2, accelerometer_z=9.8,
+                        gyroscope_x=0.5, gyroscope_y=-0.2, gyroscope_z=0.1)
+        inserted = backfill.store_samples(self.patient, [resent(1, 0, 10), resent(3, 2, 30), resent(3, 0, 31)])
+        self.assertEqual(inserted, {(0, 3)})
+        self.assertEqual(sum(1 for _ in archive.history(self.patient.id)), 11)
+        
+        # Day files written before boots were archived read as boot 0
+        day = self.old.date()
+        path = os.path.join(self.directory, str(self.patient.id), f'{day.isoformat()}.npz')
+        columns = archive.read_day(self.patient.id, day)
+        del columns['boot']
+        np.savez_compressed(path, **columns)
+        self.assertEqual(archive.read_day(self.patient.id, day)['boot'].tolist(), [0] * len(columns['id']))
+    
+    def test_dry_run(self):
+        """Test that a dry run leaves the database and archive untouched"""
+        self.assertIn('6 samples', self.archive('--dry-run'))
+        self.assertEqual(HealthData.objects.count(), 10)
+        self.assertEqual(archive.days(self.patient.id), [])
+    
+    def test_endpoints_merge_archived_samples(self):
+        """Test that health data and export responses are unchanged by archiving"""
+        url = reverse('patient-health-data', args=[self.patient.id])
+        before = self.client.get(url).json()
+        exported = self.export()
+        self.assertEqual(len(before), 10)
+        
+        self.archive()
+        after = self.client.get(url).json()
+        self.assertEqual(after, before)
+        self.assertEqual(self.export(), exported)
+        self.assertEqual([row['systolic_bp'] for row in after[-2:]], [None, 120])
+        
+        # Archived days are part of the ETag: a rewritten day file is a change
+        etag = self.client.get(url)['ETag']
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, status.HTTP_304_NOT_MODIFIED)
+        day_file = os.path.join(self.directory, str(self.patient.id), f'{archive.days(self.patient.id)[0]}.npz')
+        os.utime(day_file, ns=(0, os.stat(day_file).st_mtime_ns + 1000))
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, status.HTTP_200_OK)
+    
+    def test_export_range(self):
+        """Test that export filters by start and end across both tiers"""
+        self.archive()
+        rows = self.export(start=(self.old + datetime.timedelta(hours=5)).isoformat(),
+                           end=(self.old + datetime.timedelta(hours=40)).isoformat())
+        self.assertEqual([row['systolic_bp'] for row in rows], ['121', '122', '123'])
+        self.assertEqual(rows[0]['seq'], '1')
+        self.assertEqual(rows[1]['temperature'], '')
+        
+        response = self.client.get(reverse('patient-export', args=[self.patient.id]), {'start': 'soon'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+    
+    def test_interrupted_run_is_repeated(self):
+        """Test that rows written to a file but not deleted are archived once"""
+        rows = HealthData.objects.filter(timestamp__lt=self.old + datetime.timedelta(hours=12), alerts__isnull=True)
+        archive.write_day(self.patient.id, self.old.date(), list(rows.order_by('timestamp').values_list(*archive.COLUMNS)))
+        self.archive()
+        ids = archive.read_day(self.patient.id, self.old.date())['id']
+        self.assertEqual(len(ids), len(set(ids)))
+        self.assertEqual(len(list(archive.history(self.patient.id))), 10)
+
+
+class BacktestTests(CacheResetMixin, FakeFirebaseMixin, TestCase):
+    """Test the vectorized models and the backtest_thresholds command"""
+    
+    def setUp(self):
+        super().setUp()
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.enterContext(override_settings(HEALTH_DATA_ARCHIVE_DIR=directory.name))
+        self.directory = directory.name
+        self.predictor = HealthPredictor()
+        
+        rng = np.random.default_rng(3)
+        start = timezone.now() - datetime.timedelta(hours=2)
+        self.samples = []
+        for patient_number in range(2):
+            patient = Patient.objects.create(name=f"Replay {patient_number}", age=75, gender="OTHER",
+                                             user_id=f"replay{patient_number}")
+            for i in range(60):
+                self.samples.append(HealthData.objects.create(
+                    patient=patient, timestamp=start + datetime.timedelta(seconds=30 * i),
+                    heart_rate=float(rng.uniform(40, 130)), spo2=float(rng.uniform(85, 100)),
+                    accelerometer_x=float(rng.normal(0, 3)), accelerometer_y=float(rng.normal(0, 3)),
+                    accelerometer_z=float(rng.normal(9.8, 3)), gyroscope_x=float(rng.normal(0, 20)),
+                    gyroscope_y=float(rng.normal(0, 20)), gyroscope_z=float(rng.normal(0, 20)),
+                ))
+        # Guardians triaged some of the alerts
+        for index, status_value in ((3, 'RESOLVED'), (10, 'FALSE_ALARM'), (70, 'RESOLVED'), (80, 'NEW')):
+            sample = self.samples[index]
+            Alert.objects.create(patient=sample.patient, type='VITALS', message="Vitals",
+                                 health_data=sample, status=status_value)
+    
+    def row_probabilities(self):
+        falls, vitals = [], []
+        for sample in self.samples:
+            falls.append(self.predictor.predict_fall(
+                [sample.accelerometer_x], [sample.accelerometer_y], [sample.accelerometer_z],
+                [sample.gyroscope_x], [sample.gyroscope_y], [sample.gyroscope_z])['fall_probability'])
+            vitals.append(self.predictor.predict_vitals_risk(sample.heart_rate, sample.spo2)['risk_probability'])
+        return np.array(falls), np.array(vitals)
+    
+    def replay(self, chunk_size=1000, thresholds=(0.2, 0.4, 0.6)):
+        replay = backtest.Backtest(self.predictor, thresholds, thresholds, backtest.load_labels())
+        for block in backtest.database_blocks(chunk_size=chunk_size):
+            replay.add(block)
+        return replay
+    
+    def test_vectorized_models_match_single_predictions(self):
+        """Test that scoring whole arrays gives the per-request probabilities"""
+        falls, vitals = self.row_probabilities()
+        imu = np.array([[getattr(sample, name) for name in backtest.IMU_CHANNELS] for sample in self.samples])
+        np.testing.assert_allclose(self.predictor.fall_probabilities(imu), falls)
+        readings = np.array([[sample.heart_rate, sample.spo2] for sample in self.samples])
+        np.testing.assert_allclose(self.predictor.vitals_probabilities(readings), vitals)
+    
+    def test_counts_and_labels(self):
+        """Test alert counts and precision/recall against a row by row replay"""
+        falls, vitals = self.row_probabilities()
+        replay = self.replay(chunk_size=25)
+        self.assertEqual(replay.samples, 120)
+        rows = replay.vitals.rows(replay.patient_days())
+        for row in rows:
+            self.assertEqual(row['alerts'], int((vitals >= row['threshold']).sum()))
+        self.assertEqual([row['alerts'] for row in replay.fall.rows(replay.patient_days())],
+                         [int((falls >= t).sum()) for t in (0.2, 0.4, 0.6)])
+        
+        self.assertEqual((replay.vitals.positives, replay.vitals.negatives), (2, 1))
+        for row in rows:
+            flagged = {index for index in (3, 10, 70) if vitals[index] >= row['threshold']}
+            confirmed = flagged & {3, 70}
+            self.assertEqual(row['recall'], len(confirmed) / 2)
+            self.assertEqual(row['precision'], len(confirmed) / len(flagged) if flagged else None)
+    
+    def test_archived_samples_and_feature_windows(self):
+        """Test that archived samples are replayed and windows continue across blocks"""
+        class MeanHeartRateModel:
+            feature_names = FEATURE_NAMES
+            
+            def predict_proba(self, X):
+                risk = np.clip((X[:, FEATURE_NAMES.index('hr_mean')] - 60) / 60, 0, 1)
+                return np.column_stack([1 - risk, risk])
+        
+        self.predictor.vitals_model = MeanHeartRateModel()
+        replay = self.replay()
+        expected = [row['alerts'] for row in replay.vitals.rows(replay.patient_days())]
+        archive.archive_health_data(timezone.now() - datetime.timedelta(hours=1))
+        self.assertLess(HealthData.objects.count(), 120)
+        replay = self.replay(chunk_size=7)
+        self.assertEqual(replay.samples, 120)
+        self.assertEqual([row['alerts'] for row in replay.vitals.rows(replay.patient_days())], expected)
+    
+    def test_command(self):
+        """Test the report, with the configured thresholds marked"""
+        out = io.StringIO()
+        call_command('backtest_thresholds', '--fall-thresholds', '0.5,0.7', stdout=out)
+        output = out.getvalue()
+        self.assertIn('120 samples from 2 patients', output)
+        self.assertIn('(2 confirmed and 1 false alarms labeled)', output)
+        self.assertRegex(output, r'\*\s+0\.60')
+        self.assertRegex(output, r'\*\s+0\.30')
+        
+        # The same samples from export files
+        paths = []
+        for patient in Patient.objects.all():
+            response = self.client.get(reverse('patient-export', args=[patient.id]))
+            path = f'{self.directory}/{patient.id}.csv'
+            with open(path, 'wb') as stream:
+                stream.write(b''.join(response.streaming_content))
+            paths.append(path)
+        out = io.StringIO()
+        call_command('backtest_thresholds', '--fall-thresholds', '0.5,0.7',
+                     *itertools.chain.from_iterable(('--file', path) for path in paths), stdout=out)
+        self.assertEqual(out.getvalue().split('\n')[1:], output.split('\n')[1:])
+
+
+class TrainingTests(CacheResetMixin, FakeFirebaseMixin, TestCase):
+    """Test the train_models command and the model registry"""
+    
+    def setUp(self):
+        super().setUp()
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.enterContext(override_settings(HEALTH_DATA_ARCHIVE_DIR=f'{directory.name}/archive',
+                                            ML_MODEL_DIR=f'{directory.name}/models'))
+        
+        rng = np.random.default_rng(5)
+        patient = Patient.objects.create(name="Training", age=80, gender="OTHER", user_id="training1")
+        start = timezone.now() - datetime.timedelta(hours=3)
+        self.samples = []
+        for i in range(300):
+            fall = i % 30 == 15
+            self.samples.append(HealthData.objects.create(
+                patient=patient, timestamp=start + datetime.timedelta(seconds=30 * i),
+                heart_rate=float(rng.normal(140 if i % 30 == 5 else 75, 5)), spo2=float(rng.normal(97, 1)),
+                accelerometer_x=float(rng.normal(0, 0.5)), accelerometer_y=float(rng.normal(0, 0.5)),
+                accelerometer_z=float(rng.normal(30 if fall else 9.8, 0.5)), gyroscope_x=float(rng.normal(0, 5)),
+                gyroscope_y=float(rng.normal(0, 5)), gyroscope_z=float(rng.normal(200 if fall else 0, 5)),
+            ))
+        for index in range(0, 300, 30):
+            Alert.objects.create(patient=patient, type='FALL', message="Fall", health_data=self.samples[index + 15],
+                                 status='RESOLVED')
+            Alert.objects.create(patient=patient, type='VITALS', message="Vitals", health_data=self.samples[index + 5],
+                                 status='RESOLVED')
+        Alert.objects.create(patient=patient, type='FALL', message="Fall", health_data=self.samples[1],
+                             status='FALSE_ALARM')
+        Alert.objects.create(patient=patient, type='FALL', message="Fall", health_data=self.samples[2])
+    
+    def collect(self, max_unlabeled=500000):
+        data = training.TrainingData(backtest.load_labels(), training.alerted_ids(), max_unlabeled)
+        for block in backtest.database_blocks(chunk_size=50):
+            data.add(block)
+        return data
+    
+    def test_labels(self):
+        """Test that triaged alerts label samples and untriaged ones are left out"""
+        data = self.collect()
+        X, y = data.dataset('FALL')
+        self.assertEqual(X.shape, (10 + 1 + 278, len(FEATURE_NAMES)))
+        self.assertEqual(y.sum(), 10)
+        X, y = data.dataset('VITALS')
+        self.assertEqual((len(y), y.sum()), (10 + 278, 10))
+        
+        # Windowed features match the ones computed in a single pass
+        matrix = np.array([[getattr(sample, name) if name != 'timestamp' else sample.timestamp.timestamp()
+                            for name in CHANNELS] for sample in self.samples], dtype=float)
+        expected = compute_features(sliding_windows(matrix, 30))
+        np.testing.assert_allclose(X[:10], expected[5::30])
+        
+        data = self.collect(max_unlabeled=50)
+        self.assertEqual(len(data.dataset('FALL')[1]), 10 + 1 + 50)
+    
+    def test_command_saves_versions_the_predictor_loads(self):
+        """Test that trained models are versioned, described and loaded by HealthPredictor"""
+        out = io.StringIO()
+        call_command('train_models', '--folds', '3', '--jobs', '1', stdout=out)
+        self.assertIn('300 samples from 1 patients', out.getvalue())
+        
+        for name in (model_registry.FALL_MODEL, model_registry.VITALS_MODEL):
+            versions = model_registry.versions(name)
+            self.assertEqual(len(versions), 1)
+            metadata = model_registry.read_metadata(name, versions[0])
+            self.assertEqual(metadata['feature_names'], list(FEATURE_NAMES))
+            self.assertEqual(metadata['positives'], 10)
+            self.assertEqual(set(metadata['cross_validation']['scores']), set(training.CANDIDATES))
+            self.assertGreater(metadata['inference_seconds_per_row']['single'], 0)
+        
+        predictor = HealthPredictor()
+        self.assertIsInstance(predictor.fall_model, model_registry.TrainedModel)
+        self.assertTrue(predictor.fall_model.exported)
+        with override_settings(ML_MODEL_EXPORTED=False):
+            self.assertFalse(HealthPredictor().fall_model.exported)
+        self.assertTrue(predictor.uses_features())
+        features = feature_store.update(-1, {'heart_rate': 75, 'spo2': 97, 'accelerometer_z': 9.8})
+        self.assertFalse(predictor.predict_fall([0], [0], [9.8], [0], [0], [0], features=features)['is_anomaly'])
+        
+        # A second run adds a version; a pinned version is loaded instead of the newest
+        call_command('train_models', '--model', model_registry.FALL_MODEL, '--estimator', 'logistic',
+                     '--folds', '3', '--jobs', '1', stdout=io.StringIO())
+        first, second = model_registry.versions(model_registry.FALL_MODEL)
+        self.assertEqual(HealthPredictor().fall_model.version, second)
+        with override_settings(ML_MODEL_VERSIONS={model_registry.FALL_MODEL: first}):
+            self.assertEqual(HealthPredictor().fall_model.version, first)
+    
+    def test_other_feature_schema_is_not_loaded(self):
+        """Test that a model trained on other features falls back to the built-in one"""
+        X, y = self.collect().dataset('FALL')
+        estimator, _, metadata = training.train(X, y, ['logistic'], folds=2, n_jobs=1)
+        model_registry.save(model_registry.FALL_MODEL, estimator, dict(metadata, feature_names=['heart_rate']))
+        with self.assertLogs('api.model_registry', 'WARNING'):
+            self.assertIsNone(model_registry.load(model_registry.FALL_MODEL))
+            self.assertFalse(HealthPredictor().uses_features())
+    
+    def test_too_few_labels(self):
+        """Test that training needs labeled positives"""
+        Alert.objects.filter(type='VITALS').update(status='NEW')
+        with self.assertRaisesMessage(CommandError, 'vitals_risk_model'):
+            call_command('train_models', '--model', model_registry.VITALS_MODEL, stdout=io.StringIO())
+
+
+class DashboardTests(CacheResetMixin, FakeFirebaseMixin, APITestCase):
+    """Test the patient status summary and the dashboard endpoint"""
+    
+    def setUp(self):
+        super().setUp()
+        self.calm = Patient.objects.create(name="Calm", age=70, gender="MALE", user_id="calm")
+        self.critical = Patient.objects.create(name="Critical", age=90, gender="FEMALE", user_id="critical")
+        self.quiet = Patient.objects.create(name="Quiet", age=80, gender="OTHER", user_id="quiet")
+        self.url = reverse('dashboard')
+    
+    def ingest(self, user_id, heart_rate, spo2, timestamp=None):
+        payload = {
+            'user_id': user_id, 'heart_rate': heart_rate, 'spo2': spo2,
+            'accelerometer_x': 0.0, 'accelerometer_y': 0.0, 'accelerometer_z': 9.8,
+            'gyroscope_x': 0.0, 'gyroscope_y': 0.0, 'gyroscope_z': 0.0,
+        }
+        if timestamp is not None:
+            payload['timestamp'] = timestamp
+        response = self.client.post('/api/health-data/', payload, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response
+    
+    def test_dashboard_sorted_by_risk_in_one_query(self):
+        """Test that every patient is listed, riskiest first, from the summary rows"""
+        self.ingest('calm', 72, 98)
+        self.ingest('critical', 150, 85)
+        
+        with self.assertNumQueries(1):
+            response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        rows = response.json()
+        self.assertEqual([row['patient_name'] for row in rows], ["Critical", "Calm", "Quiet"])
+        critical, calm, quiet = rows
+        self.assertEqual((critical['risk_level'], critical['heart_rate'], critical['spo2']), ('CRITICAL', 150.0, 85.0))
+        self.assertEqual((critical['open_alerts'], critical['new_alerts']), (1, 1))
+        self.assertEqual((calm['risk_level'], calm['open_alerts']), ('NORMAL', 0))
+        self.assertIsNotNone(calm['last_seen'])
+        self.assertEqual((quiet['risk_level'], quiet['last_seen']), (None, None))
+        
+        response = self.client.get(self.url, {'min_risk': 'HIGH'})
+        self.assertEqual([row['patient'] for row in response.json()], [self.critical.id])
+        self.assertEqual(self.client.get(self.url, {'min_risk': 'SEVERE'}).status_code,
+                         status.HTTP_400_BAD_REQUEST)
+    
+    def test_alert_changes_update_open_counts(self):
+        """Test that acknowledging, resolving and deleting alerts keep the counts current"""
+        self.ingest('critical', 150, 85)
+        self.ingest('critical', 150, 85)
+        first, second = Alert.objects.filter(patient=self.critical).order_by('id')
+        status_row = PatientStatus.objects.get(patient=self.critical)
+        self.assertEqual((status_row.open_alerts, status_row.new_alerts), (2, 2))
+        
+        self.client.post(f'/api/alerts/{first.id}/acknowledge/')
+        status_row.refresh_from_db()
+        self.assertEqual((status_row.open_alerts, status_row.new_alerts), (2, 1))
+        
+        self.client.post('/api/alerts/bulk-status/', {'status': 'RESOLVED', 'ids': [first.id, second.id]},
+                         format='json')
+        status_row.refresh_from_db()
+        self.assertEqual((status_row.open_alerts, status_row.new_alerts), (0, 0))
+        
+        Alert.objects.create(patient=self.critical, type='FALL', message="Fall").delete()
+        self.assertEqual(PatientStatus.objects.get(patient=self.critical).open_alerts, 0)
+    
+    def test_older_samples_do_not_replace_the_latest(self):
+        """Test that a late sample leaves the newer one on the dashboard"""
+        now = timezone.now().timestamp()
+        self.ingest('calm', 72, 98, timestamp=now)
+        self.ingest('calm', 150, 85, timestamp=now - 60)
+        status_row = PatientStatus.objects.get(patient=self.calm)
+        self.assertEqual((status_row.heart_rate, status_row.risk_level), (72.0, 'NORMAL'))
+        self.assertEqual(status_row.last_seen.timestamp(), now)
+        
+        # Patients created without the signal get their row on the first sample
+        PatientStatus.objects.filter(patient=self.quiet).delete()
+        self.ingest('quiet', 60, 97)
+        self.assertEqual(PatientStatus.objects.get(patient=self.quiet).heart_rate, 60.0)
+
+
+class LivenessTests(CacheResetMixin, FakeFirebaseMixin, APITestCase):
+    """Test the timer wheel and DEVICE_OFFLINE alerts for devices that stop reporting"""
+    
+    def setUp(self):
+        super().setUp()
+        self.patient = Patient.objects.create(name="Silent", age=85, gender="FEMALE", user_id="watch1")
+        Guardian.objects.create(patient=self.patient, name="Carer", relationship="CHILD",
+                                phone_number="555-0100", email="carer@example.com", notification_enabled=True)
+    
+    def ingest(self, **extra):
+        payload = {
+            'user_id': 'watch1', 'heart_rate': 72, 'spo2': 97,
+            'accelerometer_x': 0.0, 'accelerometer_y': 0.0, 'accelerometer_z': 9.8,
+            'gyroscope_x': 0.0, 'gyroscope_y': 0.0, 'gyroscope_z': 0.0,
+        }
+        payload.update(extra)
+        return self.client.post('/api/health-data/', payload, format='json')
+    
+    def offline_alerts(self):
+        return Alert.objects.filter(patient=self.patient, type='DEVICE_OFFLINE')
+    
+    def test_timer_wheel_fires_at_deadlines(self):
+        """Test that timers fire on their tick across levels, beyond the top level and after re-arming"""
+        wheel = liveness.TimerWheel(tick=1.0, slot_bits=2, levels=2, start=100.0)
+        wheel.schedule('near', 102.5)
+        wheel.schedule('cascaded', 113.0)
+        wheel.schedule('beyond', 150.0)
+        wheel.schedule('rearmed', 103.0)
+        wheel.schedule('cancelled', 104.0)
+        wheel.schedule('rearmed', 120.0)
+        self.assertTrue(wheel.cancel('cancelled'))
+        self.assertEqual(len(wheel), 4)
+        
+        self.assertEqual(wheel.advance(102.9), [])
+        self.assertEqual(wheel.advance(103.0), ['near'])
+        self.assertEqual(wheel.advance(112.9), [])
+        self.assertEqual(wheel.advance(113.0), ['cascaded'])
+        self.assertEqual(wheel.advance(149.0), ['rearmed'])
+        self.assertEqual(wheel.advance(150.0), ['beyond'])
+        self.assertEqual(len(wheel), 0)
+    
+    def test_silent_device_raises_one_alert_until_it_reports_again(self):
+        """Test that a missed deadline alerts guardians once and the next sample resolves it"""
+        self.assertEqual(self.ingest().status_code, status.HTTP_200_OK)
+        self.assertIsNotNone(liveness.tracker.last_seen('watch1'))
+        deadline = liveness.tracker.last_seen('watch1') + liveness.offline_timeout()
+        
+        with mock.patch.object(views.firebase_service, 'send_alert_to_guardians') as send, \
+                self.assertLogs('api.liveness', 'WARNING'):
+            self.assertEqual(liveness.tracker.check(deadline - 2), [])
+            self.assertEqual(liveness.tracker.check(deadline + 1), ['watch1'])
+            self.assertEqual(liveness.tracker.check(deadline + 600), [])
+        send.assert_called_once()
+        self.assertEqual(send.call_args.args[2], "Device Offline")
+        alert = self.offline_alerts().get()
+        self.assertEqual(alert.status, 'NEW')
+        self.assertIn('watch1', alert.message)
+        self.assertEqual(self.firestore.data['alerts'][str(alert.id)]['type'], 'DEVICE_OFFLINE')
+        self.assertEqual(PatientStatus.objects.get(patient=self.patient).open_alerts, 1)
+        
+        with self.assertLogs('api.liveness', 'INFO'):
+            self.ingest()
+        alert.refresh_from_db()
+        self.assertEqual(alert.status, 'RESOLVED')
+        self.assertFalse(liveness.tracker.is_offline('watch1'))
+    
+    def test_reports_seen_by_other_workers_and_custom_intervals(self):
+        """Test that newer samples stored elsewhere re-arm the deadline and report_interval stretches it"""
+        started = time.time()
+        liveness.tracker.heartbeat('watch1', self.patient.id, 300, now=started)
+        PatientStatus.objects.filter(patient=self.patient).update(
+            last_received=datetime.datetime.fromtimestamp(started + 200, tz=datetime.timezone.utc)
+        )
+        with mock.patch.object(views.firebase_service, 'send_alert_to_guardians'), \
+                self.assertLogs('api.liveness', 'WARNING'):
+            self.assertEqual(liveness.tracker.check(started + 301), [])
+            self.assertFalse(self.offline_alerts().exists())
+            self.assertEqual(liveness.tracker.check(started + 501), ['watch1'])
+        self.assertEqual(self.offline_alerts().count(), 1)
+        
+        liveness.reset()
+        # The open alert is resolved although this worker never saw it raised
+        with self.assertLogs('api.liveness', 'INFO'):
+            self.assertEqual(self.ingest(report_interval=600).status_code, status.HTTP_200_OK)
+        seen = liveness.tracker.last_seen('watch1')
+        self.assertEqual(liveness.tracker.check(seen + liveness.offline_timeout() + 1), [])
+        self.assertEqual(self.ingest(report_interval=0).status_code, status.HTTP_400_BAD_REQUEST)
+        
+        with override_settings(DEVICE_OFFLINE_MISSED=0):
+            liveness.reset()
+            self.ingest()
+        self.assertEqual(len(liveness.tracker), 0)
+    
+    def test_device_clock_does_not_matter(self):
+        """Test that the confirmation uses when samples arrived, not the time the device put on them"""
+        started = time.time()
+        liveness.tracker.heartbeat('watch1', self.patient.id, 300, now=started)
+        # Another worker receives a sample from a watch whose clock is ten minutes slow
+        PatientStatus.objects.record_sample(
+            self.patient.id, {'timestamp': datetime.datetime.fromtimestamp(started - 600, tz=datetime.timezone.utc)},
+            received=datetime.datetime.fromtimestamp(started + 200, tz=datetime.timezone.utc),
+        )
+        self.assertEqual(liveness.tracker.check(started + 301), [])
+        self.assertFalse(self.offline_alerts().exists())
+        self.assertAlmostEqual(liveness.tracker.last_seen('watch1'), started + 200, places=3)
+    
+    def test_alerts_raised_elsewhere_are_resolved(self):
+        """Test that alerts from another worker or a previous process are resolved by the next report"""
+        # Deadlines come up after the test's checks, not on the background thread
+        def silent():
+            liveness.reset()
+            last_seen = float(int(time.time()) - 100)
+            PatientStatus.objects.filter(patient=self.patient).update(
+                last_received=datetime.datetime.fromtimestamp(last_seen, tz=datetime.timezone.utc)
+            )
+            liveness.tracker.heartbeat('watch1', self.patient.id, 300, now=last_seen, notify=False)
+        
+        def raise_alert():
+            silent()
+            with mock.patch.object(views.firebase_service, 'send_alert_to_guardians'), \
+                    self.assertLogs('api.liveness', 'WARNING'):
+                self.assertEqual(liveness.tracker.check(time.time() + 300), ['watch1'])
+            return self.offline_alerts().get(status='NEW')
+        
+        # Raised by another worker: this one first hears from the device afterwards
+        alert = raise_alert()
+        liveness.reset()
+        with self.assertLogs('api.liveness', 'INFO'):
+            self.ingest()
+        alert.refresh_from_db()
+        self.assertEqual(alert.status, 'RESOLVED')
+        
+        # Raised before a restart: seeding marks the device offline again
+        alert = raise_alert()
+        liveness.reset()
+        PatientStatus.objects.filter(patient=self.patient).update(last_received=timezone.now())
+        self.assertEqual(liveness.seed(), 1)
+        self.assertTrue(liveness.tracker.is_offline('watch1'))
+        with self.assertLogs('api.liveness', 'INFO'):
+            self.ingest()
+        alert.refresh_from_db()
+        self.assertEqual(alert.status, 'RESOLVED')
+        
+        # One alert while another is open, even if a worker missed it
+        raise_alert()
+        silent()
+        self.assertEqual(liveness.tracker.check(time.time() + 300), ['watch1'])
+        self.assertEqual(self.offline_alerts().filter(status='NEW').count(), 1)
+
+
+class LatestStateTests(CacheResetMixin, FakeFirebaseMixin, APITestCase):
+    """Test the shared latest-state table and the latest reading endpoint"""
+    
+    def setUp(self):
+        super().setUp()
+        self.patient = Patient.objects.create(name="Test", age=70, gender="MALE", user_id="watch1")
+        tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        self.path = os.path.join(tmpdir.name, 'latest')
+        self.addCleanup(state_table.reset)
+    
+    def ingest(self, heart_rate, spo2, timestamp=None):
+        payload = {
+            'user_id': 'watch1', 'heart_rate': heart_rate, 'spo2': spo2,
+            'accelerometer_x': 0.0, 'accelerometer_y': 0.0, 'accelerometer_z': 9.8,
+            'gyroscope_x': 0.0, 'gyroscope_y': 0.0, 'gyroscope_z': 0.0,
+        }
+        if timestamp is not None:
+            payload['timestamp'] = timestamp
+        response = self.client.post('/api/health-data/', payload, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+    
+    def test_rows_are_shared_between_mappings(self):
+        """Test that a row written through one mapping is read through another, newest first"""
+        writer = state_table.LatestStateTable(self.path, 10)
+        self.addCleanup(writer.close)
+        reader = state_table.LatestStateTable(self.path, 10)
+        self.addCleanup(reader.close)
+        
+        self.assertTrue(writer.write(3, 1000.0, {'heart_rate': 72, 'spo2': None, 'risk_level': 'HIGH',
+                                                 'risk_probability': 0.9}))
+        reading = reader.read(3)
+        self.assertEqual((reading['heart_rate'], reading['spo2'], reading['temperature']), (72.0, None, None))
+        self.assertEqual((reading['risk_level'], reading['risk_probability']), ('HIGH', 0.9))
+        self.assertEqual(reading['last_seen'].timestamp(), 1000.0)
+        
+        # Older readings are ignored; scores missing from a newer one are kept
+        self.assertFalse(writer.write(3, 999.0, {'heart_rate': 150}))
+        self.assertTrue(writer.write(3, 1001.0, {'heart_rate': 80}))
+        self.assertEqual((reader.read(3)['heart_rate'], reader.read(3)['risk_level']), (80.0, 'HIGH'))
+        
+        # A row being written is not returned, nor are empty or out-of-range ones
+        writer.rows['seq'][3] += 1
+        self.assertIsNone(reader.read(3))
+        writer.rows['seq'][3] += 1
+        self.assertEqual(reader.read(3)['heart_rate'], 80.0)
+        self.assertIsNone(reader.read(4))
+        self.assertFalse(writer.write(10, 1000.0, {}))
+        self.assertIsNone(reader.read(10))
+        writer.clear(3)
+        self.assertIsNone(reader.read(3))
+        
+        with self.assertRaises(ValueError):
+            state_table.LatestStateTable(self.path, 20)
+    
+    def test_latest_served_from_table_without_queries(self):
+        """Test that ingested readings are served from the table, and dropped with the patient"""
+        url = reverse('patient-latest', args=[self.patient.id])
+        with override_settings(LATEST_STATE_PATH=self.path):
+            self.ingest(72, 98)
+            self.ingest(150, 85)
+            with self.assertNumQueries(0):
+                response = self.client.get(url)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            reading = response.json()
+            self.assertEqual((reading['patient'], reading['heart_rate'], reading['spo2'], reading['risk_level']),
+                             (self.patient.id, 150.0, 85.0, 'CRITICAL'))
+            self.assertIsNotNone(reading['last_seen'])
+            
+            patient_id = self.patient.id
+            self.patient.delete()
+            self.assertIsNone(state_table.latest(patient_id))
+            self.assertEqual(self.client.get(url).status_code, status.HTTP_404_NOT_FOUND)
+    
+    def test_latest_falls_back_to_database(self):
+        """Test that without the table, or beyond its capacity, the status row is served"""
+        self.ingest(72, 98)
+        response = self.client.get(reverse('patient-latest', args=[self.patient.id]))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        reading = response.json()
+        self.assertEqual((reading['heart_rate'], reading['spo2'], reading['risk_level']), (72.0, 98.0, 'NORMAL'))
+        
+        with override_settings(LATEST_STATE_PATH=self.path, LATEST_STATE_CAPACITY=self.patient.id):
+            self.ingest(80, 97)
+            response = self.client.get(reverse('patient-latest', args=[self.patient.id]))
+            self.assertEqual(response.json()['heart_rate'], 80.0)
+        self.assertEqual(self.client.get(reverse('patient-latest', args=[self.patient.id + 1])).status_code,
+                         status.HTTP_404_NOT_FOUND)
+
+
+class StubShard:
+    """Answers every request with its own name, in the body and a header"""
+    
+    def __init__(self, name):
+        self.name = name
+        self.requests = []
+    
+    def handle(self, message):
+        self.requests.append(json.loads(message))
+        return 200, {'X-Shard': self.name}, json.dumps({'shard': self.name}).encode()
+
+
+class ShardingTests(CacheResetMixin, FakeFirebaseMixin, APITestCase):
+    """Test the consistent-hash ring, routing to shard processes and rebalancing"""
+    
+    def setUp(self):
+        super().setUp()
+        self.directory = tempfile.mkdtemp()
+        self.servers = {}
+    
+    def tearDown(self):
+        for name in list(self.servers):
+            self.stop(name)
+        super().tearDown()
+    
+    def start(self, name):
+        shard = StubShard(name)
+        server = sharding.ShardServer(sharding.socket_path(self.directory, name), shard)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.servers[name] = server
+        return shard
+    
+    def stop(self, name):
+        server = self.servers.pop(name)
+        server.shutdown()
+        server.server_close()
+        os.unlink(sharding.socket_path(self.directory, name))
+    
+    def test_ring_moves_only_the_keys_of_the_node_that_changed(self):
+        """Test that adding a node takes keys only from others and removing it gives them back"""
+        keys = [f'watch-{i}' for i in range(2000)]
+        ring = sharding.HashRing(['a', 'b', 'c'])
+        before = {key: ring.node_for(key) for key in keys}
+        self.assertEqual(before, {key: sharding.HashRing(['c', 'b', 'a']).node_for(key) for key in keys})
+        self.assertTrue(all(400 < list(before.values()).count(node) < 900 for node in 'abc'))
+        
+        ring.add('d')
+        after = {key: ring.node_for(key) for key in keys}
+        moved = [key for key in keys if after[key] != before[key]]
+        self.assertTrue(all(after[key] == 'd' for key in moved))
+        self.assertTrue(300 < len(moved) < 700)
+        ring.remove('d')
+        self.assertEqual({key: ring.node_for(key) for key in keys}, before)
+        self.assertIn(ring.node_for('watch-1', exclude={before['watch-1']}), set('abc') - {before['watch-1']})
+    
+    def test_router_forwards_by_device_and_fails_over(self):
+        """Test that the views forward to the owning shard, and to the next one when it is gone"""
+        shards = {name: self.start(name) for name in ('shard-0', 'shard-1')}
+        sharding.write_ring(self.directory, 1, shards)
+        ring = sharding.HashRing(shards)
+        user_id = next(f'watch-{i}' for i in itertools.count() if ring.node_for(f'watch-{i}') == 'shard-1')
+        
+        with override_settings(INGEST_SHARD_DIR=self.directory):
+            for _ in range(2):
+                response = self.client.post('/api/health-data/', {'user_id': user_id, 'heart_rate': 70},
+                                            format='json')
+                self.assertEqual((response.status_code, response.json()), (200, {'shard': 'shard-1'}))
+                self.assertEqual(response['X-Shard'], 'shard-1')
+            request = shards['shard-1'].requests[-1]
+            self.assertEqual((request['op'], request['generation']), ('ingest', 1))
+            self.assertEqual(request['data'], {'user_id': user_id, 'heart_rate': 70})
+            response = self.client.post('/api/health-data/backfill/', {'user_id': user_id, 'rows': []},
+                                        format='json')
+            self.assertEqual(shards['shard-1'].requests[-1]['op'], 'backfill')
+            for path in ('/api/health-data/', '/api/health-data/backfill/'):
+                response = self.client.post(path, [user_id], format='json')
+                self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+            self.assertEqual(len(shards['shard-1'].requests), 3)
+            self.assertFalse(shards['shard-0'].requests)
+            
+            self.stop('shard-1')
+            with self.assertLogs('api.sharding', 'WARNING'):
+                response = self.client.post('/api/health-data/', {'user_id': user_id}, format='json')
+            self.assertEqual(response.json(), {'shard': 'shard-0'})
+            
+            self.stop('shard-0')
+            with self.assertLogs('api.sharding', 'WARNING'):
+                response = self.client.post('/api/health-data/', {'user_id': user_id}, format='json')
+            self.assertEqual(response.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+        self.assertEqual(HealthData.objects.count(), 0)
+    
+    def test_shard_ingests_and_drops_state_of_devices_it_loses(self):
+        """Test that a shard runs ingestion and forgets devices a new ring gives to another shard"""
+        patient = Patient.objects.create(name="Sharded", age=80, gender="MALE", user_id="watch-s")
+        sharding.write_ring(self.directory, 1, ['shard-0'])
+        shard = sharding.Shard('shard-0', self.directory)
+        payload = {
+            'user_id': 'watch-s', 'seq': 1, 'heart_rate': 72, 'spo2': 97,
+            'accelerometer_x': 0.0, 'accelerometer_y': 0.0, 'accelerometer_z': 9.8,
+            'gyroscope_x': 0.0, 'gyroscope_y': 0.0, 'gyroscope_z': 0.0,
+        }
+        message = {'op': 'ingest', 'generation': 1, 'load_shedding': False, 'data': payload}
+        with override_settings(SERVER_TIMING_ENABLED=True):
+            status_code, headers, body = shard.handle(json.dumps(message))
+        self.assertEqual(status_code, 200)
+        self.assertIn('total;dur=', headers['Server-Timing'])
+        self.assertNotIn('Content-Type', headers)
+        self.assertEqual(json.loads(body)['health_data_id'], HealthData.objects.get(patient=patient).id)
+        self.assertIsNotNone(liveness.tracker.last_seen('watch-s'))
+        self.assertEqual(seq_window.check(patient.id, 1), DUPLICATE)
+        
+        sharding.write_ring(self.directory, 2, ['shard-1'])
+        message.update(generation=2, data=dict(payload, seq=2))
+        with self.assertLogs('api.sharding', 'INFO'):
+            status_code, _, _ = shard.handle(json.dumps(message))
+        self.assertEqual((status_code, shard.generation), (200, 2))
+        # The device's state was dropped before the sample, then rebuilt from the database
+        self.assertFalse(shard.owns('watch-s'))
+        self.assertEqual(HealthData.objects.filter(patient=patient).count(), 2)
+        self.assertEqual(sharding.SHARD_REBALANCES.value('devices_dropped'), 1)
+
+
+class ModelExportTests(TestCase):
+    """Test the NumPy-only model exports against scikit-learn"""
+    
+    def setUp(self):
+        rng = np.random.default_rng(11)
+        self.X = rng.normal(size=(2000, len(FEATURE_NAMES)))
+        self.X[rng.random(self.X.shape) < 0.1] = np.nan
+        self.X[:, FEATURE_NAMES.index('temperature')] = np.nan
+        signal = np.nan_to_num(self.X[:, 0]) + 0.5 * np.nan_to_num(self.X[:, 3])
+        self.y = (signal + rng.normal(scale=0.5, size=len(signal)) > 1).astype(int)
+    
+    def assertParity(self, estimator):
+        with warnings.catch_warnings():
+            # SimpleImputer warns about the empty temperature column
+            warnings.simplefilter('ignore', UserWarning)
+            estimator.fit(self.X, self.y)
+            expected = estimator.predict_proba(self.X)
+        exported = model_export.export(estimator, self.X.shape[1])
+        np.testing.assert_allclose(exported.predict_proba(self.X), expected, rtol=0, atol=1e-12)
+        # Single rows, as ingestion scores them
+        for row, probabilities in zip(self.X[:20], expected[:20]):
+            np.testing.assert_allclose(exported.predict_proba(row.reshape(1, -1))[0], probabilities, atol=1e-12)
+        
+        stream = io.BytesIO()
+        model_export.save(exported, stream)
+        stream.seek(0)
+        np.testing.assert_allclose(model_export.load(stream).predict_proba(self.X), expected, rtol=0, atol=1e-12)
+    
+    def test_training_candidates(self):
+        """Test parity for the pipelines train_models fits"""
+        for name, candidate in training.CANDIDATES.items():
+            with self.subTest(name):
+                self.assertParity(candidate())
+    
+    def test_other_supported_estimators(self):
+        """Test trees with missing values, dropped empty columns and multinomial regression"""
+        self.assertParity(DecisionTreeClassifier(max_depth=6, random_state=0))
+        self.assertParity(make_pipeline(SimpleImputer(), DecisionTreeClassifier(random_state=0)))
+        self.assertParity(make_pipeline(SimpleImputer(), StandardScaler(), LogisticRegression(multi_class='multinomial')))
+    
+    def test_unsupported_estimators(self):
+        """Test that estimators without an export are refused"""
+        for estimator in (make_pipeline(StandardScaler(), SimpleImputer(), LogisticRegression()),
+                          make_pipeline(SimpleImputer(), GradientBoostingClassifier(n_estimators=5))):
+            with warnings.catch_warnings():
+                warnings.simplefilter('ignore', UserWarning)
+                estimator.fit(np.nan_to_num(self.X), self.y)
+            with self.assertRaises(TypeError):
+                model_export.export(estimator, self.X.shape[1])
+
+
+class WarmupTests(CacheResetMixin, FakeFirebaseMixin, APITestCase):
+    """Test the warm-up steps and the readiness endpoint"""
+    
+    def setUp(self):
+        super().setUp()
+        warmup.reset()
+        self.addCleanup(warmup.reset)
+    
+    def test_ready_only_after_warm_up(self):
+        """Test that /ready answers 503 and starts the warm-up until it has run"""
+        with mock.patch.object(warmup, 'start') as start:
+            response = self.client.get(reverse('ready'))
+        self.assertEqual(response.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+        self.assertFalse(response.json()['ready'])
+        start.assert_called_once()
+        
+        with self.assertLogs('api.warmup', 'INFO'):
+            self.assertTrue(warmup.run())
+        self.assertEqual(self.firestore.reads, 1)
+        response = self.client.get(reverse('ready'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        body = response.json()
+        self.assertEqual(list(body['steps']), ['models', 'database', 'firebase', 'routes', 'liveness'])
+        self.assertEqual(body['errors'], {})
+        self.assertIn('server_warmup_seconds{step="models"}', metrics.REGISTRY.render())
+    
+    def test_failed_steps(self):
+        """Test that only required steps keep the process from being ready"""
+        views.firebase_service.initialized = False
+        with self.assertLogs('api.warmup', 'WARNING'):
+            self.assertTrue(warmup.run())
+        self.assertIn('firebase', warmup.state.errors)
+        
+        warmup.reset()
+        def unreachable():
+            raise DatabaseError("connection refused")
+        steps = tuple((name, unreachable if name == 'database' else step, optional)
+                      for name, step, optional in warmup.STEPS)
+        with mock.patch.object(warmup, 'STEPS', steps), self.assertLogs('api.warmup', 'WARNING'):
+            self.assertFalse(warmup.run())
+        self.assertEqual(warmup.state.errors['database'], "connection refused")
+        with mock.patch.object(warmup, 'start'):
+            self.assertEqual(self.client.get(reverse('ready')).status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+
+
+class LazyImportTests(TestCase):
+    """Test that heavy dependencies are loaded on first use"""
+    
+    def test_api_import_skips_heavy_modules(self):
+        """Test that setting up Django and importing the views loads no heavy dependency"""
+        # requests is left out: rest_framework.compat imports it whenever it is installed
+        script = (
+            "import django, sys; django.setup(); import api.views, api.urls; "
+            "print(' '.join(m for m in ('numpy', 'firebase_admin', 'joblib', 'sklearn') if m in sys.modules))"
+        )
+        result = subprocess.run([sys.executable, '-c', script], capture_output=True, text=True, check=True,
+                                cwd=settings.BASE_DIR, env=dict(os.environ, LOG_LEVEL='ERROR'))
+        self.assertEqual(result.stdout.strip(), '')
+    
+    def test_firebase_initialized_on_first_use(self):
+        """Test that FirebaseService initializes the SDK once, when first used"""
+        def unavailable(service):
+            service.initialized = False
+        with mock.patch.object(FirebaseService, 'initialize_firebase', autospec=True,
+                               side_effect=unavailable) as initialize:
+            service = FirebaseService()
+            initialize.assert_not_called()
+            self.assertFalse(service.initialized)
+            self.assertIsNone(service.db)
+            initialize.assert_called_once_with(service)
+        
+        service = FirebaseService()
+        service.initialized, service.db = True, FakeFirestore()
+        self.assertIsInstance(service.db, FakeFirestore)
@@ -0,0 +1,235 @@
+"""
+Rate limiting and load shedding for health data ingestion.
+
+Two token buckets guard ``POST /api/health-data/``: one per device
+(``user_id``) so a device stuck in a retry loop cannot starve the others, and
+one global bucket sized to what the server can process. A request that finds
+its bucket empty gets 429 with ``Retry-After`` (via DRF's throttling).
+When ingestion is sharded (api.sharding) the device bucket is checked by the
+shard that owns the device instead, so each device has one bucket however
+many web workers its requests reach; the global bucket stays with the web
+workers.
+
+The global bucket also drives load shedding. Readings that look normal
+cannot use the last INGEST_GLOBAL_RESERVE (a fraction of the burst) of its
+tokens, which are kept for readings that could raise an alert; and while the
+bucket is below INGEST_SHED_LEVEL (also a fraction), normal readings are not
+mirrored to Firestore. Readings that could raise an alert, as judged by the
+health predictor, are never rejected by either bucket. Under overload the
+server therefore first drops background work, then normal readings.
+
+Buckets live in process memory by default. With INGEST_RATE_LIMIT_BACKEND
+set to ``cache`` they are kept in a Django cache (e.g. Redis) and shared by
+all worker processes; updates are read-modify-write without locking, so
+concurrent requests can occasionally overdraw a bucket slightly. A warning is
+logged when that cache is not shared between processes (no REDIS_URL).
+"""
+import logging
+import math
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+from rest_framework.throttling import BaseThrottle
+
+from . import metrics, sharding
+
+logger = logging.getLogger(__name__)
+
+INGEST_THROTTLED = metrics.Counter(
+    'health_ingest_throttled_total',
+    'Health data uploads rejected with 429, by the bucket that was empty',
+    ['scope'],
+)
+INGEST_SHED = metrics.Counter(
+    'health_ingest_shed_total',
+    'Work dropped by load shedding, by kind',
+    ['kind'],
+)
+
+IMU_FIELDS = tuple(f'{sensor}_{axis}' for sensor in ('accelerometer', 'gyroscope') for axis in 'xyz')
+
+
+def could_alert(data):
+    """Whether a reading could raise an alert, scored by the health predictor on the reading alone"""
+    from .views import health_predictor
+    
+    try:
+        imu = [float(data[field]) for field in IMU_FIELDS]
+        vitals = [float(data['heart_rate']), float(data['spo2'])]
+    except (KeyError, TypeError, ValueError):
+        # Let validation report it rather than rejecting it here
+        return True
+    if not all(map(math.isfinite, imu + vitals)):
+        return True
+    return health_predictor.could_alert(imu, vitals)
+
+
+def _refill(state, rate, burst, now):
+    tokens, stamp = state if state is not None else (burst, now)
+    return min(burst, tokens + max(0.0, now - stamp) * rate)
+
+
+class LocalBuckets:
+    """Token buckets in process memory, evicting the least recently used keys"""
+    
+    clock = staticmethod(time.monotonic)
+    
+    def __init__(self, rate, burst, max_keys=10000):
+        self.rate = rate
+        self.burst = burst
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+    
+    def take(self, key, reserve=0):
+        """
+        Take a token unless that would leave fewer than ``reserve``
+        
+        Returns:
+            Tuple of (allowed, seconds until allowed, tokens left)
+        """
+        with self._lock:
+            now = self.clock()
+            tokens = _refill(self._buckets.get(key), self.rate, self.burst, now)
+            allowed = tokens - 1 >= reserve
+            if allowed:
+                tokens -= 1
+            self._buckets[key] = (tokens, now)
+            self._buckets.move_to_end(key)
+            if len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        wait = 0.0 if allowed else (reserve + 1 - tokens) / self.rate
+        return allowed, wait, tokens
+
+
+class CacheBuckets:
+    """Token buckets in a Django cache, shared by every process using it"""
+    
+    clock = staticmethod(time.time)
+    
+    def __init__(self, rate, burst, alias='default'):
+        self.rate = rate
+        self.burst = burst
+        self.cache = caches[alias]
+    
+    def take(self, key, reserve=0):
+        """Take a token unless that would leave fewer than ``reserve`` (see LocalBuckets.take)"""
+        cache_key = f'ingest-bucket:{key}'
+        now = self.clock()
+        tokens = _refill(self.cache.get(cache_key), self.rate, self.burst, now)
+        allowed = tokens - 1 >= reserve
+        if allowed:
+            tokens -= 1
+        # Idle buckets refill completely, so they can expire once full
+        self.cache.set(cache_key, (tokens, now), timeout=math.ceil(self.burst / self.rate) + 1)
+        wait = 0.0 if allowed else (reserve + 1 - tokens) / self.rate
+        return allowed, wait, tokens
+
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def get_buckets(scope):
+    """Bucket store for 'device' or 'global' as currently configured, or None if unlimited"""
+    rate = float(getattr(settings, f'INGEST_{scope.upper()}_RATE', 0))
+    if rate <= 0:
+        return None
+    burst = float(getattr(settings, f'INGEST_{scope.upper()}_BURST', 0)) or rate
+    backend = getattr(settings, 'INGEST_RATE_LIMIT_BACKEND', 'local')
+    config = (scope, rate, burst, backend)
+    with _stores_lock:
+        store = _stores.get(config)
+        if store is None:
+            if backend == 'cache':
+                store = CacheBuckets(rate, burst, getattr(settings, 'INGEST_RATE_LIMIT_CACHE', 'default'))
+                if isinstance(store.cache, (LocMemCache, DummyCache)):
+                    logger.warning("INGEST_RATE_LIMIT_BACKEND=cache, but the %s cache is not shared between "
+                                   "processes (set REDIS_URL); %s rate limits are not shared either",
+                                   store.cache.__class__.__name__, scope,
+                                   extra={'event': 'throttling.cache_not_shared'})
+            else:
+                store = LocalBuckets(rate, burst)
+            _stores[config] = store
+    return store
+
+
+def take_device_token(user_id, data):
+    """
+    Take a token from a device's bucket, as the owning shard does
+    
+    Readings that could raise an alert are let through an empty bucket.
+    
+    Returns:
+        Tuple of (allowed, seconds until allowed)
+    """
+    device = get_buckets('device')
+    if device is None or not user_id:
+        return True, 0.0
+    allowed, wait, _ = device.take(f'device:{user_id}')
+    if allowed or could_alert(data):
+        return True, 0.0
+    INGEST_THROTTLED.labels('device').inc()
+    return False, wait
+
+
+def reset():
+    """Forget all in-memory buckets"""
+    with _stores_lock:
+        _stores.clear()
+
+
+class IngestRateThrottle(BaseThrottle):
+    """
+    Per-device and global token buckets for health data ingestion
+    
+    The device bucket (INGEST_DEVICE_RATE per second, INGEST_DEVICE_BURST) is
+    checked first, so a device that is over its limit does not also drain the
+    global bucket (INGEST_GLOBAL_RATE, INGEST_GLOBAL_BURST). Normal-looking
+    readings may not take the reserved share of the global tokens, and
+    readings that could raise an alert get through empty buckets. Sets
+    ``request.load_shedding`` while the global bucket is below the shed level.
+    The device bucket is left to the owning shard when ingestion is sharded.
+    """
+    
+    def allow_request(self, request, view):
+        request.load_shedding = False
+        self._wait = 0.0
+        data = request.data if hasattr(request.data, 'get') else {}
+        
+        alerting = None
+        device = None if sharding.routing() else get_buckets('device')
+        if device is not None:
+            user_id = data.get('user_id') or self.get_ident(request)
+            allowed, self._wait, _ = device.take(f'device:{user_id}')
+            if not allowed:
+                alerting = could_alert(data)
+                if not alerting:
+                    INGEST_THROTTLED.labels('device').inc()
+                    return False
+        
+        server = get_buckets('global')
+        if server is None:
+            return True
+        if alerting is None:
+            alerting = could_alert(data)
+        reserve = 0 if alerting else server.burst * getattr(settings, 'INGEST_GLOBAL_RESERVE', 0)
+        allowed, self._wait, tokens = server.take('global', reserve)
+        if alerting:
+            return True
+        if not allowed:
+            INGEST_THROTTLED.labels('global').inc()
+            if tokens >= 1:
+                # Refused only because the reserve is kept for readings that could alert
+                INGEST_SHED.labels('normal_reading').inc()
+            return False
+        request.load_shedding = tokens < server.burst * getattr(settings, 'INGEST_SHED_LEVEL', 0)
+        return True
+    
+    def wait(self):
+        return self._wait
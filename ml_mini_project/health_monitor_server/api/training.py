@@ -0,0 +1,229 @@
+"""
+Training the fall and vitals models from stored health data.
+
+Samples are streamed in blocks from the database and the archive (see
+api.backtest), turned into windowed feature matrices (api.features) and
+labeled from the alerts guardians triaged:
+
+- a sample behind a RESOLVED alert of the model's type is a positive,
+- one behind a FALSE_ALARM alert is a negative,
+- samples that raised no alert at all are negatives, of which at most
+  ``max_unlabeled`` are kept (a uniform sample, so memory stays bounded).
+
+Samples behind alerts nobody has triaged yet are left out. Each candidate
+estimator is cross-validated in parallel and the best one, refitted on all the
+data, is saved to the model registry together with its NumPy-only export
+(api.model_export).
+"""
+import datetime
+import time
+
+import numpy as np
+import sklearn
+from sklearn.ensemble import RandomForestClassifier
+from sklearn.impute import SimpleImputer
+from sklearn.linear_model import LogisticRegression
+from sklearn.model_selection import StratifiedKFold, cross_validate
+from sklearn.pipeline import make_pipeline
+from sklearn.preprocessing import StandardScaler
+
+from . import backtest, model_export, model_registry
+from .features import FEATURE_NAMES
+from .models import Alert
+
+# Alert type whose triaged alerts label each model
+ALERT_TYPES = {
+    model_registry.FALL_MODEL: 'FALL',
+    model_registry.VITALS_MODEL: 'VITALS',
+}
+
+# Largest probability difference allowed between an export and its estimator
+EXPORT_TOLERANCE = 1e-9
+
+
+def _logistic():
+    return make_pipeline(
+        SimpleImputer(strategy='median', keep_empty_features=True),
+        StandardScaler(),
+        LogisticRegression(class_weight='balanced', max_iter=1000),
+    )
+
+
+def _forest():
+    return make_pipeline(
+        SimpleImputer(strategy='median', keep_empty_features=True),
+        RandomForestClassifier(n_estimators=100, max_depth=8, min_samples_leaf=5,
+                               class_weight='balanced', random_state=0),
+    )
+
+
+# Estimators tried for each model, by name
+CANDIDATES = {
+    'logistic': _logistic,
+    'forest': _forest,
+}
+
+
+def _lookup(sorted_ids, ids):
+    """Index into sorted_ids for each id, and whether it is there"""
+    if not len(sorted_ids):
+        return np.zeros(len(ids), dtype=np.int64), np.zeros(len(ids), dtype=bool)
+    index = np.minimum(np.searchsorted(sorted_ids, ids), len(sorted_ids) - 1)
+    return index, sorted_ids[index] == ids
+
+
+class TrainingData:
+    """Labeled feature matrices collected block by block"""
+
+    def __init__(self, labels, alerted_ids, max_unlabeled=500000, window_size=30, seed=0):
+        """
+        Args:
+            labels: backtest.load_labels() result
+            alerted_ids: Sorted ids of every sample referenced by an alert
+            max_unlabeled: Samples without alerts kept as negatives
+        """
+        self.labels = labels
+        self.alerted_ids = alerted_ids
+        self.max_unlabeled = max_unlabeled
+        self.samples = 0
+        self._features = backtest.BlockFeatures(window_size)
+        self._rng = np.random.default_rng(seed)
+        self._unlabeled = np.empty((0, len(FEATURE_NAMES)))
+        self._keys = np.empty(0)
+        self._labeled = {alert_type: ([], []) for alert_type in ALERT_TYPES.values()}
+        self._spans = {}
+
+    def add(self, block):
+        features = self._features(block)
+        self.samples += len(block)
+        first, last = block.samples[0, 0], block.samples[-1, 0]
+        span = self._spans.get(block.patient_id)
+        self._spans[block.patient_id] = (first, last) if span is None else (min(span[0], first), max(span[1], last))
+
+        for alert_type, (matrices, outcomes) in self._labeled.items():
+            if alert_type not in self.labels:
+                continue
+            label_ids, label_outcomes = self.labels[alert_type]
+            index, labeled = _lookup(label_ids, block.ids)
+            if labeled.any():
+                matrices.append(features[labeled])
+                outcomes.append(label_outcomes[index[labeled]])
+
+        # Uniform sample of the rest: keep the rows with the smallest random keys
+        _, alerted = _lookup(self.alerted_ids, block.ids)
+        self._unlabeled = np.concatenate((self._unlabeled, features[~alerted]))
+        self._keys = np.concatenate((self._keys, self._rng.random(int((~alerted).sum()))))
+        if len(self._keys) > self.max_unlabeled:
+            keep = np.argpartition(self._keys, self.max_unlabeled)[:self.max_unlabeled]
+            self._unlabeled, self._keys = self._unlabeled[keep], self._keys[keep]
+
+    def dataset(self, alert_type):
+        """Feature matrix and 0/1 labels for one alert type"""
+        matrices, outcomes = self._labeled[alert_type]
+        X = np.concatenate(matrices + [self._unlabeled])
+        y = np.concatenate(outcomes + [np.zeros(len(self._unlabeled), dtype=bool)]).astype(int)
+        return X, y
+
+    def time_range(self):
+        if not self._spans:
+            return None, None
+        first = min(span[0] for span in self._spans.values())
+        last = max(span[1] for span in self._spans.values())
+        return (datetime.datetime.fromtimestamp(first, tz=datetime.timezone.utc),
+                datetime.datetime.fromtimestamp(last, tz=datetime.timezone.utc))
+
+    @property
+    def patients(self):
+        return len(self._spans)
+
+
+def alerted_ids():
+    """Sorted ids of every sample referenced by an alert"""
+    ids = Alert.objects.filter(health_data__isnull=False).values_list('health_data_id', flat=True)
+    return np.unique(np.fromiter(ids, dtype=np.int64))
+
+
+def inference_latency(estimator, X, rows=200):
+    """Seconds per row scored one at a time (median), and in one batch"""
+    X = X[:max(rows, 10000)]
+    single = []
+    for row in X[:rows]:
+        started = time.perf_counter()
+        estimator.predict_proba(row.reshape(1, -1))
+        single.append(time.perf_counter() - started)
+    started = time.perf_counter()
+    estimator.predict_proba(X)
+    batch = (time.perf_counter() - started) / len(X)
+    return float(np.median(single)), batch
+
+
+def train(X, y, candidates=None, folds=5, n_jobs=-1, seed=0):
+    """
+    Cross-validate candidate estimators and refit the best on all the data
+
+    The candidate with the best mean average precision (the area under the
+    precision-recall curve, which suits rare positives) is chosen.
+
+    Returns:
+        Tuple of (fitted estimator, its ExportedModel or None, metadata dict)
+
+    Raises:
+        ValueError: if there are not at least 2 positives and 2 negatives
+    """
+    candidates = candidates or list(CANDIDATES)
+    positives = int(y.sum())
+    negatives = len(y) - positives
+    folds = min(folds, positives, negatives)
+    if folds < 2:
+        raise ValueError(f"Need at least 2 positive and 2 negative samples, have {positives} and {negatives}")
+
+    splitter = StratifiedKFold(folds, shuffle=True, random_state=seed)
+    scores = {}
+    for name in candidates:
+        results = cross_validate(CANDIDATES[name](), X, y, cv=splitter,
+                                 scoring=('roc_auc', 'average_precision'), n_jobs=n_jobs)
+        scores[name] = {
+            'roc_auc': float(results['test_roc_auc'].mean()),
+            'average_precision': float(results['test_average_precision'].mean()),
+        }
+    best = max(candidates, key=lambda name: scores[name]['average_precision'])
+
+    started = time.perf_counter()
+    estimator = CANDIDATES[best]().fit(X, y)
+    training_seconds = time.perf_counter() - started
+    single, batch = inference_latency(estimator, X)
+
+    # Keep the NumPy-only export only if it scores exactly like the estimator
+    exported = export = None
+    try:
+        exported = model_export.export(estimator, X.shape[1])
+    except TypeError:
+        pass
+    if exported is not None:
+        sample = X[:10000]
+        difference = float(np.abs(
+            exported.positive_probabilities(sample) - estimator.predict_proba(sample)[:, 1]
+        ).max())
+        if difference <= EXPORT_TOLERANCE:
+            exported_single, exported_batch = inference_latency(exported, X)
+            export = {
+                'max_difference': difference,
+                'inference_seconds_per_row': {'single': exported_single, 'batch': exported_batch},
+            }
+        else:
+            exported = None
+
+    metadata = {
+        'feature_names': list(FEATURE_NAMES),
+        'estimator': best,
+        'sklearn_version': sklearn.__version__,
+        'trained_at': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        'training_seconds': training_seconds,
+        'samples': len(y),
+        'positives': positives,
+        'negatives': negatives,
+        'cross_validation': {'folds': folds, 'scores': scores},
+        'inference_seconds_per_row': {'single': single, 'batch': batch},
+        'export': export,
+    }
+    return estimator, exported, metadata
@@ -12,5 +12,7 @@ router.register(r'alerts', views.AlertViewSet)
 urlpatterns = [
     path('', include(router.urls)),
     path('health-data/', views.process_health_data, name='process-health-data'),
+    path('health-data/backfill/', views.backfill_health_data, name='backfill-health-data'),
+    path('dashboard/', views.dashboard, name='dashboard'),
     path('chat/', views.chat_with_health_assistant, name='chat-with-health-assistant'),
 ]
\ No newline at end of file
@@ -1,14 +1,71 @@
 from rest_framework import viewsets, status
-from rest_framework.decorators import api_view, action
+from rest_framework.decorators import api_view, action, parser_classes, throttle_classes
 from rest_framework.response import Response
+from django.conf import settings
 from django.shortcuts import render, redirect
-from .models import Patient, Guardian, HealthData, Alert
-from .serializers import PatientSerializer, GuardianSerializer, HealthDataSerializer, AlertSerializer
-from .ml_predictor import HealthPredictor
+from django.http import HttpResponse, Http404, JsonResponse, StreamingHttpResponse
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+from django.utils.functional import SimpleLazyObject
+from .models import RISK_LEVELS, Patient, Guardian, HealthData, Alert, PatientStatus
+from .serializers import (
+    PatientSerializer, GuardianSerializer, AlertSerializer,
+    AlertBulkStatusSerializer, alert_rows, health_data_rows, patient_status_rows,
+)
 from .firebase_service import FirebaseService
 from .firebase_repository import FirebaseRepository
+from . import cache, liveness, metrics, sharding, state_table, warmup
+from .conditional import conditional_response, instance_validators, queryset_validators
+from .dedup import DUPLICATE, NEW, UNKNOWN, seq_window
+from .parsers import CompressedJSONParser
+from .throttling import INGEST_SHED, IngestRateThrottle
+import csv
+import datetime
+import io
 import json
-import requests
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+# Device sample times further ahead of the server clock are rejected
+MAX_CLOCK_SKEW = datetime.timedelta(minutes=5)
+
+# Largest seq and boot the BigIntegerFields hold
+MAX_BIGINT = 2 ** 63 - 1
+
+# Readings every sample must have: vitals and the IMU
+REQUIRED_SENSOR_FIELDS = ['heart_rate', 'spo2', 'accelerometer_x', 'accelerometer_y',
+                          'accelerometer_z', 'gyroscope_x', 'gyroscope_y', 'gyroscope_z']
+
+# Readings from optional sensors (thermometer, blood pressure module, ...)
+OPTIONAL_SENSOR_FIELDS = ['temperature', 'systolic_bp', 'diastolic_bp', 'respiratory_rate']
+
+INGEST_STAGE_SECONDS = metrics.Histogram(
+    'health_ingest_stage_seconds',
+    'Time spent per request in each stage of health data ingestion',
+    ['stage'],
+)
+INGEST_REQUEST_SECONDS = metrics.Histogram(
+    'health_ingest_request_seconds',
+    'Total time spent processing a health data upload',
+)
+INGEST_ALERT_PUSH_SECONDS = metrics.Histogram(
+    'health_alert_push_seconds',
+    'Time from starting to process an anomalous sample to its push notifications being sent',
+)
+INGEST_DUPLICATES = metrics.Counter(
+    'health_ingest_duplicates_total',
+    'Retried health data uploads that were dropped, by where the duplicate was detected',
+    ['source'],
+)
+INGEST_ERRORS = metrics.Counter(
+    'health_ingest_errors_total',
+    'Health data uploads that failed, by the stage that raised',
+    ['stage'],
+)
 
 def home(request):
     """Render the home page"""
@@ -101,7 +158,9 @@ def home(request):
             <li><code>GET /api/alerts/</code> - List all alerts</li>
             <li><code>POST /api/alerts/{id}/acknowledge/</code> - Acknowledge an alert</li>
             <li><code>POST /api/alerts/{id}/resolve/</code> - Resolve an alert</li>
+            <li><code>POST /api/alerts/bulk-status/</code> - Set the status of many alerts</li>
             <li><code>POST /api/chat/</code> - Chat with health assistant</li>
+            <li><code>GET /metrics</code> - Prometheus metrics for ingestion latency</li>
         </ul>
     </div>
     
@@ -124,8 +183,14 @@ def home(request):
     
     return HttpResponse(html)
 
-# Initialize ML predictor, Firebase service, and Firebase repository
-health_predictor = HealthPredictor()
+def _health_predictor():
+    from .ml_predictor import HealthPredictor
+    return HealthPredictor()
+
+# Initialize ML predictor, Firebase service, and Firebase repository. NumPy,
+# the models and Firebase Admin are loaded on first use (or by api.warmup), so
+# management commands and the admin, which import this module, do not pay for them.
+health_predictor = SimpleLazyObject(_health_predictor)
 firebase_service = FirebaseService()
 firebase_repository = FirebaseRepository()
 
@@ -134,6 +199,14 @@ class PatientViewSet(viewsets.ModelViewSet):
     queryset = Patient.objects.all()
     serializer_class = PatientSerializer
     
+    def retrieve(self, request, *args, **kwargs):
+        """Get a patient, or 304 if unchanged since the client's copy"""
+        patient = self.get_object()
+        return conditional_response(
+            request, instance_validators(patient),
+            lambda: Response(self.get_serializer(patient).data)
+        )
+    
     def perform_create(self, serializer):
         """Override create to save patient to Firebase"""
         patient = serializer.save()
@@ -154,21 +227,98 @@ class PatientViewSet(viewsets.ModelViewSet):
         serializer = GuardianSerializer(guardians, many=True)
         return Response(serializer.data)
     
+    @action(detail=True, methods=['get'])
+    def latest(self, request, pk=None):
+        """Get a patient's latest reading, from the shared state table when it holds it"""
+        try:
+            patient_id = int(pk)
+        except ValueError:
+            raise Http404
+        reading = state_table.latest(patient_id)
+        if reading is None:
+            reading = PatientStatus.objects.filter(patient_id=patient_id).values(
+                'patient', 'last_seen', *PatientStatus.VITAL_FIELDS,
+                'risk_probability', 'fall_probability', 'risk_level',
+            ).first()
+            if reading is None:
+                raise Http404
+        return Response(reading)
+    
     @action(detail=True, methods=['get'])
     def alerts(self, request, pk=None):
         """Get alerts for a specific patient"""
         patient = self.get_object()
         alerts = Alert.objects.filter(patient=patient).order_by('-timestamp')
-        serializer = AlertSerializer(alerts, many=True)
-        return Response(serializer.data)
+        return conditional_response(
+            request, queryset_validators(alerts, related=[patient]),
+            lambda: Response(alert_rows.rows(alerts))
+        )
     
     @action(detail=True, methods=['get'])
     def health_data(self, request, pk=None):
-        """Get health data for a specific patient"""
+        """Get health data for a specific patient, including archived samples"""
+        from . import archive
+        
         patient = self.get_object()
         health_data = HealthData.objects.filter(patient=patient).order_by('-timestamp')[:100]  # Get last 100 entries
-        serializer = HealthDataSerializer(health_data, many=True)
-        return Response(serializer.data)
+        return conditional_response(
+            request, queryset_validators(health_data, related=[patient], extra=archive.state(patient.id)),
+            lambda: Response(_history_rows(patient, archive.history(patient.id, descending=True, limit=100)))
+        )
+    
+    @action(detail=True, methods=['get'])
+    def export(self, request, pk=None):
+        """Download a patient's health data as CSV, oldest first, including archived samples"""
+        from . import archive
+        
+        patient = self.get_object()
+        try:
+            start = _parse_range_param(request.query_params.get('start'))
+            end = _parse_range_param(request.query_params.get('end'))
+        except ValueError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        
+        def lines():
+            buffer = io.StringIO()
+            writer = csv.writer(buffer)
+            writer.writerow(archive.COLUMNS)
+            for record in archive.history(patient.id, start, end):
+                writer.writerow([
+                    record['timestamp'].isoformat() if name == 'timestamp' else record[name]
+                    for name in archive.COLUMNS
+                ])
+                if buffer.tell() > 65536:
+                    yield buffer.getvalue()
+                    buffer.seek(0)
+                    buffer.truncate()
+            yield buffer.getvalue()
+        
+        response = StreamingHttpResponse(lines(), content_type='text/csv')
+        response['Content-Disposition'] = f'attachment; filename="patient-{patient.id}-health-data.csv"'
+        return response
+
+def _history_rows(patient, records):
+    """Render archive.history() records like health_data_rows"""
+    related = {'patient_id': patient.id, 'patient__name': patient.name}
+    columns = health_data_rows.columns
+    return health_data_rows.convert(
+        tuple(related[column] if column in related else record[column] for column in columns)
+        for record in records
+    )
+
+def _parse_range_param(value):
+    """Optional date or datetime query parameter, as an aware datetime"""
+    if not value:
+        return None
+    parsed = parse_datetime(value)
+    if parsed is None:
+        day = parse_date(value)
+        if day is None:
+            raise ValueError(f'Invalid date: {value}')
+        parsed = datetime.datetime.combine(day, datetime.time())
+    if timezone.is_naive(parsed):
+        parsed = timezone.make_aware(parsed, datetime.timezone.utc)
+    return parsed
 
 class GuardianViewSet(viewsets.ModelViewSet):
     """API endpoint for guardians"""
@@ -192,6 +342,29 @@ class AlertViewSet(viewsets.ModelViewSet):
     queryset = Alert.objects.all().order_by('-timestamp')
     serializer_class = AlertSerializer
     
+    def list(self, request, *args, **kwargs):
+        """List alerts, rendered from values() rows rather than model instances"""
+        queryset = self.filter_queryset(self.get_queryset())
+        return conditional_response(
+            request, queryset_validators(queryset, lookups=['patient__updated_at']),
+            lambda: self._list_rows(queryset)
+        )
+    
+    def _list_rows(self, queryset):
+        rows = alert_rows.values(queryset)
+        page = self.paginate_queryset(rows)
+        if page is not None:
+            return self.get_paginated_response(alert_rows.convert(page))
+        return Response(alert_rows.convert(rows))
+    
+    def retrieve(self, request, *args, **kwargs):
+        """Get an alert, or 304 if unchanged since the client's copy"""
+        alert = self.get_object()
+        return conditional_response(
+            request, instance_validators(alert, alert.patient),
+            lambda: Response(self.get_serializer(alert).data)
+        )
+    
     def perform_create(self, serializer):
         """Override create to save alert to Firebase"""
         alert = serializer.save()
@@ -229,122 +402,393 @@ class AlertViewSet(viewsets.ModelViewSet):
         
         serializer = AlertSerializer(alert)
         return Response(serializer.data)
+    
+    @action(detail=False, methods=['post'], url_path='bulk-status')
+    def bulk_status(self, request):
+        """Set the status of many alerts, selected by ids or filters"""
+        serializer = AlertBulkStatusSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        new_status = serializer.validated_data['status']
+        
+        updated = set_alerts_status(serializer.get_queryset(), new_status)
+        return Response({'status': new_status, 'updated': updated})
+
+def set_alerts_status(queryset, new_status):
+    """
+    Change the status of the alerts in a queryset and mirror it to Firebase
+    
+    The database is updated in a single statement and Firestore with batched
+    writes. Returns the number of alerts changed.
+    """
+    rows, fields = queryset.set_status(new_status)
+    if rows:
+        firebase_repository.update_alerts_status(rows, new_status, fields.get('resolved_at'))
+    return len(rows)
+
+@api_view(['GET'])
+def dashboard(request):
+    """
+    Every patient's latest vitals, risk level, open alerts and last-seen time
+    
+    Read from the PatientStatus summary rows in a single query, highest risk
+    first, then most open alerts, then most recently seen. ``?min_risk=HIGH``
+    leaves out patients at lower (or unknown) risk.
+    """
+    queryset = PatientStatus.objects.all()
+    min_risk = request.query_params.get('min_risk')
+    if min_risk:
+        if min_risk not in RISK_LEVELS:
+            return Response({'error': f"min_risk must be one of {', '.join(RISK_LEVELS)}"},
+                            status=status.HTTP_400_BAD_REQUEST)
+        queryset = queryset.filter(risk_rank__gte=RISK_LEVELS.index(min_risk))
+    queryset = queryset.order_by(
+        F('risk_rank').desc(nulls_last=True), '-open_alerts', F('last_seen').desc(nulls_last=True), 'patient_id'
+    )
+    return Response(patient_status_rows.rows(queryset))
 
 @api_view(['POST'])
+@throttle_classes([IngestRateThrottle])
 def process_health_data(request):
     """Process health data from sensors and predict anomalies"""
+    if not isinstance(request.data, dict):
+        return Response({'error': 'Expected a JSON object'}, status=status.HTTP_400_BAD_REQUEST)
+    load_shedding = getattr(request, 'load_shedding', False)
+    router = sharding.get_router()
+    if router is not None:
+        return router.respond('ingest', request.data, load_shedding)
+    return _process_health_data(request.data, load_shedding)
+
+def _process_health_data(data, load_shedding=False):
+    """Ingest one sample with stage timing, turning failures into a 500"""
+    timer = metrics.stage_timer(INGEST_STAGE_SECONDS, INGEST_REQUEST_SECONDS)
     try:
-        # Get data from request
-        data = request.data
+        response = _ingest_health_data(data, timer, load_shedding)
+    except Exception as e:
+        logger.exception("Error processing health data during stage %s", timer.current or 'unknown')
+        timer.record_error(INGEST_ERRORS)
+        response = Response({'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+    return timer.finish(response)
+
+def _parse_sample_time(value):
+    """Sample time sent by a device (epoch seconds or ISO 8601), or now"""
+    now = timezone.now()
+    if value is None:
+        return now
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        try:
+            sample_time = datetime.datetime.fromtimestamp(value, tz=datetime.timezone.utc)
+        except (OverflowError, OSError, ValueError):
+            raise ValueError(f'Invalid timestamp: {value}') from None
+    else:
+        sample_time = parse_datetime(str(value))
+        if sample_time is None:
+            raise ValueError(f'Invalid timestamp: {value}')
+        if timezone.is_naive(sample_time):
+            sample_time = timezone.make_aware(sample_time, datetime.timezone.utc)
+    if sample_time > now + MAX_CLOCK_SKEW:
+        raise ValueError(f'Timestamp is in the future: {value}')
+    return sample_time
+
+def _parse_counter(name, value):
+    """Non-negative integer that fits the BigIntegerField it is stored in"""
+    if isinstance(value, bool) or not isinstance(value, (int, str)) or not str(value).isdigit():
+        raise ValueError(f'Invalid {name}: {value}')
+    value = int(value)
+    if value > MAX_BIGINT:
+        raise ValueError(f'{name} out of range: {value}')
+    return value
+
+def _parse_seq(value, sample_time):
+    """Device sequence number, defaulting to the device's sample time in milliseconds"""
+    if value is None:
+        return int(sample_time.timestamp() * 1000) if sample_time is not None else None
+    return _parse_counter('seq', value)
+
+def _parse_boot(value):
+    """Number of the device boot its sequence numbers were counted in, 0 if it does not send one"""
+    if value is None:
+        return 0
+    return _parse_counter('boot', value)
+
+def _parse_report_interval(value):
+    """Seconds between the device's reports, if it sends them"""
+    if value is None:
+        return None
+    if isinstance(value, bool) or not isinstance(value, (int, float)) or not value > 0:
+        raise ValueError(f'Invalid report_interval: {value}')
+    return float(value)
+
+def _duplicate_response(patient, seq, boot, source):
+    """Acknowledge a retried sample without storing it or alerting again"""
+    INGEST_DUPLICATES.labels(source).inc()
+    health_data_id = HealthData.objects.filter(patient=patient, boot=boot, seq=seq).values_list(
+        'id', flat=True
+    ).first()
+    return Response({'health_data_id': health_data_id, 'duplicate': True}, status=status.HTTP_200_OK)
+
+def _ingest_health_data(data, timer, load_shedding=False):
+    """
+    Store a health data sample, run predictions and raise alerts
+    
+    Readings are scored before they are stored. Anomalous ones take the fast
+    lane: guardians are notified first, then the sample and its alerts are
+    stored and mirrored. Normal readings are stored and mirrored to Firebase in
+    batches, or not mirrored at all while load shedding.
+    """
+    from .features import feature_store
+    
+    received = time.perf_counter()
+    with timer.stage('validate'):
         user_id = data.get('user_id')
         
         # Validate required fields
-        required_fields = ['heart_rate', 'spo2', 'accelerometer_x', 'accelerometer_y', 
-                          'accelerometer_z', 'gyroscope_x', 'gyroscope_y', 'gyroscope_z']
+        required_fields = REQUIRED_SENSOR_FIELDS
         
         for field in required_fields:
             if field not in data:
                 return Response({'error': f'Missing required field: {field}'}, 
                               status=status.HTTP_400_BAD_REQUEST)
         
-        # Find patient by user_id
+        # Optional device sequence number, boot and sample time, used to drop retried uploads
+        device_time = data.get('timestamp')
+        try:
+            sample_time = _parse_sample_time(device_time)
+            seq = _parse_seq(data.get('seq'), sample_time if device_time is not None else None)
+            boot = _parse_boot(data.get('boot'))
+            report_interval = _parse_report_interval(data.get('report_interval'))
+        except ValueError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+    
+    # Find patient by user_id
+    with timer.stage('patient_lookup'):
         try:
-            patient = Patient.objects.get(user_id=user_id)
+            patient = cache.get_patient_by_user_id(user_id)
         except Patient.DoesNotExist:
             return Response({'error': f'Patient with user_id {user_id} not found'}, 
                            status=status.HTTP_404_NOT_FOUND)
-        
-        # Create health data entry
-        health_data = HealthData.objects.create(
-            patient=patient,
-            heart_rate=data['heart_rate'],
-            spo2=data['spo2'],
-            accelerometer_x=data['accelerometer_x'],
-            accelerometer_y=data['accelerometer_y'],
-            accelerometer_z=data['accelerometer_z'],
-            gyroscope_x=data['gyroscope_x'],
-            gyroscope_y=data['gyroscope_y'],
-            gyroscope_z=data['gyroscope_z']
-        )
-        
-        # Save health data to Firebase
-        firebase_repository.save_health_data(health_data)
-        
-        # Run ML predictions
+    
+    # The device is alive, even if this turns out to be a retry
+    received_at = timezone.now()
+    with timer.stage('liveness'):
+        liveness.heartbeat(user_id, patient.id, report_interval, received_at)
+    
+    # Sample fields, including optional readings from additional sensors
+    sample = {field: data[field] for field in required_fields}
+    sample.update({field: data[field] for field in OPTIONAL_SENSOR_FIELDS if data.get(field) is not None})
+    sample['timestamp'] = sample_time
+    sample['seq'] = seq
+    sample['boot'] = boot
+    
+    # Drop retries of a sample that is already stored
+    if seq is not None:
+        with timer.stage('dedup'):
+            seen = seq_window.check(patient.id, seq, boot)
+            source = 'memory'
+            if seen == UNKNOWN:
+                source = 'database'
+                stored = HealthData.objects.filter(patient=patient, boot=boot, seq=seq).exists()
+                seen = DUPLICATE if stored else NEW
+            if seen == DUPLICATE:
+                return _duplicate_response(patient, seq, boot, source)
+    
+    # Update the patient's sliding window and derive features
+    with timer.stage('features'):
+        feature_vector = feature_store.update(patient.id, sample)
+    
+    # Run ML predictions before storing, so anomalies can be pushed first
+    with timer.stage('predict'):
         # 1. Fall detection
         fall_result = health_predictor.predict_fall(
             [data['accelerometer_x']], [data['accelerometer_y']], [data['accelerometer_z']],
-            [data['gyroscope_x']], [data['gyroscope_y']], [data['gyroscope_z']]
+            [data['gyroscope_x']], [data['gyroscope_y']], [data['gyroscope_z']],
+            features=feature_vector
         )
         
         # 2. Vitals risk assessment
         vitals_result = health_predictor.predict_vitals_risk(
-            data['heart_rate'], data['spo2']
+            data['heart_rate'], data['spo2'], features=feature_vector
         )
-        
-        # Process results and create alerts if anomalies detected
-        alerts_created = []
-        
-        # Check for fall
-        if fall_result['is_anomaly']:
-            fall_alert = Alert.objects.create(
-                patient=patient,
-                type='FALL',
-                message=f"Fall detected with {fall_result['fall_probability']:.2%} confidence",
-                health_data=health_data,
-                status='NEW'
-            )
-            alerts_created.append(fall_alert)
-            
-            # Save alert to Firebase
-            firebase_repository.save_alert(fall_alert)
-            
-            # Send notifications to guardians
-            guardians = Guardian.objects.filter(patient=patient, notification_enabled=True)
-            firebase_service.send_alert_to_guardians(
-                guardians, 
-                patient.name, 
-                "Fall Detected", 
-                f"A fall was detected with {fall_result['fall_probability']:.2%} confidence"
-            )
-        
-        # Check for abnormal vitals
-        if vitals_result['is_anomaly']:
-            vitals_alert = Alert.objects.create(
+    
+    pending_alerts = []
+    if fall_result['is_anomaly']:
+        pending_alerts.append((
+            'FALL', "Fall Detected",
+            f"Fall detected with {fall_result['fall_probability']:.2%} confidence",
+            f"A fall was detected with {fall_result['fall_probability']:.2%} confidence",
+        ))
+    if vitals_result['is_anomaly']:
+        message = (f"Abnormal vitals detected: {vitals_result['risk_level']}. " +
+                   f"HR: {data['heart_rate']}, SpO2: {data['spo2']}")
+        pending_alerts.append(('VITALS', "Abnormal Vitals", message, message))
+    
+    # Fast lane: notify guardians before anything is written. A retry racing
+    # past the dedup check can be pushed twice, but is still stored once.
+    if pending_alerts:
+        with timer.stage('notify'):
+            guardians = cache.get_notifiable_guardians(patient)
+            for _, title, _, notification in pending_alerts:
+                firebase_service.send_alert_to_guardians(guardians, patient.name, title, notification)
+        INGEST_ALERT_PUSH_SECONDS.observe(time.perf_counter() - received)
+    
+    # Create health data entry
+    with timer.stage('insert'):
+        if seq is None:
+            health_data = HealthData.objects.create(patient=patient, **sample)
+        else:
+            try:
+                with transaction.atomic():
+                    health_data = HealthData.objects.create(patient=patient, **sample)
+            except IntegrityError:
+                # A concurrent retry, or one handled by another worker, got there first;
+                # reseed the feature window so it does not count the sample twice
+                feature_store.reset(patient.id)
+                seq_window.add(patient.id, seq, boot)
+                return _duplicate_response(patient, seq, boot, 'database')
+            seq_window.add(patient.id, seq, boot)
+    
+    # Show it on the dashboard, unless a newer sample got there first
+    with timer.stage('status'):
+        PatientStatus.objects.record_sample(patient.id, sample, vitals_result, fall_result,
+                                            received=received_at)
+        state_table.record_sample(patient.id, sample, vitals_result, fall_result)
+    
+    # Save health data to Firebase: now for readings that raise alerts, which
+    # link to it; batched for normal ones, or not at all under overload
+    if pending_alerts:
+        with timer.stage('firebase_save'):
+            firebase_repository.save_health_data(health_data)
+    elif load_shedding:
+        INGEST_SHED.labels('mirror').inc()
+    else:
+        with timer.stage('firebase_save'):
+            firebase_repository.buffer_health_data(health_data)
+    
+    # Create alerts for the anomalies that were pushed
+    alerts_created = []
+    for alert_type, _, message, _ in pending_alerts:
+        with timer.stage('alert_create'):
+            alert = Alert.objects.create(
                 patient=patient,
-                type='VITALS',
-                message=f"Abnormal vitals detected: {vitals_result['risk_level']}. " +
-                        f"HR: {data['heart_rate']}, SpO2: {data['spo2']}",
+                type=alert_type,
+                message=message,
                 health_data=health_data,
                 status='NEW'
             )
-            alerts_created.append(vitals_alert)
+            alerts_created.append(alert)
             
             # Save alert to Firebase
-            firebase_repository.save_alert(vitals_alert)
-            
-            # Send notifications to guardians
-            guardians = Guardian.objects.filter(patient=patient, notification_enabled=True)
-            firebase_service.send_alert_to_guardians(
-                guardians, 
-                patient.name, 
-                "Abnormal Vitals", 
-                f"Abnormal vitals detected: {vitals_result['risk_level']}. " +
-                f"HR: {data['heart_rate']}, SpO2: {data['spo2']}"
-            )
-        
-        # Return results
-        response_data = {
-            'health_data_id': health_data.id,
-            'fall_detection': fall_result,
-            'vitals_assessment': vitals_result,
-            'alerts_created': AlertSerializer(alerts_created, many=True).data
-        }
-        
-        return Response(response_data, status=status.HTTP_200_OK)
+            firebase_repository.save_alert(alert)
     
-    except Exception as e:
-        return Response({'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+    # Return results
+    response_data = {
+        'health_data_id': health_data.id,
+        'fall_detection': fall_result,
+        'vitals_assessment': vitals_result,
+        'alerts_created': AlertSerializer(alerts_created, many=True).data
+    }
+    
+    return Response(response_data, status=status.HTTP_200_OK)
+
+@api_view(['POST'])
+@parser_classes([CompressedJSONParser])
+def backfill_health_data(request):
+    """
+    Store samples a device buffered while offline
+    
+    The body (optionally gzip or deflate compressed, see Content-Encoding) is
+    {"user_id": ..., "fields": ["timestamp", "heart_rate", ...], "rows": [[...], ...]}
+    with the original sample times. Samples are bulk inserted without
+    real-time pushes; anomalies in the backfilled range raise one alert per
+    episode.
+    """
+    if not isinstance(request.data, dict):
+        return Response({'error': 'Expected a JSON object'}, status=status.HTTP_400_BAD_REQUEST)
+    router = sharding.get_router()
+    if router is not None:
+        return router.respond('backfill', request.data)
+    return _backfill_health_data(request.data)
+
+def _backfill_health_data(data):
+    """Store a backfill chunk and rescore it"""
+    from .backfill import rescore, store_samples
+    from .features import feature_store
+    
+    fields = data.get('fields')
+    rows = data.get('rows')
+    if not isinstance(fields, list) or not isinstance(rows, list):
+        return Response({'error': "Expected 'fields' and 'rows' lists"}, status=status.HTTP_400_BAD_REQUEST)
+    for field in REQUIRED_SENSOR_FIELDS + ['timestamp']:
+        if field not in fields:
+            return Response({'error': f'Missing required field: {field}'}, status=status.HTTP_400_BAD_REQUEST)
+    max_samples = getattr(settings, 'BACKFILL_MAX_SAMPLES', 10000)
+    if len(rows) > max_samples:
+        return Response({'error': f'At most {max_samples} samples per chunk'},
+                        status=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+    
+    user_id = data.get('user_id')
+    try:
+        patient = cache.get_patient_by_user_id(user_id)
+    except Patient.DoesNotExist:
+        return Response({'error': f'Patient with user_id {user_id} not found'},
+                        status=status.HTTP_404_NOT_FOUND)
+    
+    # A device uploading its backlog is back online
+    received_at = timezone.now()
+    liveness.heartbeat(user_id, patient.id, received=received_at)
+    PatientStatus.objects.record_received(patient.id, received_at)
+    
+    samples = []
+    for index, row in enumerate(rows):
+        try:
+            samples.append(_backfill_sample(fields, row))
+        except (TypeError, ValueError, OverflowError) as e:
+            return Response({'error': f'Row {index}: {e}'}, status=status.HTTP_400_BAD_REQUEST)
+    
+    inserted = store_samples(patient, samples)
+    alerts = []
+    if inserted:
+        times = [sample['timestamp'] for sample in samples if (sample['boot'], sample['seq']) in inserted]
+        alerts = rescore(patient, min(times), max(times), health_predictor, inserted)
+        for alert in alerts:
+            firebase_repository.save_alert(alert)
+        # Windows are reseeded from the database, now including the backfill
+        feature_store.reset(patient.id)
+        seq_window.reset(patient.id)
+    
+    return Response({
+        'received': len(rows),
+        'inserted': len(inserted),
+        'duplicates': len(rows) - len(inserted),
+        'alerts_created': AlertSerializer(alerts, many=True).data,
+    }, status=status.HTTP_200_OK)
+
+def _backfill_sample(fields, row):
+    """Sample dict for one row of a backfill chunk"""
+    if not isinstance(row, list) or len(row) != len(fields):
+        raise ValueError(f'expected {len(fields)} values')
+    values = dict(zip(fields, row))
+    sample = {field: float(values[field]) for field in REQUIRED_SENSOR_FIELDS}
+    for field in OPTIONAL_SENSOR_FIELDS:
+        if values.get(field) is not None:
+            sample[field] = float(values[field])
+    if values['timestamp'] is None:
+        raise ValueError('missing timestamp')
+    sample['timestamp'] = _parse_sample_time(values['timestamp'])
+    sample['seq'] = _parse_seq(values.get('seq'), sample['timestamp'])
+    sample['boot'] = _parse_boot(values.get('boot'))
+    return sample
+
+def metrics_view(request):
+    """Expose collected metrics in the Prometheus text format"""
+    if not metrics.metrics_enabled():
+        raise Http404("Metrics are disabled")
+    return HttpResponse(metrics.REGISTRY.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+def ready_view(request):
+    """Readiness probe: 200 once this process has warmed up (see api.warmup), 503 until then"""
+    if not warmup.state.ready:
+        warmup.start()
+    return JsonResponse(warmup.state.as_dict(), status=200 if warmup.state.ready else 503)
 
 @api_view(['POST'])
 def chat_with_health_assistant(request):
@@ -364,7 +808,7 @@ def chat_with_health_assistant(request):
         patient_context = ""
         if patient_id:
             try:
-                patient = Patient.objects.get(id=patient_id)
+                patient = cache.get_patient(patient_id)
                 # Get latest health data
                 latest_health_data = HealthData.objects.filter(patient=patient).order_by('-timestamp').first()
                 
@@ -404,6 +848,8 @@ Never provide dangerous advice and clarify you are not a replacement for profess
         messages.append({"role": "user", "content": message})
         
         # Send request to llm7.io
+        import requests
+        
         response = requests.post(
             "https://api.llm7.io/v1/chat/completions",
             headers={
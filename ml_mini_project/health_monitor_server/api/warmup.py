@@ -0,0 +1,189 @@
+"""
+Warm-up of a server process before it takes traffic.
+
+Left alone, the first requests after a deploy pay for importing NumPy, the
+models and firebase_admin (which api.views defers to first use), loading the
+models and NumPy's first calls, opening the database connection, the
+Firestore channel and its auth token, and building the URL resolvers and DRF
+settings. ``run()`` does all of that up front, one timed step at a time, and
+re-arms the device liveness deadlines lost with the previous process
+(api.liveness).
+
+It is called from the WSGI and ASGI entry points (health_monitor/wsgi.py and
+asgi.py), which runserver, Gunicorn and Uvicorn import before accepting
+connections, rather than from AppConfig.ready(), which also runs for every
+management command and test run. ``/ready`` answers 503 until the required
+steps have succeeded; Firebase is optional, as everywhere else in the API,
+and so is liveness.
+"""
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.db import connection
+from django.urls import resolve, reverse
+
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+WARMUP_SECONDS = metrics.Gauge(
+    'server_warmup_seconds',
+    'Time the last warm-up of this process spent in each step',
+    ['step'],
+)
+
+# Seconds to wait for the Firestore round trip
+FIRESTORE_TIMEOUT = 5.0
+
+# Routes resolved ahead of the first request
+ROUTES = (
+    ('process-health-data', ()), ('backfill-health-data', ()), ('patient-list', ()),
+    ('patient-detail', (1,)), ('patient-latest', (1,)), ('patient-health-data', (1,)), ('alert-list', ()),
+    ('guardian-list', ()), ('dashboard', ()), ('metrics', ()), ('ready', ()),
+)
+
+# A normal reading, scored once so the models and NumPy paths are loaded
+SAMPLE = {
+    'timestamp': 0.0, 'heart_rate': 72, 'spo2': 97,
+    'accelerometer_x': 0.0, 'accelerometer_y': 0.0, 'accelerometer_z': 9.8,
+    'gyroscope_x': 0.0, 'gyroscope_y': 0.0, 'gyroscope_z': 0.0,
+}
+
+
+def _models():
+    from . import sharding
+
+    if sharding.routing():
+        return  # shard processes score the samples
+    import numpy as np
+
+    from . import views
+    from .features import CHANNELS, compute_features, sample_row
+
+    window = np.full((1, getattr(settings, 'FEATURE_WINDOW_SIZE', 30), len(CHANNELS)), np.nan)
+    window[0, -1] = sample_row(SAMPLE)
+    features = compute_features(window)[0]
+    views.health_predictor.predict_fall([0.0], [0.0], [9.8], [0.0], [0.0], [0.0], features=features)
+    views.health_predictor.predict_vitals_risk(SAMPLE['heart_rate'], SAMPLE['spo2'], features=features)
+
+
+def _database():
+    from .models import Alert, HealthData, Patient
+
+    connection.ensure_connection()
+    Patient.objects.filter(user_id='').exists()
+    HealthData.objects.filter(patient_id=0).order_by('-timestamp').exists()
+    Alert.objects.filter(patient_id=0).exists()
+
+
+def _firebase():
+    from . import views
+
+    service = views.firebase_service
+    if not service.initialized:
+        raise RuntimeError("Firebase is not initialized")
+    # Opens the gRPC channel and fetches an access token
+    service.db.collection('patients').document('__warmup__').get(timeout=FIRESTORE_TIMEOUT)
+
+
+def _routes():
+    from rest_framework.settings import api_settings
+
+    from .renderers import FastJSONRenderer
+
+    for name, args in ROUTES:
+        resolve(reverse(name, args=args))
+    for setting in ('DEFAULT_RENDERER_CLASSES', 'DEFAULT_PARSER_CLASSES', 'DEFAULT_AUTHENTICATION_CLASSES',
+                    'DEFAULT_PERMISSION_CLASSES', 'DEFAULT_THROTTLE_CLASSES'):
+        getattr(api_settings, setting)
+    FastJSONRenderer().render({'ready': True})
+
+
+def _liveness():
+    from . import liveness, sharding
+
+    if sharding.current is not None:
+        liveness.seed(sharding.current.owns)
+    elif not sharding.routing():
+        liveness.seed()
+
+
+# (name, function, whether the process is ready without it), in order
+STEPS = (
+    ('models', _models, False),
+    ('database', _database, False),
+    ('firebase', _firebase, True),
+    ('routes', _routes, False),
+    ('liveness', _liveness, True),
+)
+
+
+class WarmupState:
+    """Outcome of the warm-up of this process"""
+
+    def __init__(self):
+        self.ready = False
+        self.running = False
+        self.seconds = {}
+        self.errors = {}
+        self.lock = threading.Lock()
+
+    def as_dict(self):
+        return {
+            'ready': self.ready,
+            'steps': {name: round(seconds, 4) for name, seconds in self.seconds.items()},
+            'errors': dict(self.errors),
+        }
+
+
+state = WarmupState()
+
+
+def run():
+    """
+    Run every warm-up step; safe to call again, e.g. after a failure
+
+    Returns:
+        Whether the process is ready
+    """
+    with state.lock:
+        if state.ready:
+            return True
+        state.running = True
+        try:
+            started = time.perf_counter()
+            errors = {}
+            for name, step, optional in STEPS:
+                step_started = time.perf_counter()
+                try:
+                    step()
+                except Exception as e:
+                    errors[name] = str(e) or type(e).__name__
+                    logger.warning("Warm-up step %s failed", name, exc_info=not optional,
+                                   extra={'event': 'warmup.step_failed', 'step': name})
+                state.seconds[name] = time.perf_counter() - step_started
+                WARMUP_SECONDS.labels(name).set(state.seconds[name])
+            state.errors = errors
+            state.ready = not any(name in errors for name, _, optional in STEPS if not optional)
+        finally:
+            state.running = False
+    logger.info("Warm-up finished in %.2fs", time.perf_counter() - started,
+                extra={'event': 'warmup.done', 'ready': state.ready, 'steps': state.as_dict()['steps']})
+    return state.ready
+
+
+def start():
+    """Run the warm-up in a background thread unless it is done or running"""
+    if state.ready or state.running:
+        return
+    threading.Thread(target=run, name='warmup', daemon=True).start()
+
+
+def reset():
+    """Forget the outcome, so the next run() warms up again"""
+    with state.lock:
+        state.ready = False
+        state.seconds = {}
+        state.errors = {}
@@ -0,0 +1,88 @@
+"""
+Buffered Firestore writes for the normal ingestion lane.
+
+Normal readings do not need to reach Firestore within the request, so instead
+of one write per sample they are collected here and written with batched
+writes: by the request that fills a batch, or by a background thread for
+whatever has waited ``max_delay`` seconds. Readings that raise alerts are
+mirrored synchronously and never wait here.
+
+Pending documents live only in process memory. A bounded number are kept;
+beyond that the oldest are dropped and counted, and ``reconcile_firestore``
+repairs anything that was not written.
+"""
+import atexit
+import threading
+import time
+from collections import OrderedDict
+
+from . import metrics
+
+BUFFERED_WRITES_DROPPED = metrics.Counter(
+    'firebase_buffered_writes_dropped_total',
+    'Buffered Firestore writes dropped because the buffer was full, by collection',
+    ['collection'],
+)
+
+
+class WriteBuffer:
+    """Collects documents for one collection and writes them in batches"""
+
+    def __init__(self, collection, write, max_batch=100, max_delay=1.0, max_pending=10000):
+        """
+        Args:
+            collection: Firestore collection name, for metrics
+            write: Callable taking a list of (document_id, data) pairs
+            max_batch: Pending documents that trigger a write
+            max_delay: Seconds before the background thread writes a partial batch
+            max_pending: Documents kept before the oldest are dropped
+        """
+        self.collection = collection
+        self.write = write
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.max_pending = max_pending
+        self._pending = OrderedDict()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def add(self, document_id, data):
+        """Queue a document; a later write to the same document replaces it"""
+        with self._lock:
+            self._pending.pop(document_id, None)
+            self._pending[document_id] = data
+            while len(self._pending) > self.max_pending:
+                self._pending.popitem(last=False)
+                BUFFERED_WRITES_DROPPED.labels(self.collection).inc()
+            full = len(self._pending) >= self.max_batch
+            if self._thread is None and not full:
+                self._start()
+        if full:
+            self.flush()
+
+    def flush(self):
+        """Write every pending document now; returns how many were written"""
+        with self._lock:
+            documents = list(self._pending.items())
+            self._pending.clear()
+        if not documents:
+            return 0
+        self.write(documents)
+        return len(documents)
+
+    def __len__(self):
+        return len(self._pending)
+
+    def _start(self):
+        self._thread = threading.Thread(target=self._run, name=f'write-buffer-{self.collection}', daemon=True)
+        self._thread.start()
+        atexit.register(self.flush)
+
+    def _run(self):
+        while True:
+            time.sleep(self.max_delay)
+            try:
+                self.flush()
+            except Exception:
+                # The writer reports its own failures; keep the thread alive
+                pass
@@ -5,9 +5,14 @@ Django settings for health_monitor project.
 import os
 from pathlib import Path
 
+from dotenv import load_dotenv
+
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 
+# Settings below can be overridden by environment variables or a .env file
+load_dotenv(BASE_DIR / '.env')
+
 # SECURITY WARNING: keep the secret key used in production secret!
 SECRET_KEY = 'django-insecure-m2e_u!i2*t1@!d&f9m$8-4j$yw8d@k9*+9!k!e3b=9g&8ym+g#'
 
@@ -68,11 +73,56 @@ WSGI_APPLICATION = 'health_monitor.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/4.2/ref/settings/#databases
 
-DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+#
+# DB_ENGINE selects the backend:
+#   sqlite   - single-node deployments and development (default). Connections run
+#              in WAL mode with the pragmas in SQLITE_PRAGMAS so readers do not
+#              block the writer.
+#   postgres - production (needs psycopg, see requirements.txt). Connections are
+#              kept open for DB_CONN_MAX_AGE seconds. To pool connections, put
+#              PgBouncer in transaction pooling mode in front of the server and
+#              set DB_POOLER=pgbouncer.
+
+DB_ENGINE = os.environ.get('DB_ENGINE', 'sqlite')
+
+if DB_ENGINE == 'postgres':
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.postgresql',
+            'NAME': os.environ.get('DB_NAME', 'health_monitor'),
+            'USER': os.environ.get('DB_USER', 'health_monitor'),
+            'PASSWORD': os.environ.get('DB_PASSWORD', ''),
+            'HOST': os.environ.get('DB_HOST', 'localhost'),
+            'PORT': os.environ.get('DB_PORT', '5432'),
+            'CONN_MAX_AGE': int(os.environ.get('DB_CONN_MAX_AGE', '60')),
+            'CONN_HEALTH_CHECKS': True,
+            # Server-side cursors do not survive transaction pooling
+            'DISABLE_SERVER_SIDE_CURSORS': os.environ.get('DB_POOLER') == 'pgbouncer',
+            'OPTIONS': {
+                'connect_timeout': int(os.environ.get('DB_CONNECT_TIMEOUT', '5')),
+            },
+        }
+    }
+else:
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': os.environ.get('SQLITE_PATH', BASE_DIR / 'db.sqlite3'),
+            'OPTIONS': {
+                # Seconds to wait for the write lock before raising "database is locked"
+                'timeout': int(os.environ.get('SQLITE_TIMEOUT', '20')),
+            },
+        }
     }
+
+# Applied to every new SQLite connection (see api.signals)
+SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'busy_timeout': 5000,
+    'cache_size': -20000,
+    'temp_store': 'MEMORY',
+    'mmap_size': 134217728,
 }
 
 # Password validation
@@ -121,8 +171,156 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 REST_FRAMEWORK = {
     'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
     'PAGE_SIZE': 20,
+    # orjson-backed JSON when installed, same output as the stock renderer
+    'DEFAULT_RENDERER_CLASSES': [
+        'api.renderers.FastJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
     'DEFAULT_AUTHENTICATION_CLASSES': [
         'rest_framework.authentication.SessionAuthentication',
         'rest_framework.authentication.BasicAuthentication',
     ],
-}
\ No newline at end of file
+}
+
+# Metrics and request timing
+# METRICS_ENABLED exposes Prometheus-style histograms on /metrics;
+# SERVER_TIMING_ENABLED adds per-stage Server-Timing headers to ingestion responses
+METRICS_ENABLED = os.environ.get('METRICS_ENABLED', 'true').lower() == 'true'
+SERVER_TIMING_ENABLED = os.environ.get('SERVER_TIMING_ENABLED', 'false').lower() == 'true'
+
+# Seconds that cached patient and guardian lookups stay valid. Local saves and
+# deletes invalidate immediately; the TTL bounds staleness across worker processes.
+PATIENT_CACHE_TTL = int(os.environ.get('PATIENT_CACHE_TTL', '300'))
+
+# Firestore reads made through FirebaseRepository are cached for FIRESTORE_CACHE_TTL
+# seconds. With FIRESTORE_CACHE_LISTENERS, snapshot listeners (at most
+# FIRESTORE_MAX_LISTENERS) also invalidate entries changed by other writers.
+FIRESTORE_CACHE_TTL = int(os.environ.get('FIRESTORE_CACHE_TTL', '30'))
+FIRESTORE_CACHE_LISTENERS = os.environ.get('FIRESTORE_CACHE_LISTENERS', 'false').lower() == 'true'
+FIRESTORE_MAX_LISTENERS = int(os.environ.get('FIRESTORE_MAX_LISTENERS', '100'))
+
+# Health data that raises no alert is mirrored to Firestore in batched writes of
+# FIRESTORE_WRITE_BATCH_SIZE documents, or after FIRESTORE_WRITE_DELAY seconds
+FIRESTORE_WRITE_BATCH_SIZE = int(os.environ.get('FIRESTORE_WRITE_BATCH_SIZE', '100'))
+FIRESTORE_WRITE_DELAY = float(os.environ.get('FIRESTORE_WRITE_DELAY', '1.0'))
+
+# Alert thresholds used by HealthPredictor: the fall probability that raises an
+# alert, and the vitals risk probabilities at which a reading becomes ELEVATED,
+# HIGH and CRITICAL. Evaluate changes with `manage.py backtest_thresholds`.
+FALL_ALERT_THRESHOLD = float(os.environ.get('FALL_ALERT_THRESHOLD', '0.6'))
+VITALS_RISK_BANDS = tuple(float(value) for value in os.environ.get('VITALS_RISK_BANDS', '0.3,0.6,0.8').split(','))
+
+# Warm up server processes (api.warmup) before they take requests; /ready reports
+# 503 until this has succeeded
+WARMUP_ON_STARTUP = os.environ.get('WARMUP_ON_STARTUP', 'true').lower() == 'true'
+
+# Trained models (`manage.py train_models`, api.model_registry). The newest version
+# of each is loaded unless pinned, e.g. ML_MODEL_VERSIONS=vitals_risk_model=20240101T000000Z
+ML_MODEL_DIR = os.environ.get('ML_MODEL_DIR', BASE_DIR / 'ml_models')
+ML_MODEL_VERSIONS = dict(
+    pin.split('=', 1) for pin in os.environ.get('ML_MODEL_VERSIONS', '').split(',') if '=' in pin
+)
+# Load the NumPy-only export of a model (api.model_export) when it has one
+ML_MODEL_EXPORTED = os.environ.get('ML_MODEL_EXPORTED', 'true').lower() == 'true'
+
+# Samples per patient kept in memory for windowed features (api.features)
+FEATURE_WINDOW_SIZE = int(os.environ.get('FEATURE_WINDOW_SIZE', '30'))
+FEATURE_STORE_MAX_PATIENTS = int(os.environ.get('FEATURE_STORE_MAX_PATIENTS', '10000'))
+
+# Duplicate detection for retried uploads (api.dedup): the last INGEST_DEDUP_WINDOW
+# sequence numbers per device are remembered in memory; older ones are checked in
+# the database.
+INGEST_DEDUP_WINDOW = int(os.environ.get('INGEST_DEDUP_WINDOW', '256'))
+INGEST_DEDUP_MAX_DEVICES = int(os.environ.get('INGEST_DEDUP_MAX_DEVICES', '10000'))
+
+# Device liveness (api.liveness): a device that sends nothing for
+# DEVICE_OFFLINE_MISSED report intervals raises a DEVICE_OFFLINE alert. Devices
+# report every DEVICE_REPORT_INTERVAL seconds unless their samples say otherwise
+# (report_interval); DEVICE_OFFLINE_MISSED=0 disables the check.
+DEVICE_REPORT_INTERVAL = float(os.environ.get('DEVICE_REPORT_INTERVAL', '60'))
+DEVICE_OFFLINE_MISSED = float(os.environ.get('DEVICE_OFFLINE_MISSED', '5'))
+DEVICE_LIVENESS_TICK = float(os.environ.get('DEVICE_LIVENESS_TICK', '1'))
+
+# Rate limits for /api/health-data/ (api.throttling), in requests per second with
+# bursts of up to *_BURST requests; a rate of 0 disables the limit. Set
+# INGEST_GLOBAL_RATE to what the deployment can process. Normal-looking readings
+# cannot use the last INGEST_GLOBAL_RESERVE share of the global burst, and are not
+# mirrored to Firestore while less than INGEST_SHED_LEVEL of it is left.
+# INGEST_RATE_LIMIT_BACKEND=cache shares buckets between processes via CACHES.
+INGEST_DEVICE_RATE = float(os.environ.get('INGEST_DEVICE_RATE', '5'))
+INGEST_DEVICE_BURST = float(os.environ.get('INGEST_DEVICE_BURST', '20'))
+INGEST_GLOBAL_RATE = float(os.environ.get('INGEST_GLOBAL_RATE', '0'))
+INGEST_GLOBAL_BURST = float(os.environ.get('INGEST_GLOBAL_BURST', '0'))
+INGEST_GLOBAL_RESERVE = float(os.environ.get('INGEST_GLOBAL_RESERVE', '0.1'))
+INGEST_SHED_LEVEL = float(os.environ.get('INGEST_SHED_LEVEL', '0.5'))
+INGEST_RATE_LIMIT_BACKEND = os.environ.get('INGEST_RATE_LIMIT_BACKEND', 'local')
+INGEST_RATE_LIMIT_CACHE = 'default'
+
+# Cache used by INGEST_RATE_LIMIT_BACKEND=cache; point REDIS_URL at a shared
+# Redis (requires the redis package) so all workers see the same buckets
+if os.environ.get('REDIS_URL'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.environ['REDIS_URL'],
+        }
+    }
+
+# Sharded ingestion (api.sharding): with INGEST_SHARD_DIR set, web workers forward
+# samples and backfills to the shard process that owns the device, over Unix
+# sockets in that directory. Start the shards with `manage.py run_ingest_shards`.
+INGEST_SHARD_DIR = os.environ.get('INGEST_SHARD_DIR', '')
+INGEST_SHARD_WORKERS = int(os.environ.get('INGEST_SHARD_WORKERS', str(os.cpu_count() or 1)))
+INGEST_SHARD_TIMEOUT = float(os.environ.get('INGEST_SHARD_TIMEOUT', '30'))
+
+# Shared latest-state table (api.state_table): with LATEST_STATE_PATH set (e.g. a
+# file in /dev/shm), ingestion keeps each patient's latest reading in that
+# memory-mapped file and every worker serves /api/patients/{id}/latest/ from it.
+# Patients with ids of LATEST_STATE_CAPACITY and up are read from the database.
+LATEST_STATE_PATH = os.environ.get('LATEST_STATE_PATH', '')
+LATEST_STATE_CAPACITY = int(os.environ.get('LATEST_STATE_CAPACITY', '100000'))
+
+# Limits for one chunk of samples uploaded to /api/health-data/backfill/
+BACKFILL_MAX_SAMPLES = int(os.environ.get('BACKFILL_MAX_SAMPLES', '10000'))
+BACKFILL_MAX_BYTES = int(os.environ.get('BACKFILL_MAX_BYTES', str(8 * 1024 * 1024)))
+
+# Health data older than HEALTH_DATA_ARCHIVE_AFTER_DAYS is moved by
+# `manage.py archive_health_data` to per-patient, per-day files (api.archive)
+HEALTH_DATA_ARCHIVE_DIR = os.environ.get('HEALTH_DATA_ARCHIVE_DIR', BASE_DIR / 'archive')
+HEALTH_DATA_ARCHIVE_AFTER_DAYS = int(os.environ.get('HEALTH_DATA_ARCHIVE_AFTER_DAYS', '30'))
+
+# Logging
+# Application logs are written as JSON lines from a background thread so request
+# threads never block on the console. Each message type is rate limited.
+LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO')
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'filters': {
+        'rate_limit': {
+            '()': 'api.logging_utils.RateLimitFilter',
+            'rate': 10,
+            'per': 60.0,
+        },
+    },
+    'formatters': {
+        'structured': {
+            '()': 'api.logging_utils.StructuredFormatter',
+        },
+    },
+    'handlers': {
+        'nonblocking': {
+            'class': 'api.logging_utils.NonBlockingHandler',
+            'formatter': 'structured',
+            'filters': ['rate_limit'],
+        },
+    },
+    'loggers': {
+        'api': {
+            'handlers': ['nonblocking'],
+            'level': LOG_LEVEL,
+            'propagate': False,
+        },
+    },
+}
@@ -6,4 +6,6 @@ urlpatterns = [
     path('admin/', admin.site.urls),
     path('', views.home, name='home'),
     path('api/', include('api.urls')),
+    path('metrics', views.metrics_view, name='metrics'),
+    path('ready', views.ready_view, name='ready'),
 ]
\ No newline at end of file